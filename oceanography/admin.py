@@ -1,9 +1,24 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.contrib.auth import get_permission_codename
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Count
+from django.http import FileResponse, Http404
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.html import format_html
+from django.utils.text import capfirst
+
+from .paginators import EstimatedCountPaginator
+from .profiling import delete_profiles, profile_dir
+from .partitions import PartitionUnavailable, active_aliases, alias_for_profile
+from .purge import background_threshold, purge_counts, purge_in_background
+from .rows import project_rows
 from .models import (
     Expedition, Station, Sample, MeteoData, CarbonData, 
     IonicCompositionData, PigmentsData, OxymetrData, 
     NutrientsData, PHMeasurement, Probe, CTDData, 
-    CTDProfile, CTDMeasurement
+    CTDProfile, CTDMeasurement, CTDPartition, ExpeditionArchive, RequestProfile
 )
 
 class StationInline(admin.TabularInline):
@@ -20,8 +35,57 @@ class SampleInline(admin.TabularInline):
     readonly_fields = ('datetime', 'sampling_depth')
     show_change_link = True
 
+class PurgeAdmin(admin.ModelAdmin):
+    """
+    Удаление больших объектов через purge (purge.py): без каскада Django,
+    который загружает все связанные строки - и для страницы подтверждения,
+    и для самого удаления. Объекты от PURGE_BACKGROUND_ROWS строк
+    удаляются в фоне через очередь записи.
+    """
+
+    def purge_counts(self, objs):
+        counts = {}
+        for obj in objs:
+            for model, count in purge_counts(obj).items():
+                counts[model] = counts.get(model, 0) + count
+        return counts
+
+    def is_large(self, counts):
+        return sum(counts.values()) >= background_threshold()
+
+    def get_deleted_objects(self, objs, request):
+        counts = self.purge_counts(objs)
+        if not self.is_large(counts):
+            return super().get_deleted_objects(objs, request)
+        # Для подтверждения - только счетчики по таблицам, без списка всех объектов
+        perms_needed = {
+            model._meta.verbose_name for model, count in counts.items()
+            if count and not request.user.has_perm(
+                f'{model._meta.app_label}.{get_permission_codename("delete", model._meta)}'
+            )
+        }
+        model_count = {model._meta.verbose_name_plural: count for model, count in counts.items() if count}
+        deleted_objects = [f'{capfirst(obj._meta.verbose_name)}: {obj}' for obj in objs]
+        return deleted_objects, model_count, perms_needed, []
+
+    def delete_model(self, request, obj):
+        if self.is_large(self.purge_counts([obj])):
+            purge_in_background(obj)
+            messages.info(request, f'«{obj}»: удаление выполняется в фоне')
+        else:
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        small = []
+        for obj in queryset:
+            if self.is_large(self.purge_counts([obj])):
+                self.delete_model(request, obj)
+            else:
+                small.append(obj.pk)
+        super().delete_queryset(request, queryset.filter(pk__in=small))
+
 @admin.register(Expedition)
-class ExpeditionAdmin(admin.ModelAdmin):
+class ExpeditionAdmin(PurgeAdmin):
     list_display = ('platform', 'start_date', 'end_date', 'area', 'stations_count')
     list_filter = ('platform', 'start_date', 'area')
     search_fields = ('platform', 'area')
@@ -38,9 +102,12 @@ class ExpeditionAdmin(admin.ModelAdmin):
         }),
     )
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(stations_count=Count('stations'))
+
+    @admin.display(description='Кол-во станций', ordering='stations_count')
     def stations_count(self, obj):
-        return obj.stations.count()
-    stations_count.short_description = 'Кол-во станций'
+        return obj.stations_count
 
 @admin.register(Station)
 class StationAdmin(admin.ModelAdmin):
@@ -49,11 +116,15 @@ class StationAdmin(admin.ModelAdmin):
     search_fields = ('station_name', 'expedition__platform')
     date_hierarchy = 'datetime'
     raw_id_fields = ('expedition',)
+    list_select_related = ('expedition',)
     inlines = [SampleInline]
-    
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(samples_count=Count('samples'))
+
+    @admin.display(description='Кол-во проб', ordering='samples_count')
     def samples_count(self, obj):
-        return obj.samples.count()
-    samples_count.short_description = 'Кол-во проб'
+        return obj.samples_count
 
 class MeteoDataInline(admin.TabularInline):
     model = MeteoData
@@ -102,6 +173,7 @@ class SampleAdmin(admin.ModelAdmin):
     search_fields = ('station__station_name', 'sampling_depth')
     date_hierarchy = 'datetime'
     raw_id_fields = ('station',)
+    list_select_related = ('station',)
     inlines = [
         MeteoDataInline,
         CarbonDataInline,
@@ -113,63 +185,114 @@ class SampleAdmin(admin.ModelAdmin):
         CTDDataInline,
     ]
 
-class CTDMeasurementInline(admin.TabularInline):
-    model = CTDMeasurement
-    extra = 0
-    fields = ('depth_m', 'temp_c', 'salinity_psu', 'do_mg_l')
-    readonly_fields = fields
-
 @admin.register(CTDProfile)
-class CTDProfileAdmin(admin.ModelAdmin):
+class CTDProfileAdmin(PurgeAdmin):
     list_display = ('profile_id', 'station', 'probe', 'start_datetime', 'max_depth')
     list_filter = ('station__expedition', 'probe', 'start_datetime')
     search_fields = ('station__station_name', 'probe__probe_name')
     date_hierarchy = 'start_datetime'
     raw_id_fields = ('station', 'probe')
-    inlines = [CTDMeasurementInline]
+    list_select_related = ('station', 'probe')
+    # Измерения профиля (десятки тысяч строк) выводятся не inline-формами,
+    # а постраничной таблицей только для чтения - см. шаблон change_form.html
+    measurements_per_page = 100
+    measurement_fields = [
+        ('measurement_id', 'measurement_id'),
+        ('depth_m', 'depth_m'),
+        ('datetime', 'datetime'),
+        ('pressure_dbar', 'pressure_dbar'),
+        ('temp_c', 'temp_c'),
+        ('salinity_psu', 'salinity_psu'),
+        ('do_mg_l', 'do_mg_l'),
+        ('sigma_kg_m3', 'sigma_kg_m3'),
+    ]
+
+    def render_change_form(self, request, context, add=False, change=False, form_url='', obj=None):
+        if obj is not None:
+            context.update(self.measurements_context(request, obj))
+        return super().render_change_form(request, context, add, change, form_url, obj)
+
+    def measurements_context(self, request, profile):
+        """Одна страница измерений профиля: один запрос без COUNT(*) по профилю"""
+        try:
+            page = max(int(request.GET.get('m_page', 1)), 1)
+        except ValueError:
+            page = 1
+        per_page = self.measurements_per_page
+        offset = (page - 1) * per_page
+
+        # Берем на одну строку больше, чтобы узнать, есть ли следующая страница
+        try:
+            rows = list(project_rows(
+                CTDMeasurement.objects.for_profile(profile).order_by('depth_m', 'measurement_id'),
+                self.measurement_fields,
+            )[offset:offset + per_page + 1])
+        except PartitionUnavailable as e:
+            messages.warning(request, str(e))
+            rows = []
+
+        has_next = len(rows) > per_page
+        rows = rows[:per_page]
+        opts = CTDMeasurement._meta
+        return {
+            'measurements': rows,
+            'measurements_page': page,
+            'measurements_offset': offset,
+            'measurements_last': offset + len(rows),
+            'measurements_has_previous': page > 1,
+            'measurements_has_next': has_next,
+            'measurements_changelist_url': '%s?profile__profile_id__exact=%s' % (
+                reverse(f'admin:{opts.app_label}_{opts.model_name}_changelist'), profile.pk
+            ),
+        }
+
+class MeasurementAdmin(admin.ModelAdmin):
+    """Общие настройки для таблиц измерений (__str__ пробы обращается к станции)"""
+    list_select_related = ('sample__station',)
+    raw_id_fields = ('sample',)
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Таблицы на миллионы строк: без полного COUNT(*) на каждой странице"""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
 
 # Базовые модели данных с простой регистрацией
 @admin.register(MeteoData)
-class MeteoDataAdmin(admin.ModelAdmin):
+class MeteoDataAdmin(MeasurementAdmin):
     list_display = ('meteo_data_id', 'sample', 't_air_c', 'wind_speed_m_s')
     list_filter = ('sample__station__expedition',)
-    raw_id_fields = ('sample',)
 
 @admin.register(CarbonData)
-class CarbonDataAdmin(admin.ModelAdmin):
+class CarbonDataAdmin(MeasurementAdmin):
     list_display = ('carbon_data_id', 'sample', 'dtc_mg_c_l', 'doc_mg_c_l')
     list_filter = ('sample__station__expedition',)
-    raw_id_fields = ('sample',)
 
 @admin.register(IonicCompositionData)
-class IonicCompositionDataAdmin(admin.ModelAdmin):
+class IonicCompositionDataAdmin(MeasurementAdmin):
     list_display = ('ionic_data_id', 'sample', 'cl_mg_l', 'ca_mg_l')
     list_filter = ('sample__station__expedition',)
-    raw_id_fields = ('sample',)
 
 @admin.register(PigmentsData)
-class PigmentsDataAdmin(admin.ModelAdmin):
+class PigmentsDataAdmin(MeasurementAdmin):
     list_display = ('pigments_data_id', 'sample', 'chl_a_mg_m3', 'total_chl_mg_m3')
     list_filter = ('sample__station__expedition',)
-    raw_id_fields = ('sample',)
 
 @admin.register(OxymetrData)
-class OxymetrDataAdmin(admin.ModelAdmin):
+class OxymetrDataAdmin(MeasurementAdmin):
     list_display = ('oxymetr_data_id', 'sample', 'do_mg_l_oxy', 'do_sat_percent_oxy')
     list_filter = ('sample__station__expedition',)
-    raw_id_fields = ('sample',)
 
 @admin.register(NutrientsData)
-class NutrientsDataAdmin(admin.ModelAdmin):
+class NutrientsDataAdmin(MeasurementAdmin):
     list_display = ('nutrients_data_id', 'sample', 'no3_mg_n_l', 'nh4_mg_n_l', 'po4_mg_p_l')
     list_filter = ('sample__station__expedition',)
-    raw_id_fields = ('sample',)
 
 @admin.register(PHMeasurement)
-class PHMeasurementAdmin(admin.ModelAdmin):
+class PHMeasurementAdmin(MeasurementAdmin):
     list_display = ('id', 'sample', 'ph_meter', 'ph_value')
     list_filter = ('sample__station__expedition', 'ph_meter')
-    raw_id_fields = ('sample',)
 
 @admin.register(Probe)
 class ProbeAdmin(admin.ModelAdmin):
@@ -177,13 +300,152 @@ class ProbeAdmin(admin.ModelAdmin):
     search_fields = ('probe_name',)
 
 @admin.register(CTDData)
-class CTDDataAdmin(admin.ModelAdmin):
+class CTDDataAdmin(MeasurementAdmin):
     list_display = ('ctd_data_id', 'sample', 'probe', 'temp_c', 'salinity_psu')
     list_filter = ('sample__station__expedition', 'probe')
+    list_select_related = ('sample__station', 'probe')
     raw_id_fields = ('sample', 'probe')
 
 @admin.register(CTDMeasurement)
-class CTDMeasurementAdmin(admin.ModelAdmin):
+class CTDMeasurementAdmin(LargeTableAdmin):
     list_display = ('measurement_id', 'profile', 'depth_m', 'temp_c', 'salinity_psu')
     list_filter = ('profile__station__expedition',)
-    raw_id_fields = ('profile',)
\ No newline at end of file
+    list_select_related = ('profile__station',)
+    raw_id_fields = ('profile',)
+
+    def partition_alias(self, request):
+        """Секция, если список отфильтрован по профилю секционированной экспедиции"""
+        profile_id = request.GET.get('profile__profile_id__exact', '')
+        if not profile_id.isdigit():
+            return None
+        try:
+            return alias_for_profile(int(profile_id))
+        except PartitionUnavailable:
+            return None
+
+    def changelist_view(self, request, extra_context=None):
+        profile_id = request.GET.get('profile__profile_id__exact', '')
+        if profile_id.isdigit():
+            try:
+                alias_for_profile(int(profile_id))
+            except PartitionUnavailable as e:
+                messages.warning(request, str(e))
+        return super().changelist_view(request, extra_context)
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        alias = self.partition_alias(request)
+        return queryset.using(alias) if alias else queryset.main_table()
+
+    def get_object(self, request, object_id, from_field=None):
+        """
+        Формы изменения и удаления получают только ID (фильтр списка - в
+        _changelist_filters), поэтому измерение ищется по ID в основной базе
+        и в подключенных секциях: ID уникальны во всех файлах.
+        """
+        queryset = super().get_queryset(request)
+        field = self.model._meta.pk if from_field is None else self.model._meta.get_field(from_field)
+        try:
+            object_id = field.to_python(object_id)
+        except ValidationError:
+            return None
+        for alias in [DEFAULT_DB_ALIAS, *active_aliases()]:
+            obj = queryset.using(alias).filter(**{field.name: object_id}).first()
+            if obj is not None:
+                return obj
+        return None
+
+    # В файле секции нет таблиц профилей и станций - без соединений с ними
+    def get_list_display(self, request):
+        if self.partition_alias(request):
+            return ('measurement_id', 'profile_id', 'depth_m', 'temp_c', 'salinity_psu')
+        return super().get_list_display(request)
+
+    def get_list_select_related(self, request):
+        if self.partition_alias(request):
+            return False
+        return super().get_list_select_related(request)
+
+    def get_list_filter(self, request):
+        if self.partition_alias(request):
+            return ()
+        return super().get_list_filter(request)
+
+@admin.register(CTDPartition)
+class CTDPartitionAdmin(admin.ModelAdmin):
+    """Секции меняются только командой ctd_partitions (перенос данных)"""
+    list_display = ('expedition', 'file_name', 'state', 'created_at', 'archived_at')
+    list_filter = ('state',)
+    list_select_related = ('expedition',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+@admin.register(ExpeditionArchive)
+class ExpeditionArchiveAdmin(admin.ModelAdmin):
+    """Архив меняется только командой cold_storage или восстановлением со страницы экспедиции"""
+    list_display = ('expedition', 'file_name', 'size', 'archived_at')
+    list_select_related = ('expedition',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    """Профили запросов (profiling.py): просмотр сводки, скачивание pstats, удаление вместе с файлом"""
+    list_display = ('created_at', 'method', 'path', 'view', 'status', 'duration_ms', 'queries', 'user', 'download_link')
+    list_filter = ('view',)
+    readonly_fields = (
+        'created_at', 'user', 'view', 'method', 'path', 'status', 'duration_ms', 'queries', 'download_link', 'summary_text',
+    )
+    exclude = ('summary', 'file_name')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        return [
+            path('<int:pk>/download/', self.admin_site.admin_view(self.download_view),
+                 name='oceanography_requestprofile_download'),
+        ] + super().get_urls()
+
+    def download_view(self, request, pk):
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        profile = get_object_or_404(RequestProfile, pk=pk)
+        file_path = profile_dir() / profile.file_name
+        if not file_path.exists():
+            raise Http404('Файл профиля удален')
+        return FileResponse(open(file_path, 'rb'), as_attachment=True, filename=profile.file_name)
+
+    @admin.display(description='Файл pstats')
+    def download_link(self, obj):
+        return format_html(
+            '<a href="{}">{}</a>', reverse('admin:oceanography_requestprofile_download', args=[obj.pk]), obj.file_name
+        )
+
+    @admin.display(description='Сводка (по накопленному времени)')
+    def summary_text(self, obj):
+        return format_html('<pre style="white-space: pre; overflow-x: auto">{}</pre>', obj.summary)
+
+    def delete_model(self, request, obj):
+        delete_profiles([obj])
+
+    def delete_queryset(self, request, queryset):
+        delete_profiles(queryset)
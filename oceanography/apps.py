@@ -1,6 +1,20 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import pre_delete, pre_save
 
 
 class OceanographyConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'oceanography'
+
+    def ready(self):
+        from .db import configure_sqlite_connection
+        connection_created.connect(configure_sqlite_connection, dispatch_uid='oceanography_sqlite_pragmas')
+
+        from .metrics import install_query_counter
+        connection_created.connect(install_query_counter, dispatch_uid='oceanography_query_counter')
+
+        from .models import CTDMeasurement, CTDProfile
+        from .partitions import assign_partition_id, delete_partition_measurements
+        pre_delete.connect(delete_partition_measurements, sender=CTDProfile, dispatch_uid='oceanography_ctd_partitions')
+        pre_save.connect(assign_partition_id, sender=CTDMeasurement, dispatch_uid='oceanography_ctd_partition_ids')
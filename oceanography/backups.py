@@ -0,0 +1,515 @@
+"""
+Резервные копии базы и файлов.
+
+create_snapshot() снимает согласованную копию основной базы и активных
+секций CTD измерений через online backup API SQLite. Все файлы читаются
+на один момент времени (open_snapshot): под кратковременной блокировкой
+записи всех файлов открываются читающие транзакции, и копия каждого
+файла - это состояние на этот момент. Копирование идет порциями по pages
+страниц с паузой; в режиме WAL запросы сайта, в том числе запись, не
+ждут копию, а копия не начинается заново из-за их записей. Копия
+проверяется (PRAGMA integrity_check) и сжимается gzip.
+
+Снимок - каталог BACKUP_DIR/snapshot_<дата_время>/ с db.sqlite3.gz,
+partitions/*.gz и manifest.json (контрольные суммы, метрики). Файлы
+(CTD профили, архивы секций и экспедиций) копируются инкрементально:
+каждый файл хранится один раз в BACKUP_DIR/objects/ под своим SHA-256,
+снимок лишь ссылается на него, так что неизменные файлы не копируются
+повторно. Старые снимки удаляются по BACKUP_KEEP вместе с файлами,
+на которые больше никто не ссылается.
+
+restore_snapshot() сначала проверяет снимок, затем записывает базу
+обратно тем же backup API (в работающую базу, без остановки соединений).
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils import timezone
+
+from . import cold_storage, partitions
+from .models import CTDPartition
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+SNAPSHOT_PREFIX = 'snapshot_'
+MANIFEST = 'manifest.json'
+READ_CHUNK = 1024 * 1024
+# Попыток открыть согласованный снимок (список секций изменился или блокировка занята)
+SNAPSHOT_ATTEMPTS = 5
+
+
+class BackupError(Exception):
+    """Снимок поврежден, не найден или его нельзя создать"""
+
+
+def backup_dir():
+    return Path(getattr(settings, 'BACKUP_DIR', Path(settings.BASE_DIR) / 'backups'))
+
+
+def objects_dir():
+    return backup_dir() / 'objects'
+
+
+def backup_keep():
+    """Сколько последних снимков хранить"""
+    return getattr(settings, 'BACKUP_KEEP', 7)
+
+
+def file_roots():
+    """Каталоги файлов, которые входят в снимок: {имя: путь}"""
+    return {
+        'ctd_profiles': Path(default_storage.path('ctd_profiles')),
+        'partition_archive': partitions.archive_dir(),
+        'cold_storage': cold_storage.archive_dir(),
+    }
+
+
+def file_sha256(path, opener=open):
+    digest = hashlib.sha256()
+    with opener(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(READ_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def gzip_file(source, target):
+    with open(source, 'rb') as src, gzip.open(target, 'wb', compresslevel=6) as dst:
+        shutil.copyfileobj(src, dst, READ_CHUNK)
+
+
+def gunzip_file(source, target):
+    with gzip.open(source, 'rb') as src, open(target, 'wb') as dst:
+        shutil.copyfileobj(src, dst, READ_CHUNK)
+
+
+def object_path(sha256):
+    return objects_dir() / sha256[:2] / f'{sha256}.gz'
+
+
+class BackupTimer:
+    """
+    progress-обработчик backup API: число шагов и самый долгий шаг.
+
+    Между вызовами progress проходит шаг копирования плюс пауза sleep;
+    длительность шага - это время, пока держится блокировка базы.
+    """
+
+    def __init__(self, sleep=0.0, progress=None):
+        self.sleep = sleep
+        self.progress = progress
+        self.steps = 0
+        self.max_step = 0.0
+        self.started = self.last = time.perf_counter()
+
+    def __call__(self, status, remaining, total):
+        now = time.perf_counter()
+        step = now - self.last - (self.sleep if self.steps else 0.0)
+        self.max_step = max(self.max_step, step)
+        self.last = now
+        self.steps += 1
+        if self.progress:
+            self.progress(total - remaining, total)
+
+    def metrics(self):
+        return {
+            'seconds': round(time.perf_counter() - self.started, 3),
+            'steps': self.steps,
+            'max_step_ms': round(self.max_step * 1000, 2),
+        }
+
+
+class LatencyProbe(threading.Thread):
+    """
+    Замер задержки запросов сайта во время копирования.
+
+    Отдельное соединение раз в interval секунд выполняет чтение
+    (SELECT из таблицы экспедиций) и захват блокировки записи
+    (BEGIN IMMEDIATE / ROLLBACK - без изменения данных).
+    """
+
+    def __init__(self, path, interval=0.05):
+        super().__init__(daemon=True)
+        self.path = path
+        self.interval = interval
+        self.reads, self.writes = [], []
+        self.stopped = threading.Event()
+
+    def run(self):
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            while not self.stopped.is_set():
+                started = time.perf_counter()
+                connection.execute('SELECT COUNT(*) FROM expeditions').fetchone()
+                self.reads.append(time.perf_counter() - started)
+                started = time.perf_counter()
+                connection.execute('BEGIN IMMEDIATE')
+                connection.execute('ROLLBACK')
+                self.writes.append(time.perf_counter() - started)
+                self.stopped.wait(self.interval)
+        finally:
+            connection.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        return {'read': latency_summary(self.reads), 'write': latency_summary(self.writes)}
+
+
+def latency_summary(samples):
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+    return {
+        'count': len(ordered),
+        'p50_ms': round(statistics.median(ordered) * 1000, 2),
+        'p95_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 2),
+        'max_ms': round(ordered[-1] * 1000, 2),
+    }
+
+
+def probe_latency(path, seconds, interval=0.05):
+    """Задержка запросов без копирования - база для сравнения"""
+    probe = LatencyProbe(path, interval)
+    probe.start()
+    time.sleep(seconds)
+    return probe.stop()
+
+
+def _check_copy(path):
+    connection = sqlite3.connect(path)
+    try:
+        result = connection.execute('PRAGMA integrity_check').fetchone()[0]
+    finally:
+        connection.close()
+    if result != 'ok':
+        raise BackupError(f'Копия {path.name} не прошла integrity_check: {result}')
+
+
+def _store_copy(raw, target):
+    """Проверенная копия базы -> gzip; возвращает описание для манифеста"""
+    _check_copy(raw)
+    entry = {'sha256': file_sha256(raw), 'size': raw.stat().st_size}
+    gzip_file(raw, target)
+    raw.unlink()
+    return entry
+
+
+def _store_files(root):
+    """{относительный путь: SHA-256}; в objects/ пишутся только новые файлы"""
+    files = {}
+    copied = 0
+    if not root.is_dir():
+        return files, copied
+    for path in sorted(root.rglob('*')):
+        if not path.is_file() or path.name.endswith('.tmp'):
+            continue
+        sha256 = file_sha256(path)
+        files[path.relative_to(root).as_posix()] = sha256
+        target = object_path(sha256)
+        if not target.exists():
+            target.parent.mkdir(parents=True, exist_ok=True)
+            tmp = target.with_suffix('.tmp')
+            gzip_file(path, tmp)
+            os.replace(tmp, target)
+            copied += 1
+    return files, copied
+
+
+def _connect(name, uri=False):
+    return sqlite3.connect(name, uri=uri, timeout=5, isolation_level=None)
+
+
+def _active_partitions(connection):
+    """[(expedition_id, имя файла)] активных секций по данным соединения"""
+    return sorted(connection.execute(
+        f'SELECT expedition_id, file_name FROM {CTDPartition._meta.db_table} WHERE state = ?',
+        [CTDPartition.ACTIVE],
+    ).fetchall())
+
+
+def open_snapshot(database, attempts=SNAPSHOT_ATTEMPTS):
+    """
+    Читающие транзакции основной базы и активных секций на один момент.
+
+    Блокировки записи (BEGIN IMMEDIATE) берутся по порядку - основная
+    база, затем секции, - при них открываются читающие транзакции
+    источников копии, и блокировки сразу снимаются. В режиме WAL источники
+    видят этот момент до конца копирования; в других режимах журнала
+    читающая транзакция задерживает запись до конца копии.
+
+    Возвращает ([(expedition_id или None, имя файла, соединение)], сведения
+    для манифеста). Соединения закрывает вызывающий.
+    """
+    for attempt in range(1, attempts + 1):
+        main = _connect(database, uri=True)
+        listed = [
+            (expedition_id, file_name) for expedition_id, file_name in _active_partitions(main)
+            if (partitions.partitions_dir() / file_name).exists()
+        ]
+        sources = [(None, 'db', main)] + [
+            (expedition_id, file_name, _connect(partitions.partitions_dir() / file_name))
+            for expedition_id, file_name in listed
+        ]
+        locks = [_connect(database, uri=True)] + [
+            _connect(partitions.partitions_dir() / file_name) for _, file_name in listed
+        ]
+        modes = {name: source.execute('PRAGMA journal_mode').fetchone()[0] for _, name, source in sources}
+        current = None
+        started = time.perf_counter()
+        try:
+            for lock in locks:
+                lock.execute('BEGIN IMMEDIATE')
+            for _, _, source in sources:
+                source.execute('BEGIN')
+                source.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+            # Список секций на момент снимка: новая секция могла появиться до блокировки
+            current = [
+                (expedition_id, file_name) for expedition_id, file_name in _active_partitions(main)
+                if (partitions.partitions_dir() / file_name).exists()
+            ]
+        except sqlite3.OperationalError as e:
+            logger.warning('Backup snapshot attempt %s failed: %s', attempt, e)
+        finally:
+            for lock in locks:
+                if lock.in_transaction:
+                    lock.execute('ROLLBACK')
+                lock.close()
+        locked_ms = round((time.perf_counter() - started) * 1000, 2)
+        if current == listed:
+            return sources, {
+                'point_in_time': True,
+                'attempts': attempt,
+                'lock_ms': locked_ms,
+                'journal_modes': modes,
+            }
+        for _, _, source in sources:
+            source.close()
+    raise BackupError(f'Не удалось открыть согласованный снимок базы и секций за {attempts} попыток')
+
+
+def _backup(source, raw, pages, sleep, timer):
+    copy = sqlite3.connect(raw)
+    try:
+        source.backup(copy, pages=pages, progress=timer, sleep=sleep)
+    finally:
+        copy.close()
+
+
+def create_snapshot(pages=1024, sleep=0.005, keep=None, include_files=True, probe=False, progress=None):
+    """
+    Снимок базы, секций и файлов; возвращает путь к каталогу снимка.
+
+    probe=True - во время копирования основной базы замеряется задержка
+    конкурентных запросов (LatencyProbe), результат - в manifest['metrics'].
+    progress(имя, скопировано страниц, всего страниц) - после каждого шага.
+    """
+    connection = connections[DEFAULT_DB_ALIAS]
+    if connection.vendor != 'sqlite':
+        raise BackupError('Резервное копирование поддерживает только SQLite')
+
+    started = time.perf_counter()
+    stamp = f'{SNAPSHOT_PREFIX}{timezone.localtime():%Y%m%d_%H%M%S}'
+    name, n = stamp, 0
+    while (backup_dir() / name).exists() or (backup_dir() / f'{name}.tmp').exists():
+        # Несколько снимков за одну секунду
+        n += 1
+        name = f'{stamp}_{n}'
+    target = backup_dir() / name
+    work = backup_dir() / f'{name}.tmp'
+    (work / 'partitions').mkdir(parents=True, exist_ok=True)
+
+    sources = []
+    try:
+        metrics = {}
+        sources, consistency = open_snapshot(str(connection.settings_dict['NAME']))
+        (_, _, main), partition_sources = sources[0], sources[1:]
+        timer = BackupTimer(sleep, progress and (lambda done, total: progress('db', done, total)))
+        latency = LatencyProbe(str(connection.settings_dict['NAME'])) if probe else None
+        if latency:
+            latency.start()
+        try:
+            _backup(main, work / 'db.sqlite3', pages, sleep, timer)
+        finally:
+            if latency:
+                metrics['latency'] = latency.stop()
+        metrics['database'] = timer.metrics()
+        main.close()
+        database = _store_copy(work / 'db.sqlite3', work / 'db.sqlite3.gz')
+
+        partition_entries = []
+        for expedition_id, file_name, source in partition_sources:
+            raw = work / 'partitions' / file_name
+            timer = BackupTimer(sleep, progress and (lambda done, total: progress(file_name, done, total)))
+            _backup(source, raw, pages, sleep, timer)
+            source.close()
+            partition_entries.append({
+                'expedition_id': expedition_id, 'file': file_name,
+                **_store_copy(raw, work / 'partitions' / f'{file_name}.gz'),
+            })
+            metrics[file_name] = timer.metrics()
+
+        files, copied = {}, 0
+        if include_files:
+            for root_name, root in file_roots().items():
+                files[root_name], root_copied = _store_files(root)
+                copied += root_copied
+        metrics['files_copied'] = copied
+        metrics['seconds'] = round(time.perf_counter() - started, 3)
+
+        (work / MANIFEST).write_text(json.dumps({
+            'format': FORMAT_VERSION,
+            'created_at': timezone.now().isoformat(),
+            'database': database,
+            'partitions': partition_entries,
+            # База и секции - состояние на один момент (open_snapshot)
+            'consistency': consistency,
+            'files': files,
+            'metrics': metrics,
+        }, ensure_ascii=False, indent=1))
+        verify_snapshot(work)
+        os.replace(work, target)
+    except BaseException:
+        shutil.rmtree(work, ignore_errors=True)
+        raise
+    finally:
+        for _, _, source in sources:
+            source.close()
+
+    logger.info('Backup %s created in %.2f s: %s', name, metrics['seconds'], metrics)
+    prune_snapshots(backup_keep() if keep is None else keep)
+    return target
+
+
+def snapshot_path(name):
+    path = backup_dir() / name
+    if not (path / MANIFEST).exists():
+        raise BackupError(f'Снимок {name} не найден в {backup_dir()}')
+    return path
+
+
+def read_manifest(path):
+    manifest = json.loads((Path(path) / MANIFEST).read_text())
+    if manifest['format'] != FORMAT_VERSION:
+        raise BackupError(f'Неизвестный формат снимка {manifest["format"]}')
+    return manifest
+
+
+def list_snapshots():
+    """Каталоги снимков, от старых к новым"""
+    if not backup_dir().is_dir():
+        return []
+    return sorted(
+        path for path in backup_dir().iterdir()
+        if path.is_dir() and path.name.startswith(SNAPSHOT_PREFIX) and (path / MANIFEST).exists()
+    )
+
+
+def verify_snapshot(path):
+    """Сверяет контрольные суммы базы, секций и файлов снимка; BackupError при расхождении"""
+    path = Path(path)
+    manifest = read_manifest(path)
+    expected = [(path / 'db.sqlite3.gz', manifest['database']['sha256'])]
+    expected += [(path / 'partitions' / f'{entry["file"]}.gz', entry['sha256']) for entry in manifest['partitions']]
+    expected += [
+        (object_path(sha256), sha256)
+        for files in manifest['files'].values() for sha256 in set(files.values())
+    ]
+    for gz_path, sha256 in expected:
+        if not gz_path.exists():
+            raise BackupError(f'В снимке {path.name} нет {gz_path}')
+        try:
+            actual = file_sha256(gz_path, opener=gzip.open)
+        except (OSError, EOFError) as e:
+            raise BackupError(f'{gz_path} поврежден: {e}')
+        if actual != sha256:
+            raise BackupError(f'{gz_path}: контрольная сумма не совпадает')
+    return manifest
+
+
+def prune_snapshots(keep):
+    """Удаляет снимки старше keep последних и файлы, на которые они одни ссылались"""
+    snapshots = list_snapshots()
+    removed = snapshots[:-keep] if keep > 0 else []
+    for path in removed:
+        shutil.rmtree(path)
+        logger.info('Backup %s removed by retention', path.name)
+
+    referenced = set()
+    for path in list_snapshots():
+        for files in read_manifest(path)['files'].values():
+            referenced.update(files.values())
+    if objects_dir().is_dir():
+        for path in objects_dir().rglob('*.gz'):
+            if path.name[:-len('.gz')] not in referenced:
+                path.unlink()
+    return removed
+
+
+def restore_snapshot(name, include_files=True, progress=None):
+    """
+    Возвращает базу, секции и файлы из снимка.
+
+    Основная база перезаписывается backup API в работающий файл: другие
+    соединения ждут только на время шагов копирования и затем видят
+    восстановленные данные. Файлы, которых нет в снимке, не удаляются.
+    """
+    path = snapshot_path(name)
+    manifest = verify_snapshot(path)
+    connection = connections[DEFAULT_DB_ALIAS]
+
+    with tempfile.TemporaryDirectory(dir=backup_dir()) as tmp:
+        raw = Path(tmp) / 'db.sqlite3'
+        gunzip_file(path / 'db.sqlite3.gz', raw)
+        connection.ensure_connection()
+        source = sqlite3.connect(raw)
+        try:
+            source.backup(
+                connection.connection,
+                progress=progress and (lambda status, remaining, total: progress('db', total - remaining, total)),
+            )
+        finally:
+            source.close()
+        connection.close()
+
+    for entry in manifest['partitions']:
+        partitions.unregister_alias(entry['expedition_id'])
+        target = partitions.partitions_dir() / entry['file']
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp = target.with_suffix('.restore')
+        gunzip_file(path / 'partitions' / f'{entry["file"]}.gz', tmp)
+        for suffix in ('-wal', '-shm'):
+            Path(f'{target}{suffix}').unlink(missing_ok=True)
+        os.replace(tmp, target)
+        if progress:
+            progress(entry['file'], 1, 1)
+    partitions.registry_changed()
+
+    restored = 0
+    if include_files:
+        roots = file_roots()
+        for root_name, files in manifest['files'].items():
+            root = roots[root_name]
+            for relative, sha256 in files.items():
+                target = root / relative
+                if target.exists() and file_sha256(target) == sha256:
+                    continue
+                target.parent.mkdir(parents=True, exist_ok=True)
+                gunzip_file(object_path(sha256), target)
+                restored += 1
+
+    logger.info('Backup %s restored (%s files)', name, restored)
+    return manifest
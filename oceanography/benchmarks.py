@@ -0,0 +1,307 @@
+"""
+Замеры ключевых страниц (команда run_benchmarks).
+
+Страницы запрашиваются тестовым клиентом Django от имени суперпользователя
+через весь стек (middleware, шаблоны, журнал) - как в работе, но без сети:
+главная, списки и страницы data_*, экспедиция и ее станции, CTD профиль,
+выгрузка шаблонов Excel и загрузка станций и метеоданных. Данные - обычно
+из generate_data (synthetic.py): берется самая большая экспедиция и самый
+длинный CTD профиль в ней.
+
+Каждый замер - warmup прогонов без учета, затем repeat прогонов; в
+результат идут медиана, минимум и максимум времени и число SQL запросов.
+Результаты пишутся в JSON и сравниваются с сохраненным базовым файлом:
+замедление медианы больше допуска (и больше MIN_DELTA_MS) или рост числа
+запросов - регрессия. Запросы потока очереди записи (загрузки) в число
+запросов не входят.
+
+Загрузки пишут данные, поэтому идут во временную экспедицию UPLOAD_PLATFORM,
+которая удаляется (purge) в конце.
+"""
+import contextlib
+import datetime
+import io
+import json
+import platform
+import statistics
+import time
+from pathlib import Path
+
+import django
+import openpyxl
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Count
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from . import urls
+from .models import CTDMeasurement, CTDProfile, Expedition, Sample, Station
+from .partitions import active_aliases
+from .purge import purge
+from .synthetic import SURFACE
+
+DEFAULT_REPEAT = 5
+DEFAULT_WARMUP = 1
+DEFAULT_TOLERANCE = 0.2     # допустимое замедление медианы (доля)
+MIN_DELTA_MS = 2.0          # меньшая разница медиан - шум, не регрессия
+DEFAULT_UPLOAD_ROWS = 200   # станций / проб в файле загрузки
+UPLOAD_PLATFORM = 'BENCH upload'
+UPLOAD_CASES = ('upload_stations', 'meteo_template', 'upload_meteo')
+
+OK, SLOWER, FASTER, MORE_QUERIES, NEW = 'ok', 'slower', 'faster', 'more_queries', 'new'
+REGRESSIONS = {SLOWER, MORE_QUERIES}
+
+
+class BenchmarkError(Exception):
+    """Замер нельзя выполнить (нет данных, пользователя, ошибка страницы)"""
+
+
+def results_dir():
+    return Path(settings.BASE_DIR) / 'benchmarks'
+
+
+def default_baseline():
+    return results_dir() / 'baseline.json'
+
+
+class Case:
+    """Замер: prepare() - подготовка без учета времени, run(client, prepared) - замеряемый запрос"""
+
+    def __init__(self, name, run, prepare=None):
+        self.name = name
+        self.run = run
+        self.prepare = prepare or (lambda: None)
+
+
+def get_case(name, view_name, url_kwargs=None, **params):
+    url = reverse(f'oceanography:{view_name}', kwargs=url_kwargs)
+    return Case(name, lambda client, _: client.get(url, params))
+
+
+def post_case(name, view_name, data, url_kwargs=None, prepare=None):
+    """POST формы; prepare() может добавить к данным файл"""
+    url = reverse(f'oceanography:{view_name}', kwargs=url_kwargs)
+    return Case(name, lambda client, prepared: client.post(url, {**data, **(prepared or {})}), prepare)
+
+
+def pick_targets(expedition_id=None):
+    """Экспедиция с наибольшим числом станций и ее самый длинный CTD профиль"""
+    expeditions = Expedition.objects.exclude(platform=UPLOAD_PLATFORM)
+    if expedition_id is not None:
+        expeditions = expeditions.filter(pk=expedition_id)
+    expedition = expeditions.annotate(stations_count=Count('stations')).order_by('-stations_count', 'pk').first()
+    if expedition is None:
+        raise BenchmarkError('Нет экспедиций - сначала manage.py generate_data')
+    profile = CTDProfile.objects.filter(station__expedition=expedition).annotate(
+        scans=Count('measurements')
+    ).order_by('-scans', 'pk').first()
+    return expedition, profile
+
+
+def page_cases(expedition, profile):
+    """Страницы просмотра и выгрузки шаблонов"""
+    cases = [
+        get_case('home', 'home'),
+        get_case('expedition_list', 'expedition_list'),
+        get_case('expedition_detail', 'expedition_detail', url_kwargs={'pk': expedition.pk}),
+        get_case('expedition_stations_table', 'expedition_stations_table', url_kwargs={'pk': expedition.pk}),
+        get_case('expedition_stations_geojson', 'expedition_stations_geojson', url_kwargs={'pk': expedition.pk}, zoom=5),
+        get_case('ctd_profile_list', 'ctd_profile_list'),
+    ]
+    # Все страницы data_* из urls.py - новые попадают в замеры сами
+    cases += [get_case(pattern.name, pattern.name) for pattern in urls.urlpatterns
+              if pattern.name and pattern.name.startswith('data_')]
+    if profile is not None:
+        cases.append(get_case('ctd_profile_detail', 'ctd_profile_detail', url_kwargs={'pk': profile.pk}))
+    cases.append(post_case(
+        'stations_template', 'add_stations_excel', {'action': 'download_template'}, {'expedition_id': expedition.pk},
+    ))
+    return cases
+
+
+def workbook_file(wb, name):
+    content = io.BytesIO()
+    wb.save(content)
+    content.seek(0)
+    content.name = name
+    return content
+
+
+def upload_cases(client, expedition, rows):
+    """Загрузка станций, выгрузка и загрузка метеоданных по загруженным пробам"""
+    batches = iter(range(1_000_000))
+    url_kwargs = {'expedition_id': expedition.pk}
+    meteo_url = reverse('oceanography:add_meteo_excel', kwargs=url_kwargs)
+
+    def stations_file():
+        batch = next(batches)
+        wb = openpyxl.Workbook()
+        ws = wb.active
+        # Первые две строки файла - заголовки
+        ws.append(['station_name'])
+        ws.append(['Название станции*'])
+        start = datetime.datetime(2000, 1, 1) + datetime.timedelta(days=batch)
+        for row in range(rows):
+            moment = (start + datetime.timedelta(minutes=row)).strftime('%Y-%m-%d %H:%M:%S')
+            ws.append([f'B{batch}-{row}', moment, 60 + row / 1000, 30 + row / 1000, 50, 5, moment, SURFACE, 'Проба'])
+        return {'excel_file': workbook_file(wb, 'stations.xlsx')}
+
+    def meteo_file():
+        # Шаблон с пробами без метеоданных, заполненный для rows проб
+        response = client.post(meteo_url, {'action': 'download_template'})
+        wb = openpyxl.load_workbook(io.BytesIO(response.content))
+        ws = wb.active
+        ws.delete_rows(3 + rows, ws.max_row)
+        for row in ws.iter_rows(min_row=3, min_col=5, max_col=9):
+            for cell, value in zip(row, (5.5, 80, 7.5, 180, 1013)):
+                cell.value = value
+        return {'excel_file': workbook_file(wb, 'meteo.xlsx')}
+
+    return [
+        post_case('upload_stations', 'add_stations_excel', {'action': 'upload_data'}, url_kwargs, stations_file),
+        post_case('meteo_template', 'add_meteo_excel', {'action': 'download_template'}, url_kwargs),
+        post_case('upload_meteo', 'add_meteo_excel', {'action': 'upload_data'}, url_kwargs, meteo_file),
+    ]
+
+
+@contextlib.contextmanager
+def query_counter():
+    """
+    Число SQL запросов блока по всем базам (страницы data_* и выгрузки
+    читают с реплики). Обертка выполнения не открывает соединений.
+    """
+    counter = [0]
+
+    def count(execute, sql, params, many, context):
+        counter[0] += 1
+        return execute(sql, params, many, context)
+
+    with contextlib.ExitStack() as stack:
+        for alias in settings.DATABASES:
+            stack.enter_context(connections[alias].execute_wrapper(count))
+        yield counter
+
+
+def measure(case, client, repeat, warmup):
+    """Прогоны замера: время в мс и число SQL запросов последнего прогона"""
+    for _ in range(warmup):
+        _check(case, case.run(client, case.prepare()))
+    timings = []
+    for _ in range(repeat):
+        prepared = case.prepare()
+        with query_counter() as queries:
+            started = time.perf_counter()
+            response = case.run(client, prepared)
+            if hasattr(response, 'streaming_content'):
+                b''.join(response.streaming_content)
+            timings.append((time.perf_counter() - started) * 1000)
+        _check(case, response)
+    return {
+        'median_ms': round(statistics.median(timings), 2),
+        'min_ms': round(min(timings), 2),
+        'max_ms': round(max(timings), 2),
+        'queries': queries[0],
+    }
+
+
+def _check(case, response):
+    if response.status_code >= 400:
+        raise BenchmarkError(f'{case.name}: ответ {response.status_code}')
+
+
+def make_client(user):
+    host = next((h for h in settings.ALLOWED_HOSTS if h not in ('*',) and not h.startswith('.')), 'localhost')
+    client = Client(SERVER_NAME=host)
+    client.force_login(user)
+    return client
+
+
+def run(user, repeat=DEFAULT_REPEAT, warmup=DEFAULT_WARMUP, only=None, upload_rows=DEFAULT_UPLOAD_ROWS,
+        expedition_id=None, progress=None):
+    """Выполняет замеры; возвращает словарь результатов для JSON"""
+    expedition, profile = pick_targets(expedition_id)
+    client = make_client(user)
+    cases = page_cases(expedition, profile)
+    upload_expedition = None
+    if upload_rows and (not only or set(only) & set(UPLOAD_CASES)):
+        upload_expedition = Expedition.objects.create(
+            platform=UPLOAD_PLATFORM, area='Замеры', start_date=datetime.date(2000, 1, 1),
+            end_date=datetime.date(2000, 12, 31),
+        )
+        cases += upload_cases(client, upload_expedition, upload_rows)
+    if only:
+        cases = [case for case in cases if case.name in only]
+
+    results = {}
+    try:
+        for case in cases:
+            results[case.name] = measure(case, client, repeat, warmup)
+            if progress:
+                progress(case.name, results[case.name])
+    finally:
+        if upload_expedition is not None:
+            purge(upload_expedition)
+
+    return {
+        'created_at': timezone.now().isoformat(),
+        'environment': {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connections[DEFAULT_DB_ALIAS].vendor,
+            'debug': settings.DEBUG,
+        },
+        'dataset': {
+            'expeditions': Expedition.objects.count(),
+            'stations': Station.objects.count(),
+            'samples': Sample.objects.count(),
+            'ctd_measurements': CTDMeasurement.objects.main_table().count() + sum(
+                CTDMeasurement.objects.using(alias).count() for alias in active_aliases()
+            ),
+            'expedition_id': expedition.pk,
+            'profile_id': profile.pk if profile is not None else None,
+        },
+        'repeat': repeat,
+        'upload_rows': upload_rows,
+        'cases': results,
+    }
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Сравнение с базовыми результатами: строки (замер, медиана, базовая
+    медиана, отношение, запросы, базовые запросы, статус).
+    """
+    rows = []
+    base_cases = baseline.get('cases', {}) if baseline else {}
+    for name, result in results['cases'].items():
+        base = base_cases.get(name)
+        if base is None:
+            rows.append((name, result['median_ms'], None, None, result['queries'], None, NEW))
+            continue
+        ratio = result['median_ms'] / base['median_ms'] if base['median_ms'] else 1.0
+        noticeable = abs(result['median_ms'] - base['median_ms']) >= MIN_DELTA_MS
+        if result['queries'] > base['queries']:
+            status = MORE_QUERIES
+        elif ratio > 1 + tolerance and noticeable:
+            status = SLOWER
+        elif ratio < 1 - tolerance and noticeable:
+            status = FASTER
+        else:
+            status = OK
+        rows.append((name, result['median_ms'], base['median_ms'], ratio, result['queries'], base['queries'], status))
+    return rows
+
+
+def load_results(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_results(results, path):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    return path
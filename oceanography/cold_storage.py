@@ -0,0 +1,246 @@
+"""
+Холодный архив старых экспедиций.
+
+archive_expedition() выгружает все данные экспедиции - станции, пробы,
+таблицы измерений, CTD профили со сканами и файлами профилей - в сжатый
+архив EXPEDITION_ARCHIVE_DIR/expedition_<id>.zip и удаляет их из базы
+(purge). Запись экспедиции остается, а заглушка ExpeditionArchive хранит
+счетчики строк, так что списки и сводки работают без восстановления.
+
+Архив колоночный: каждая таблица - куски по CHUNK_ROWS строк, кусок -
+JSON {"columns": [...], "data": [[значения колонки], ...]}. Значения
+читаются курсором как они лежат в базе (без конвертеров ORM), поэтому
+восстановление - это INSERT тех же значений с теми же ключами.
+
+rehydrate_expedition() возвращает данные обратно; на странице архивной
+экспедиции staff запускает восстановление кнопкой (фоном, через очередь
+записи - rehydrate_in_background), просмотр страницы его не запускает.
+"""
+import datetime
+import decimal
+import json
+import logging
+import os
+import zipfile
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from .models import CTDMeasurement, CTDPartition, CTDProfile, Expedition, ExpeditionArchive
+from .partitions import alias_for_expedition
+from .purge import purge, purge_plan
+from .write_queue import get_write_queue
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+CHUNK_ROWS = 50000
+
+
+class ArchiveError(Exception):
+    """Экспедицию нельзя отправить в архив или восстановить"""
+
+
+class ColumnEncoder(json.JSONEncoder):
+    """
+    Значения, которые драйвер БД вернул объектами (даты SQLite разбираются
+    конвертерами Django), - обратно в текст хранения без потери точности
+    (DjangoJSONEncoder обрезает микросекунды).
+    """
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat(' ')
+        if isinstance(o, (datetime.date, datetime.time)):
+            return o.isoformat()
+        if isinstance(o, decimal.Decimal):
+            return str(o)
+        return super().default(o)
+
+
+def archive_dir():
+    return Path(getattr(settings, 'EXPEDITION_ARCHIVE_DIR', Path(settings.BASE_DIR) / 'archive'))
+
+
+def bundle_path(file_name):
+    return archive_dir() / file_name
+
+
+def archive_tables(expedition):
+    """
+    (модель, queryset) всех данных экспедиции сверху вниз - в порядке вставки.
+
+    Тот же набор таблиц, что удаляет purge; измерения секции читаются из ее файла.
+    """
+    steps = [
+        (model, queryset) for model, queryset in reversed(purge_plan(expedition, include_root=False))
+        if model is not CTDPartition
+    ]
+    alias = alias_for_expedition(expedition.pk)
+    if alias:
+        steps.append((CTDMeasurement, CTDMeasurement.objects.using(alias)))
+    return steps
+
+
+def _columns(model):
+    return [field.column for field in model._meta.concrete_fields]
+
+
+def _export_table(bundle, model, queryset, progress=None):
+    """Пишет таблицу кусками по CHUNK_ROWS строк (по возрастанию ключа); возвращает число строк"""
+    attnames = [field.attname for field in model._meta.concrete_fields]
+    using = queryset._db or router.db_for_write(model, **queryset._hints)
+    pk_name = model._meta.pk.attname
+    total, chunk, last_pk = 0, 0, None
+    while True:
+        page = queryset.order_by(pk_name)
+        if last_pk is not None:
+            page = page.filter(pk__gt=last_pk)
+        page = page.values_list(*attnames)[:CHUNK_ROWS]
+        sql, params = page.query.get_compiler(using).as_sql()
+        with connections[using].cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+        if not rows:
+            return total
+        member = f'{model._meta.db_table}/{chunk:05d}.json'
+        bundle.writestr(member, json.dumps(
+            {'columns': _columns(model), 'data': [list(column) for column in zip(*rows)]},
+            cls=ColumnEncoder, separators=(',', ':'),
+        ))
+        last_pk = rows[-1][attnames.index(pk_name)]
+        total += len(rows)
+        chunk += 1
+        if progress:
+            progress(model, total)
+
+
+def archive_expedition(expedition, progress=None):
+    """
+    Выгружает данные экспедиции в архив и удаляет их из базы.
+
+    Архив пишется во временный файл и переименовывается только целиком;
+    удаление из базы и заглушка - в одной транзакции.
+    """
+    if ExpeditionArchive.objects.filter(expedition=expedition).exists():
+        raise ArchiveError(f'Экспедиция {expedition.pk} уже в архиве')
+    partition = CTDPartition.objects.filter(expedition=expedition).first()
+    if partition is not None and partition.state != CTDPartition.ACTIVE:
+        raise ArchiveError(f'Секция CTD измерений экспедиции {expedition.pk} в архиве: сначала восстановите ее')
+
+    directory = archive_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    file_name = f'expedition_{expedition.pk}.zip'
+    target = bundle_path(file_name)
+    tmp = target.with_suffix('.zip.tmp')
+
+    counts = {}
+    files = []
+    with zipfile.ZipFile(tmp, 'w', compression=zipfile.ZIP_DEFLATED) as bundle:
+        tables = []
+        for model, queryset in archive_tables(expedition):
+            count = _export_table(bundle, model, queryset, progress)
+            counts[model._meta.label] = counts.get(model._meta.label, 0) + count
+            if model._meta.db_table not in tables:
+                tables.append(model._meta.db_table)
+
+        for name in CTDProfile.objects.filter(station__expedition=expedition).exclude(
+            data_file=''
+        ).exclude(data_file__isnull=True).values_list('data_file', flat=True):
+            if default_storage.exists(name):
+                with default_storage.open(name, 'rb') as f:
+                    bundle.writestr(f'files/{name}', f.read())
+                files.append(name)
+
+        bundle.writestr('manifest.json', json.dumps({
+            'format': FORMAT_VERSION,
+            'expedition_id': expedition.pk,
+            'created_at': timezone.now().isoformat(),
+            'tables': tables,
+            'counts': counts,
+            'files': files,
+        }, ensure_ascii=False, indent=1))
+    os.replace(tmp, target)
+
+    try:
+        with transaction.atomic():
+            purge(expedition, include_root=False)
+            ExpeditionArchive.objects.create(
+                expedition=expedition, file_name=file_name, size=target.stat().st_size, counts=counts,
+            )
+            transaction.on_commit(lambda: [default_storage.delete(name) for name in files])
+    except Exception:
+        target.unlink()
+        raise
+    logger.info('Archived expedition %s to %s: %s', expedition.pk, target, counts)
+    return target
+
+
+def rehydrate_expedition(expedition, progress=None):
+    """Возвращает данные экспедиции из архива в базу (измерения CTD - в основную таблицу)"""
+    stub = ExpeditionArchive.objects.filter(expedition=expedition).first()
+    if stub is None:
+        raise ArchiveError(f'Экспедиция {expedition.pk} не в архиве')
+    source = bundle_path(stub.file_name)
+
+    with zipfile.ZipFile(source) as bundle, transaction.atomic():
+        manifest = json.loads(bundle.read('manifest.json'))
+        if manifest['format'] != FORMAT_VERSION:
+            raise ArchiveError(f'Неизвестный формат архива {manifest["format"]}')
+
+        connection = connections[router.db_for_write(Expedition)]
+        members = sorted(name for name in bundle.namelist() if name.endswith('.json') and '/' in name)
+        with connection.cursor() as cursor:
+            for table in manifest['tables']:
+                restored = 0
+                for member in members:
+                    if member.split('/', 1)[0] != table or member.startswith('files/'):
+                        continue
+                    chunk = json.loads(bundle.read(member))
+                    columns = ', '.join(connection.ops.quote_name(column) for column in chunk['columns'])
+                    placeholders = ', '.join(['%s'] * len(chunk['columns']))
+                    rows = list(zip(*chunk['data']))
+                    cursor.executemany(
+                        f'INSERT INTO {connection.ops.quote_name(table)} ({columns}) VALUES ({placeholders})', rows
+                    )
+                    restored += len(rows)
+                    if progress:
+                        progress(table, restored)
+
+        for name in manifest['files']:
+            if not default_storage.exists(name):
+                default_storage.save(name, ContentFile(bundle.read(f'files/{name}')))
+        stub.delete()
+        transaction.on_commit(lambda: source.unlink(missing_ok=True))
+
+    logger.info('Rehydrated expedition %s from %s', expedition.pk, source)
+    return manifest['counts']
+
+
+def apply_stub_counts(expeditions):
+    """Счетчики станций и проб архивных экспедиций списка - из заглушек (нужен select_related('cold_archive'))"""
+    for expedition in expeditions:
+        stub = getattr(expedition, 'cold_archive', None)
+        if stub is not None:
+            expedition.stations_count = stub.stations_count
+            expedition.samples_count = stub.samples_count
+    return expeditions
+
+
+def _rehydrate_by_pk(pk):
+    expedition = Expedition.objects.get(pk=pk)
+    if not ExpeditionArchive.objects.filter(expedition=expedition).exists():
+        # Уже восстановлена предыдущим заданием
+        return {}
+    return rehydrate_expedition(expedition)
+
+
+def rehydrate_in_background(expedition):
+    """Восстановление через очередь записи; повторные запросы получают тот же Future"""
+    return get_write_queue().submit(
+        _rehydrate_by_pk, expedition.pk, key=f'rehydrate:{expedition.pk}'
+    )
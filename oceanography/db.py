@@ -0,0 +1,67 @@
+"""
+Настройка соединений SQLite.
+
+При каждом новом соединении (сигнал connection_created) выполняются
+PRAGMA из settings.SQLITE_PRAGMAS: журнал WAL (читатели не блокируют
+писателя), synchronous, размер кеша страниц, mmap, временные таблицы
+в памяти и ожидание блокировки вместо немедленной ошибки
+"database is locked".
+"""
+import sqlite3
+
+from django.conf import settings
+
+# Значения по умолчанию; переопределяются settings.SQLITE_PRAGMAS
+DEFAULT_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    # В режиме WAL NORMAL не портит базу при сбое, теряются лишь последние транзакции
+    'synchronous': 'NORMAL',
+    # Отрицательное значение - размер в KiB (64 МБ)
+    'cache_size': -64000,
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,
+}
+
+
+def sqlite_pragmas(overrides=None):
+    """Итоговый набор PRAGMA: умолчания + settings.SQLITE_PRAGMAS + overrides"""
+    pragmas = {**DEFAULT_SQLITE_PRAGMAS, **getattr(settings, 'SQLITE_PRAGMAS', {})}
+    pragmas.update(overrides or {})
+    return {name: value for name, value in pragmas.items() if value is not None}
+
+
+def apply_pragmas(cursor, pragmas):
+    # journal_mode первым: остальные PRAGMA от него не зависят, а смена режима
+    # журнала невозможна внутри транзакции
+    for name in sorted(pragmas, key=lambda name: name != 'journal_mode'):
+        cursor.execute(f"PRAGMA {name} = {pragmas[name]}")
+
+
+def configure_sqlite_connection(sender, connection, **kwargs):
+    """Обработчик connection_created для соединений SQLite"""
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = sqlite_pragmas(connection.settings_dict.get('PRAGMAS'))
+    if connection.is_in_memory_db():
+        # Для базы в памяти (тесты) WAL и mmap не применимы
+        pragmas.pop('journal_mode', None)
+        pragmas.pop('mmap_size', None)
+    with connection.cursor() as cursor:
+        apply_pragmas(cursor, pragmas)
+
+
+def sqlite_backup(connection, target_path, pages=1024, sleep=0.0, progress=None):
+    """
+    Онлайн-копия базы SQLite (backup API) в файл target_path.
+
+    Копирование идет порциями по pages страниц с паузой sleep между ними,
+    так что писатели основной базы не блокируются надолго. Читатели target
+    в режиме WAL видят прежнюю версию, пока копия не завершена.
+    """
+    connection.ensure_connection()
+    target = sqlite3.connect(target_path)
+    try:
+        connection.connection.backup(target, pages=pages, progress=progress, sleep=sleep)
+    finally:
+        target.close()
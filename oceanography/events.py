@@ -0,0 +1,255 @@
+"""
+Хранилище событий журналов пользователей.
+
+Записи логгеров user_actions и user_activity, кроме файлов, сохраняются
+структурированно в таблицу log_events отдельной базы SQLite (алиас
+events, settings.DATABASES) - журнал не конкурирует за блокировку записи
+с данными экспедиций. Пишет поток журнала (log_queue.py) пакетами
+через EventStoreHandler; схема создается командой
+`python manage.py migrate --database events`.
+
+Страница журнала (LogViewerView) читает события через event_page():
+фильтр по одному индексу и постраничный переход по ключу (id < курсора)
+без OFFSET и полного COUNT(*), так что стоимость страницы не зависит
+от размера журнала.
+
+archive_events() ("Очистить логи" на странице журнала) переносит события
+в сжатый файл JSON Lines рядом с копиями файлов журнала и удаляет их
+из базы.
+"""
+import datetime
+import gzip
+import json
+import logging
+import os
+from pathlib import Path
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Max, Min
+from django.db.utils import DatabaseError
+from django.utils import timezone
+
+from .log_queue import ActionMessage, JsonMessage
+from .models import LogEvent, SlowQuery
+from .paginators import estimate_row_count
+
+logger = logging.getLogger(__name__)
+
+EVENTS_ALIAS = 'events'
+# Модели, которые живут в базе events
+EVENT_MODELS = (LogEvent, SlowQuery)
+PAGE_SIZE = 100
+ARCHIVE_PREFIX = 'events_'
+# Сколько строк фильтра считать точно; больше - "COUNT_LIMIT+"
+COUNT_LIMIT = 10000
+SOURCES = {'user_actions': LogEvent.ACTION, 'user_activity': LogEvent.ACTIVITY, 'memory_usage': LogEvent.MEMORY}
+TIME_FILTERS = {
+    '1h': datetime.timedelta(hours=1),
+    '24h': datetime.timedelta(hours=24),
+    '7d': datetime.timedelta(days=7),
+}
+
+
+_available = set()
+
+
+def events_configured():
+    return EVENTS_ALIAS in settings.DATABASES
+
+
+def events_available(using=EVENTS_ALIAS, model=LogEvent):
+    """База событий настроена и таблица model в ней создана (migrate --database events)"""
+    if (using, model) in _available:
+        return True
+    if using not in settings.DATABASES:
+        return False
+    connection = connections[using]
+    try:
+        with connection.cursor() as cursor:
+            tables = connection.introspection.table_names(cursor)
+    except DatabaseError:
+        return False
+    if model._meta.db_table not in tables:
+        return False
+    _available.add((using, model))
+    return True
+
+
+class EventsRouter:
+    """Журналы (EVENT_MODELS) живут только в базе events, остальные модели - не в ней"""
+
+    def db_for_read(self, model, **hints):
+        if model in EVENT_MODELS:
+            return EVENTS_ALIAS
+        return None
+
+    db_for_write = db_for_read
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if app_label == LogEvent._meta.app_label and model_name in {m._meta.model_name for m in EVENT_MODELS}:
+            return db == EVENTS_ALIAS
+        if db == EVENTS_ALIAS:
+            return False
+        return None
+
+
+def event_from_record(record):
+    """LogRecord логгера журнала -> несохраненный LogEvent"""
+    event = LogEvent(
+        time=datetime.datetime.fromtimestamp(record.created, tz=datetime.timezone.utc),
+        source=SOURCES.get(record.name, record.name[:10]),
+        level=record.levelno,
+    )
+    message = record.msg
+    if isinstance(message, ActionMessage):
+        event.user = message.username or 'anonymous'
+        event.action = message.action or ''
+        event.path = message.path or ''
+        event.status = message.status or ''
+        event.target = message.target or ''
+        event.details = message.details or ''
+        event.ip = message.ip or ''
+    elif isinstance(message, JsonMessage):
+        payload = dict(message.payload)
+        event.user = payload.pop('user', '')
+        event.action = payload.pop('method', '') or payload.get('label', '')
+        event.path = (payload.pop('path', '') or '').split('?', 1)[0]
+        event.status = str(payload.pop('status', '') or '')
+        event.ip = payload.pop('ip', '') or ''
+        payload.pop('timestamp', None)
+        event.extra = payload
+    else:
+        event.details = record.getMessage()
+    for name, max_length in [('user', 150), ('action', 200), ('path', 500), ('status', 20), ('ip', 45)]:
+        setattr(event, name, getattr(event, name)[:max_length])
+    return event
+
+
+class EventStoreHandler(logging.Handler):
+    """Обработчик потока журнала: пакет записей - одна вставка в базу events"""
+
+    def __init__(self, using=EVENTS_ALIAS, level=logging.NOTSET):
+        super().__init__(level)
+        self.using = using
+        self._warned = False
+
+    def emit(self, record):
+        self.emit_batch([record])
+
+    def emit_batch(self, records):
+        if not records:
+            return
+        try:
+            LogEvent.objects.using(self.using).bulk_create([event_from_record(record) for record in records])
+        except DatabaseError:
+            if not self._warned:
+                self._warned = True
+                logger.exception(
+                    'Cannot write log events to %r (run "manage.py migrate --database %s")', self.using, self.using
+                )
+        finally:
+            connections[self.using].close_if_unusable_or_obsolete()
+
+
+def event_filters(params):
+    """
+    Фильтры страницы журнала из GET: время, источник, пользователь, действие,
+    путь, статус; q - поиск текста по файлам журнала (log_reader.search_logs).
+    """
+    return {
+        'time_filter': params.get('time_filter', 'all'),
+        'source': params.get('source', ''),
+        'user': params.get('user', '').strip(),
+        'action': params.get('action', '').strip(),
+        'path': params.get('path', '').strip(),
+        'status': params.get('status', '').strip(),
+        'q': params.get('q', '').strip(),
+    }
+
+
+def filtered_events(filters, using=EVENTS_ALIAS):
+    """
+    QuerySet событий по фильтрам, новые первыми.
+
+    Условия - равенства по индексированным полям; период переводится
+    в нижнюю границу ключа одним запросом по индексу времени.
+    """
+    queryset = LogEvent.objects.using(using).order_by('-id')
+    for name in ('source', 'user', 'action', 'path', 'status'):
+        if filters.get(name):
+            queryset = queryset.filter(**{name: filters[name]})
+    period = TIME_FILTERS.get(filters.get('time_filter'))
+    if period is not None:
+        first_id = LogEvent.objects.using(using).filter(
+            time__gte=timezone.now() - period
+        ).order_by('time').values_list('id', flat=True).first()
+        if first_id is None:
+            return queryset.none()
+        queryset = queryset.filter(id__gte=first_id)
+    return queryset
+
+
+def event_page(filters, before=None, page_size=PAGE_SIZE, using=EVENTS_ALIAS):
+    """
+    Страница событий: {'events', 'next_before', 'filtered_count', 'count_is_limit', 'total_count'}.
+
+    before - курсор (id последнего события предыдущей страницы);
+    filtered_count считается не дальше COUNT_LIMIT строк.
+    """
+    queryset = filtered_events(filters, using)
+    page = queryset.filter(id__lt=before) if before else queryset
+    events = list(page[:page_size + 1])
+    next_before = events[page_size - 1].pk if len(events) > page_size else None
+    filtered_count = queryset[:COUNT_LIMIT + 1].count()
+    return {
+        'events': events[:page_size],
+        'next_before': next_before,
+        'filtered_count': min(filtered_count, COUNT_LIMIT),
+        'count_is_limit': filtered_count > COUNT_LIMIT,
+        'total_count': estimate_row_count(LogEvent, using) or 0,
+    }
+
+
+def archive_events(directory, keep=None, using=EVENTS_ALIAS, batch_size=5000):
+    """
+    Переносит события, записанные до вызова, в directory/events_<дата_время>.jsonl.gz
+    и удаляет их из базы; хранится keep последних архивов.
+
+    Возвращает (путь, число событий); без событий - (None, 0).
+    """
+    events = LogEvent.objects.using(using).order_by('id')
+    bounds = events.aggregate(first=Min('id'), last=Max('id'))
+    if bounds['last'] is None:
+        return None, 0
+
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    stamp = f'{ARCHIVE_PREFIX}{timezone.localtime():%Y%m%d_%H%M%S}'
+    name, n = stamp, 0
+    while (directory / f'{name}.jsonl.gz').exists():
+        n += 1
+        name = f'{stamp}_{n}'
+    path = directory / f'{name}.jsonl.gz'
+    tmp = directory / f'{name}.tmp'
+    count = 0
+    with gzip.open(tmp, 'wt', encoding='utf-8') as f:
+        for row in events.filter(id__lte=bounds['last']).values().iterator(chunk_size=batch_size):
+            f.write(json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n')
+            count += 1
+    os.replace(tmp, path)
+
+    # Удаление порциями по ключу: поток журнала не ждет одну длинную транзакцию
+    for start in range(bounds['first'], bounds['last'] + 1, batch_size):
+        LogEvent.objects.using(using).filter(
+            id__gte=start, id__lte=min(start + batch_size - 1, bounds['last'])
+        ).delete()
+
+    if keep:
+        for old in sorted(directory.glob(f'{ARCHIVE_PREFIX}*.jsonl.gz'))[:-keep]:
+            old.unlink()
+    return path, count
@@ -0,0 +1,153 @@
+"""
+Компактное хранение десятичных значений массовых таблиц (CTD измерения).
+
+ScaledIntegerField хранит десятичное значение целым числом
+value * 10**decimal_places. В SQLite целое занимает 1-4 байта вместо
+8 байт REAL, а чтение не требует преобразования float -> Decimal
+с округлением по контексту. В Python значение остается Decimal, поэтому
+формы, шаблоны и фильтры (depth_m__gte=10) работают как с DecimalField.
+
+Для расчетов по целому профилю column_arrays() читает колонки одним
+запросом без создания объектов и Decimal и отдает их массивами NumPy
+(float64, пропуски - NaN), а без NumPy - массивами array('d').
+"""
+import math
+from array import array
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+from django import forms
+from django.core import exceptions, validators
+from django.db import connections, models
+from django.db.models import lookups
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class ScaledIntegerField(models.IntegerField):
+    """Decimal с фиксированным числом знаков, хранимый целым числом"""
+    description = 'Десятичное число, хранимое масштабированным целым'
+
+    def __init__(self, *args, max_digits=None, decimal_places=0, **kwargs):
+        self.max_digits = max_digits
+        self.decimal_places = decimal_places
+        self.scale = 10 ** decimal_places
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.max_digits is not None:
+            kwargs['max_digits'] = self.max_digits
+        kwargs['decimal_places'] = self.decimal_places
+        return name, path, args, kwargs
+
+    @property
+    def validators(self):
+        # Диапазон целого в БД проверяется по хранимому значению (см. get_prep_value),
+        # здесь - только число знаков, как у DecimalField
+        result = list(self._validators)
+        if self.max_digits is not None:
+            result.append(validators.DecimalValidator(self.max_digits, self.decimal_places))
+        return result
+
+    def to_python(self, value):
+        if value is None or isinstance(value, Decimal):
+            return value
+        try:
+            if isinstance(value, float):
+                return Decimal(repr(value))
+            return Decimal(str(value))
+        except InvalidOperation:
+            raise exceptions.ValidationError(
+                self.error_messages['invalid'], code='invalid', params={'value': value},
+            )
+
+    def encode(self, value):
+        """Decimal/float/int -> хранимое целое"""
+        value = self.to_python(value)
+        if value is None:
+            return None
+        return int(value.scaleb(self.decimal_places).to_integral_value(ROUND_HALF_UP))
+
+    def decode(self, value):
+        """Хранимое целое -> Decimal с decimal_places знаками"""
+        if value is None:
+            return None
+        return Decimal(value).scaleb(-self.decimal_places)
+
+    def get_prep_value(self, value):
+        value = models.Field.get_prep_value(self, value)
+        if hasattr(value, 'resolve_expression'):
+            return value
+        return self.encode(value)
+
+    def from_db_value(self, value, expression, connection):
+        return self.decode(value)
+
+    def formfield(self, **kwargs):
+        return models.Field.formfield(self, **{
+            'form_class': forms.DecimalField,
+            'max_digits': self.max_digits,
+            'decimal_places': self.decimal_places,
+            **kwargs,
+        })
+
+
+# IntegerField округляет float в сравнениях (gte=5.5 -> 6) до масштабирования -
+# для масштабированных значений нужны обычные сравнения
+ScaledIntegerField.register_lookup(lookups.GreaterThanOrEqual)
+ScaledIntegerField.register_lookup(lookups.LessThan)
+
+
+def decode_column(field, values):
+    """
+    Колонка сырых значений из БД -> массив.
+
+    ScaledIntegerField, DecimalField и FloatField - float64 (NaN вместо NULL),
+    целые поля (ключи, ID) - int64.
+    """
+    if isinstance(field, (models.AutoField, models.ForeignKey)) or (
+        isinstance(field, models.IntegerField) and not isinstance(field, ScaledIntegerField)
+    ):
+        if numpy is not None:
+            return numpy.fromiter(values, dtype=numpy.int64, count=len(values))
+        return array('q', values)
+
+    if not isinstance(field, (ScaledIntegerField, models.DecimalField, models.FloatField)):
+        raise ValueError(f'column_arrays поддерживает только числовые поля, {field.name} - {type(field).__name__}')
+
+    scale = getattr(field, 'scale', 1)
+    if numpy is not None:
+        column = numpy.array(values, dtype=numpy.float64)  # None -> NaN
+        if scale != 1:
+            column /= scale
+        return column
+    nan = math.nan
+    if scale == 1:
+        return array('d', (nan if v is None else float(v) for v in values))
+    return array('d', (nan if v is None else v / scale for v in values))
+
+
+def column_arrays(queryset, field_names):
+    """
+    {имя поля: массив} по колонкам queryset одним запросом.
+
+    Значения читаются курсором без конвертеров ORM: масштабированные целые
+    переводятся в float64 делением всей колонки, а не по одному значению.
+    Фильтры, сортировка и база (using/секция) берутся из queryset.
+    """
+    model = queryset.model
+    fields = [model._meta.get_field(name) for name in field_names]
+    queryset = queryset.values_list(*[field.attname for field in fields])
+    sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+
+    columns = list(zip(*rows)) if rows else [()] * len(fields)
+    return {
+        name: decode_column(field, list(column))
+        for name, field, column in zip(field_names, fields, columns)
+    }
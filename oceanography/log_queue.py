@@ -0,0 +1,440 @@
+"""
+Журналы действий пользователей вне пути запроса.
+
+Middleware и view не пишут в файл сами: обработчик DroppingQueueHandler
+кладет запись (LogRecord с неотформатированным сообщением) в очередь
+и сразу возвращается. Единственный поток LogListener разбирает очередь
+пакетами - форматирует записи и пишет каждый пакет в файл одной
+операцией с одним flush.
+
+Очередь ограничена (LOG_QUEUE['MAXSIZE']): когда она заполнена больше чем
+на SAMPLE_AT, записи INFO прореживаются (остается каждая SAMPLE_RATE-я),
+а при переполнении записи отбрасываются - запрос никогда не ждет журнал.
+Пропуски считаются, и поток записи сообщает о них в журнал модуля.
+При остановке процесса (atexit) очередь дописывается до конца.
+
+Файлы журналов поворачиваются по размеру (LOG_ROTATION['MAX_BYTES'])
+или возрасту (MAX_AGE_HOURS): текущий файл сжимается в file.log.1.gz,
+старые копии сдвигаются (.2.gz, ...), и остается BACKUP_COUNT копий.
+Поворот делает поток записи между пакетами, сжатие не задерживает запросы.
+"""
+import atexit
+import gzip
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOG_QUEUE = {
+    'ENABLED': True,        # False - запись в файл прямо в потоке запроса
+    'MAXSIZE': 10000,       # записей в очереди, дальше - отбрасываются
+    'BATCH_SIZE': 500,      # записей в одной операции записи
+    'BATCH_WAIT': 0.2,      # сколько ждать следующие записи для пакета, с
+    'SAMPLE_AT': 0.8,       # заполнение очереди, с которого INFO прореживаются
+    'SAMPLE_RATE': 10,      # ... и остается каждая SAMPLE_RATE-я запись
+}
+
+DEFAULT_LOG_ROTATION = {
+    'MAX_BYTES': 10 * 1024 * 1024,  # размер файла, после которого он поворачивается; 0 - без ограничения
+    'MAX_AGE_HOURS': 0,             # возраст первой записи файла для поворота; 0 - без ограничения
+    'BACKUP_COUNT': 20,             # сколько сжатых копий хранить
+}
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+_STOP = object()
+
+
+def log_queue_settings():
+    return {**DEFAULT_LOG_QUEUE, **getattr(settings, 'LOG_QUEUE', {})}
+
+
+def log_rotation_settings():
+    return {**DEFAULT_LOG_ROTATION, **getattr(settings, 'LOG_ROTATION', {})}
+
+
+def log_dir():
+    return os.path.join(settings.BASE_DIR, 'logs')
+
+
+class JsonMessage:
+    """Сообщение-словарь; в JSON переводится только потоком записи"""
+    __slots__ = ('payload',)
+
+    def __init__(self, payload):
+        self.payload = payload
+
+    def __str__(self):
+        return json.dumps(self.payload, ensure_ascii=False)
+
+
+class ActionMessage:
+    """
+    Действие пользователя для журнала.
+
+    Строка журнала собирается потоком записи, а поля
+    сохраняются в хранилище событий как есть (events.py).
+    """
+    __slots__ = ('username', 'user_id', 'action', 'target', 'details', 'status', 'ip', 'agent', 'path')
+
+    def __init__(self, username, user_id, action, target, details, status, ip, agent, path):
+        self.username = username
+        self.user_id = user_id
+        self.action = action
+        self.target = target
+        self.details = details
+        self.status = status
+        self.ip = ip
+        self.agent = agent
+        self.path = path
+
+    def __str__(self):
+        user_info = f"{self.username} (ID: {self.user_id})" if self.user_id is not None else "Anonymous User"
+        log_message = f"USER: {user_info} | ACTION: {self.action}"
+        if self.target:
+            log_message += f" | TARGET: {self.target}"
+        if self.details:
+            log_message += f" | DETAILS: {self.details}"
+        return log_message + f" | STATUS: {self.status} | IP: {self.ip}, Agent: {self.agent[:100]}..."
+
+
+ACTION_LINE = re.compile(
+    r'^(?P<time>\d{4}-\d\d-\d\d \d\d:\d\d:\d\d) - (?P<level_name>\w+) - '
+    r'USER: (?P<user>.*?) \| ACTION: (?P<action>.*?)'
+    r'(?: \| TARGET: (?P<target>.*?))?(?: \| DETAILS: (?P<details>.*?))?'
+    r' \| STATUS: (?P<status>\w+) \| (?P<client>.*)$'
+)
+
+
+def parse_action_line(line):
+    """
+    Строка user_actions.log -> словарь полей ActionMessage (time - строка,
+    как в файле). Строки другого вида - {'time', 'level', 'details'}.
+    """
+    match = ACTION_LINE.match(line)
+    if match:
+        return {name: value or '' for name, value in match.groupdict().items()}
+    return {'time': line[:19], 'level_name': 'INFO', 'details': line[22:] if len(line) > 22 else line}
+
+
+def _format_batch(handler, records):
+    """Строки пакета записей одним текстом; ошибки форматирования - через handleError"""
+    lines = []
+    for record in records:
+        try:
+            lines.append(handler.format(record) + handler.terminator)
+        except Exception:
+            handler.handleError(record)
+    return ''.join(lines)
+
+
+class BatchFileHandler(logging.FileHandler):
+    """FileHandler, который пишет пакет записей одной операцией"""
+
+    def emit_batch(self, records):
+        text = _format_batch(self, records)
+        if not text:
+            return
+        with self.lock:
+            try:
+                if self.stream is None:
+                    self.stream = self._open()
+                self.stream.write(text)
+                self.stream.flush()
+            except Exception:
+                self.handleError(records[-1])
+
+
+def gzip_rotator(source, dest):
+    """Поворот с сжатием: source -> dest (.gz) потоком, source удаляется"""
+    if not os.path.exists(source):
+        return
+    tmp = dest + '.tmp'
+    with open(source, 'rb') as src, gzip.open(tmp, 'wb', compresslevel=6) as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    os.replace(tmp, dest)
+    os.remove(source)
+
+
+class RotatingBatchFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    Пакетная запись с поворотом: по размеру (max_bytes) или по возрасту
+    первой записи файла (max_age, секунды). Повернутые копии сжимаются gzip
+    (file.log.N.gz), хранится backup_count копий.
+    """
+
+    def __init__(self, filename, max_bytes=0, max_age=0, backup_count=0, encoding=None, delay=True):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding=encoding, delay=delay)
+        self.max_age = max_age
+        self.namer = lambda name: name + '.gz'
+        self.rotator = gzip_rotator
+        self._started_at = None
+
+    def _file_started_at(self):
+        """Время первой записи текущего файла (по ее метке), None - файл пуст"""
+        if self._started_at is None:
+            try:
+                with open(self.baseFilename, 'rb') as f:
+                    head = f.read(19).decode('ascii', errors='replace')
+                self._started_at = time.mktime(time.strptime(head, DATE_FORMAT))
+            except (OSError, ValueError):
+                return None
+        return self._started_at
+
+    def should_rotate(self, pending):
+        """Нужен ли поворот перед записью pending байт"""
+        if not os.path.exists(self.baseFilename):
+            return False
+        if self.maxBytes > 0:
+            size = self.stream.tell() if self.stream is not None else os.path.getsize(self.baseFilename)
+            if size > 0 and size + pending > self.maxBytes:
+                return True
+        if self.max_age > 0:
+            started_at = self._file_started_at()
+            if started_at is not None and time.time() - started_at >= self.max_age:
+                return True
+        return False
+
+    def doRollover(self):
+        super().doRollover()
+        self._started_at = None
+
+    def emit(self, record):
+        self.emit_batch([record])
+
+    def emit_batch(self, records):
+        text = _format_batch(self, records)
+        if not text:
+            return
+        with self.lock:
+            try:
+                if self.should_rotate(len(text.encode(self.encoding or 'utf-8'))):
+                    self.doRollover()
+                if self.stream is None:
+                    self.stream = self._open()
+                self.stream.write(text)
+                self.stream.flush()
+            except Exception:
+                self.handleError(records[-1])
+
+    def rotate_now(self):
+        """Принудительный поворот (очистка журнала со страницы логов)"""
+        with self.lock:
+            self.doRollover()
+
+
+class LogListener:
+    """Поток записи журналов: {имя логгера: [обработчики]}"""
+
+    def __init__(self, maxsize=None, batch_size=None, batch_wait=None):
+        config = log_queue_settings()
+        self.queue = queue.Queue(maxsize=maxsize or config['MAXSIZE'])
+        self.batch_size = batch_size or config['BATCH_SIZE']
+        self.batch_wait = config['BATCH_WAIT'] if batch_wait is None else batch_wait
+        self.handlers = {}
+        self.dropped = 0
+        self.sampled = 0
+        self._reported = (0, 0)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._atexit = False
+
+    def add_handler(self, name, handler):
+        self.handlers.setdefault(name, []).append(handler)
+
+    def ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='log-queue', daemon=True)
+                self._thread.start()
+                if not self._atexit:
+                    atexit.register(self.stop)
+                    self._atexit = True
+
+    def _next_batch(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size and batch[-1] is not _STOP:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self.queue.get(timeout=remaining))
+                else:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            records = [record for record in batch if record is not _STOP]
+            try:
+                self.write(records)
+            except Exception:
+                logger.exception('Log queue batch failed')
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+            if len(records) < len(batch):
+                return
+
+    def write(self, records):
+        by_name = {}
+        for record in records:
+            by_name.setdefault(record.name, []).append(record)
+        for name, named in by_name.items():
+            for handler in self.handlers.get(name, []):
+                accepted = [record for record in named if record.levelno >= handler.level]
+                if hasattr(handler, 'emit_batch'):
+                    handler.emit_batch(accepted)
+                else:
+                    for record in accepted:
+                        handler.handle(record)
+        self._report_losses()
+
+    def _report_losses(self):
+        losses = (self.dropped, self.sampled)
+        if losses != self._reported:
+            logger.warning(
+                'Log queue overloaded: dropped %s, sampled out %s records',
+                losses[0] - self._reported[0], losses[1] - self._reported[1],
+            )
+            self._reported = losses
+
+    def flush(self):
+        """Ждет, пока поток запишет все записи очереди"""
+        if self._thread is not None and self._thread.is_alive():
+            self.queue.join()
+
+    def stop(self, timeout=5):
+        """Дописывает очередь и останавливает поток (atexit)"""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        try:
+            self.queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        for handlers in self.handlers.values():
+            for handler in handlers:
+                handler.flush()
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Кладет запись в очередь LogListener без ожидания.
+
+    Сообщение не форматируется в потоке запроса; при заполненной
+    очереди INFO прореживаются, при переполненной - записи отбрасываются.
+    """
+
+    def __init__(self, listener, sample_at=None, sample_rate=None):
+        super().__init__(listener.queue)
+        config = log_queue_settings()
+        self.listener = listener
+        self.sample_threshold = int(listener.queue.maxsize * (sample_at or config['SAMPLE_AT']))
+        self.sample_rate = sample_rate or config['SAMPLE_RATE']
+        self._sample_counter = itertools.count()
+
+    def prepare(self, record):
+        if record.exc_info:
+            # Трассировку - сейчас, пока кадры стека живы
+            return super().prepare(record)
+        return record
+
+    def enqueue(self, record):
+        if record.levelno < logging.WARNING and self.queue.qsize() >= self.sample_threshold:
+            if next(self._sample_counter) % self.sample_rate:
+                self.listener.sampled += 1
+                return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.listener.dropped += 1
+            return
+        self.listener.ensure_started()
+
+
+_listener = None
+_listener_lock = threading.Lock()
+_configure_lock = threading.Lock()
+
+
+def get_log_listener():
+    """Общий поток записи журналов процесса"""
+    global _listener
+    with _listener_lock:
+        if _listener is None:
+            _listener = LogListener()
+        return _listener
+
+
+def activity_logger(name, file_name, store_handler=None):
+    """
+    Логгер name, пишущий в logs/file_name и в хранилище событий
+    (events.py, если база events настроена) через очередь.
+    store_handler - класс обработчика хранилища (по умолчанию EventStoreHandler).
+
+    Если у логгера уже есть обработчики (например, из settings.LOGGING),
+    он не перенастраивается.
+    """
+    activity = logging.getLogger(name)
+    with _configure_lock:
+        if activity.handlers:
+            return activity
+        os.makedirs(log_dir(), exist_ok=True)
+        rotation = log_rotation_settings()
+        file_handler = RotatingBatchFileHandler(
+            os.path.join(log_dir(), file_name), encoding='utf-8',
+            max_bytes=rotation['MAX_BYTES'], max_age=rotation['MAX_AGE_HOURS'] * 3600,
+            backup_count=rotation['BACKUP_COUNT'],
+        )
+        file_handler.setFormatter(logging.Formatter(LOG_FORMAT, datefmt=DATE_FORMAT))
+        handlers = [file_handler]
+        from .events import EventStoreHandler, events_configured
+        if events_configured():
+            handlers.append((store_handler or EventStoreHandler)())
+        if log_queue_settings()['ENABLED']:
+            listener = get_log_listener()
+            for handler in handlers:
+                listener.add_handler(name, handler)
+            activity.addHandler(DroppingQueueHandler(listener))
+        else:
+            for handler in handlers:
+                activity.addHandler(handler)
+        activity.setLevel(logging.INFO)
+        # Обработчики корневого логгера писали бы в потоке запроса
+        activity.propagate = False
+    return activity
+
+
+def rotate_log(name):
+    """
+    Поворачивает файл журнала логгера name (из activity_logger) сейчас.
+
+    Возвращает False, если у логгера нет поворачиваемого файла.
+    """
+    listener = get_log_listener()
+    # Записи, уже стоящие в очереди, - еще в старый файл
+    listener.flush()
+    handlers = list(logging.getLogger(name).handlers) + listener.handlers.get(name, [])
+    rotated = False
+    for handler in handlers:
+        if isinstance(handler, RotatingBatchFileHandler):
+            handler.rotate_now()
+            rotated = True
+    return rotated
@@ -0,0 +1,348 @@
+"""
+Чтение хвоста журналов без чтения файла целиком.
+
+Записи user_actions.log начинаются с метки времени '%Y-%m-%d %H:%M:%S',
+которая сортируется как строка, а новые записи дописываются в конец.
+Поэтому:
+
+- последние N записей читаются с конца файла блоками назад
+  (reverse_entries) - стоимость зависит от N, а не от размера файла;
+- начало периода (фильтры 1h/24h/7d) находится двоичным поиском по
+  смещению в файле (entry_offset), а число записей периода - подсчетом
+  строк только от этого смещения до конца.
+
+Повернутые файлы (user_actions.log.1, .2, ... - соглашение
+RotatingFileHandler, и сжатые .1.gz, .2.gz, ... - log_queue.py) читаются
+следом за текущим, от новых к старым. По сжатому файлу нельзя идти назад,
+поэтому он читается потоком вперед с хвостом из последних записей;
+копия, сжатая раньше начала периода (по времени изменения файла),
+не читается вовсе. Строки без метки времени (трассировки) относятся
+к записи над ними.
+
+search_logs() ищет подстроку во всех копиях сразу: текущий файл делится
+на куски по SEARCH_CHUNK байт, каждая сжатая копия - отдельное задание;
+задания выполняются параллельно, архивы распаковываются в памяти блоками
+по BLOCK_SIZE без временных файлов.
+"""
+import gzip
+import os
+import re
+import struct
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+BLOCK_SIZE = 64 * 1024
+GZIP_BLOCK_SIZE = 1024 * 1024
+SEARCH_CHUNK = 8 * 1024 * 1024
+SEARCH_WORKERS = 4
+TIMESTAMP_LENGTH = 19
+TIMESTAMP = re.compile(rb'\d{4}-\d\d-\d\d \d\d:\d\d:\d\d')
+
+
+def rotated_files(path):
+    """Текущий файл журнала и его повернутые копии, от новых к старым (только существующие)"""
+    path = Path(path)
+    files = [path] if path.exists() else []
+    numbered = []
+    for candidate in path.parent.glob(f'{path.name}.*'):
+        suffix = candidate.name[len(path.name) + 1:]
+        if suffix.endswith('.gz'):
+            suffix = suffix[:-3]
+        if suffix.isdigit():
+            numbered.append((int(suffix), candidate.name, candidate))
+    return files + [candidate for _, _, candidate in sorted(numbered)]
+
+
+def is_compressed(path):
+    return Path(path).suffix == '.gz'
+
+
+def _timestamp(value):
+    """'%Y-%m-%d %H:%M:%S' (местное время) -> секунды эпохи"""
+    return time.mktime(time.strptime(value, '%Y-%m-%d %H:%M:%S'))
+
+
+def older_than(path, since):
+    """Сжатая копия целиком старше since: сжата (изменена) раньше начала периода"""
+    return since is not None and os.path.getmtime(path) < _timestamp(since)
+
+
+def uncompressed_size(path):
+    """Размер данных gzip-файла из его заголовка (ISIZE, по модулю 4 ГБ)"""
+    with open(path, 'rb') as f:
+        f.seek(-4, os.SEEK_END)
+        return struct.unpack('<I', f.read(4))[0]
+
+
+def _is_entry_start(line):
+    return TIMESTAMP.match(line) is not None
+
+
+def reverse_entries(path, start=0, block_size=BLOCK_SIZE):
+    """Записи файла от последней к первой, не читая байты до смещения start"""
+    with open(path, 'rb') as f:
+        position = f.seek(0, os.SEEK_END)
+        buffer = b''
+        continuation = []
+        while position > start:
+            size = min(block_size, position - start)
+            position -= size
+            f.seek(position)
+            buffer = f.read(size) + buffer
+            lines = buffer.split(b'\n')
+            # Первая строка блока может быть неполной - дочитывается со следующим блоком
+            buffer = lines.pop(0) if position > start else b''
+            for line in reversed(lines):
+                if not line:
+                    continue
+                if _is_entry_start(line):
+                    yield b'\n'.join([line] + continuation[::-1]).decode('utf-8', errors='replace')
+                    continuation = []
+                else:
+                    continuation.append(line)
+
+
+def _entry_at_or_after(f, position):
+    """(смещение, метка) первой записи, начинающейся не раньше position; (None, None) - до конца файла"""
+    if position == 0:
+        f.seek(0)
+    else:
+        f.seek(position - 1)
+        f.readline()
+    while True:
+        offset = f.tell()
+        line = f.readline()
+        if not line:
+            return None, None
+        if _is_entry_start(line):
+            return offset, line[:TIMESTAMP_LENGTH]
+
+
+def entry_offset(path, timestamp):
+    """
+    Смещение первой записи с меткой не раньше timestamp ('%Y-%m-%d %H:%M:%S')
+    двоичным поиском; размер файла, если таких записей нет.
+    """
+    target = timestamp.encode()
+    with open(path, 'rb') as f:
+        size = f.seek(0, os.SEEK_END)
+        low, high = 0, size
+        while low < high:
+            middle = (low + high) // 2
+            _, found = _entry_at_or_after(f, middle)
+            if found is None or found >= target:
+                high = middle
+            else:
+                low = middle + 1
+        offset, _ = _entry_at_or_after(f, low)
+    return size if offset is None else offset
+
+
+def _stream_lines(path, block_size=GZIP_BLOCK_SIZE):
+    """Строки сжатого файла по порядку, распаковка блоками"""
+    with gzip.open(path, 'rb') as f:
+        rest = b''
+        for block in iter(lambda: f.read(block_size), b''):
+            lines = (rest + block).split(b'\n')
+            rest = lines.pop()
+            yield from lines
+        if rest:
+            yield rest
+
+
+def forward_entries(path):
+    """Записи сжатого файла от первой к последней (байты)"""
+    entry = []
+    for line in _stream_lines(path):
+        if not line:
+            continue
+        if _is_entry_start(line) and entry:
+            yield b'\n'.join(entry)
+            entry = []
+        entry.append(line)
+    if entry:
+        yield b'\n'.join(entry)
+
+
+def _archive_tail(path, limit, since=None):
+    """
+    Сжатая копия: (последние limit записей новыми первыми, число строк
+    не старше since, есть ли записи старше since).
+    """
+    tail = deque(maxlen=max(limit, 0))
+    count = 0
+    target = since.encode() if since is not None else None
+    reached_start = False
+    for entry in forward_entries(path):
+        if target is not None and entry[:TIMESTAMP_LENGTH] < target:
+            reached_start = True
+            continue
+        count += entry.count(b'\n') + 1
+        tail.append(entry)
+    return [entry.decode('utf-8', errors='replace') for entry in reversed(tail)], count, reached_start
+
+
+def count_lines(path, start=0, block_size=BLOCK_SIZE):
+    """Число строк файла от смещения start до конца"""
+    count = 0
+    with open(path, 'rb') as f:
+        f.seek(start)
+        for block in iter(lambda: f.read(block_size), b''):
+            count += block.count(b'\n')
+    return count
+
+
+def read_log(path, limit, since=None):
+    """
+    Последние limit записей журнала path и его повернутых копий, новые первыми.
+
+    since ('%Y-%m-%d %H:%M:%S') - только записи не старше этой метки;
+    тогда filtered_count - точное число строк периода. Без since общее
+    число записей не считается (для этого пришлось бы читать все файлы),
+    а оценивается по среднему размеру прочитанных записей (estimated=True).
+    """
+    entries = []
+    filtered_count = 0
+    total_bytes = 0
+    read_bytes = 0
+    for file_path in rotated_files(path):
+        if is_compressed(file_path):
+            if older_than(file_path, since):
+                break
+            total_bytes += uncompressed_size(file_path)
+            if since is None and len(entries) >= limit:
+                # Хвост уже набран, для оценки хватает размера из заголовка
+                continue
+            tail, count, reached_start = _archive_tail(file_path, limit - len(entries), since)
+            entries.extend(tail)
+            filtered_count += count
+            read_bytes += sum(len(entry.encode('utf-8')) + 1 for entry in tail)
+            if reached_start:
+                break
+            continue
+        start = 0
+        if since is not None:
+            start = entry_offset(file_path, since)
+            filtered_count += count_lines(file_path, start)
+        total_bytes += file_path.stat().st_size
+        if len(entries) < limit:
+            for entry in reverse_entries(file_path, start):
+                entries.append(entry)
+                read_bytes += len(entry.encode('utf-8')) + 1
+                if len(entries) >= limit:
+                    break
+        if since is not None and start > 0:
+            # Начало периода в этом файле - копии старше целиком до него
+            break
+
+    if since is not None:
+        return {'entries': entries, 'filtered_count': filtered_count, 'estimated': False}
+    estimate = round(total_bytes / (read_bytes / len(entries))) if entries else 0
+    return {'entries': entries, 'filtered_count': max(estimate, len(entries)), 'estimated': True}
+
+
+def search_pattern(query):
+    """
+    Регулярное выражение по байтам UTF-8 для query без учета регистра:
+    каждая буква - альтернатива ее строчного и заглавного вида. Файлы не
+    декодируются целиком - декодируются только найденные строки.
+    """
+    parts = []
+    for char in query:
+        variants = sorted({c.encode() for c in (char, char.lower(), char.upper()) if len(c) == 1})
+        if len(variants) == 1:
+            parts.append(re.escape(variants[0]))
+        else:
+            parts.append(b'(?:' + b'|'.join(re.escape(v) for v in variants) + b')')
+    return re.compile(b''.join(parts))
+
+
+def _match_lines(data, pattern, since=None):
+    """Строки данных (целые строки) с совпадением, по порядку, каждая один раз"""
+    found = []
+    last_start = -1
+    target = since.encode() if since is not None else None
+    for match in pattern.finditer(data):
+        start = data.rfind(b'\n', 0, match.start()) + 1
+        if start == last_start:
+            continue
+        last_start = start
+        end = data.find(b'\n', match.end())
+        line = data[start:end if end != -1 else len(data)]
+        if target is not None and _is_entry_start(line) and line[:TIMESTAMP_LENGTH] < target:
+            continue
+        found.append(line.decode('utf-8', errors='replace'))
+    return found
+
+
+def _search_range(path, start, end, pattern):
+    """Совпадения в строках файла, начинающихся в [start, end)"""
+    with open(path, 'rb') as f:
+        if start > 0:
+            f.seek(start - 1)
+            f.readline()
+        position = f.tell()
+        if position >= end:
+            return []
+        data = f.read(end - position)
+        if data and not data.endswith(b'\n'):
+            data += f.readline()
+    return _match_lines(data, pattern)
+
+
+def _search_archive(path, pattern, since=None, block_size=GZIP_BLOCK_SIZE):
+    """Совпадения в сжатой копии: распаковка блоками в памяти"""
+    found = []
+    with gzip.open(path, 'rb') as f:
+        rest = b''
+        for block in iter(lambda: f.read(block_size), b''):
+            data = rest + block
+            cut = data.rfind(b'\n') + 1
+            rest = data[cut:]
+            found.extend(_match_lines(data[:cut], pattern, since))
+        if rest:
+            found.extend(_match_lines(rest, pattern, since))
+    return found
+
+
+def search_logs(path, query, limit, since=None, workers=SEARCH_WORKERS, chunk_size=SEARCH_CHUNK):
+    """
+    Строки журнала path и всех его копий, содержащие query (без учета
+    регистра), новые первыми: {'entries': первые limit строк, 'filtered_count': всего совпадений}.
+
+    since ('%Y-%m-%d %H:%M:%S') ограничивает поиск периодом: в текущем
+    файле начало периода находится двоичным поиском, копии старше
+    периода пропускаются.
+    """
+    pattern = search_pattern(query)
+    groups = []
+    for file_path in rotated_files(path):
+        if is_compressed(file_path):
+            if older_than(file_path, since):
+                break
+            groups.append([(_search_archive, file_path, pattern, since)])
+            continue
+        start = entry_offset(file_path, since) if since is not None else 0
+        size = file_path.stat().st_size
+        groups.append([
+            (_search_range, file_path, offset, min(offset + chunk_size, size), pattern)
+            for offset in range(start, size, chunk_size)
+        ])
+        if since is not None and start > 0:
+            break
+
+    tasks = [task for group in groups for task in group]
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(tasks) or 1))) as pool:
+        results = iter(list(pool.map(lambda task: task[0](*task[1:]), tasks)))
+
+    entries = []
+    count = 0
+    for group in groups:
+        # Куски файла - по порядку, файл целиком - новыми первыми
+        lines = [line for _ in group for line in next(results)]
+        count += len(lines)
+        if len(entries) < limit:
+            entries.extend(reversed(lines[-(limit - len(entries)):]))
+    return {'entries': entries, 'filtered_count': count, 'estimated': False}
@@ -1,65 +1,31 @@
-import logging
-import os
-from datetime import datetime
-from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
 
+from .log_queue import ActionMessage, activity_logger
+
+
 class UserActionLogger:
     """Логгер действий пользователей"""
     
     def __init__(self):
-        self.logger = logging.getLogger('user_actions')
-        
-        # Создаем папку для логов если её нет
-        log_dir = os.path.join(settings.BASE_DIR, 'logs')
-        if not os.path.exists(log_dir):
-            os.makedirs(log_dir)
-            
-        log_file = os.path.join(log_dir, 'user_actions.log')
-        
-        # Настраиваем обработчик файла
-        file_handler = logging.FileHandler(log_file, encoding='utf-8')
-        formatter = logging.Formatter(
-            '%(asctime)s - %(levelname)s - %(message)s',
-            datefmt='%Y-%m-%d %H:%M:%S'
-        )
-        file_handler.setFormatter(formatter)
-        
-        if not self.logger.handlers:
-            self.logger.addHandler(file_handler)
-            self.logger.setLevel(logging.INFO)
-    
-    def _get_user_info(self, request):
-        """Получаем информацию о пользователе"""
-        if hasattr(request, 'user') and not isinstance(request.user, AnonymousUser):
-            return f"{request.user.username} (ID: {request.user.id})"
-        else:
-            return "Anonymous User"
-    
-    def _get_client_info(self, request):
-        """Получаем информацию о клиенте"""
-        ip = request.META.get('REMOTE_ADDR', 'Unknown IP')
-        user_agent = request.META.get('HTTP_USER_AGENT', 'Unknown Agent')
-        return f"IP: {ip}, Agent: {user_agent[:100]}..."
+        # logs/user_actions.log; запись идет фоновым потоком (см. log_queue.py)
+        self.logger = activity_logger('user_actions', 'user_actions.log')
     
     def log_action(self, request, action, target=None, details=None, status='success'):
         """Логируем действие пользователя"""
-        user_info = self._get_user_info(request)
-        client_info = self._get_client_info(request)
-        
-        log_message = f"USER: {user_info} | ACTION: {action}"
-        
-        if target:
-            log_message += f" | TARGET: {target}"
-        if details:
-            log_message += f" | DETAILS: {details}"
-        
-        log_message += f" | STATUS: {status} | {client_info}"
-        
+        user = getattr(request, 'user', None)
+        authenticated = user is not None and not isinstance(user, AnonymousUser)
+        message = ActionMessage(
+            user.username if authenticated else '',
+            user.id if authenticated else None,
+            action, target, details, status,
+            request.META.get('REMOTE_ADDR', 'Unknown IP'),
+            request.META.get('HTTP_USER_AGENT', 'Unknown Agent'),
+            request.path,
+        )
         if status == 'error':
-            self.logger.error(log_message)
+            self.logger.error(message)
         else:
-            self.logger.info(log_message)
+            self.logger.info(message)
     
     # Специализированные методы для частых действий
     def log_create(self, request, model_name, object_id, object_name):
@@ -0,0 +1,89 @@
+from django.core.management.base import CommandError
+from django.db import connections
+
+from oceanography.backups import (
+    BackupError, backup_keep, create_snapshot, list_snapshots, probe_latency, read_manifest, snapshot_path,
+    verify_snapshot,
+)
+from oceanography.memory import MemoryTrackingCommand
+
+
+class Command(MemoryTrackingCommand):
+    help = 'Снимок базы, секций CTD и файлов профилей (online backup API SQLite) с проверкой и хранением по BACKUP_KEEP'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=1024, help='Страниц за один шаг копирования')
+        parser.add_argument('--sleep', type=float, default=0.005, help='Пауза между шагами, с')
+        parser.add_argument('--keep', type=int, default=None, help='Сколько последних снимков хранить')
+        parser.add_argument('--no-files', action='store_true', help='Только база и секции, без файлов')
+        parser.add_argument(
+            '--probe', type=float, default=0, metavar='SECONDS',
+            help='Замерить задержку запросов: SECONDS без копирования, затем во время копирования',
+        )
+        parser.add_argument('--list', action='store_true', help='Список снимков')
+        parser.add_argument('--verify', metavar='SNAPSHOT', help='Проверить контрольные суммы снимка')
+
+    def handle(self, *args, **options):
+        try:
+            if options['list']:
+                return self.list_snapshots()
+            if options['verify']:
+                verify_snapshot(snapshot_path(options['verify']))
+                self.stdout.write(self.style.SUCCESS(f"Снимок {options['verify']} в порядке"))
+                return
+            self.create(options)
+        except BackupError as e:
+            raise CommandError(str(e))
+
+    def create(self, options):
+        baseline = None
+        if options['probe']:
+            baseline = probe_latency(str(connections['default'].settings_dict['NAME']), options['probe'])
+
+        shown = set()
+
+        def progress(name, done, total):
+            if name not in shown:
+                shown.add(name)
+                self.stdout.write(f'  {name}: {total} страниц')
+
+        keep = backup_keep() if options['keep'] is None else options['keep']
+        path = create_snapshot(
+            pages=options['pages'], sleep=options['sleep'], keep=keep,
+            include_files=not options['no_files'], probe=bool(options['probe']), progress=progress,
+        )
+        manifest = read_manifest(path)
+        metrics = manifest['metrics']
+        database = metrics['database']
+        self.stdout.write(
+            f"База: {database['seconds']:.2f} с, шагов {database['steps']}, "
+            f"самый долгий шаг {database['max_step_ms']:.1f} мс; новых файлов {metrics['files_copied']}"
+        )
+        consistency = manifest['consistency']
+        self.stdout.write(
+            f"База и секции на один момент: блокировка записи {consistency['lock_ms']:.1f} мс, "
+            f"попыток {consistency['attempts']}"
+        )
+        if baseline is not None:
+            self.stdout.write(f"{'задержка, мс':<28}{'p50':>10}{'p95':>10}{'max':>10}")
+            for label, latency in [('без копирования', baseline), ('во время копирования', metrics['latency'])]:
+                for kind in ('read', 'write'):
+                    summary = latency[kind]
+                    if summary['count']:
+                        self.stdout.write(
+                            f"{kind + ' ' + label:<28}{summary['p50_ms']:>10.2f}"
+                            f"{summary['p95_ms']:>10.2f}{summary['max_ms']:>10.2f}"
+                        )
+        size = sum(f.stat().st_size for f in path.rglob('*') if f.is_file())
+        self.stdout.write(self.style.SUCCESS(
+            f"Снимок {path} ({size / 1024 / 1024:.1f} МБ) за {metrics['seconds']:.1f} с, хранится последних {keep}"
+        ))
+
+    def list_snapshots(self):
+        for path in list_snapshots():
+            manifest = read_manifest(path)
+            files = sum(len(files) for files in manifest['files'].values())
+            self.stdout.write(
+                f"{path.name}  база {manifest['database']['size'] / 1024 / 1024:>8.1f} МБ  "
+                f"секций {len(manifest['partitions']):>3}  файлов {files:>6}  {manifest['metrics']['seconds']:>7.1f} с"
+            )
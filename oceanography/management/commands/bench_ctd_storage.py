@@ -0,0 +1,112 @@
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections, models
+
+from oceanography.fields import ScaledIntegerField, decode_column, numpy
+from oceanography.models import CTDMeasurement
+
+
+class Command(BaseCommand):
+    help = 'Размер и скорость чтения CTD измерений: DecimalField (REAL) против ScaledIntegerField (INTEGER)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=200000, help='Синтетических измерений')
+        parser.add_argument('--repeat', type=int, default=3, help='Повторов чтения, берется лучший')
+
+    def handle(self, *args, **options):
+        fields = [f for f in CTDMeasurement._meta.concrete_fields if isinstance(f, ScaledIntegerField)]
+        rows = self.make_rows(fields, options['rows'])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            sizes = {
+                'decimal': self.write_file(os.path.join(tmp, 'decimal.sqlite3'), fields, rows, scaled=False),
+                'scaled': self.write_file(os.path.join(tmp, 'scaled.sqlite3'), fields, rows, scaled=True),
+            }
+            timings = self.read_timings(tmp, fields, options['repeat'])
+
+        n = options['rows']
+        self.stdout.write(f'Измерений: {n}, колонок: {len(fields)}, NumPy: {"да" if numpy is not None else "нет (array)"}')
+        self.stdout.write(f"{'хранение':<10}{'МБ':>10}{'байт/строку':>14}")
+        for name, size in sizes.items():
+            self.stdout.write(f'{name:<10}{size / 1024 / 1024:>10.2f}{size / n:>14.1f}')
+        self.stdout.write(f"\n{'чтение':<36}{'с':>10}{'строк/с':>14}")
+        for name, seconds in timings:
+            self.stdout.write(f'{name:<36}{seconds:>10.3f}{n / seconds:>14.0f}')
+
+    def make_rows(self, fields, count):
+        rng = random.Random(0)
+        return [
+            [round(rng.uniform(0, 10 ** (f.max_digits - f.decimal_places - 1)), f.decimal_places) for f in fields]
+            for _ in range(count)
+        ]
+
+    def write_file(self, path, fields, rows, scaled):
+        column_type = 'integer' if scaled else 'decimal'
+        columns = ', '.join(f'{f.column} {column_type}' for f in fields)
+        connection = sqlite3.connect(path)
+        try:
+            connection.execute(f'CREATE TABLE ctd (measurement_id integer PRIMARY KEY, profile_id integer, {columns})')
+            if scaled:
+                rows = [[f.encode(value) for f, value in zip(fields, row)] for row in rows]
+            placeholders = ', '.join(['?'] * (len(fields) + 1))
+            with connection:
+                connection.executemany(
+                    f"INSERT INTO ctd (profile_id, {', '.join(f.column for f in fields)}) VALUES ({placeholders})",
+                    ([i // 1000] + row for i, row in enumerate(rows)),
+                )
+            connection.execute('VACUUM')
+        finally:
+            connection.close()
+        return os.path.getsize(path)
+
+    def fetch(self, path, fields):
+        connection = sqlite3.connect(path)
+        try:
+            return connection.execute(f"SELECT {', '.join(f.column for f in fields)} FROM ctd").fetchall()
+        finally:
+            connection.close()
+
+    def read_timings(self, tmp, fields, repeat):
+        ops = connections['default'].ops
+        # Конвертеры, которые ORM применяет к DecimalField той же точности
+        decimal_converters = [
+            ops.get_decimalfield_converter(models.Value(
+                None, output_field=models.DecimalField(max_digits=f.max_digits, decimal_places=f.decimal_places)
+            ))
+            for f in fields
+        ]
+        decimal_path = os.path.join(tmp, 'decimal.sqlite3')
+        scaled_path = os.path.join(tmp, 'scaled.sqlite3')
+
+        def decimal_objects():
+            for row in self.fetch(decimal_path, fields):
+                [convert(value, None, None) for convert, value in zip(decimal_converters, row)]
+
+        def scaled_objects():
+            for row in self.fetch(scaled_path, fields):
+                [f.decode(value) for f, value in zip(fields, row)]
+
+        def scaled_columns():
+            columns = list(zip(*self.fetch(scaled_path, fields)))
+            [decode_column(f, list(column)) for f, column in zip(fields, columns)]
+
+        cases = [
+            ('DecimalField -> Decimal по значению', decimal_objects),
+            ('ScaledIntegerField -> Decimal', scaled_objects),
+            ('ScaledIntegerField -> column_arrays', scaled_columns),
+        ]
+        timings = []
+        for name, func in cases:
+            best = None
+            for _ in range(repeat):
+                started = time.perf_counter()
+                func()
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            timings.append((name, best))
+        return timings
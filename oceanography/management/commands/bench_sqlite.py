@@ -0,0 +1,140 @@
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from oceanography.db import apply_pragmas, sqlite_backup, sqlite_pragmas
+
+READ_SQL = """
+    SELECT s.sample_id, s.datetime, s.sampling_depth, st.station_name, st.latitude, st.longitude
+    FROM samples s JOIN stations st ON st.station_id = s.station_id
+    ORDER BY s.datetime DESC LIMIT 50 OFFSET ?
+"""
+WRITE_SQL = "INSERT INTO bench_writes (payload, created) VALUES (?, ?)"
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочный тест SQLite: чтение и запись параллельно, стандартные настройки против WAL + PRAGMA'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--seconds', type=float, default=5, help='Длительность каждого прогона')
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--writers', type=int, default=2)
+        parser.add_argument('--rows-per-write', type=int, default=20, help='Строк в одной транзакции записи')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        if connection.vendor != 'sqlite':
+            raise CommandError('Команда работает только с SQLite')
+
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, 'source.sqlite3')
+            self.copy_database(connection, source)
+
+            profiles = [
+                # Настройки Django по умолчанию: журнал отката, соединение на каждый запрос
+                ('default', {'journal_mode': 'DELETE', 'synchronous': 'FULL'}, False),
+                ('tuned', sqlite_pragmas(), True),
+            ]
+            results = []
+            for name, pragmas, persistent in profiles:
+                path = os.path.join(tmp, f'{name}.sqlite3')
+                self.copy_file(source, path, pragmas)
+                results.append((name, self.run_profile(path, pragmas, persistent, options)))
+
+        self.stdout.write(f"{'профиль':<10}{'операция':<10}{'оп/с':>10}{'p50 мс':>10}{'p95 мс':>10}{'locked':>8}")
+        for name, stats in results:
+            for kind in ('read', 'write'):
+                s = stats[kind]
+                self.stdout.write(
+                    f"{name:<10}{kind:<10}{s['ops_per_sec']:>10.1f}{s['p50_ms']:>10.2f}"
+                    f"{s['p95_ms']:>10.2f}{s['locked']:>8}"
+                )
+
+    def copy_database(self, connection, path):
+        """Копия рабочей базы через backup API, чтобы тест не трогал данные"""
+        sqlite_backup(connection, path, pages=-1)
+        target = sqlite3.connect(path)
+        try:
+            target.execute("CREATE TABLE IF NOT EXISTS bench_writes (id INTEGER PRIMARY KEY, payload TEXT, created REAL)")
+            target.commit()
+        finally:
+            target.close()
+
+    def copy_file(self, source, path, pragmas):
+        src, dst = sqlite3.connect(source), sqlite3.connect(path)
+        try:
+            src.backup(dst)
+            # Режим журнала сохраняется в файле базы
+            dst.execute(f"PRAGMA journal_mode = {pragmas.get('journal_mode', 'DELETE')}")
+        finally:
+            src.close()
+            dst.close()
+
+    def run_profile(self, path, pragmas, persistent, options):
+        samples = sqlite3.connect(path).execute("SELECT COUNT(*) FROM samples").fetchone()[0]
+        deadline = time.perf_counter() + options['seconds']
+        stats = {kind: {'latencies': [], 'locked': 0} for kind in ('read', 'write')}
+        lock = threading.Lock()
+
+        def connect():
+            conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+            apply_pragmas(conn.cursor(), pragmas)
+            return conn
+
+        def worker(kind):
+            rng = random.Random()
+            conn = connect() if persistent else None
+            latencies, locked = [], 0
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                current = conn or connect()
+                try:
+                    if kind == 'read':
+                        current.execute(READ_SQL, (rng.randrange(max(samples - 50, 1)),)).fetchall()
+                    else:
+                        current.execute("BEGIN IMMEDIATE")
+                        current.executemany(WRITE_SQL, [
+                            ('x' * 100, time.time()) for _ in range(options['rows_per_write'])
+                        ])
+                        current.execute("COMMIT")
+                    latencies.append(time.perf_counter() - started)
+                except sqlite3.OperationalError as exc:
+                    if 'locked' not in str(exc) and 'busy' not in str(exc):
+                        raise
+                    locked += 1
+                    if current.in_transaction:
+                        current.execute("ROLLBACK")
+                finally:
+                    if conn is None:
+                        current.close()
+            if conn is not None:
+                conn.close()
+            with lock:
+                stats[kind]['latencies'].extend(latencies)
+                stats[kind]['locked'] += locked
+
+        threads = [threading.Thread(target=worker, args=('read',)) for _ in range(options['readers'])]
+        threads += [threading.Thread(target=worker, args=('write',)) for _ in range(options['writers'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        summary = {}
+        for kind, data in stats.items():
+            latencies = sorted(data['latencies']) or [0.0]
+            summary[kind] = {
+                'ops_per_sec': len(data['latencies']) / options['seconds'],
+                'p50_ms': statistics.median(latencies) * 1000,
+                'p95_ms': latencies[int(len(latencies) * 0.95) - 1 if len(latencies) > 1 else 0] * 1000,
+                'locked': data['locked'],
+            }
+        return summary
@@ -0,0 +1,49 @@
+from django.core.management.base import CommandError
+
+from oceanography.cold_storage import ArchiveError, archive_expedition, bundle_path, rehydrate_expedition
+from oceanography.memory import MemoryTrackingCommand
+from oceanography.models import Expedition, ExpeditionArchive
+
+
+class Command(MemoryTrackingCommand):
+    help = 'Холодный архив экспедиций: list, archive, rehydrate'
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest='action', required=True)
+        subparsers.add_parser('list', help='Экспедиции в архиве')
+        for name, help_text in [
+            ('archive', 'Выгрузить данные экспедиций в архив и удалить из базы'),
+            ('rehydrate', 'Вернуть данные экспедиций из архива'),
+        ]:
+            action = subparsers.add_parser(name, help=help_text)
+            action.add_argument('expedition_ids', nargs='+', type=int)
+
+    def handle(self, *args, **options):
+        if options['action'] == 'list':
+            return self.list_archives()
+
+        def progress(table, rows):
+            self.stdout.write(f'  {table}: {rows}')
+
+        for expedition_id in options['expedition_ids']:
+            try:
+                expedition = Expedition.objects.get(pk=expedition_id)
+                if options['action'] == 'archive':
+                    target = archive_expedition(expedition, progress=lambda model, rows: progress(model._meta.label, rows))
+                    self.stdout.write(self.style.SUCCESS(
+                        f'Экспедиция {expedition_id}: в архиве {target} ({target.stat().st_size / 1024 / 1024:.1f} МБ)'
+                    ))
+                else:
+                    counts = rehydrate_expedition(expedition, progress=progress)
+                    self.stdout.write(self.style.SUCCESS(
+                        f'Экспедиция {expedition_id}: восстановлено строк {sum(counts.values())}'
+                    ))
+            except (Expedition.DoesNotExist, ArchiveError, FileNotFoundError) as e:
+                raise CommandError(f'Экспедиция {expedition_id}: {e}')
+
+    def list_archives(self):
+        for stub in ExpeditionArchive.objects.select_related('expedition').order_by('expedition_id'):
+            self.stdout.write(
+                f'{stub.expedition_id:>6}  {stub.expedition.platform:<30} {stub.archived_at:%d.%m.%Y} '
+                f'{stub.stations_count:>8} ст. {stub.size / 1024 / 1024:>8.1f} МБ  {bundle_path(stub.file_name)}'
+            )
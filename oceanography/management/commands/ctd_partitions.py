@@ -0,0 +1,74 @@
+import os
+
+from django.core.management.base import CommandError
+
+from oceanography.memory import MemoryTrackingCommand
+from oceanography.models import CTDPartition, Expedition
+from oceanography.partitions import (
+    PartitionUnavailable, archive_dir, archive_partition, create_partition,
+    partitions_dir, restore_partition, vacuum_partition,
+)
+
+
+class Command(MemoryTrackingCommand):
+    help = 'Секции CTD измерений по экспедициям: list, create, vacuum, archive, restore'
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest='action', required=True)
+        subparsers.add_parser('list', help='Список секций с размерами файлов')
+
+        create = subparsers.add_parser('create', help='Выделить измерения экспедиций в отдельные файлы')
+        create.add_argument('expedition_ids', nargs='+', type=int)
+        create.add_argument('--batch-size', type=int, default=50000, help='Измерений в одной транзакции переноса')
+
+        for name, help_text in [
+            ('vacuum', 'Сжать файл секции'),
+            ('archive', 'Сжатая копия секции в архив, файл отключается'),
+            ('restore', 'Вернуть секцию из архива'),
+        ]:
+            action = subparsers.add_parser(name, help=help_text)
+            action.add_argument('expedition_ids', nargs='+', type=int)
+
+    def handle(self, *args, **options):
+        action = options['action']
+        if action == 'list':
+            return self.list_partitions()
+
+        for expedition_id in options['expedition_ids']:
+            try:
+                if action == 'create':
+                    self.create(expedition_id, options['batch_size'])
+                elif action == 'vacuum':
+                    size = vacuum_partition(expedition_id)
+                    self.stdout.write(f'Экспедиция {expedition_id}: секция сжата до {size / 1024 / 1024:.1f} МБ')
+                elif action == 'archive':
+                    target = archive_partition(expedition_id)
+                    self.stdout.write(f'Экспедиция {expedition_id}: секция в архиве {target}')
+                elif action == 'restore':
+                    target = restore_partition(expedition_id)
+                    self.stdout.write(f'Экспедиция {expedition_id}: секция восстановлена в {target}')
+            except (Expedition.DoesNotExist, CTDPartition.DoesNotExist, PartitionUnavailable, FileNotFoundError) as e:
+                raise CommandError(f'Экспедиция {expedition_id}: {e}')
+
+    def create(self, expedition_id, batch_size):
+        expedition = Expedition.objects.get(pk=expedition_id)
+
+        def progress(moved):
+            self.stdout.write(f'  перенесено {moved} измерений')
+
+        moved = create_partition(expedition, batch_size=batch_size, progress=progress)
+        self.stdout.write(self.style.SUCCESS(
+            f'Экспедиция {expedition_id}: секция создана, перенесено {moved} измерений'
+        ))
+
+    def list_partitions(self):
+        for partition in CTDPartition.objects.select_related('expedition').order_by('expedition_id'):
+            if partition.state == CTDPartition.ACTIVE:
+                path = partitions_dir() / partition.file_name
+            else:
+                path = archive_dir() / f'{partition.file_name}.gz'
+            size = os.path.getsize(path) / 1024 / 1024 if path.exists() else 0
+            self.stdout.write(
+                f'{partition.expedition_id:>6}  {partition.expedition.platform:<30} '
+                f'{partition.get_state_display():<12} {size:>8.1f} МБ  {path}'
+            )
@@ -0,0 +1,55 @@
+import time
+
+from django.core.management.base import CommandError
+
+from oceanography.memory import MemoryTrackingCommand
+from oceanography.synthetic import (
+    DEFAULT_BATCH_SIZE, DEFAULT_PROFILE_EVERY, DEFAULT_SCANS, EXPEDITIONS_PER_SCALE, STATIONS_PER_EXPEDITION,
+    delete_generated, generate,
+)
+
+
+class Command(MemoryTrackingCommand):
+    help = (
+        f'Детерминированные синтетические данные: на scale=1 - {EXPEDITIONS_PER_SCALE} экспедиций '
+        f'по {STATIONS_PER_EXPEDITION} станций, пробы со всеми измерениями, CTD профили'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=float, default=1.0, help='Коэффициент объема (можно дробный)')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--scans', type=int, default=DEFAULT_SCANS, help='Сканов в CTD профиле')
+        parser.add_argument(
+            '--profile-every', type=int, default=DEFAULT_PROFILE_EVERY, help='CTD профиль на каждой N-й станции',
+        )
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Строк в одной вставке')
+        parser.add_argument('--delete', action='store_true', help='Удалить ранее созданные синтетические данные')
+
+    def handle(self, *args, **options):
+        if options['delete']:
+            deleted = delete_generated(progress=lambda expedition: self.stdout.write(f'  удалена {expedition.platform}'))
+            self.stdout.write(self.style.SUCCESS(f'Удалено синтетических экспедиций: {deleted}'))
+            return
+        if options['scale'] <= 0 or options['profile_every'] < 1 or options['scans'] < 1:
+            raise CommandError('--scale, --scans и --profile-every должны быть положительными')
+
+        started = time.perf_counter()
+
+        def progress(index, counts):
+            self.stdout.write(
+                f'  экспедиция {index}: станций {counts["Station"]}, проб {counts["Sample"]}, '
+                f'CTD сканов {counts["CTDMeasurement"]} ({time.perf_counter() - started:.1f} с)'
+            )
+
+        counts = generate(
+            scale=options['scale'], seed=options['seed'], scans=options['scans'],
+            profile_every=options['profile_every'], batch_size=options['batch_size'], progress=progress,
+        )
+        if not counts:
+            self.stdout.write('Данные этого объема уже созданы')
+            return
+        elapsed = time.perf_counter() - started
+        for name, rows in sorted(counts.items()):
+            self.stdout.write(f'{name:<24}{rows:>12}')
+        total = sum(counts.values())
+        self.stdout.write(self.style.SUCCESS(f'Создано строк: {total} за {elapsed:.1f} с ({total / elapsed:.0f} строк/с)'))
@@ -0,0 +1,49 @@
+import time
+
+from django.core.management.base import CommandError
+
+from oceanography.memory import MemoryTrackingCommand
+from oceanography.models import CTDProfile, Expedition
+from oceanography.purge import DEFAULT_BATCH_SIZE, purge, purge_counts
+
+MODELS = {'expedition': Expedition, 'profile': CTDProfile}
+
+
+class Command(MemoryTrackingCommand):
+    help = 'Удаление экспедиций или CTD профилей со всеми данными пакетными DELETE без каскада Django'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(MODELS))
+        parser.add_argument('ids', nargs='+', type=int)
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Строк в одном DELETE')
+        parser.add_argument(
+            '--no-atomic', action='store_true',
+            help='Фиксировать каждый пакет отдельно (не держать блокировку записи SQLite все время удаления)',
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Только показать, сколько строк будет удалено')
+
+    def handle(self, *args, **options):
+        model = MODELS[options['kind']]
+        for pk in options['ids']:
+            try:
+                obj = model.objects.get(pk=pk)
+            except model.DoesNotExist:
+                raise CommandError(f'{model._meta.verbose_name} {pk} не найден(а)')
+
+            self.stdout.write(f'{obj}:')
+            for counted_model, count in purge_counts(obj).items():
+                self.stdout.write(f'  {counted_model._meta.verbose_name_plural:<40} {count:>10}')
+            if options['dry_run']:
+                continue
+
+            started = time.monotonic()
+
+            def progress(deleted_model, deleted):
+                self.stdout.write(f'  {deleted_model._meta.verbose_name_plural}: удалено {deleted}')
+
+            deleted = purge(
+                obj, batch_size=options['batch_size'], atomic=not options['no_atomic'], progress=progress,
+            )
+            self.stdout.write(self.style.SUCCESS(
+                f'Удалено строк: {sum(deleted.values())} за {time.monotonic() - started:.1f} с'
+            ))
@@ -0,0 +1,42 @@
+import os
+import time
+
+from django.core.management.base import CommandError
+from django.db import connections
+
+from oceanography.db import sqlite_backup
+from oceanography.memory import MemoryTrackingCommand
+from oceanography.routers import REPLICA_ALIAS
+
+
+class Command(MemoryTrackingCommand):
+    help = 'Обновляет реплику SQLite для чтения копией основной базы (online backup API)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', default='default', help='Основная база')
+        parser.add_argument('--replica', default=REPLICA_ALIAS, help='Алиас реплики')
+        parser.add_argument('--pages', type=int, default=1024, help='Страниц за один шаг копирования')
+        parser.add_argument('--sleep', type=float, default=0.005, help='Пауза между шагами, с')
+
+    def handle(self, *args, **options):
+        if options['replica'] not in connections.databases:
+            raise CommandError(f"База '{options['replica']}' не описана в DATABASES")
+        source = connections[options['source']]
+        replica = connections[options['replica']]
+        if source.vendor != 'sqlite' or replica.vendor != 'sqlite':
+            raise CommandError('Команда обновляет только реплики SQLite; для других СУБД используйте их репликацию')
+
+        target = str(replica.settings_dict['NAME'])
+        if os.path.abspath(target) == os.path.abspath(str(source.settings_dict['NAME'])):
+            raise CommandError('Реплика совпадает с основной базой')
+
+        # Открытые соединения с репликой увидят новые данные после переподключения
+        replica.close()
+        started = time.perf_counter()
+        sqlite_backup(source, target, pages=options['pages'], sleep=options['sleep'])
+        elapsed = time.perf_counter() - started
+
+        size_mb = os.path.getsize(target) / 1024 / 1024
+        self.stdout.write(self.style.SUCCESS(
+            f'Реплика {target} обновлена: {size_mb:.1f} МБ за {elapsed:.2f} с'
+        ))
@@ -0,0 +1,41 @@
+from django.core.management.base import CommandError
+
+from oceanography.backups import BackupError, list_snapshots, restore_snapshot
+from oceanography.memory import MemoryTrackingCommand
+
+
+class Command(MemoryTrackingCommand):
+    help = 'Восстанавливает базу, секции CTD и файлы профилей из снимка команды backup'
+
+    def add_arguments(self, parser):
+        parser.add_argument('snapshot', nargs='?', help='Имя снимка (по умолчанию - последний)')
+        parser.add_argument('--no-files', action='store_true', help='Только база и секции, без файлов')
+        parser.add_argument(
+            '--noinput', '--no-input', action='store_false', dest='interactive', help='Не спрашивать подтверждение',
+        )
+
+    def handle(self, *args, **options):
+        name = options['snapshot']
+        if name is None:
+            snapshots = list_snapshots()
+            if not snapshots:
+                raise CommandError('Снимков нет')
+            name = snapshots[-1].name
+
+        if options['interactive']:
+            answer = input(f'Все текущие данные базы будут заменены снимком {name}. Продолжить? [yes/no]: ')
+            if answer != 'yes':
+                self.stdout.write('Отменено')
+                return
+
+        def progress(name, done, total):
+            if done == total:
+                self.stdout.write(f'  {name}: готово')
+
+        try:
+            restore_snapshot(name, include_files=not options['no_files'], progress=progress)
+        except BackupError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f'Восстановлено из {name}. Реплику чтения обновите командой refresh_replica'
+        ))
@@ -0,0 +1,78 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from oceanography.benchmarks import (
+    DEFAULT_REPEAT, DEFAULT_TOLERANCE, DEFAULT_UPLOAD_ROWS, DEFAULT_WARMUP, REGRESSIONS, BenchmarkError, compare,
+    default_baseline, load_results, results_dir, run, save_results,
+)
+
+
+class Command(BaseCommand):
+    help = 'Замеры ключевых страниц (данные - generate_data); результат в JSON и сравнение с базовым'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='Прогонов на замер')
+        parser.add_argument('--warmup', type=int, default=DEFAULT_WARMUP, help='Прогонов без учета')
+        parser.add_argument('--only', nargs='+', metavar='NAME', help='Только эти замеры')
+        parser.add_argument(
+            '--upload-rows', type=int, default=DEFAULT_UPLOAD_ROWS, help='Строк в файлах загрузки (0 - без загрузок)',
+        )
+        parser.add_argument('--expedition', type=int, help='ID экспедиции (по умолчанию - с наибольшим числом станций)')
+        parser.add_argument('--user', help='Суперпользователь, от имени которого идут запросы')
+        parser.add_argument('--output', help='Файл результатов (по умолчанию benchmarks/results/<время>.json)')
+        parser.add_argument('--baseline', help='Базовые результаты (по умолчанию benchmarks/baseline.json)')
+        parser.add_argument('--save-baseline', action='store_true', help='Сохранить результаты как базовые')
+        parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help='Допустимое замедление (доля)')
+        parser.add_argument('--check', action='store_true', help='Ошибка при регрессии относительно базовых')
+
+    def handle(self, *args, **options):
+        user = self.get_user(options['user'])
+
+        def progress(name, result):
+            self.stdout.write(f'  {name}: {result["median_ms"]:.1f} мс, запросов {result["queries"]}')
+
+        try:
+            results = run(
+                user, repeat=options['repeat'], warmup=options['warmup'], only=options['only'],
+                upload_rows=options['upload_rows'], expedition_id=options['expedition'], progress=progress,
+            )
+        except BenchmarkError as e:
+            raise CommandError(str(e))
+
+        output = save_results(
+            results, options['output'] or results_dir() / 'results' / f'{timezone.now():%Y%m%d_%H%M%S}.json',
+        )
+        self.stdout.write(f'Результаты: {output}')
+
+        baseline_path = options['baseline'] or default_baseline()
+        if options['save_baseline']:
+            self.stdout.write(self.style.SUCCESS(f'Базовые результаты: {save_results(results, baseline_path)}'))
+            return
+        try:
+            baseline = load_results(baseline_path)
+        except FileNotFoundError:
+            self.stdout.write(f'Базовых результатов нет ({baseline_path}) - сохраните их ключом --save-baseline')
+            return
+
+        rows = compare(results, baseline, options['tolerance'])
+        self.stdout.write(f"\n{'замер':<30}{'мс':>10}{'база мс':>10}{'x':>7}{'запр.':>7}{'база':>6}  статус")
+        for name, median, base_median, ratio, queries, base_queries, status in rows:
+            line = (
+                f'{name:<30}{median:>10.1f}{"" if base_median is None else f"{base_median:.1f}":>10}'
+                f'{"" if ratio is None else f"{ratio:.2f}":>7}{queries:>7}{"" if base_queries is None else base_queries:>6}  {status}'
+            )
+            self.stdout.write(self.style.ERROR(line) if status in REGRESSIONS else line)
+
+        regressions = [row[0] for row in rows if row[-1] in REGRESSIONS]
+        if regressions and options['check']:
+            raise CommandError(f'Регрессии: {", ".join(regressions)}')
+
+    def get_user(self, username):
+        users = get_user_model().objects.filter(is_superuser=True, is_active=True)
+        if username:
+            users = users.filter(username=username)
+        user = users.order_by('pk').first()
+        if user is None:
+            raise CommandError('Нужен активный суперпользователь (manage.py createsuperuser или --user)')
+        return user
@@ -0,0 +1,220 @@
+"""
+Учет памяти (tracemalloc) для тяжелых операций по требованию.
+
+Выгрузка и загрузка Excel (download_template, upload_data), создание CTD
+профиля с файлом данных и команды управления (backup, cold_storage и др.)
+выполняются под tracemalloc:
+
+- в запросе - с заголовком X-Memory-Profile: 1 или параметром ?_memory=1
+  от staff с правом oceanography.add_requestprofile (как profiling.py);
+- в команде - с ключом --trace-memory или переменной окружения TRACE_MEMORY=1.
+
+Запись (JSON) уходит в logs/memory_usage.log и хранилище событий: пик и
+прирост памяти, места выделения памяти, оставшейся занятой к концу
+операции (файл:строка), и прирост числа живых объектов по типам.
+MEMORY_PROFILING['BUDGETS'] - предел пика в КБ для метки операции;
+превышение пишется с уровнем WARNING, тесты проверяют пик тем же пределом.
+
+tracemalloc общий на процесс, поэтому одновременно учитывается одна
+операция; остальные в это время выполняются без учета.
+"""
+import contextlib
+import gc
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from .log_queue import JsonMessage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MEMORY_PROFILING = {
+    'ENABLED': True,
+    'TOP': 10,          # мест выделения в записи
+    'OBJECTS': 10,      # типов объектов в записи
+    'FRAMES': 1,        # кадров стека на место выделения
+    'BUDGETS': {},      # метка операции -> предел пика, КБ
+}
+
+HEADER = 'HTTP_X_MEMORY_PROFILE'
+PARAM = '_memory'
+PERMISSION = 'oceanography.add_requestprofile'
+ENV = 'TRACE_MEMORY'
+
+# Кадры модулей учета в места выделения не попадают
+_SKIP = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, __file__),
+    tracemalloc.Filter(False, '<frozen importlib.*>'),
+    tracemalloc.Filter(False, '<unknown>'),
+)
+
+_busy = threading.Lock()
+
+
+def memory_settings():
+    return {**DEFAULT_MEMORY_PROFILING, **getattr(settings, 'MEMORY_PROFILING', {})}
+
+
+def memory_budget(label):
+    """Предел пика для метки в КБ или None"""
+    return memory_settings()['BUDGETS'].get(label)
+
+
+def memory_logger():
+    from .log_queue import activity_logger
+    return activity_logger('memory_usage', 'memory_usage.log')
+
+
+def memory_requested(request):
+    """Запрос просит учет памяти и пользователю это разрешено"""
+    if HEADER not in request.META and PARAM not in request.GET and PARAM not in request.POST:
+        return False
+    if not memory_settings()['ENABLED']:
+        return False
+    user = getattr(request, 'user', None)
+    return user is not None and user.is_active and user.is_staff and user.has_perm(PERMISSION)
+
+
+def object_counts():
+    """Число живых объектов, отслеживаемых gc, по типам"""
+    return Counter(type(obj).__name__ for obj in gc.get_objects())
+
+
+class MemoryReport:
+    """Итог учета памяти одной операции; пока блок выполняется - пустой"""
+
+    def __init__(self, label, context):
+        self.label = label
+        self.context = context
+        self.traced = False
+        self.peak = 0
+        self.net = 0
+        self.duration = 0.0
+        self.top = []
+        self.objects = []
+        self.budget = memory_budget(label)
+
+    @property
+    def peak_kb(self):
+        return self.peak / 1024
+
+    @property
+    def over_budget(self):
+        return self.budget is not None and self.peak_kb > self.budget
+
+    def payload(self):
+        return {
+            **self.context,
+            'label': self.label,
+            'peak_kb': round(self.peak_kb, 1),
+            'net_kb': round(self.net / 1024, 1),
+            'duration_ms': round(self.duration * 1000, 1),
+            'budget_kb': self.budget,
+            'over_budget': self.over_budget,
+            'top': self.top,
+            'objects': self.objects,
+        }
+
+    def __str__(self):
+        lines = [f'{self.label}: пик {self.peak_kb:.1f} КБ, прирост {self.net / 1024:.1f} КБ, {self.duration:.2f} с']
+        lines += [f'  {site["size_kb"]:>10.1f} КБ {site["count"]:>8} {site["site"]}' for site in self.top]
+        lines += [f'  {entry["delta"]:>+10} {entry["type"]}' for entry in self.objects]
+        return '\n'.join(lines)
+
+
+@contextlib.contextmanager
+def track_memory(label, log=True, **context):
+    """
+    Выполняет блок под tracemalloc; отдает MemoryReport, заполняемый при выходе.
+    Если учет уже идет (другая операция или PYTHONTRACEMALLOC) - блок
+    выполняется без учета, report.traced остается False.
+    """
+    report = MemoryReport(label, context)
+    if tracemalloc.is_tracing() or not _busy.acquire(blocking=False):
+        logger.warning('tracemalloc is busy, %s runs without memory tracking', label)
+        yield report
+        return
+    config = memory_settings()
+    try:
+        # Мусор в циклах ссылок не должен попасть в прирост объектов
+        gc.collect()
+        before_objects = object_counts()
+        tracemalloc.start(config['FRAMES'])
+        before = tracemalloc.take_snapshot().filter_traces(_SKIP)
+        start_memory, _ = tracemalloc.get_traced_memory()
+        started = time.perf_counter()
+        try:
+            yield report
+        finally:
+            report.duration = time.perf_counter() - started
+            _, peak = tracemalloc.get_traced_memory()
+            gc.collect()
+            current, _ = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot().filter_traces(_SKIP)
+            tracemalloc.stop()
+            report.traced = True
+            # Снимок до блока сам занимает память, пик считаем от нее
+            report.peak = max(peak - start_memory, 0)
+            report.net = current - start_memory
+            report.top = [
+                {'site': _site(stat.traceback), 'size_kb': round(stat.size_diff / 1024, 1), 'count': stat.count_diff}
+                for stat in after.compare_to(before, 'lineno')[:config['TOP']]
+                if stat.size_diff > 0
+            ]
+            del before, after
+            delta = object_counts()
+            delta.subtract(before_objects)
+            report.objects = [
+                {'type': name, 'delta': count}
+                for name, count in delta.most_common(config['OBJECTS']) if count > 0
+            ]
+            if log:
+                level = logging.WARNING if report.over_budget else logging.INFO
+                memory_logger().log(level, JsonMessage(report.payload()))
+    finally:
+        _busy.release()
+
+
+def _site(traceback):
+    frame = traceback[0]
+    filename = frame.filename
+    base = str(settings.BASE_DIR)
+    if filename.startswith(base):
+        filename = os.path.relpath(filename, base)
+    return f'{filename}:{frame.lineno}'
+
+
+def track_request_memory(request, label):
+    """Учет памяти операции в запросе, если он запрошен; иначе пустой контекст"""
+    if not memory_requested(request):
+        return contextlib.nullcontext()
+    return track_memory(label, user=request.user.get_username(), path=request.get_full_path())
+
+
+class MemoryTrackingCommand(BaseCommand):
+    """Команда управления с ключом --trace-memory (или TRACE_MEMORY=1)"""
+
+    def create_parser(self, prog_name, subcommand, **kwargs):
+        parser = super().create_parser(prog_name, subcommand, **kwargs)
+        parser.add_argument(
+            '--trace-memory', action='store_true',
+            help='Учет памяти (tracemalloc): пик, места выделения, объекты - в logs/memory_usage.log',
+        )
+        return parser
+
+    def execute(self, *args, **options):
+        if not options.get('trace_memory') and os.environ.get(ENV) != '1':
+            return super().execute(*args, **options)
+        label = f'command.{self.__module__.rsplit(".", 1)[-1]}'
+        with track_memory(label) as report:
+            output = super().execute(*args, **options)
+        if report.traced:
+            self.stderr.write(str(report))
+        return output
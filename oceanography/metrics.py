@@ -0,0 +1,374 @@
+"""
+Метрики запросов по представлениям.
+
+UserActivityLoggingMiddleware (middleware.py) на том же вызове, что и
+журнал активности, отдает сюда каждый ответ: для имени URL (view_name)
+копятся число ответов по классам статуса и гистограммы времени ответа,
+числа и времени SQL запросов и размера ответа. Гистограммы - счетчики
+по фиксированным границам (как в Prometheus), поэтому их можно
+складывать между процессами, а p50/p95/p99 оцениваются интерполяцией
+внутри корзины.
+
+SQL запросы считает обертка выполнения (execute_wrapper), которая
+ставится на соединение один раз при его открытии (сигнал
+connection_created, apps.py) и в запросе только прибавляет к счетчикам
+текущего потока.
+
+Каждый процесс держит метрики в памяти и раз в METRICS['FLUSH_INTERVAL']
+секунд сохраняет их в METRICS['DIR']/metrics_<pid>.json; страница
+метрик и /metrics/prometheus складывают файлы всех процессов.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+
+from .slow_queries import report
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_METRICS = {
+    'ENABLED': True,
+    'DIR': None,              # по умолчанию logs/metrics
+    'FLUSH_INTERVAL': 10,     # секунд между сохранениями метрик процесса
+}
+
+# Границы корзин гистограмм (верхние, включительно); последняя корзина - +Inf
+BUCKETS = {
+    'duration': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    'db_time': (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+    'queries': (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+    'size': (1024, 10240, 102400, 1048576, 10485760, 104857600),
+}
+QUANTILES = (0.5, 0.95, 0.99)
+STATUS_CLASSES = ('2xx', '3xx', '4xx', '5xx')
+UNRESOLVED = '<unresolved>'
+
+
+def metrics_settings():
+    return {**DEFAULT_METRICS, **getattr(settings, 'METRICS', {})}
+
+
+def metrics_dir():
+    return Path(metrics_settings()['DIR'] or Path(settings.BASE_DIR) / 'logs' / 'metrics')
+
+
+class Histogram:
+    """Счетчики по корзинам, сумма и число наблюдений"""
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds, counts=None, total=0.0, count=0):
+        self.bounds = bounds
+        self.counts = list(counts) if counts else [0] * (len(bounds) + 1)
+        self.sum = total
+        self.count = count
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other):
+        for i, value in enumerate(other.counts):
+            self.counts[i] += value
+        self.sum += other.sum
+        self.count += other.count
+
+    def quantile(self, q):
+        """
+        Оценка квантиля: линейно внутри корзины. Для последней
+        корзины (+Inf) - ее нижняя граница.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, value in enumerate(self.counts):
+            if seen + value >= rank and value:
+                if i == len(self.bounds):
+                    return self.bounds[-1]
+                lower = self.bounds[i - 1] if i else 0
+                return lower + (self.bounds[i] - lower) * (rank - seen) / value
+            seen += value
+        return self.bounds[-1]
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else None
+
+    def cumulative(self):
+        """[(граница, накопленный счетчик)] для Prometheus, последняя - '+Inf'"""
+        result, seen = [], 0
+        for bound, value in zip(list(self.bounds) + ['+Inf'], self.counts):
+            seen += value
+            result.append((bound, seen))
+        return result
+
+
+class ViewMetrics:
+    """Метрики одного имени URL"""
+    __slots__ = ('statuses', 'histograms')
+
+    def __init__(self):
+        self.statuses = dict.fromkeys(STATUS_CLASSES, 0)
+        self.histograms = {name: Histogram(bounds) for name, bounds in BUCKETS.items()}
+
+    @property
+    def requests(self):
+        return sum(self.statuses.values())
+
+    def to_dict(self):
+        return {
+            'statuses': dict(self.statuses),
+            'histograms': {
+                name: {'counts': list(h.counts), 'sum': h.sum, 'count': h.count} for name, h in self.histograms.items()
+            },
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        metrics = cls()
+        for status, value in data.get('statuses', {}).items():
+            metrics.statuses[status] = metrics.statuses.get(status, 0) + value
+        for name, values in data.get('histograms', {}).items():
+            bounds = BUCKETS.get(name)
+            if bounds is not None and len(values['counts']) == len(bounds) + 1:
+                metrics.histograms[name] = Histogram(bounds, values['counts'], values['sum'], values['count'])
+        return metrics
+
+    def merge(self, other):
+        for status, value in other.statuses.items():
+            self.statuses[status] = self.statuses.get(status, 0) + value
+        for name, histogram in other.histograms.items():
+            self.histograms[name].merge(histogram)
+
+
+class MetricsRegistry:
+    """Метрики процесса: {имя URL: ViewMetrics} с периодическим сохранением в файл"""
+
+    def __init__(self, directory=None, flush_interval=None):
+        config = metrics_settings()
+        self.directory = Path(directory) if directory else metrics_dir()
+        self.flush_interval = config['FLUSH_INTERVAL'] if flush_interval is None else flush_interval
+        self.views = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+
+    @property
+    def path(self):
+        return self.directory / f'metrics_{os.getpid()}.json'
+
+    def record(self, view, status, duration, queries, db_time, size=None):
+        with self._lock:
+            metrics = self.views.get(view)
+            if metrics is None:
+                metrics = self.views[view] = ViewMetrics()
+            metrics.statuses[f'{status // 100}xx' if 200 <= status < 600 else '5xx'] += 1
+            histograms = metrics.histograms
+            histograms['duration'].observe(duration)
+            histograms['queries'].observe(queries)
+            histograms['db_time'].observe(db_time)
+            if size is not None:
+                histograms['size'].observe(size)
+        if time.monotonic() - self._flushed_at >= self.flush_interval:
+            self.flush()
+
+    def snapshot(self):
+        with self._lock:
+            return {view: metrics.to_dict() for view, metrics in self.views.items()}
+
+    def flush(self):
+        """Сохраняет метрики процесса (не ждет, если сохранение уже идет в другом потоке)"""
+        if not self._flush_lock.acquire(blocking=False):
+            return
+        try:
+            self._flushed_at = time.monotonic()
+            self.directory.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix('.tmp')
+            tmp.write_text(json.dumps({'pid': os.getpid(), 'views': self.snapshot()}), encoding='utf-8')
+            os.replace(tmp, self.path)
+        except OSError:
+            logger.exception('Cannot save request metrics to %s', self.directory)
+        finally:
+            self._flush_lock.release()
+
+    def collect(self):
+        """Метрики всех процессов: сохраненные файлы + текущее состояние этого процесса"""
+        merged = {}
+        own = self.path
+        sources = [self.snapshot()]
+        for path in sorted(self.directory.glob('metrics_*.json')) if self.directory.exists() else []:
+            if path == own:
+                continue
+            try:
+                sources.append(json.loads(path.read_text(encoding='utf-8'))['views'])
+            except (OSError, ValueError, KeyError):
+                continue
+        for views in sources:
+            for view, data in views.items():
+                metrics = ViewMetrics.from_dict(data)
+                if view in merged:
+                    merged[view].merge(metrics)
+                else:
+                    merged[view] = metrics
+        return merged
+
+    def reset(self):
+        with self._lock:
+            self.views = {}
+        for path in self.directory.glob('metrics_*.json') if self.directory.exists() else []:
+            path.unlink(missing_ok=True)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_metrics_registry():
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = MetricsRegistry()
+        return _registry
+
+
+# [число SQL, время SQL, сборщик журнала медленных запросов] текущего
+# запроса (поток); None - запрос не измеряется
+_current = threading.local()
+
+
+def count_queries(execute, sql, params, many, context):
+    """Обертка выполнения SQL: число и время запросов текущего измеряемого запроса"""
+    stats = getattr(_current, 'stats', None)
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        stats[0] += 1
+        stats[1] += elapsed
+        if stats[2] is not None:
+            stats[2].observe(sql, None if many else params, context['connection'].alias, elapsed)
+
+
+def current_stats():
+    """Счетчики измеряемого запроса текущего потока (для передачи в другой поток)"""
+    return getattr(_current, 'stats', None)
+
+
+@contextmanager
+def attributed_to(stats):
+    """SQL внутри блока засчитывается запросу со счетчиками stats (задания очереди записи)"""
+    previous = getattr(_current, 'stats', None)
+    _current.stats = stats
+    try:
+        yield
+    finally:
+        _current.stats = previous
+
+
+def install_query_counter(sender=None, connection=None, **kwargs):
+    """Обработчик connection_created: обертка ставится на соединение один раз"""
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
+
+
+class RequestTimer:
+    """
+    Измерение одного запроса: время, число и время SQL. collector -
+    сборщик журнала медленных запросов (slow_queries.QueryCollector);
+    record=False - только журнал, без метрик.
+    """
+    __slots__ = ('started', 'stats', 'record')
+
+    def __init__(self, collector=None, record=True):
+        self.stats = [0, 0.0, collector]
+        self.record = record
+        _current.stats = self.stats
+        self.started = time.perf_counter()
+
+    def finish(self, request, response):
+        duration = time.perf_counter() - self.started
+        _current.stats = None
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match is not None else UNRESOLVED
+        if self.stats[2] is not None:
+            report(self.stats[2], view, request.path)
+        if not self.record:
+            return
+        if getattr(response, 'streaming', False):
+            size = None
+        else:
+            size = len(response.content)
+        get_metrics_registry().record(
+            view, response.status_code, duration, self.stats[0], self.stats[1], size,
+        )
+
+    def cancel(self):
+        _current.stats = None
+
+
+def view_rows(views):
+    """Строки страницы метрик: квантили времени в мс, SQL и размера, по убыванию p95"""
+    rows = []
+    for view, metrics in views.items():
+        h = metrics.histograms
+        rows.append({
+            'view': view,
+            'requests': metrics.requests,
+            'errors': metrics.statuses.get('5xx', 0),
+            'client_errors': metrics.statuses.get('4xx', 0),
+            'duration': [_scaled(h['duration'].quantile(q), 1000) for q in QUANTILES],
+            'duration_mean': _scaled(h['duration'].mean, 1000),
+            'queries': [h['queries'].quantile(q) for q in QUANTILES],
+            'queries_mean': h['queries'].mean,
+            'db_time': [_scaled(h['db_time'].quantile(q), 1000) for q in QUANTILES],
+            'size': [h['size'].quantile(q) for q in QUANTILES],
+        })
+    rows.sort(key=lambda row: row['duration'][1] or 0, reverse=True)
+    return rows
+
+
+def _scaled(value, factor):
+    return None if value is None else value * factor
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus_text(views):
+    """Метрики в текстовом формате Prometheus"""
+    histograms = {
+        'duration': ('oceanography_request_duration_seconds', 'Request wall time'),
+        'db_time': ('oceanography_request_db_seconds', 'Time spent in SQL per request'),
+        'queries': ('oceanography_request_queries', 'SQL queries per request'),
+        'size': ('oceanography_response_size_bytes', 'Response body size (non-streaming)'),
+    }
+    lines = [
+        '# HELP oceanography_requests_total Responses by URL name and status class',
+        '# TYPE oceanography_requests_total counter',
+    ]
+    for view in sorted(views):
+        for status, value in sorted(views[view].statuses.items()):
+            lines.append(f'oceanography_requests_total{{view="{_label(view)}",status="{status}"}} {value}')
+    for name, (metric, help_text) in histograms.items():
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} histogram')
+        for view in sorted(views):
+            histogram = views[view].histograms[name]
+            label = _label(view)
+            for bound, value in histogram.cumulative():
+                lines.append(f'{metric}_bucket{{view="{label}",le="{bound}"}} {value}')
+            lines.append(f'{metric}_sum{{view="{label}"}} {histogram.sum:.6g}')
+            lines.append(f'{metric}_count{{view="{label}"}} {histogram.count}')
+    return '\n'.join(lines) + '\n'
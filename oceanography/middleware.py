@@ -1,8 +1,14 @@
-import json
 import logging
+import time
 
+from django.conf import settings
 from django.utils import timezone
 
+from .log_queue import JsonMessage, activity_logger
+from .metrics import RequestTimer, metrics_settings
+from .slow_queries import new_collector, slow_queries_settings, slow_query_logger
+from .routers import PIN_COOKIE, track_writes
+
 logger = logging.getLogger('user_activity')
 
 
@@ -10,18 +16,47 @@ class UserActivityLoggingMiddleware:
     """
     Логирует каждое обращение пользователя к сайту
     с минимально необходимыми данными и маскировкой чувствительных полей.
+
+    В запросе только собирается словарь: JSON и запись в logs/user_activity.log
+    выполняет поток журнала (см. log_queue.py).
+
+    Тот же вызов измеряет запрос для метрик (metrics.py): время ответа,
+    число и время SQL, размер ответа - по имени URL, и, если включен,
+    собирает журнал медленных SQL запросов (slow_queries.py).
     """
 
     SENSITIVE_KEYS = {'password', 'passwd', 'pwd', 'token', 'csrfmiddlewaretoken'}
 
     def __init__(self, get_response):
         self.get_response = get_response
+        self.metrics_enabled = metrics_settings()['ENABLED']
+        self.slow_queries_enabled = slow_queries_settings()['ENABLED']
+        activity_logger('user_activity', 'user_activity.log')
+        if self.slow_queries_enabled:
+            slow_query_logger()
 
     def __call__(self, request):
-        response = self.get_response(request)
+        timer = None
+        if self.metrics_enabled or self.slow_queries_enabled:
+            collector = new_collector() if self.slow_queries_enabled else None
+            timer = RequestTimer(collector, record=self.metrics_enabled)
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            if timer is not None:
+                timer.cancel()
+            raise
+        if timer is not None:
+            self._record_metrics(timer, request, response)
         self._log_activity(request, response)
         return response
 
+    def _record_metrics(self, timer, request, response):
+        try:
+            timer.finish(request, response)
+        except Exception:
+            logger.exception('Не удалось записать метрики запроса')
+
     def _log_activity(self, request, response):
         try:
             payload = {
@@ -40,7 +75,7 @@ class UserActivityLoggingMiddleware:
             if request.method in {'POST', 'PUT', 'PATCH', 'DELETE'} and request.POST:
                 payload['body'] = self._sanitize_querydict(request.POST)
 
-            logger.info(json.dumps(payload, ensure_ascii=False))
+            logger.info(JsonMessage(payload))
         except Exception:
             logger.exception('Не удалось записать лог пользовательской активности')
 
@@ -59,3 +94,24 @@ class UserActivityLoggingMiddleware:
             return forwarded_for.split(',')[0].strip()
         return request.META.get('REMOTE_ADDR')
 
+
+
+class ReadAfterWriteMiddleware:
+    """
+    После записи данных закрепляет клиента за основной базой (cookie),
+    чтобы следующие страницы не читали устаревшую реплику.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.pin_seconds = getattr(settings, 'REPLICA_PIN_SECONDS', 60)
+
+    def __call__(self, request):
+        with track_writes() as wrote:
+            response = self.get_response(request)
+        if wrote:
+            response.set_cookie(
+                PIN_COOKIE, str(time.time() + self.pin_seconds),
+                max_age=self.pin_seconds, httponly=True, samesite='Lax'
+            )
+        return response
@@ -0,0 +1,22 @@
+from django.db import migrations
+
+from oceanography.spatial import install_rtree, uninstall_rtree
+
+
+def create_rtree(apps, schema_editor):
+    install_rtree(schema_editor.connection)
+
+
+def drop_rtree(apps, schema_editor):
+    uninstall_rtree(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('oceanography', '0003_ctdprofile_ctdmeasurement_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_rtree, drop_rtree),
+    ]
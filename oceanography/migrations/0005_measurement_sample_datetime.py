@@ -0,0 +1,177 @@
+# Generated by Django 4.2.30 on 2026-10-19 01:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+MEASUREMENT_MODELS = [
+    'meteodata', 'carbondata', 'ioniccompositiondata', 'pigmentsdata',
+    'oxymetrdata', 'nutrientsdata', 'phmeasurement', 'ctddata',
+]
+
+
+def backfill_sample_fields(apps, schema_editor):
+    """Заполняет дату пробы и экспедицию одним UPDATE на таблицу"""
+    Sample = apps.get_model('oceanography', 'Sample')
+    for model_name in MEASUREMENT_MODELS:
+        model = apps.get_model('oceanography', model_name)
+        sample = Sample.objects.filter(pk=models.OuterRef('sample_id'))
+        model.objects.update(
+            sample_datetime=models.Subquery(sample.values('datetime')[:1]),
+            expedition_id=models.Subquery(sample.values('station__expedition_id')[:1]),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('oceanography', '0004_station_rtree'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='carbondata',
+            name='expedition',
+            field=models.ForeignKey(db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='oceanography.expedition', verbose_name='Экспедиция'),
+        ),
+        migrations.AddField(
+            model_name='carbondata',
+            name='sample_datetime',
+            field=models.DateTimeField(editable=False, null=True, verbose_name='Дата и время пробы'),
+        ),
+        migrations.AddField(
+            model_name='ctddata',
+            name='expedition',
+            field=models.ForeignKey(db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='oceanography.expedition', verbose_name='Экспедиция'),
+        ),
+        migrations.AddField(
+            model_name='ctddata',
+            name='sample_datetime',
+            field=models.DateTimeField(editable=False, null=True, verbose_name='Дата и время пробы'),
+        ),
+        migrations.AddField(
+            model_name='ioniccompositiondata',
+            name='expedition',
+            field=models.ForeignKey(db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='oceanography.expedition', verbose_name='Экспедиция'),
+        ),
+        migrations.AddField(
+            model_name='ioniccompositiondata',
+            name='sample_datetime',
+            field=models.DateTimeField(editable=False, null=True, verbose_name='Дата и время пробы'),
+        ),
+        migrations.AddField(
+            model_name='meteodata',
+            name='expedition',
+            field=models.ForeignKey(db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='oceanography.expedition', verbose_name='Экспедиция'),
+        ),
+        migrations.AddField(
+            model_name='meteodata',
+            name='sample_datetime',
+            field=models.DateTimeField(editable=False, null=True, verbose_name='Дата и время пробы'),
+        ),
+        migrations.AddField(
+            model_name='nutrientsdata',
+            name='expedition',
+            field=models.ForeignKey(db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='oceanography.expedition', verbose_name='Экспедиция'),
+        ),
+        migrations.AddField(
+            model_name='nutrientsdata',
+            name='sample_datetime',
+            field=models.DateTimeField(editable=False, null=True, verbose_name='Дата и время пробы'),
+        ),
+        migrations.AddField(
+            model_name='oxymetrdata',
+            name='expedition',
+            field=models.ForeignKey(db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='oceanography.expedition', verbose_name='Экспедиция'),
+        ),
+        migrations.AddField(
+            model_name='oxymetrdata',
+            name='sample_datetime',
+            field=models.DateTimeField(editable=False, null=True, verbose_name='Дата и время пробы'),
+        ),
+        migrations.AddField(
+            model_name='phmeasurement',
+            name='expedition',
+            field=models.ForeignKey(db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='oceanography.expedition', verbose_name='Экспедиция'),
+        ),
+        migrations.AddField(
+            model_name='phmeasurement',
+            name='sample_datetime',
+            field=models.DateTimeField(editable=False, null=True, verbose_name='Дата и время пробы'),
+        ),
+        migrations.AddField(
+            model_name='pigmentsdata',
+            name='expedition',
+            field=models.ForeignKey(db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='oceanography.expedition', verbose_name='Экспедиция'),
+        ),
+        migrations.AddField(
+            model_name='pigmentsdata',
+            name='sample_datetime',
+            field=models.DateTimeField(editable=False, null=True, verbose_name='Дата и время пробы'),
+        ),
+        migrations.RunPython(backfill_sample_fields, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='carbondata',
+            index=models.Index(fields=['sample_datetime'], name='carbon_data_sample__ec4118_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='carbondata',
+            index=models.Index(fields=['expedition', 'sample_datetime'], name='carbon_data_expedit_0b66f4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ctddata',
+            index=models.Index(fields=['sample_datetime'], name='ctd_data_sample__f2d506_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ctddata',
+            index=models.Index(fields=['expedition', 'sample_datetime'], name='ctd_data_expedit_6260c4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ioniccompositiondata',
+            index=models.Index(fields=['sample_datetime'], name='ionic_compo_sample__117a4b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ioniccompositiondata',
+            index=models.Index(fields=['expedition', 'sample_datetime'], name='ionic_compo_expedit_cf474f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='meteodata',
+            index=models.Index(fields=['sample_datetime'], name='meteo_data_sample__8d9589_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='meteodata',
+            index=models.Index(fields=['expedition', 'sample_datetime'], name='meteo_data_expedit_832f7a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='nutrientsdata',
+            index=models.Index(fields=['sample_datetime'], name='nutrients_d_sample__163804_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='nutrientsdata',
+            index=models.Index(fields=['expedition', 'sample_datetime'], name='nutrients_d_expedit_a0fb6c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='oxymetrdata',
+            index=models.Index(fields=['sample_datetime'], name='oxymetr_dat_sample__3535c9_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='oxymetrdata',
+            index=models.Index(fields=['expedition', 'sample_datetime'], name='oxymetr_dat_expedit_52e5d5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='phmeasurement',
+            index=models.Index(fields=['sample_datetime'], name='ph_measurem_sample__176853_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='phmeasurement',
+            index=models.Index(fields=['expedition', 'sample_datetime'], name='ph_measurem_expedit_ce7c16_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pigmentsdata',
+            index=models.Index(fields=['sample_datetime'], name='pigments_da_sample__4617d4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pigmentsdata',
+            index=models.Index(fields=['expedition', 'sample_datetime'], name='pigments_da_expedit_0f370b_idx'),
+        ),
+    ]
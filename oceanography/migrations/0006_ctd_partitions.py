@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-19 01:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('oceanography', '0005_measurement_sample_datetime'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CTDPartition',
+            fields=[
+                ('expedition', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='ctd_partition', serialize=False, to='oceanography.expedition', verbose_name='Экспедиция')),
+                ('file_name', models.CharField(max_length=255, verbose_name='Файл секции')),
+                ('state', models.CharField(choices=[('active', 'Подключена'), ('archived', 'В архиве')], default='active', max_length=20, verbose_name='Состояние')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создана')),
+                ('archived_at', models.DateTimeField(blank=True, null=True, verbose_name='Отправлена в архив')),
+            ],
+            options={
+                'verbose_name': 'Секция CTD измерений',
+                'verbose_name_plural': 'Секции CTD измерений',
+                'db_table': 'ctd_partitions',
+            },
+        ),
+        migrations.AlterModelOptions(
+            name='ctdmeasurement',
+            options={'ordering': ['profile_id', 'depth_m'], 'verbose_name': 'CTD измерение', 'verbose_name_plural': 'CTD измерения'},
+        ),
+    ]
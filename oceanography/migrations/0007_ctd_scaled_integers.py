@@ -0,0 +1,122 @@
+# Generated by Django 4.2.30 on 2026-10-19 01:53
+
+import sqlite3
+from pathlib import Path
+
+from django.conf import settings
+from django.db import migrations
+import oceanography.fields
+
+
+# Колонка -> число знаков после запятой (ScaledIntegerField.decimal_places)
+SCALED_COLUMNS = {
+    'depth_m': 2, 'pressure_dbar': 2, 'temp_c': 2, 'cond_ms_cm': 4, 'salinity_psu': 3,
+    'do_ml_l': 2, 'do_mg_l': 2, 'do_sat_percent': 1, 'chl_a_ug_l': 2,
+    'turbidity_ntu': 2, 'cdom_ppb': 2, 'sigma_kg_m3': 3,
+}
+
+
+def scale_sql(forward):
+    if forward:
+        sets = [f'{column} = CAST(ROUND({column} * {10 ** places}) AS INTEGER)' for column, places in SCALED_COLUMNS.items()]
+    else:
+        sets = [f'{column} = {column} / {float(10 ** places)}' for column, places in SCALED_COLUMNS.items()]
+    return f"UPDATE ctd_measurements SET {', '.join(sets)}"
+
+
+def partition_files(apps):
+    """Файлы подключенных секций CTD измерений (0006); архивные конвертировать нельзя"""
+    CTDPartition = apps.get_model('oceanography', 'CTDPartition')
+    archived = list(CTDPartition.objects.exclude(state='active').values_list('expedition_id', flat=True))
+    if archived:
+        raise RuntimeError(
+            f'Секции экспедиций {archived} в архиве: восстановите их (ctd_partitions restore) перед миграцией'
+        )
+    directory = Path(getattr(settings, 'CTD_PARTITIONS_DIR', Path(settings.BASE_DIR) / 'partitions'))
+    return [directory / name for name in CTDPartition.objects.values_list('file_name', flat=True)]
+
+
+def convert(forward):
+    def run(apps, schema_editor):
+        # Основная таблица: до смены типа колонок (вперед) и после (назад)
+        schema_editor.execute(scale_sql(forward))
+        for path in partition_files(apps):
+            # В файле секции тип колонок не меняется: NUMERIC хранит целые как есть
+            connection = sqlite3.connect(path)
+            try:
+                with connection:
+                    connection.execute(scale_sql(forward))
+            finally:
+                connection.close()
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('oceanography', '0006_ctd_partitions'),
+    ]
+
+    operations = [
+        migrations.RunPython(convert(True), convert(False)),
+        migrations.AlterField(
+            model_name='ctdmeasurement',
+            name='cdom_ppb',
+            field=oceanography.fields.ScaledIntegerField(blank=True, decimal_places=2, max_digits=6, null=True, verbose_name='CDOM (ppb)'),
+        ),
+        migrations.AlterField(
+            model_name='ctdmeasurement',
+            name='chl_a_ug_l',
+            field=oceanography.fields.ScaledIntegerField(blank=True, decimal_places=2, max_digits=6, null=True, verbose_name='Хлорофилл-а (µg/L)'),
+        ),
+        migrations.AlterField(
+            model_name='ctdmeasurement',
+            name='cond_ms_cm',
+            field=oceanography.fields.ScaledIntegerField(decimal_places=4, max_digits=7, verbose_name='Электропроводность (мС/см)'),
+        ),
+        migrations.AlterField(
+            model_name='ctdmeasurement',
+            name='depth_m',
+            field=oceanography.fields.ScaledIntegerField(decimal_places=2, max_digits=7, verbose_name='Глубина (м)'),
+        ),
+        migrations.AlterField(
+            model_name='ctdmeasurement',
+            name='do_mg_l',
+            field=oceanography.fields.ScaledIntegerField(blank=True, decimal_places=2, max_digits=5, null=True, verbose_name='Кислород (мг/л)'),
+        ),
+        migrations.AlterField(
+            model_name='ctdmeasurement',
+            name='do_ml_l',
+            field=oceanography.fields.ScaledIntegerField(blank=True, decimal_places=2, max_digits=5, null=True, verbose_name='Кислород (мл/л)'),
+        ),
+        migrations.AlterField(
+            model_name='ctdmeasurement',
+            name='do_sat_percent',
+            field=oceanography.fields.ScaledIntegerField(blank=True, decimal_places=1, max_digits=5, null=True, verbose_name='Насыщение кислородом (%)'),
+        ),
+        migrations.AlterField(
+            model_name='ctdmeasurement',
+            name='pressure_dbar',
+            field=oceanography.fields.ScaledIntegerField(decimal_places=2, max_digits=7, verbose_name='Давление (dBar)'),
+        ),
+        migrations.AlterField(
+            model_name='ctdmeasurement',
+            name='salinity_psu',
+            field=oceanography.fields.ScaledIntegerField(decimal_places=3, max_digits=6, verbose_name='Соленость (PSU)'),
+        ),
+        migrations.AlterField(
+            model_name='ctdmeasurement',
+            name='sigma_kg_m3',
+            field=oceanography.fields.ScaledIntegerField(blank=True, decimal_places=3, max_digits=6, null=True, verbose_name='Плотность (kg/m³)'),
+        ),
+        migrations.AlterField(
+            model_name='ctdmeasurement',
+            name='temp_c',
+            field=oceanography.fields.ScaledIntegerField(decimal_places=2, max_digits=5, verbose_name='Температура (°C)'),
+        ),
+        migrations.AlterField(
+            model_name='ctdmeasurement',
+            name='turbidity_ntu',
+            field=oceanography.fields.ScaledIntegerField(blank=True, decimal_places=2, max_digits=6, null=True, verbose_name='Мутность (NTU)'),
+        ),
+    ]
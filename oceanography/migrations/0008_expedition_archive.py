@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-19 01:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('oceanography', '0007_ctd_scaled_integers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExpeditionArchive',
+            fields=[
+                ('expedition', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='cold_archive', serialize=False, to='oceanography.expedition', verbose_name='Экспедиция')),
+                ('file_name', models.CharField(max_length=255, verbose_name='Файл архива')),
+                ('size', models.BigIntegerField(default=0, verbose_name='Размер архива (байт)')),
+                ('counts', models.JSONField(default=dict, verbose_name='Строк по таблицам')),
+                ('archived_at', models.DateTimeField(auto_now_add=True, verbose_name='Отправлена в архив')),
+            ],
+            options={
+                'verbose_name': 'Архив экспедиции',
+                'verbose_name_plural': 'Архивы экспедиций',
+                'db_table': 'expedition_archives',
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-19 02:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('oceanography', '0008_expedition_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LogEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('time', models.DateTimeField(db_index=True, verbose_name='Время')),
+                ('source', models.CharField(choices=[('action', 'Действие'), ('activity', 'Запрос')], max_length=10, verbose_name='Источник')),
+                ('level', models.PositiveSmallIntegerField(default=20, verbose_name='Уровень')),
+                ('user', models.CharField(blank=True, db_index=True, max_length=150, verbose_name='Пользователь')),
+                ('action', models.CharField(blank=True, db_index=True, max_length=200, verbose_name='Действие')),
+                ('path', models.CharField(blank=True, db_index=True, max_length=500, verbose_name='Путь')),
+                ('status', models.CharField(blank=True, db_index=True, max_length=20, verbose_name='Статус')),
+                ('target', models.TextField(blank=True, verbose_name='Цель')),
+                ('details', models.TextField(blank=True, verbose_name='Детали')),
+                ('ip', models.CharField(blank=True, max_length=45, verbose_name='IP')),
+                ('extra', models.JSONField(blank=True, default=dict, verbose_name='Дополнительно')),
+            ],
+            options={
+                'verbose_name': 'Событие журнала',
+                'verbose_name_plural': 'События журнала',
+                'db_table': 'log_events',
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.30 on 2026-10-19 02:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('oceanography', '0009_log_event'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlowQuery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('time', models.DateTimeField(db_index=True, verbose_name='Время')),
+                ('kind', models.CharField(choices=[('slow', 'Медленный'), ('sampled', 'Выборка запросов'), ('repeated', 'Повтор (N+1)')], max_length=10, verbose_name='Вид')),
+                ('fingerprint', models.CharField(db_index=True, max_length=16, verbose_name='Отпечаток SQL')),
+                ('sql', models.TextField(verbose_name='Нормализованный SQL')),
+                ('example', models.TextField(blank=True, verbose_name='Пример SQL')),
+                ('params_fingerprint', models.CharField(blank=True, max_length=16, verbose_name='Отпечаток параметров')),
+                ('duration_ms', models.FloatField(verbose_name='Время, мс')),
+                ('executions', models.PositiveIntegerField(default=1, verbose_name='Выполнений')),
+                ('database', models.CharField(blank=True, max_length=100, verbose_name='База')),
+                ('view', models.CharField(blank=True, db_index=True, max_length=200, verbose_name='Представление')),
+                ('path', models.CharField(blank=True, max_length=500, verbose_name='Путь')),
+                ('stack', models.TextField(blank=True, verbose_name='Стек')),
+            ],
+            options={
+                'verbose_name': 'Медленный запрос',
+                'verbose_name_plural': 'Медленные запросы',
+                'db_table': 'slow_queries',
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-19 02:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('oceanography', '0010_slow_query'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Создан')),
+                ('user', models.CharField(blank=True, max_length=150, verbose_name='Пользователь')),
+                ('view', models.CharField(blank=True, max_length=200, verbose_name='Представление')),
+                ('method', models.CharField(max_length=10, verbose_name='Метод')),
+                ('path', models.CharField(max_length=500, verbose_name='Путь')),
+                ('status', models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Статус')),
+                ('duration_ms', models.FloatField(verbose_name='Время, мс')),
+                ('queries', models.PositiveIntegerField(blank=True, null=True, verbose_name='SQL запросов')),
+                ('file_name', models.CharField(max_length=255, verbose_name='Файл pstats')),
+                ('summary', models.TextField(blank=True, verbose_name='Сводка (по накопленному времени)')),
+            ],
+            options={
+                'verbose_name': 'Профиль запроса',
+                'verbose_name_plural': 'Профили запросов',
+                'db_table': 'request_profiles',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 02:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('oceanography', '0011_request_profile'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='logevent',
+            name='source',
+            field=models.CharField(choices=[('action', 'Действие'), ('activity', 'Запрос'), ('memory', 'Память')], max_length=10, verbose_name='Источник'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-19 03:15
+
+from django.db import migrations, models
+
+from oceanography.spatial import install_rtree
+
+
+def reinstall_rtree(apps, schema_editor):
+    # SQLite пересоздает таблицу stations при добавлении и удалении колонки - триггеры R*Tree теряются
+    install_rtree(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('oceanography', '0012_logevent_memory_source'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, reinstall_rtree),
+        migrations.AddField(
+            model_name='station',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, null=True, verbose_name='Изменена'),
+        ),
+        migrations.RunPython(reinstall_rtree, migrations.RunPython.noop),
+    ]
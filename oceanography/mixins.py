@@ -1,4 +1,6 @@
 from .logger import user_action_logger
+from .profiling import profile_request, profiling_requested
+from .routers import use_replica
 
 
 class LoggingMixin:
@@ -90,4 +92,30 @@ class ViewAccessLoggingMixin:
     def _stringify_value(self, value):
         if isinstance(value, (str, int, float, bool)) or value is None:
             return value
-        return str(value)
\ No newline at end of file
+        return str(value)
+
+class ReplicaReadMixin:
+    """Страница только для чтения: запросы (включая отрисовку шаблона) идут на реплику"""
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return super().dispatch(request, *args, **kwargs)
+        with use_replica(request):
+            response = super().dispatch(request, *args, **kwargs)
+            # TemplateResponse отрисовывается позже - ленивые QuerySet считаются сейчас
+            if hasattr(response, 'render') and not response.is_rendered:
+                response.render()
+        return response
+
+
+class ProfilingMixin:
+    """
+    Профиль запроса по требованию (profiling.py): заголовок X-Profile или
+    параметр _profile от staff с правом add_requestprofile. Ставится первым
+    среди миксинов, чтобы в профиль попали и журнал, и выбор реплики.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        if profiling_requested(request):
+            return profile_request(request, lambda: super(ProfilingMixin, self).dispatch(request, *args, **kwargs))
+        return super().dispatch(request, *args, **kwargs)
@@ -1,5 +1,11 @@
-from django.db import models
+import logging
+
+from django.db import connections, models
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.utils import timezone
+
+from .fields import ScaledIntegerField
+from .spatial import MAX_DISTANCE_KM, bounding_box, haversine_km, rtree_bbox_subquery
 
 class Expedition(models.Model):
     """Экспедиции"""
@@ -23,6 +29,51 @@ class Expedition(models.Model):
     def __str__(self):
         return f"{self.platform} ({self.start_date})"
 
+class StationQuerySet(models.QuerySet):
+    """Пространственные выборки станций (см. spatial.py)"""
+
+    def in_bbox(self, min_lat, min_lon, max_lat, max_lon):
+        """Станции внутри прямоугольника координат; min_lon > max_lon - через антимеридиан"""
+        if float(min_lon) > float(max_lon):
+            return self.in_bbox(min_lat, min_lon, max_lat, 180) | self.in_bbox(min_lat, -180, max_lat, max_lon)
+        if connections[self.db].vendor == 'sqlite':
+            return self.filter(pk__in=rtree_bbox_subquery(min_lat, min_lon, max_lat, max_lon))
+        return self.filter(
+            latitude__range=(min_lat, max_lat),
+            longitude__range=(min_lon, max_lon),
+        )
+
+    def with_distance(self, lat, lon):
+        """Добавляет поле distance_km - расстояние от точки до станции"""
+        return self.annotate(distance_km=haversine_km(lat, lon))
+
+    def within_radius(self, lat, lon, radius_km):
+        """Станции в радиусе radius_km от точки, с полем distance_km"""
+        return self.in_bbox(*bounding_box(lat, lon, radius_km)).with_distance(
+            lat, lon
+        ).filter(distance_km__lte=radius_km)
+
+    def nearest(self, lat, lon, k=10, start_radius_km=10, max_radius_km=MAX_DISTANCE_KM):
+        """
+        k ближайших станций, отсортированных по distance_km.
+
+        Радиус поиска расширяется, пока в прямоугольник не попадет k станций.
+        Расстояние до k-й из них - радиус, в круге которого заведомо лежат
+        все k ближайших: итоговая выборка идет по прямоугольнику этого круга.
+        """
+        radius = start_radius_km
+        while radius < max_radius_km and self.in_bbox(*bounding_box(lat, lon, radius)).count() < k:
+            radius *= 4
+        distances = list(self.in_bbox(*bounding_box(lat, lon, min(radius, max_radius_km))).with_distance(
+            lat, lon
+        ).order_by('distance_km').values_list('distance_km', flat=True)[:k])
+        # Запас на округление расстояния в SQL
+        radius = distances[-1] * (1 + 1e-9) + 1e-6 if len(distances) == k else max_radius_km
+        return self.in_bbox(*bounding_box(lat, lon, radius)).with_distance(
+            lat, lon
+        ).order_by('distance_km')[:k]
+
+
 class Station(models.Model):
     """Станции наблюдений"""
     station_id = models.AutoField(primary_key=True)
@@ -33,6 +84,10 @@ class Station(models.Model):
     longitude = models.DecimalField(max_digits=9, decimal_places=6, verbose_name="Долгота")
     bottom_depth = models.DecimalField(max_digits=7, decimal_places=2, null=True, blank=True, verbose_name="Глубина дна (м)")
     secchi_depth = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True, verbose_name="Прозрачность по диску Секки (м)")
+    # Метка последней правки - для ETag карты экспедиции
+    updated_at = models.DateTimeField(auto_now=True, null=True, verbose_name="Изменена")
+
+    objects = StationQuerySet.as_manager()
     
     class Meta:
         db_table = 'stations'
@@ -49,6 +104,24 @@ class Station(models.Model):
     def __str__(self):
         return f"{self.station_name} ({self.datetime.date()})"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._synced_expedition_id = instance.__dict__.get('expedition_id')
+        return instance
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        if not adding and getattr(self, '_synced_expedition_id', None) != self.expedition_id:
+            # Станция перенесена в другую экспедицию - обновляем таблицы измерений
+            for model in SampleMeasurement.measurement_models():
+                model.objects.filter(sample__station_id=self.pk).update(expedition_id=self.expedition_id)
+            # CTD измерения профилей станции - в секцию новой экспедиции
+            from .partitions import station_moved
+            station_moved(self.pk, self._synced_expedition_id, self.expedition_id)
+        self._synced_expedition_id = self.expedition_id
+
 class Sample(models.Model):
     """Пробы - основная связующая сущность"""
     sample_id = models.AutoField(primary_key=True)
@@ -70,13 +143,76 @@ class Sample(models.Model):
     
     def __str__(self):
         return f"Проба {self.sample_id} - {self.station.station_name} ({self.datetime})"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._synced_values = (instance.__dict__.get('datetime'), instance.__dict__.get('station_id'))
+        return instance
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        current = (self.datetime, self.station_id)
+        if not adding and getattr(self, '_synced_values', None) != current:
+            # Дата или станция пробы изменились - обновляем копии в таблицах измерений
+            expedition_id = Station.objects.filter(pk=self.station_id).values_list('expedition_id', flat=True).get()
+            for model in SampleMeasurement.measurement_models():
+                model.objects.filter(sample_id=self.pk).update(
+                    sample_datetime=self.datetime, expedition_id=expedition_id
+                )
+            if self._synced_values[1] != self.station_id:
+                # Число проб обеих станций на карте изменилось
+                Station.objects.filter(pk__in=[self._synced_values[1], self.station_id]).update(updated_at=timezone.now())
+        self._synced_values = current
     
     @property
     def expedition(self):
         """Получить экспедицию через станцию"""
         return self.station.expedition
 
-class MeteoData(models.Model):
+class SampleMeasurement(models.Model):
+    """
+    Базовый класс таблиц измерений по пробе.
+
+    Дата пробы и экспедиция дублируются в таблицу измерений, чтобы списки
+    сортировались и фильтровались по индексу без соединения с samples
+    и stations. Значения заполняются в save() и поддерживаются
+    Sample.save() / Station.save() при изменении пробы или станции.
+    """
+    sample_datetime = models.DateTimeField(null=True, editable=False, verbose_name="Дата и время пробы")
+    expedition = models.ForeignKey(
+        Expedition, on_delete=models.CASCADE, null=True, editable=False,
+        related_name='+', db_index=False, verbose_name="Экспедиция"
+    )
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        self.sync_sample_fields()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'sample_datetime', 'expedition'}
+        super().save(*args, **kwargs)
+
+    def sync_sample_fields(self):
+        """Копирует дату пробы и экспедицию из связанной пробы"""
+        sample = self._state.fields_cache.get('sample')
+        if sample is not None and 'station' in sample._state.fields_cache:
+            self.sample_datetime = sample.datetime
+            self.expedition_id = sample.station.expedition_id
+        else:
+            self.sample_datetime, self.expedition_id = Sample.objects.filter(
+                pk=self.sample_id
+            ).values_list('datetime', 'station__expedition_id').get()
+
+    @classmethod
+    def measurement_models(cls):
+        return cls.__subclasses__()
+
+
+class MeteoData(SampleMeasurement):
     """Метеоданные"""
     meteo_data_id = models.AutoField(primary_key=True)
     sample = models.ForeignKey(Sample, on_delete=models.CASCADE, verbose_name="Проба", related_name='meteo_data')
@@ -91,11 +227,15 @@ class MeteoData(models.Model):
         db_table = 'meteo_data'
         verbose_name = "Метеоданные"
         verbose_name_plural = "Метеоданные"
+        indexes = [
+            models.Index(fields=['sample_datetime']),
+            models.Index(fields=['expedition', 'sample_datetime']),
+        ]
     
     def __str__(self):
-        return f"Метео {self.sample.sample_id}"
+        return f"Метео {self.sample_id}"
 
-class CarbonData(models.Model):
+class CarbonData(SampleMeasurement):
     """Данные по углероду"""
     carbon_data_id = models.AutoField(primary_key=True)
     sample = models.ForeignKey(Sample, on_delete=models.CASCADE, verbose_name="Проба", related_name='carbon_data')
@@ -110,12 +250,16 @@ class CarbonData(models.Model):
         db_table = 'carbon_data'
         verbose_name = "Данные по углероду"
         verbose_name_plural = "Данные по углероду"
+        indexes = [
+            models.Index(fields=['sample_datetime']),
+            models.Index(fields=['expedition', 'sample_datetime']),
+        ]
     
     def __str__(self):
-        return f"Углерод {self.sample.sample_id}"
+        return f"Углерод {self.sample_id}"
 
 
-class IonicCompositionData(models.Model):
+class IonicCompositionData(SampleMeasurement):
     """Данные по ионному составу"""
     ionic_data_id = models.AutoField(primary_key=True)
     sample = models.ForeignKey(Sample, on_delete=models.CASCADE, verbose_name="Проба", related_name='ionic_data')
@@ -150,11 +294,15 @@ class IonicCompositionData(models.Model):
         db_table = 'ionic_composition_data'
         verbose_name = "Данные по ионному составу"
         verbose_name_plural = "Данные по ионному составу"
+        indexes = [
+            models.Index(fields=['sample_datetime']),
+            models.Index(fields=['expedition', 'sample_datetime']),
+        ]
     
     def __str__(self):
-        return f"Ионы {self.sample.sample_id}"
+        return f"Ионы {self.sample_id}"
 
-class PigmentsData(models.Model):
+class PigmentsData(SampleMeasurement):
     """Данные по пигментам"""
     pigments_data_id = models.AutoField(primary_key=True)
     sample = models.ForeignKey(Sample, on_delete=models.CASCADE, verbose_name="Проба", related_name='pigments_data')
@@ -168,11 +316,15 @@ class PigmentsData(models.Model):
         db_table = 'pigments_data'
         verbose_name = "Данные по пигментам"
         verbose_name_plural = "Данные по пигментам"
+        indexes = [
+            models.Index(fields=['sample_datetime']),
+            models.Index(fields=['expedition', 'sample_datetime']),
+        ]
     
     def __str__(self):
-        return f"Пигменты {self.sample.sample_id}"
+        return f"Пигменты {self.sample_id}"
 
-class OxymetrData(models.Model):
+class OxymetrData(SampleMeasurement):
     """Данные оксиметра"""
     oxymetr_data_id = models.AutoField(primary_key=True)
     sample = models.ForeignKey(Sample, on_delete=models.CASCADE, verbose_name="Проба", related_name='oxymetr_data')
@@ -184,13 +336,17 @@ class OxymetrData(models.Model):
         db_table = 'oxymetr_data'
         verbose_name = "Данные оксиметра"
         verbose_name_plural = "Данные оксиметра"
+        indexes = [
+            models.Index(fields=['sample_datetime']),
+            models.Index(fields=['expedition', 'sample_datetime']),
+        ]
 
     def __str__(self):
-        return f'Оксиметр {self.sample.sample_id}'
+        return f'Оксиметр {self.sample_id}'
 
 
 
-class NutrientsData(models.Model):
+class NutrientsData(SampleMeasurement):
     """Данные по биогенным элементам"""
     nutrients_data_id = models.AutoField(primary_key=True)
     sample = models.ForeignKey(Sample, on_delete=models.CASCADE, verbose_name="Проба", related_name='nutrients_data')
@@ -216,12 +372,16 @@ class NutrientsData(models.Model):
         db_table = 'nutrients_data'
         verbose_name = "Данные по биогенам"
         verbose_name_plural = "Данные по биогенам"
+        indexes = [
+            models.Index(fields=['sample_datetime']),
+            models.Index(fields=['expedition', 'sample_datetime']),
+        ]
     
     def __str__(self):
-        return f"Биогены {self.sample.sample_id}"
+        return f"Биогены {self.sample_id}"
 
 
-class PHMeasurement(models.Model):
+class PHMeasurement(SampleMeasurement):
     """Измерения pH"""
     sample = models.ForeignKey(Sample, on_delete=models.CASCADE, verbose_name="Проба", related_name='ph_measurements')
     ph_meter = models.CharField(max_length=100, verbose_name="Название/модель прибора")
@@ -231,6 +391,10 @@ class PHMeasurement(models.Model):
         db_table = 'ph_measurements'
         verbose_name = "Измерение pH"
         verbose_name_plural = "Измерения pH"
+        indexes = [
+            models.Index(fields=['sample_datetime']),
+            models.Index(fields=['expedition', 'sample_datetime']),
+        ]
     
     def __str__(self):
         return f"pH {self.ph_value} - {self.sample}"
@@ -250,7 +414,7 @@ class Probe(models.Model):
     def __str__(self):
         return self.probe_name
 
-class CTDData(models.Model):
+class CTDData(SampleMeasurement):
     """Данные CTD-зонда"""
     ctd_data_id = models.AutoField(primary_key=True)
     sample = models.ForeignKey(Sample, on_delete=models.CASCADE, verbose_name="Проба", related_name='ctd_data')
@@ -280,6 +444,8 @@ class CTDData(models.Model):
         verbose_name_plural = "Данные CTD"
         indexes = [
             models.Index(fields=['sample', 'probe']),
+            models.Index(fields=['sample_datetime']),
+            models.Index(fields=['expedition', 'sample_datetime']),
         ]
     
     @property
@@ -289,9 +455,7 @@ class CTDData(models.Model):
         return None
 
     def __str__(self):
-        return f"CTD {self.sample.sample_id} - {self.probe.probe_name}"
-    def __str__(self):
-        return f"CTD {self.sample.sample_id} - {self.probe.probe_name}"
+        return f"CTD {self.sample_id} - {self.probe.probe_name}"
 
 
 # Добавить в конец models.py
@@ -316,35 +480,113 @@ class CTDProfile(models.Model):
             models.Index(fields=['start_datetime']),
         ]
         ordering = ['station', 'start_datetime']
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._synced_station_id = instance.__dict__.get('station_id')
+        return instance
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        if not adding and getattr(self, '_synced_station_id', None) != self.station_id:
+            # Профиль перенесен на другую станцию - измерения могут сменить секцию
+            from .partitions import profile_moved
+            profile_moved(self, self._synced_station_id)
+            # Наличие CTD у обеих станций на карте могло измениться
+            Station.objects.filter(pk__in=[self._synced_station_id, self.station_id]).update(updated_at=timezone.now())
+        self._synced_station_id = self.station_id
     
     def __str__(self):
         return f"CTD профиль {self.profile_id} - {self.station.station_name} ({self.start_datetime})"
 
+class CTDMeasurementQuerySet(models.QuerySet):
+    """
+    Выборки измерений с учетом секционирования (см. partitions.py).
+
+    Измерения секционированной экспедиции лежат в отдельном файле SQLite;
+    запросы по профилю или экспедиции направляются в нужную секцию.
+    """
+
+    def for_profile(self, profile):
+        """Измерения профиля (объект или ID) из секции его экспедиции"""
+        from .partitions import alias_for_profile
+        alias = alias_for_profile(profile)
+        queryset = self.filter(profile_id=getattr(profile, 'pk', profile))
+        return queryset.using(alias) if alias else queryset.main_table()
+
+    def main_table(self):
+        """Строки основной таблицы (несекционированные экспедиции), явно"""
+        clone = self._chain()
+        # Словарь подсказок общий у копий queryset - не меняем исходный
+        clone._hints = {**self._hints, 'main_table': True}
+        return clone
+
+    def for_expedition(self, expedition_id):
+        """Все измерения экспедиции"""
+        from .partitions import alias_for_expedition
+        alias = alias_for_expedition(expedition_id)
+        if alias:
+            # В секции только измерения этой экспедиции - без соединения с профилями
+            return self.using(alias)
+        return self.main_table().filter(profile__station__expedition_id=expedition_id)
+
+    def update(self, **kwargs):
+        self._require_route()
+        return super().update(**kwargs)
+
+    def delete(self):
+        self._require_route()
+        return super().delete()
+
+    def _require_route(self):
+        from .partitions import require_route
+        if self._db is None:
+            require_route(self._hints)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        from .partitions import assign_measurement_ids, is_partition_alias
+        if is_partition_alias(self.db):
+            # ID секции - из общей последовательности основной таблицы
+            objs = list(objs)
+            assign_measurement_ids(objs)
+        return super().bulk_create(objs, *args, **kwargs)
+
+
 class CTDMeasurement(models.Model):
-    """Измерение в рамках CTD профиля"""
+    """
+    Измерение в рамках CTD профиля.
+
+    Числовые колонки - ScaledIntegerField: значения хранятся целыми
+    (value * 10**decimal_places), в Python остаются Decimal. Для расчетов
+    по профилю - column_arrays(CTDMeasurement.objects.for_profile(p), [...]).
+    """
     measurement_id = models.AutoField(primary_key=True)
     profile = models.ForeignKey(CTDProfile, on_delete=models.CASCADE, verbose_name="Профиль", related_name='measurements')
     
     # Временная метка и глубина
     datetime = models.DateTimeField(verbose_name="Дата и время измерения")
-    depth_m = models.DecimalField(max_digits=7, decimal_places=2, verbose_name="Глубина (м)")
+    depth_m = ScaledIntegerField(max_digits=7, decimal_places=2, verbose_name="Глубина (м)")
     
     # Основные параметры (как в существующей CTDData)
-    pressure_dbar = models.DecimalField(max_digits=7, decimal_places=2, verbose_name="Давление (dBar)")
-    temp_c = models.DecimalField(max_digits=5, decimal_places=2, verbose_name="Температура (°C)")
-    cond_ms_cm = models.DecimalField(max_digits=7, decimal_places=4, verbose_name="Электропроводность (мС/см)")
-    salinity_psu = models.DecimalField(max_digits=6, decimal_places=3, verbose_name="Соленость (PSU)")
+    pressure_dbar = ScaledIntegerField(max_digits=7, decimal_places=2, verbose_name="Давление (dBar)")
+    temp_c = ScaledIntegerField(max_digits=5, decimal_places=2, verbose_name="Температура (°C)")
+    cond_ms_cm = ScaledIntegerField(max_digits=7, decimal_places=4, verbose_name="Электропроводность (мС/см)")
+    salinity_psu = ScaledIntegerField(max_digits=6, decimal_places=3, verbose_name="Соленость (PSU)")
     
     # Кислород
-    do_ml_l = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True, verbose_name="Кислород (мл/л)")
-    do_mg_l = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True, verbose_name="Кислород (мг/л)")
-    do_sat_percent = models.DecimalField(max_digits=5, decimal_places=1, null=True, blank=True, verbose_name="Насыщение кислородом (%)")
+    do_ml_l = ScaledIntegerField(max_digits=5, decimal_places=2, null=True, blank=True, verbose_name="Кислород (мл/л)")
+    do_mg_l = ScaledIntegerField(max_digits=5, decimal_places=2, null=True, blank=True, verbose_name="Кислород (мг/л)")
+    do_sat_percent = ScaledIntegerField(max_digits=5, decimal_places=1, null=True, blank=True, verbose_name="Насыщение кислородом (%)")
     
     # Дополнительные параметры
-    chl_a_ug_l = models.DecimalField(max_digits=6, decimal_places=2, null=True, blank=True, verbose_name="Хлорофилл-а (µg/L)")
-    turbidity_ntu = models.DecimalField(max_digits=6, decimal_places=2, null=True, blank=True, verbose_name="Мутность (NTU)")
-    cdom_ppb = models.DecimalField(max_digits=6, decimal_places=2, null=True, blank=True, verbose_name="CDOM (ppb)")
-    sigma_kg_m3 = models.DecimalField(max_digits=6, decimal_places=3, null=True, blank=True, verbose_name="Плотность (kg/m³)")
+    chl_a_ug_l = ScaledIntegerField(max_digits=6, decimal_places=2, null=True, blank=True, verbose_name="Хлорофилл-а (µg/L)")
+    turbidity_ntu = ScaledIntegerField(max_digits=6, decimal_places=2, null=True, blank=True, verbose_name="Мутность (NTU)")
+    cdom_ppb = ScaledIntegerField(max_digits=6, decimal_places=2, null=True, blank=True, verbose_name="CDOM (ppb)")
+    sigma_kg_m3 = ScaledIntegerField(max_digits=6, decimal_places=3, null=True, blank=True, verbose_name="Плотность (kg/m³)")
+
+    objects = CTDMeasurementQuerySet.as_manager()
     
     class Meta:
         db_table = 'ctd_measurements'
@@ -354,7 +596,9 @@ class CTDMeasurement(models.Model):
             models.Index(fields=['profile', 'depth_m']),
             models.Index(fields=['profile', 'datetime']),
         ]
-        ordering = ['profile', 'depth_m']
+        # profile_id, а не profile: сортировка по связи добавила бы JOIN с ctd_profiles,
+        # которой нет в файлах секций
+        ordering = ['profile_id', 'depth_m']
     
     @property
     def sigma_plus_1000(self):
@@ -363,4 +607,178 @@ class CTDMeasurement(models.Model):
         return None
     
     def __str__(self):
-        return f"CTD измерение {self.measurement_id} - {self.depth_m} м"
\ No newline at end of file
+        return f"CTD измерение {self.measurement_id} - {self.depth_m} м"
+
+
+class CTDPartition(models.Model):
+    """Секция CTD измерений: отдельный файл SQLite для одной экспедиции"""
+    ACTIVE = 'active'
+    ARCHIVED = 'archived'
+    STATE_CHOICES = [
+        (ACTIVE, 'Подключена'),
+        (ARCHIVED, 'В архиве'),
+    ]
+
+    expedition = models.OneToOneField(
+        Expedition, on_delete=models.CASCADE, primary_key=True,
+        verbose_name="Экспедиция", related_name='ctd_partition'
+    )
+    file_name = models.CharField(max_length=255, verbose_name="Файл секции")
+    state = models.CharField(max_length=20, choices=STATE_CHOICES, default=ACTIVE, verbose_name="Состояние")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Создана")
+    archived_at = models.DateTimeField(null=True, blank=True, verbose_name="Отправлена в архив")
+
+    class Meta:
+        db_table = 'ctd_partitions'
+        verbose_name = "Секция CTD измерений"
+        verbose_name_plural = "Секции CTD измерений"
+
+    def __str__(self):
+        return f"{self.file_name} ({self.get_state_display()})"
+
+
+class ExpeditionArchive(models.Model):
+    """
+    Заглушка экспедиции в холодном архиве (cold_storage.py).
+
+    Данные экспедиции выгружены в файл архива и удалены из базы; запись
+    экспедиции остается, а счетчики строк по таблицам хранятся здесь,
+    чтобы списки и сводки показывали их без восстановления.
+    """
+    expedition = models.OneToOneField(
+        Expedition, on_delete=models.CASCADE, primary_key=True,
+        verbose_name="Экспедиция", related_name='cold_archive'
+    )
+    file_name = models.CharField(max_length=255, verbose_name="Файл архива")
+    size = models.BigIntegerField(default=0, verbose_name="Размер архива (байт)")
+    counts = models.JSONField(default=dict, verbose_name="Строк по таблицам")
+    archived_at = models.DateTimeField(auto_now_add=True, verbose_name="Отправлена в архив")
+
+    class Meta:
+        db_table = 'expedition_archives'
+        verbose_name = "Архив экспедиции"
+        verbose_name_plural = "Архивы экспедиций"
+
+    def __str__(self):
+        return f"{self.file_name} ({self.archived_at:%d.%m.%Y})"
+
+    @property
+    def stations_count(self):
+        return self.counts.get(Station._meta.label, 0)
+
+    @property
+    def samples_count(self):
+        return self.counts.get(Sample._meta.label, 0)
+
+
+class LogEvent(models.Model):
+    """
+    Событие журнала действий пользователей (user_actions), обращения
+    к сайту (user_activity) или учета памяти (memory_usage, memory.py).
+
+    Хранится в отдельной базе events (см. events.py), пишется потоком
+    журнала пакетами. Ключ растет вместе со временем записи, поэтому
+    страницы просмотра идут по ключу, а индексы по времени, пользователю,
+    действию и пути (в SQLite индекс включает rowid) отдают строку фильтра
+    уже упорядоченной.
+    """
+    ACTION = 'action'
+    ACTIVITY = 'activity'
+    MEMORY = 'memory'
+    SOURCE_CHOICES = [
+        (ACTION, 'Действие'),
+        (ACTIVITY, 'Запрос'),
+        (MEMORY, 'Память'),
+    ]
+
+    time = models.DateTimeField(db_index=True, verbose_name="Время")
+    source = models.CharField(max_length=10, choices=SOURCE_CHOICES, verbose_name="Источник")
+    level = models.PositiveSmallIntegerField(default=logging.INFO, verbose_name="Уровень")
+    user = models.CharField(max_length=150, blank=True, db_index=True, verbose_name="Пользователь")
+    action = models.CharField(max_length=200, blank=True, db_index=True, verbose_name="Действие")
+    path = models.CharField(max_length=500, blank=True, db_index=True, verbose_name="Путь")
+    status = models.CharField(max_length=20, blank=True, db_index=True, verbose_name="Статус")
+    target = models.TextField(blank=True, verbose_name="Цель")
+    details = models.TextField(blank=True, verbose_name="Детали")
+    ip = models.CharField(max_length=45, blank=True, verbose_name="IP")
+    extra = models.JSONField(default=dict, blank=True, verbose_name="Дополнительно")
+
+    class Meta:
+        db_table = 'log_events'
+        verbose_name = "Событие журнала"
+        verbose_name_plural = "События журнала"
+
+    def __str__(self):
+        return f"{self.time:%Y-%m-%d %H:%M:%S} {self.user} {self.action}"
+
+    @property
+    def level_name(self):
+        return logging.getLevelName(self.level)
+
+
+class SlowQuery(models.Model):
+    """
+    SQL запрос из журнала медленных запросов (slow_queries.py).
+
+    Хранится в базе events рядом с LogEvent. fingerprint - хеш
+    нормализованного SQL (литералы и списки IN свернуты), по нему
+    страница журнала группирует запросы. Повторы одного запроса в одном
+    HTTP запросе (N+1) пишутся одной строкой kind=repeated с числом
+    выполнений и суммарным временем.
+    """
+    SLOW = 'slow'
+    SAMPLED = 'sampled'
+    REPEATED = 'repeated'
+    KIND_CHOICES = [
+        (SLOW, 'Медленный'),
+        (SAMPLED, 'Выборка запросов'),
+        (REPEATED, 'Повтор (N+1)'),
+    ]
+
+    time = models.DateTimeField(db_index=True, verbose_name="Время")
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, verbose_name="Вид")
+    fingerprint = models.CharField(max_length=16, db_index=True, verbose_name="Отпечаток SQL")
+    sql = models.TextField(verbose_name="Нормализованный SQL")
+    example = models.TextField(blank=True, verbose_name="Пример SQL")
+    params_fingerprint = models.CharField(max_length=16, blank=True, verbose_name="Отпечаток параметров")
+    duration_ms = models.FloatField(verbose_name="Время, мс")
+    executions = models.PositiveIntegerField(default=1, verbose_name="Выполнений")
+    database = models.CharField(max_length=100, blank=True, verbose_name="База")
+    view = models.CharField(max_length=200, blank=True, db_index=True, verbose_name="Представление")
+    path = models.CharField(max_length=500, blank=True, verbose_name="Путь")
+    stack = models.TextField(blank=True, verbose_name="Стек")
+
+    class Meta:
+        db_table = 'slow_queries'
+        verbose_name = "Медленный запрос"
+        verbose_name_plural = "Медленные запросы"
+
+    def __str__(self):
+        return f"{self.time:%Y-%m-%d %H:%M:%S} {self.view} {self.duration_ms:.1f} ms"
+
+
+class RequestProfile(models.Model):
+    """
+    Профиль одного HTTP запроса (profiling.py): запускается staff-пользователем
+    с правом add_requestprofile по заголовку X-Profile или параметру _profile.
+    Файл pstats лежит в PROFILING['DIR'], здесь - сводка и ссылка на него.
+    """
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name="Создан")
+    user = models.CharField(max_length=150, blank=True, verbose_name="Пользователь")
+    view = models.CharField(max_length=200, blank=True, verbose_name="Представление")
+    method = models.CharField(max_length=10, verbose_name="Метод")
+    path = models.CharField(max_length=500, verbose_name="Путь")
+    status = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name="Статус")
+    duration_ms = models.FloatField(verbose_name="Время, мс")
+    queries = models.PositiveIntegerField(null=True, blank=True, verbose_name="SQL запросов")
+    file_name = models.CharField(max_length=255, verbose_name="Файл pstats")
+    summary = models.TextField(blank=True, verbose_name="Сводка (по накопленному времени)")
+
+    class Meta:
+        db_table = 'request_profiles'
+        ordering = ['-created_at']
+        verbose_name = "Профиль запроса"
+        verbose_name_plural = "Профили запросов"
+
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.duration_ms:.0f} мс)"
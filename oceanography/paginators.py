@@ -0,0 +1,50 @@
+"""
+Пагинация больших таблиц без полного подсчета строк.
+"""
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+
+def estimate_row_count(model, using='default'):
+    """
+    Быстрая оценка числа строк таблицы без полного COUNT(*).
+
+    SQLite: максимальный rowid (верхняя граница - удаленные строки не учитываются),
+    PostgreSQL: статистика планировщика pg_class.reltuples.
+    Для остальных СУБД возвращает None.
+    """
+    connection = connections[using]
+    table = connection.ops.quote_name(model._meta.db_table)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(f"SELECT MAX(rowid) FROM {table}")
+        elif connection.vendor == 'postgresql':
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [model._meta.db_table])
+        else:
+            return None
+        row = cursor.fetchone()
+    if not row or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Пагинатор для больших таблиц.
+
+    Для выборки без фильтров вместо COUNT(*) по всей таблице использует
+    оценку estimate_row_count(). Оценка берется только если она больше
+    exact_count_limit - на небольших таблицах точный подсчет дешев.
+    """
+    exact_count_limit = 100000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        query = getattr(queryset, 'query', None)
+        if query is not None and not query.where and not query.distinct:
+            estimate = estimate_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate > self.exact_count_limit:
+                return estimate
+        return super().count
@@ -0,0 +1,486 @@
+"""
+Секционирование CTD измерений по экспедициям.
+
+Измерения экспедиции можно вынести из общей таблицы `ctd_measurements`
+в отдельный файл SQLite (`CTD_PARTITIONS_DIR/ctd_expedition_<id>.sqlite3`)
+с той же таблицей. Секции регистрируются в модели CTDPartition; для каждой
+подключенной секции во время работы добавляется алиас базы `ctd_exp_<id>`,
+и CTDPartitionRouter направляет туда запросы измерений профилей этой
+экспедиции. Несекционированные экспедиции остаются в основной базе.
+
+Процессы кешируют реестр и экспедиции профилей; любое изменение секций
+или перенос станции (профиля) в другую экспедицию меняет версию реестра
+(файл registry.version), и каждый процесс перечитывает его при следующем
+запросе измерений.
+
+Секцию можно сжать (VACUUM), отправить в архив (сжатая копия, файл
+отключается) и вернуть из архива, не затрагивая остальные данные.
+Управление - команда ctd_partitions.
+
+Внешних ключей между файлами нет: в соединениях секций foreign_keys
+отключены, удаление профилей дочищает секцию сигналом pre_delete.
+
+measurement_id уникален во всех файлах: ID новых измерений секции берутся
+из последовательности основной таблицы (allocate_measurement_ids), а не
+из собственной AUTOINCREMENT файла. Иначе ID секции совпадали бы с ID
+основной базы, и восстановление из архива с исходными ключами ломалось бы.
+"""
+import gzip
+import os
+import shutil
+import threading
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import CTDMeasurement, CTDPartition, CTDProfile, Station
+
+ALIAS_PREFIX = 'ctd_exp_'
+PROFILE_CACHE_SIZE = 10000
+
+
+class PartitionUnavailable(Exception):
+    """Секция экспедиции в архиве - измерения недоступны до восстановления"""
+
+
+class UnroutedMeasurementQuery(Exception):
+    """Запрос CTD измерений без профиля, экспедиции или явной базы при подключенных секциях"""
+
+
+def partitions_dir():
+    return Path(getattr(settings, 'CTD_PARTITIONS_DIR', Path(settings.BASE_DIR) / 'partitions'))
+
+
+def archive_dir():
+    return partitions_dir() / 'archive'
+
+
+def partition_alias(expedition_id):
+    return f'{ALIAS_PREFIX}{expedition_id}'
+
+
+def partition_file_name(expedition_id):
+    return f'ctd_expedition_{expedition_id}.sqlite3'
+
+
+def is_partition_alias(alias):
+    return bool(alias) and alias.startswith(ALIAS_PREFIX)
+
+
+def register_alias(expedition_id, file_name):
+    """Добавляет алиас секции в DATABASES (копия настроек основной базы)"""
+    alias = partition_alias(expedition_id)
+    if alias not in connections.databases:
+        connections.databases[alias] = {
+            **connections.databases[DEFAULT_DB_ALIAS],
+            'NAME': str(partitions_dir() / file_name),
+            # Профилей в файле секции нет - ссылки на них не проверяются
+            'PRAGMAS': {'foreign_keys': 'OFF'},
+        }
+    return alias
+
+
+def unregister_alias(expedition_id):
+    alias = partition_alias(expedition_id)
+    if alias in connections.databases:
+        connections[alias].close()
+        del connections[alias]
+        del connections.databases[alias]
+
+
+_registry_lock = threading.Lock()
+_registry = {'loaded': False, 'version': None, 'partitions': {}}
+_profile_expeditions = {}
+
+
+def registry_version_path():
+    return partitions_dir() / 'registry.version'
+
+
+def registry_version():
+    """Версия реестра секций, общая для всех процессов (файл в CTD_PARTITIONS_DIR)"""
+    try:
+        return registry_version_path().read_text()
+    except FileNotFoundError:
+        return None
+
+
+def partition_registry():
+    """
+    {ID экспедиции: (состояние, файл)}. Кеш процесса (и кеш экспедиций
+    профилей) сбрасывается, как только другой процесс сменил версию реестра.
+    """
+    version = registry_version()
+    with _registry_lock:
+        if not _registry['loaded'] or _registry['version'] != version:
+            _profile_expeditions.clear()
+            _registry['partitions'] = {
+                expedition_id: (state, file_name)
+                for expedition_id, state, file_name in CTDPartition.objects.using(
+                    DEFAULT_DB_ALIAS
+                ).values_list('expedition_id', 'state', 'file_name')
+            }
+            _registry['version'] = version
+            _registry['loaded'] = True
+        return _registry['partitions']
+
+
+def invalidate_registry():
+    """Сбрасывает кеш реестра этого процесса"""
+    with _registry_lock:
+        _registry['loaded'] = False
+        _profile_expeditions.clear()
+
+
+def registry_changed():
+    """Новая версия реестра: все процессы перечитают его при следующем запросе измерений"""
+    path = registry_version_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f'.{path.name}.{os.getpid()}.{threading.get_ident()}')
+    tmp.write_text(uuid.uuid4().hex)
+    os.replace(tmp, path)
+    invalidate_registry()
+
+
+def alias_for_expedition(expedition_id):
+    """Алиас секции экспедиции или None, если измерения в основной базе"""
+    partition = partition_registry().get(expedition_id)
+    if partition is None:
+        return None
+    state, file_name = partition
+    if state != CTDPartition.ACTIVE:
+        raise PartitionUnavailable(f'CTD измерения экспедиции {expedition_id} находятся в архиве')
+    return register_alias(expedition_id, file_name)
+
+
+def active_aliases():
+    """Алиасы всех подключенных секций"""
+    return [
+        register_alias(expedition_id, file_name)
+        for expedition_id, (state, file_name) in partition_registry().items()
+        if state == CTDPartition.ACTIVE
+    ]
+
+
+def profile_expedition_id(profile):
+    """ID экспедиции профиля (объект или ID) без лишних запросов, если возможно"""
+    if isinstance(profile, CTDProfile):
+        station = profile._state.fields_cache.get('station')
+        if station is not None:
+            return station.expedition_id
+        profile = profile.pk
+    profile_id = int(profile)
+    if profile_id not in _profile_expeditions:
+        if len(_profile_expeditions) >= PROFILE_CACHE_SIZE:
+            _profile_expeditions.clear()
+        _profile_expeditions[profile_id] = CTDProfile.objects.using(DEFAULT_DB_ALIAS).filter(
+            pk=profile_id
+        ).values_list('station__expedition_id', flat=True).first()
+    return _profile_expeditions[profile_id]
+
+
+def alias_for_profile(profile):
+    if not partition_registry():
+        return None
+    return alias_for_expedition(profile_expedition_id(profile))
+
+
+def move_profile_measurements(profile_ids, old_expedition_id, new_expedition_id):
+    """
+    Профили перешли в другую экспедицию: измерения переезжают в файл
+    новой экспедиции, кеш экспедиций профилей сбрасывается во всех процессах.
+    Возвращает число перенесенных измерений.
+    """
+    if old_expedition_id is None:
+        # Прежняя экспедиция неизвестна - переносить неоткуда
+        registry_changed()
+        return 0
+    source = alias_for_expedition(old_expedition_id) or DEFAULT_DB_ALIAS
+    target = alias_for_expedition(new_expedition_id) or DEFAULT_DB_ALIAS
+    moved = 0
+    if source != target:
+        for profile_id in profile_ids:
+            measurements = list(CTDMeasurement.objects.using(source).filter(profile_id=profile_id))
+            # Ключи сохраняются: ID уникальны во всех файлах
+            CTDMeasurement.objects.using(target).bulk_create(measurements)
+            CTDMeasurement.objects.using(source).filter(profile_id=profile_id)._raw_delete(source)
+            moved += len(measurements)
+    registry_changed()
+    return moved
+
+
+def station_moved(station_id, old_expedition_id, new_expedition_id):
+    """Station.save(): станция перенесена в другую экспедицию"""
+    if not partition_registry():
+        return
+    profile_ids = list(CTDProfile.objects.using(DEFAULT_DB_ALIAS).filter(
+        station_id=station_id
+    ).values_list('pk', flat=True))
+    move_profile_measurements(profile_ids, old_expedition_id, new_expedition_id)
+
+
+def profile_moved(profile, old_station_id):
+    """CTDProfile.save(): профиль перенесен на станцию другой экспедиции"""
+    if not partition_registry():
+        return
+    expeditions = dict(Station.objects.using(DEFAULT_DB_ALIAS).filter(
+        pk__in=[old_station_id, profile.station_id]
+    ).values_list('pk', 'expedition_id'))
+    old_expedition_id, new_expedition_id = expeditions.get(old_station_id), expeditions.get(profile.station_id)
+    if old_expedition_id != new_expedition_id:
+        move_profile_measurements([profile.pk], old_expedition_id, new_expedition_id)
+
+
+def measurement_counts(profiles):
+    """{ID профиля: число измерений} - один агрегатный запрос на каждую секцию"""
+    by_alias = {}
+    for profile in profiles:
+        try:
+            alias = alias_for_profile(profile) or DEFAULT_DB_ALIAS
+        except PartitionUnavailable:
+            continue
+        by_alias.setdefault(alias, []).append(profile.pk)
+
+    counts = {}
+    for alias, profile_ids in by_alias.items():
+        counts.update(
+            CTDMeasurement.objects.using(alias).filter(profile_id__in=profile_ids)
+            .order_by().values_list('profile_id').annotate(n=Count('*'))
+        )
+    return counts
+
+
+def require_route(hints):
+    """Пока есть секции, запрос измерений должен указать профиль, секцию или main_table()"""
+    if hints.get('instance') is None and not hints.get('main_table') and partition_registry():
+        raise UnroutedMeasurementQuery(
+            'Запрос CTD измерений без профиля при подключенных секциях: '
+            'используйте for_profile(), for_expedition(), using() или main_table()'
+        )
+
+
+class CTDPartitionRouter:
+    """
+    Направляет запросы CTDMeasurement в секцию экспедиции профиля.
+
+    Маршрут определяется по подсказке instance: профиль (related manager
+    profile.measurements) или само измерение. Пока есть секции, чтение,
+    update() и delete() измерений без подсказки - ошибка
+    UnroutedMeasurementQuery, а не тихий запрос к одной основной таблице:
+    используйте CTDMeasurement.objects.for_profile() / for_expedition(),
+    явный using() или main_table() для строк основной таблицы.
+    """
+
+    def _route(self, model, **hints):
+        instance = hints.get('instance')
+        if instance is None:
+            return None
+        if model is not CTDMeasurement:
+            # Связанные объекты измерений из секции (профиль и т.д.) - в основной базе
+            if is_partition_alias(instance._state.db):
+                return DEFAULT_DB_ALIAS
+            return None
+        if isinstance(instance, CTDMeasurement):
+            if is_partition_alias(instance._state.db):
+                return instance._state.db
+            if instance.profile_id is None:
+                return None
+            return alias_for_profile(instance._state.fields_cache.get('profile') or instance.profile_id)
+        if isinstance(instance, CTDProfile) and instance.pk is not None:
+            return alias_for_profile(instance)
+        return None
+
+    def db_for_read(self, model, **hints):
+        if model is CTDMeasurement:
+            require_route(hints)
+        return self._route(model, **hints)
+
+    # Запись без подсказки - это транзакции админки и т.п., а не строки измерений;
+    # update() и delete() без подсказки проверяет CTDMeasurementQuerySet
+    db_for_write = _route
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if is_partition_alias(obj1._state.db) or is_partition_alias(obj2._state.db):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if is_partition_alias(db):
+            return False
+        return None
+
+
+def allocate_measurement_ids(count):
+    """Резервирует count ID в последовательности основной таблицы измерений; возвращает range"""
+    connection = connections[DEFAULT_DB_ALIAS]
+    table = CTDMeasurement._meta.db_table
+    with transaction.atomic(using=DEFAULT_DB_ALIAS), connection.cursor() as cursor:
+        # UPDATE первым - транзакция сразу берет блокировку записи
+        cursor.execute("UPDATE sqlite_sequence SET seq = seq + %s WHERE name = %s", [count, table])
+        if cursor.rowcount == 0:
+            # В основную таблицу еще ничего не вставлялось
+            cursor.execute(
+                f"SELECT COALESCE(MAX({connection.ops.quote_name(CTDMeasurement._meta.pk.column)}), 0) "
+                f"FROM {connection.ops.quote_name(table)}"
+            )
+            cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)",
+                           [table, cursor.fetchone()[0] + count])
+        cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = %s", [table])
+        last = cursor.fetchone()[0]
+    return range(last - count + 1, last + 1)
+
+
+def assign_measurement_ids(measurements):
+    """Выдает ID измерениям без ключа перед вставкой в секцию"""
+    new = [measurement for measurement in measurements if measurement.pk is None]
+    if new:
+        for measurement, pk in zip(new, allocate_measurement_ids(len(new))):
+            measurement.pk = pk
+
+
+def assign_partition_id(sender, instance, raw, using, **kwargs):
+    """pre_save измерения: в секции ID - из общей последовательности"""
+    if is_partition_alias(using) and instance.pk is None:
+        assign_measurement_ids([instance])
+
+
+def delete_partition_measurements(sender, instance, using, **kwargs):
+    """pre_delete профиля: каскад по внешнему ключу не доходит до файла секции"""
+    try:
+        alias = alias_for_profile(instance)
+    except PartitionUnavailable:
+        return
+    if alias:
+        CTDMeasurement.objects.using(alias).filter(profile_id=instance.pk)._raw_delete(alias)
+
+
+# Управление секциями
+
+def create_partition(expedition, batch_size=50000, progress=None):
+    """
+    Создает секцию экспедиции и переносит в нее измерения из основной базы.
+
+    Перенос идет пакетами: INSERT OR IGNORE в секцию и удаление пакета
+    из основной базы, поэтому прерванный перенос можно просто повторить.
+    Возвращает число перенесенных измерений.
+    """
+    directory = partitions_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    file_name = partition_file_name(expedition.pk)
+
+    partition, _ = CTDPartition.objects.using(DEFAULT_DB_ALIAS).get_or_create(
+        expedition=expedition, defaults={'file_name': file_name}
+    )
+    if partition.state != CTDPartition.ACTIVE:
+        raise PartitionUnavailable(f'Секция экспедиции {expedition.pk} в архиве, сначала восстановите ее')
+
+    alias = register_alias(expedition.pk, partition.file_name)
+    partition_connection = connections[alias]
+    with partition_connection.cursor() as cursor:
+        tables = partition_connection.introspection.table_names(cursor)
+    if CTDMeasurement._meta.db_table not in tables:
+        with partition_connection.schema_editor() as editor:
+            editor.create_model(CTDMeasurement)
+        # schema_editor на выходе включает foreign_keys - новое соединение получит PRAGMAS секции
+        partition_connection.close()
+
+    # Пока идет перенос, новые измерения уже пишутся в секцию - во всех процессах
+    registry_changed()
+
+    primary = connections[DEFAULT_DB_ALIAS]
+    table = primary.ops.quote_name(CTDMeasurement._meta.db_table)
+    columns = ', '.join(primary.ops.quote_name(f.column) for f in CTDMeasurement._meta.concrete_fields)
+    id_sql = (
+        f"SELECT m.measurement_id FROM {table} m "
+        f"JOIN ctd_profiles p ON p.profile_id = m.profile_id "
+        f"JOIN stations s ON s.station_id = p.station_id "
+        f"WHERE s.expedition_id = %s ORDER BY m.measurement_id LIMIT %s"
+    )
+    moved = 0
+    # Внешний ключ таблицы секции ссылается на профили, которых в ее файле нет
+    with primary.constraint_checks_disabled(), primary.cursor() as cursor:
+        cursor.execute("ATTACH DATABASE %s AS part", [str(directory / partition.file_name)])
+        try:
+            while True:
+                with transaction.atomic(using=DEFAULT_DB_ALIAS):
+                    cursor.execute(id_sql, [expedition.pk, batch_size])
+                    ids = [row[0] for row in cursor.fetchall()]
+                    if not ids:
+                        break
+                    placeholders = ', '.join(['%s'] * len(ids))
+                    cursor.execute(
+                        f"INSERT OR IGNORE INTO part.{table} ({columns}) "
+                        f"SELECT {columns} FROM main.{table} WHERE measurement_id IN ({placeholders})", ids
+                    )
+                    cursor.execute(f"DELETE FROM main.{table} WHERE measurement_id IN ({placeholders})", ids)
+                moved += len(ids)
+                if progress:
+                    progress(moved)
+        finally:
+            cursor.execute("DETACH DATABASE part")
+    return moved
+
+
+def vacuum_partition(expedition_id):
+    """Сжимает файл секции; остальные данные не затрагиваются"""
+    alias = alias_for_expedition(expedition_id)
+    if alias is None:
+        raise CTDPartition.DoesNotExist(f'Экспедиция {expedition_id} не секционирована')
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        cursor.execute("VACUUM")
+    return os.path.getsize(connection.settings_dict['NAME'])
+
+
+def archive_partition(expedition_id):
+    """
+    Отправляет секцию в архив: сжатая копия в CTD_PARTITIONS_DIR/archive,
+    исходный файл удаляется, измерения экспедиции становятся недоступны.
+    """
+    partition = CTDPartition.objects.using(DEFAULT_DB_ALIAS).get(expedition_id=expedition_id)
+    source = partitions_dir() / partition.file_name
+    archive_dir().mkdir(parents=True, exist_ok=True)
+    target = archive_dir() / f'{partition.file_name}.gz'
+
+    alias = register_alias(expedition_id, partition.file_name)
+    compact = source.with_suffix('.vacuum')
+    if compact.exists():
+        compact.unlink()
+    with connections[alias].cursor() as cursor:
+        # Компактная и согласованная копия без журнала WAL
+        cursor.execute("VACUUM INTO %s", [str(compact)])
+    unregister_alias(expedition_id)
+
+    with open(compact, 'rb') as src, gzip.open(target, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    compact.unlink()
+
+    partition.state = CTDPartition.ARCHIVED
+    partition.archived_at = timezone.now()
+    partition.save(update_fields=['state', 'archived_at'])
+    registry_changed()
+    for suffix in ('', '-wal', '-shm'):
+        path = Path(f'{source}{suffix}')
+        if path.exists():
+            path.unlink()
+    return target
+
+
+def restore_partition(expedition_id):
+    """Возвращает секцию из архива и снова подключает ее"""
+    partition = CTDPartition.objects.using(DEFAULT_DB_ALIAS).get(expedition_id=expedition_id)
+    source = archive_dir() / f'{partition.file_name}.gz'
+    target = partitions_dir() / partition.file_name
+    with gzip.open(source, 'rb') as src, open(target, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+
+    partition.state = CTDPartition.ACTIVE
+    partition.archived_at = None
+    partition.save(update_fields=['state', 'archived_at'])
+    registry_changed()
+    source.unlink()
+    return target
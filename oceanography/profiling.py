@@ -0,0 +1,191 @@
+"""
+Профилирование отдельного запроса по требованию.
+
+Страницы с ProfilingMixin (mixins.py) - data_*, загрузка Excel
+(download_template, upload_data) и CTD профиль - выполняются под cProfile,
+если в запросе есть заголовок X-Profile: 1 или параметр ?_profile=1,
+а пользователь - staff с правом oceanography.add_requestprofile.
+Без заголовка и параметра проверка стоит одного поиска в словаре.
+
+Профиль (pstats, вместе с отрисовкой шаблона) сохраняется в
+PROFILING['DIR'], запись RequestProfile со сводкой - в базу; ответ
+получает заголовки X-Profile-Id и X-Profile-Url (страница в админке,
+откуда файл скачивается). Хранится PROFILING['KEEP'] последних профилей.
+Файл открывается `python -m pstats`, snakeviz и подобными.
+
+cProfile видит только свой поток, а запись при загрузке Excel выполняет
+поток очереди записи (write_queue.py). Задания, поставленные профилируемым
+запросом, выполняются там под своим профилировщиком, и их статистика
+добавляется в профиль запроса; время потока записи пишется в сводку.
+Попадают только задания, завершившиеся до конца запроса (upload_data ждет
+результата).
+"""
+import cProfile
+import io
+import logging
+import pstats
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .metrics import current_stats
+from .models import RequestProfile
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROFILING = {
+    'ENABLED': True,
+    'DIR': None,        # по умолчанию BASE_DIR/profiles
+    'KEEP': 50,         # сколько последних профилей хранить
+    'TOP': 40,          # строк сводки
+}
+
+HEADER = 'HTTP_X_PROFILE'
+PARAM = '_profile'
+PERMISSION = 'oceanography.add_requestprofile'
+
+_current = threading.local()
+
+
+def profiling_settings():
+    return {**DEFAULT_PROFILING, **getattr(settings, 'PROFILING', {})}
+
+
+def profile_dir():
+    return Path(profiling_settings()['DIR'] or Path(settings.BASE_DIR) / 'profiles')
+
+
+def profiling_requested(request):
+    """Запрос просит профиль и пользователю это разрешено"""
+    if HEADER not in request.META and PARAM not in request.GET:
+        return False
+    if not profiling_settings()['ENABLED']:
+        return False
+    user = getattr(request, 'user', None)
+    return user is not None and user.is_active and user.is_staff and user.has_perm(PERMISSION)
+
+
+class WriterProfiles:
+    """Профили заданий очереди записи, поставленных профилируемым запросом"""
+
+    def __init__(self):
+        self.thread = threading.get_ident()
+        self.profilers = []
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, profiler, seconds):
+        with self._lock:
+            self.profilers.append(profiler)
+            self.seconds += seconds
+
+
+def current_writer_profiles():
+    """Профили заданий профилируемого запроса текущего потока (для передачи в поток записи)"""
+    return getattr(_current, 'writer_profiles', None)
+
+
+@contextmanager
+def profiled_job(profiles):
+    """Задание очереди записи под своим cProfile, если его поставил профилируемый запрос"""
+    # В потоке самого запроса (EAGER) задание и так под профилировщиком запроса
+    if profiles is None or profiles.thread == threading.get_ident():
+        yield
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiles.add(profiler, time.perf_counter() - started)
+
+
+def profile_request(request, handler):
+    """Выполняет handler() под cProfile и сохраняет профиль; возвращает ответ"""
+    profiler = cProfile.Profile()
+    writer = WriterProfiles()
+    stats = current_stats()
+    queries_before = stats[0] if stats is not None else None
+    started = time.perf_counter()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Уже работает другой профилировщик - запрос выполняется как обычно
+        logger.warning('Profiler is busy, %s served without profiling', request.path)
+        return handler()
+    _current.writer_profiles = writer
+    try:
+        response = handler()
+        # TemplateResponse отрисовывается позже - отрисовка тоже в профиле
+        if hasattr(response, 'render') and not response.is_rendered:
+            response.render()
+    finally:
+        profiler.disable()
+        _current.writer_profiles = None
+    duration = time.perf_counter() - started
+
+    try:
+        profile = save_profile(request, response, profiler, duration,
+                               stats[0] - queries_before if stats is not None else None, writer)
+    except OSError:
+        logger.exception('Cannot save request profile for %s', request.path)
+        return response
+    response['X-Profile-Id'] = str(profile.pk)
+    response['X-Profile-Url'] = reverse('admin:oceanography_requestprofile_change', args=[profile.pk])
+    return response
+
+
+def save_profile(request, response, profiler, duration, queries=None, writer=None):
+    config = profiling_settings()
+    directory = profile_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    file_name = f'{timezone.now():%Y%m%d_%H%M%S}_{uuid.uuid4().hex[:8]}.prof'
+
+    summary = io.StringIO()
+    profile_stats = pstats.Stats(profiler, stream=summary)
+    if writer is not None and writer.profilers:
+        profile_stats.add(*writer.profilers)
+        summary.write(f'Поток записи: {len(writer.profilers)} заданий, {writer.seconds * 1000:.1f} мс '
+                      f'(статистика заданий добавлена в профиль)\n\n')
+    profile_stats.dump_stats(directory / file_name)
+    profile_stats.strip_dirs().sort_stats('cumulative').print_stats(config['TOP'])
+
+    match = getattr(request, 'resolver_match', None)
+    profile = RequestProfile.objects.create(
+        user=request.user.get_username(),
+        view=(match.view_name if match is not None else '')[:200],
+        method=request.method,
+        path=request.get_full_path()[:500],
+        status=getattr(response, 'status_code', None),
+        duration_ms=duration * 1000,
+        queries=queries,
+        file_name=file_name,
+        summary=summary.getvalue(),
+    )
+    prune_profiles(config['KEEP'])
+    return profile
+
+
+def delete_profiles(profiles):
+    """Удаляет профили вместе с файлами"""
+    directory = profile_dir()
+    for profile in profiles:
+        (directory / profile.file_name).unlink(missing_ok=True)
+        profile.delete()
+
+
+def prune_profiles(keep):
+    """Оставляет keep последних профилей"""
+    delete_profiles(RequestProfile.objects.order_by('-created_at', '-pk')[keep:])
@@ -0,0 +1,195 @@
+"""
+Быстрое удаление экспедиций и CTD профилей.
+
+Каскад Django (Collector) перед удалением загружает в память все
+станции, пробы, измерения и CTD сканы объекта и отправляет сигналы для
+каждой строки - для большой экспедиции это минуты и гигабайты памяти.
+purge() удаляет снизу вверх (измерения -> пробы и профили -> станции ->
+экспедиция) запросами DELETE ... WHERE pk IN (SELECT pk ... LIMIT n):
+в Python попадают только счетчики.
+
+Сигналы pre/post_delete для удаляемых строк не отправляются: индекс
+R*Tree станций чистится триггером, секции CTD измерений - здесь же.
+Большие объекты админка удаляет в фоне через очередь записи.
+"""
+import logging
+from contextlib import nullcontext
+from pathlib import Path
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, router, transaction
+
+from .models import (
+    CTDMeasurement, CTDPartition, CTDProfile, Expedition, ExpeditionArchive, Sample, SampleMeasurement, Station,
+)
+from .partitions import (
+    PartitionUnavailable, alias_for_expedition, alias_for_profile, archive_dir,
+    partitions_dir, registry_changed, unregister_alias,
+)
+from .write_queue import get_write_queue
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 5000
+
+
+def background_threshold():
+    """С какого числа строк админка удаляет объект в фоне"""
+    return getattr(settings, 'PURGE_BACKGROUND_ROWS', 10000)
+
+
+def purge_plan(obj, include_root=True):
+    """
+    Шаги удаления объекта снизу вверх: список (модель, queryset).
+
+    Строки секции CTD измерений экспедиции не входят в план - файл секции
+    удаляется целиком после фиксации (см. purge). include_root=False -
+    только данные объекта, сама запись остается (архив, cold_storage.py).
+    """
+    if isinstance(obj, CTDProfile):
+        try:
+            alias = alias_for_profile(obj) or DEFAULT_DB_ALIAS
+        except PartitionUnavailable:
+            # Измерения в архиве секции - удаляются вместе с ее архивом
+            alias = None
+        steps = []
+        if alias is not None:
+            steps.append((CTDMeasurement, CTDMeasurement.objects.using(alias).filter(profile_id=obj.pk)))
+        if include_root:
+            steps.append((CTDProfile, CTDProfile.objects.filter(pk=obj.pk)))
+        return steps
+
+    if not isinstance(obj, Expedition):
+        raise TypeError(f'purge поддерживает Expedition и CTDProfile, а не {type(obj).__name__}')
+
+    stations = Station.objects.filter(expedition_id=obj.pk).values('pk')
+    samples = Sample.objects.filter(station__in=stations).values('pk')
+    profiles = CTDProfile.objects.filter(station__in=stations).values('pk')
+
+    steps = []
+    if not CTDPartition.objects.filter(expedition_id=obj.pk).exists():
+        steps.append((CTDMeasurement, CTDMeasurement.objects.main_table().filter(profile__in=profiles)))
+    steps.append((CTDProfile, CTDProfile.objects.filter(station__in=stations)))
+    for model in SampleMeasurement.measurement_models():
+        steps.append((model, model.objects.filter(sample__in=samples)))
+    steps += [
+        (Sample, Sample.objects.filter(station__in=stations)),
+        (Station, Station.objects.filter(expedition_id=obj.pk)),
+        (CTDPartition, CTDPartition.objects.filter(expedition_id=obj.pk)),
+    ]
+    if include_root:
+        steps += [
+            (ExpeditionArchive, ExpeditionArchive.objects.filter(expedition_id=obj.pk)),
+            (Expedition, Expedition.objects.filter(pk=obj.pk)),
+        ]
+    return steps
+
+
+def purge_counts(obj):
+    """{модель: число строк} - что удалит purge(obj)"""
+    counts = {}
+    for model, queryset in purge_plan(obj):
+        counts[model] = counts.get(model, 0) + queryset.count()
+    if isinstance(obj, Expedition):
+        try:
+            alias = alias_for_expedition(obj.pk)
+        except PartitionUnavailable:
+            alias = None
+        if alias:
+            counts[CTDMeasurement] = counts.get(CTDMeasurement, 0) + CTDMeasurement.objects.using(alias).count()
+    return counts
+
+
+def delete_in_batches(queryset, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """DELETE строк queryset пакетами по batch_size; возвращает число удаленных"""
+    model = queryset.model
+    # Явная база (секция) или база для записи - не реплика чтения
+    using = queryset._db or router.db_for_write(model, **queryset._hints)
+    batch = queryset.order_by().values('pk')[:batch_size]
+    deleted = 0
+    while True:
+        with transaction.atomic(using=using):
+            count = model._base_manager.using(using).filter(pk__in=batch)._raw_delete(using)
+        if not count:
+            return deleted
+        deleted += count
+        if progress:
+            progress(model, deleted)
+
+
+def partition_files(expedition_id, include_root=True):
+    """Файлы секции и ее архив (и холодный архив экспедиции) - удаляются вместе с данными"""
+    from .cold_storage import bundle_path
+
+    paths = []
+    if include_root:
+        paths += [
+            bundle_path(file_name)
+            for file_name in ExpeditionArchive.objects.filter(
+                expedition_id=expedition_id
+            ).values_list('file_name', flat=True)
+        ]
+    partition = CTDPartition.objects.filter(expedition_id=expedition_id).first()
+    if partition is not None:
+        source = partitions_dir() / partition.file_name
+        paths += [Path(f'{source}{suffix}') for suffix in ('', '-wal', '-shm')]
+        paths.append(archive_dir() / f'{partition.file_name}.gz')
+    return paths
+
+
+def drop_partition_files(expedition_id, paths):
+    unregister_alias(expedition_id)
+    registry_changed()
+    for path in paths:
+        if path.exists():
+            path.unlink()
+
+
+def purge(obj, batch_size=DEFAULT_BATCH_SIZE, atomic=True, progress=None, include_root=True):
+    """
+    Удаляет экспедицию или CTD профиль со всеми данными.
+
+    atomic=True - все пакеты в одной транзакции (все или ничего);
+    atomic=False - каждый пакет фиксируется отдельно и блокировка записи
+    SQLite не держится все время удаления. Порядок снизу вверх не оставляет
+    висячих ссылок, поэтому прерванное удаление можно просто повторить.
+
+    progress(модель, удалено строк) вызывается после каждого пакета.
+    Возвращает {модель: удалено строк}.
+    """
+    deleted = {}
+    paths = partition_files(obj.pk, include_root) if isinstance(obj, Expedition) else []
+    with transaction.atomic() if atomic else nullcontext():
+        for model, queryset in purge_plan(obj, include_root):
+            count = delete_in_batches(queryset, batch_size, progress)
+            deleted[model] = deleted.get(model, 0) + count
+        if paths:
+            transaction.on_commit(lambda: drop_partition_files(obj.pk, paths))
+    logger.info('Purged %s %s: %s', obj._meta.label, obj.pk, {m._meta.label: n for m, n in deleted.items()})
+    return deleted
+
+
+def _purge_by_pk(model, pk, batch_size):
+    obj = model._base_manager.filter(pk=pk).first()
+    if obj is None:
+        return {}
+    return purge(obj, batch_size=batch_size)
+
+
+def purge_in_background(obj, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Ставит удаление в очередь записи и сразу возвращает Future.
+
+    Повторный запрос на удаление того же объекта, пока первое ждет
+    в очереди, возвращает тот же Future.
+    """
+    future = get_write_queue().submit(
+        _purge_by_pk, type(obj), obj.pk, batch_size, key=f'purge:{obj._meta.label}:{obj.pk}'
+    )
+
+    def log_result(future):
+        if future.exception() is not None:
+            logger.error('Background purge of %s %s failed', obj._meta.label, obj.pk, exc_info=future.exception())
+
+    future.add_done_callback(log_result)
+    return future
@@ -0,0 +1,157 @@
+"""
+Маршрутизация запросов между основной базой и репликой для чтения.
+
+Все записи идут в основную базу. Чтение данных приложения (не сессий
+и пользователей) уходит на реплику только внутри use_replica() - его
+включают страницы data_* и выгрузки (ReplicaReadMixin).
+После записи данных приложения клиент на REPLICA_PIN_SECONDS закрепляется
+за основной базой (cookie, ставит ReadAfterWriteMiddleware), чтобы сразу
+видеть свои изменения, пока реплика не обновлена.
+
+Для SQLite реплика - копия файла базы, обновляемая командой refresh_replica.
+Реплика, не обновленная после миграций, в чтение не идет: страницы
+читают основную базу, пока refresh_replica не скопирует новую схему.
+"""
+import functools
+import logging
+import os
+import sqlite3
+import time
+from contextlib import closing, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+logger = logging.getLogger(__name__)
+
+REPLICA_ALIAS = 'replica'
+PIN_COOKIE = 'db_primary_until'
+
+# База для чтения в текущем контексте (None - по умолчанию)
+_read_alias = ContextVar('read_alias', default=None)
+# Были ли записи данных приложения в текущем запросе
+_wrote = ContextVar('wrote', default=None)
+
+
+# Алиас -> (mtime файла реплики, схема актуальна)
+_schema_state = {}
+
+
+def replica_available(alias=REPLICA_ALIAS):
+    """Реплика настроена и (для SQLite) ее файл создан и содержит все миграции проекта"""
+    if alias not in settings.DATABASES:
+        return False
+    connection = connections[alias]
+    if connection.vendor != 'sqlite' or connection.is_in_memory_db():
+        return True
+    path = connection.settings_dict['NAME']
+    try:
+        stamp = os.stat(path).st_mtime_ns
+    except OSError:
+        return False
+    cached = _schema_state.get(alias)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    current = replica_schema_current(path)
+    if not current:
+        logger.warning('Replica %s is behind migrations, reads go to the primary database', alias)
+    _schema_state[alias] = (stamp, current)
+    return current
+
+
+@functools.lru_cache(maxsize=None)
+def expected_migrations():
+    """Последние миграции каждого приложения по файлам проекта"""
+    from django.db.migrations.loader import MigrationLoader
+    return frozenset(MigrationLoader(None, ignore_no_migrations=True).graph.leaf_nodes())
+
+
+def replica_schema_current(path):
+    """В файле реплики применены последние миграции (иначе чтение упадет на 'no such column')"""
+    try:
+        with closing(sqlite3.connect(f'file:{path}?mode=ro', uri=True)) as db:
+            applied = set(db.execute('SELECT app, name FROM django_migrations'))
+    except sqlite3.Error:
+        return False
+    return expected_migrations() <= applied
+
+
+def pinned_to_primary(request):
+    """Клиент недавно записывал данные - читать нужно из основной базы"""
+    if request is None:
+        return False
+    try:
+        return float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+@contextmanager
+def use_replica(request=None, alias=REPLICA_ALIAS):
+    """Чтение внутри блока идет с реплики, если она доступна и клиент не закреплен"""
+    if pinned_to_primary(request) or not replica_available(alias):
+        yield DEFAULT_DB_ALIAS
+        return
+    token = _read_alias.set(alias)
+    try:
+        yield alias
+    finally:
+        _read_alias.reset(token)
+
+
+@contextmanager
+def track_writes():
+    """Отслеживает записи данных приложения в блоке; флаг - в yielded списке"""
+    wrote = []
+    token = _wrote.set(wrote)
+    try:
+        yield wrote
+    finally:
+        _wrote.reset(token)
+
+
+def note_write(label):
+    """
+    Отмечает запись в текущем запросе вручную - для записей, которые
+    выполняет другой поток (очередь записи): ContextVar туда не переходит.
+    """
+    wrote = _wrote.get()
+    if wrote is not None:
+        wrote.append(label)
+
+
+class ReplicaRouter:
+    """
+    Запись - в основную базу, чтение данных приложения - на реплику внутри
+    use_replica(). Сессии, пользователи и прочие модели django.contrib
+    читаются из основной базы: вход пишет только их и не закрепляет клиента,
+    а сессия из устаревшей реплики не нашлась бы и клиент вышел бы из системы.
+    """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != 'oceanography':
+            return None
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            # Связанные объекты читаем из той же базы, что и исходный объект
+            return instance._state.db
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        wrote = _wrote.get()
+        if wrote is not None and model._meta.app_label == 'oceanography':
+            wrote.append(model._meta.label)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, REPLICA_ALIAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Реплика получает схему вместе с данными при обновлении
+        if db == REPLICA_ALIAS:
+            return False
+        return None
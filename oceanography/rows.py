@@ -0,0 +1,109 @@
+"""
+Легковесные строки для табличных страниц только для чтения.
+
+Вместо полноценных экземпляров моделей (со всеми колонками, Decimal
+и связанными объектами из select_related) из БД выбираются только
+колонки, которые выводит шаблон. Каждая строка - кортеж (namedtuple
+без __dict__), десятичные колонки читаются как float и переводятся
+в Decimal только по запросу - методом decimal().
+"""
+from collections import namedtuple
+from decimal import Decimal
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import DecimalField, ExpressionWrapper, F, FloatField, Value
+from django.db.models.query import ValuesListIterable
+
+from .fields import ScaledIntegerField
+
+
+class BaseRow:
+    """Общие методы строк; поля задаются в make_row_class"""
+    __slots__ = ()
+    decimal_places = {}
+    # Делители масштабированных целых колонок (ScaledIntegerField)
+    scales = {}
+
+    def decimal(self, name):
+        """Значение десятичной колонки как Decimal с точностью поля модели"""
+        value = getattr(self, name)
+        if value is None or name not in self.decimal_places:
+            return value
+        return round(Decimal(repr(value)), self.decimal_places[name])
+
+
+def _resolve_field(model, path):
+    """Поле модели по пути ORM ('sample__station__station_name') или None"""
+    field = None
+    for part in path.split('__'):
+        if model is None:
+            return None
+        try:
+            field = model._meta.get_field(part)
+        except FieldDoesNotExist:
+            return None
+        model = field.related_model
+    return field
+
+
+def make_row_class(model, fields, name=None):
+    """
+    Класс строки для набора колонок.
+
+    fields - последовательность пар (имя в шаблоне, путь ORM).
+    """
+    aliases = [alias for alias, _ in fields]
+    decimal_places = {}
+    scales = {}
+    for alias, path in fields:
+        field = _resolve_field(model, path)
+        if isinstance(field, (DecimalField, ScaledIntegerField)):
+            decimal_places[alias] = field.decimal_places
+        if isinstance(field, ScaledIntegerField):
+            scales[alias] = field.scale
+
+    name = name or f'{model.__name__}Row'
+    return type(name, (namedtuple(f'{name}Fields', aliases), BaseRow), {
+        '__slots__': (),
+        'decimal_places': decimal_places,
+        'scales': scales,
+    })
+
+
+def project_rows(queryset, fields):
+    """
+    QuerySet, отдающий строки make_row_class вместо экземпляров модели.
+
+    Результат по-прежнему ленивый: работают order_by, срезы, count()
+    и пагинация ListView.
+    """
+    row_class = make_row_class(queryset.model, fields)
+
+    columns = []
+    for alias, path in fields:
+        if alias in row_class.scales:
+            # Масштабированное целое делится в SQL и тоже приходит как float
+            columns.append(ExpressionWrapper(
+                F(path) / Value(float(row_class.scales[alias])), output_field=FloatField()
+            ))
+        elif alias in row_class.decimal_places:
+            # Без конвертера DecimalField: значение приходит из БД как float
+            columns.append(ExpressionWrapper(F(path), output_field=FloatField()))
+        else:
+            columns.append(path)
+
+    queryset = queryset.values_list(*columns)
+    queryset._iterable_class = type(
+        f'{row_class.__name__}Iterable', (RowIterable,), {'row_class': row_class}
+    )
+    return queryset
+
+
+class RowIterable(ValuesListIterable):
+    """Итератор QuerySet, превращающий кортежи values_list в строки row_class"""
+    row_class = None
+
+    def __iter__(self):
+        make = self.row_class._make
+        for row in super().__iter__():
+            yield make(row)
@@ -0,0 +1,233 @@
+"""
+Журнал медленных SQL запросов (включается settings.SLOW_QUERIES['ENABLED']).
+
+Обертка выполнения SQL из metrics.py (count_queries) в измеряемом HTTP
+запросе передает каждый запрос в QueryCollector этого запроса:
+
+- запрос дольше THRESHOLD_MS записывается отдельно (kind=slow);
+- одинаковый SQL, выполненный в одном HTTP запросе REPEAT_THRESHOLD раз
+  и больше, записывается одной строкой с числом выполнений (kind=repeated) -
+  так выглядит N+1, например Sample.objects.get на каждую строку импорта;
+- в доле SAMPLE_RATE HTTP запросов записывается каждый SQL (kind=sampled).
+
+В потоке запроса только копятся счетчики по строке SQL; стек вызова
+(кадры кода приложения, обычно views.py) снимается лишь для записываемых
+запросов. Нормализация SQL и запись в таблицу slow_queries базы events
+идут в потоке журнала (log_queue.py) вместе с файлом logs/slow_queries.log.
+"""
+import datetime
+import hashlib
+import logging
+import os
+import random
+import re
+import sys
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Count, Max, Sum
+from django.db.utils import DatabaseError
+from django.utils import timezone
+
+from .events import EVENTS_ALIAS
+from .models import SlowQuery
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SLOW_QUERIES = {
+    'ENABLED': False,
+    'THRESHOLD_MS': 100,      # запросы дольше - записываются всегда
+    'SAMPLE_RATE': 0.0,       # доля HTTP запросов, в которых записывается каждый SQL
+    'REPEAT_THRESHOLD': 20,   # столько выполнений одного SQL за HTTP запрос - N+1
+    'STACK_DEPTH': 8,         # кадров стека приложения в записи
+}
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+# Кадры самой обвязки в стек не попадают
+SKIP_FILES = {os.path.join(APP_DIR, name) for name in ('metrics.py', 'slow_queries.py', 'middleware.py')}
+
+_IN_LIST = re.compile(r'\(\s*(?:%s|\?)(?:\s*,\s*(?:%s|\?))*\s*\)')
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'(?<![\w"])-?\d+(?:\.\d+)?(?![\w"])')
+_SPACE = re.compile(r'\s+')
+
+
+def slow_queries_settings():
+    return {**DEFAULT_SLOW_QUERIES, **getattr(settings, 'SLOW_QUERIES', {})}
+
+
+def normalize_sql(sql):
+    """SQL без литералов: строки и числа - ?, списки IN (%s, %s, ...) - (...)"""
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _IN_LIST.sub('(...)', sql)
+    return _SPACE.sub(' ', sql).strip()
+
+
+def fingerprint(text):
+    return hashlib.sha1(text.encode('utf-8', errors='replace')).hexdigest()[:16]
+
+
+def capture_stack(depth):
+    """
+    Кадры кода приложения (файл:строка в функции), от вызова SQL наружу.
+    Запрос из шаблона (ленивый QuerySet, .count в цикле) - строка шаблона.
+    """
+    frames = []
+    in_template = False
+    frame = sys._getframe(1)
+    while frame is not None and len(frames) < depth:
+        code = frame.f_code
+        if code.co_filename.startswith(APP_DIR) and code.co_filename not in SKIP_FILES:
+            frames.append(f'{os.path.relpath(code.co_filename, os.path.dirname(APP_DIR))}:{frame.f_lineno} in {code.co_name}')
+        elif code.co_name == 'render_annotated' and not in_template:
+            node = frame.f_locals.get('self')
+            token, origin = getattr(node, 'token', None), getattr(node, 'origin', None)
+            if token is not None and origin is not None:
+                frames.append(f'{origin.template_name}:{token.lineno} (шаблон)')
+                in_template = True
+        frame = frame.f_back
+    return frames
+
+
+class QueryCollector:
+    """SQL одного HTTP запроса: медленные запросы и счетчики повторов по строке SQL"""
+    __slots__ = ('threshold', 'repeat_threshold', 'depth', 'sampled', 'slow', 'seen')
+
+    def __init__(self, config, sampled):
+        self.threshold = config['THRESHOLD_MS'] / 1000
+        self.repeat_threshold = config['REPEAT_THRESHOLD']
+        self.depth = config['STACK_DEPTH']
+        self.sampled = sampled
+        self.slow = []
+        # sql -> [выполнений, суммарное время, параметры первого, база, стек]
+        self.seen = {}
+
+    def observe(self, sql, params, alias, elapsed):
+        entry = self.seen.get(sql)
+        if entry is None:
+            entry = self.seen[sql] = [0, 0.0, params, alias, None]
+            if self.sampled:
+                entry[4] = capture_stack(self.depth)
+        entry[0] += 1
+        entry[1] += elapsed
+        if entry[0] == self.repeat_threshold and entry[4] is None:
+            entry[4] = capture_stack(self.depth)
+        if elapsed >= self.threshold:
+            self.slow.append((sql, params, alias, elapsed, capture_stack(self.depth)))
+
+    def records(self):
+        """Записи журнала: (kind, sql, params, база, время, выполнений, стек)"""
+        records = [
+            (SlowQuery.SLOW, sql, params, alias, elapsed, 1, stack)
+            for sql, params, alias, elapsed, stack in self.slow
+        ]
+        for sql, (count, total, params, alias, stack) in self.seen.items():
+            if count >= self.repeat_threshold:
+                records.append((SlowQuery.REPEATED, sql, params, alias, total, count, stack))
+            elif self.sampled:
+                records.append((SlowQuery.SAMPLED, sql, params, alias, total, count, stack))
+        return records
+
+
+def new_collector():
+    """Сборщик для нового HTTP запроса; None - журнал выключен"""
+    config = slow_queries_settings()
+    if not config['ENABLED']:
+        return None
+    return QueryCollector(config, sampled=config['SAMPLE_RATE'] > 0 and random.random() < config['SAMPLE_RATE'])
+
+
+class SlowQueryReport:
+    """Записи одного HTTP запроса; строки журнала собирает поток записи"""
+    __slots__ = ('time', 'view', 'path', 'records')
+
+    def __init__(self, view, path, records):
+        self.time = time.time()
+        self.view = view
+        self.path = path
+        self.records = records
+
+    def __str__(self):
+        lines = []
+        for kind, sql, params, alias, elapsed, count, stack in self.records:
+            lines.append(
+                f'{kind.upper()} {elapsed * 1000:.1f} ms x{count} [{alias}] {self.view} {self.path} | '
+                f'{_SPACE.sub(" ", sql)[:500]}' + (f' | {stack[0]}' if stack else '')
+            )
+        return '\n'.join(lines)
+
+    def rows(self):
+        moment = datetime.datetime.fromtimestamp(self.time, tz=datetime.timezone.utc)
+        for kind, sql, params, alias, elapsed, count, stack in self.records:
+            normalized = normalize_sql(sql)
+            yield SlowQuery(
+                time=moment, kind=kind, fingerprint=fingerprint(normalized), sql=normalized,
+                example=sql[:2000], params_fingerprint=fingerprint(repr(params)) if params else '',
+                duration_ms=elapsed * 1000, executions=count, database=alias[:100],
+                view=self.view[:200], path=self.path[:500], stack='\n'.join(stack or []),
+            )
+
+
+class SlowQueryStoreHandler(logging.Handler):
+    """Обработчик потока журнала: отчеты о запросах - в таблицу slow_queries базы events"""
+
+    def __init__(self, using=None, level=logging.NOTSET):
+        super().__init__(level)
+        self.using = using or EVENTS_ALIAS
+        self._warned = False
+
+    def emit(self, record):
+        self.emit_batch([record])
+
+    def emit_batch(self, records):
+        rows = [row for record in records if isinstance(record.msg, SlowQueryReport) for row in record.msg.rows()]
+        if not rows:
+            return
+        try:
+            SlowQuery.objects.using(self.using).bulk_create(rows)
+        except DatabaseError:
+            if not self._warned:
+                self._warned = True
+                logger.exception('Cannot write slow queries to %r', self.using)
+        finally:
+            connections[self.using].close_if_unusable_or_obsolete()
+
+
+def slow_query_logger():
+    from .log_queue import activity_logger
+    return activity_logger('slow_queries', 'slow_queries.log', store_handler=SlowQueryStoreHandler)
+
+
+def report(collector, view, path):
+    """Отдает записи HTTP запроса потоку журнала"""
+    records = collector.records()
+    if records:
+        slow_query_logger().warning(SlowQueryReport(view, path, records))
+
+
+def query_groups(period=None, view='', kind='', limit=100):
+    """
+    Группы записей по нормализованному SQL, самые затратные первыми: суммарное
+    время, выполнения (calls), записи, худшее время и наибольшее число повторов
+    за HTTP запрос; пример записи группы - в 'example'.
+    """
+    queryset = SlowQuery.objects.using(EVENTS_ALIAS)
+    if period is not None:
+        queryset = queryset.filter(time__gte=timezone.now() - period)
+    if view:
+        queryset = queryset.filter(view=view)
+    if kind:
+        queryset = queryset.filter(kind=kind)
+    groups = list(
+        queryset.values('fingerprint').annotate(
+            total_ms=Sum('duration_ms'), calls=Sum('executions'), records=Count('id'),
+            max_ms=Max('duration_ms'), max_repeat=Max('executions'), last_id=Max('id'),
+        ).order_by('-total_ms')[:limit]
+    )
+    examples = SlowQuery.objects.using(EVENTS_ALIAS).in_bulk([group['last_id'] for group in groups])
+    for group in groups:
+        group['example'] = examples.get(group['last_id'])
+        group['is_repeated'] = group['max_repeat'] >= slow_queries_settings()['REPEAT_THRESHOLD']
+    return groups
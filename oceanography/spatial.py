@@ -0,0 +1,121 @@
+"""
+Пространственные запросы по станциям.
+
+На SQLite координаты станций дублируются в виртуальную таблицу R*Tree
+(`stations_rtree`), которая поддерживается триггерами на таблице `stations`.
+Поиск по прямоугольнику идет по R*Tree, точное расстояние считается
+по формуле гаверсинуса. На других СУБД используется обычный индекс
+(latitude, longitude).
+"""
+import math
+
+from django.db.models import FloatField, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import ASin, Cast, Cos, Least, Power, Radians, Sin, Sqrt
+
+EARTH_RADIUS_KM = 6371.0088
+# Максимально возможное расстояние между точками на сфере
+MAX_DISTANCE_KM = math.pi * EARTH_RADIUS_KM
+RTREE_TABLE = 'stations_rtree'
+
+RTREE_INSTALL_SQL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {RTREE_TABLE} USING rtree(id, min_lat, max_lat, min_lon, max_lon)",
+    f"""CREATE TRIGGER IF NOT EXISTS {RTREE_TABLE}_insert AFTER INSERT ON stations BEGIN
+        INSERT OR REPLACE INTO {RTREE_TABLE} VALUES (NEW.station_id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {RTREE_TABLE}_update AFTER UPDATE OF station_id, latitude, longitude ON stations BEGIN
+        DELETE FROM {RTREE_TABLE} WHERE id = OLD.station_id;
+        INSERT OR REPLACE INTO {RTREE_TABLE} VALUES (NEW.station_id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {RTREE_TABLE}_delete AFTER DELETE ON stations BEGIN
+        DELETE FROM {RTREE_TABLE} WHERE id = OLD.station_id;
+    END""",
+]
+
+RTREE_UNINSTALL_SQL = [
+    f"DROP TRIGGER IF EXISTS {RTREE_TABLE}_insert",
+    f"DROP TRIGGER IF EXISTS {RTREE_TABLE}_update",
+    f"DROP TRIGGER IF EXISTS {RTREE_TABLE}_delete",
+    f"DROP TABLE IF EXISTS {RTREE_TABLE}",
+]
+
+
+def install_rtree(connection):
+    """
+    Создает R*Tree-индекс и триггеры и перестраивает индекс по текущим данным.
+
+    Вызывать повторно после миграций, пересоздающих таблицу `stations`:
+    SQLite удаляет триггеры вместе со старой таблицей.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for sql in RTREE_INSTALL_SQL:
+            cursor.execute(sql)
+        cursor.execute(f"DELETE FROM {RTREE_TABLE}")
+        cursor.execute(
+            f"INSERT INTO {RTREE_TABLE} "
+            f"SELECT station_id, latitude, latitude, longitude, longitude FROM stations"
+        )
+
+
+def uninstall_rtree(connection):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for sql in RTREE_UNINSTALL_SQL:
+            cursor.execute(sql)
+
+
+def bounding_box(lat, lon, radius_km):
+    """
+    Прямоугольник (min_lat, min_lon, max_lat, max_lon), содержащий круг радиуса radius_km.
+
+    Полуширина по долготе - asin(sin(r/R) / cos(lat)): это долгота точек
+    касания круга с меридианами, которые лежат севернее (южнее) центра.
+    Прямоугольник через антимеридиан возвращается с min_lon > max_lon.
+    """
+    lat, lon = float(lat), float(lon)
+    angle = radius_km / EARTH_RADIUS_KM
+    dlat = math.degrees(angle)
+    min_lat, max_lat = lat - dlat, lat + dlat
+
+    # У полюсов или при очень большом радиусе долгота не ограничивает поиск
+    if min_lat <= -90 or max_lat >= 90:
+        return max(min_lat, -90.0), -180.0, min(max_lat, 90.0), 180.0
+
+    ratio = math.sin(angle) / math.cos(math.radians(lat))
+    if ratio >= 1:
+        return min_lat, -180.0, max_lat, 180.0
+    dlon = math.degrees(math.asin(ratio))
+    min_lon, max_lon = lon - dlon, lon + dlon
+    # Пересечение антимеридиана: край переносится на другую сторону
+    if min_lon < -180:
+        min_lon += 360
+    elif max_lon > 180:
+        max_lon -= 360
+    return min_lat, min_lon, max_lat, max_lon
+
+
+def rtree_bbox_subquery(min_lat, min_lon, max_lat, max_lon):
+    """Подзапрос с ID станций, попадающих в прямоугольник, по R*Tree"""
+    return RawSQL(
+        f"SELECT id FROM {RTREE_TABLE} "
+        f"WHERE max_lat >= %s AND min_lat <= %s AND max_lon >= %s AND min_lon <= %s",
+        (float(min_lat), float(max_lat), float(min_lon), float(max_lon)),
+    )
+
+
+def haversine_km(lat, lon, lat_field='latitude', lon_field='longitude'):
+    """Выражение ORM: расстояние по большому кругу (км) от точки до станции"""
+    lat1 = Radians(Value(float(lat)))
+    lon1 = Radians(Value(float(lon)))
+    lat2 = Radians(Cast(lat_field, FloatField()))
+    lon2 = Radians(Cast(lon_field, FloatField()))
+
+    a = (
+        Power(Sin((lat2 - lat1) / 2), 2)
+        + Cos(lat1) * Cos(lat2) * Power(Sin((lon2 - lon1) / 2), 2)
+    )
+    # Least защищает ASIN от ошибок округления (a чуть больше 1)
+    return Value(2 * EARTH_RADIUS_KM) * ASin(Sqrt(Least(a, Value(1.0))))
@@ -0,0 +1,233 @@
+"""
+Синтетические данные для нагрузочных проверок (команда generate_data).
+
+Объем задается коэффициентом scale: на единицу - EXPEDITIONS_PER_SCALE
+экспедиций по STATIONS_PER_EXPEDITION станций, на каждой станции проба
+с поверхности и со дна со всеми таблицами измерений, на каждой
+profile_every-й станции - CTD профиль из scans сканов.
+
+Данные детерминированы: значения каждой экспедиции зависят только от
+seed и ее номера, даты отсчитываются от EPOCH, а не от текущего времени.
+Вставка - bulk_create пакетами по batch_size (CTD сканы - executemany
+курсора), экспедиция - одна транзакция. Платформа синтетических
+экспедиций начинается с PREFIX, по нему delete_generated() удаляет их
+через purge.
+"""
+import datetime
+import math
+import random
+from collections import Counter
+from decimal import Decimal
+
+from django.db import connections, models, router, transaction
+
+from .fields import ScaledIntegerField
+from .models import CTDMeasurement, CTDProfile, Expedition, Probe, Sample, SampleMeasurement, Station
+from .purge import purge
+
+PREFIX = 'SYN-'
+PROBE_NAME = 'SYN SBE 19plus V2'
+EPOCH = datetime.datetime(2015, 1, 1, tzinfo=datetime.timezone.utc)
+
+EXPEDITIONS_PER_SCALE = 10
+STATIONS_PER_EXPEDITION = 100
+DEFAULT_SCANS = 10000
+DEFAULT_PROFILE_EVERY = 10
+DEFAULT_BATCH_SIZE = 5000
+
+SURFACE = 'поверхность'
+BOTTOM = 'дно'
+
+# Район работ -> (широта, долгота) центра
+AREAS = {
+    'Белое море': (65.5, 36.5),
+    'Баренцево море': (72.0, 40.0),
+    'Карское море': (74.0, 65.0),
+    'Море Лаптевых': (76.0, 125.0),
+    'Восточно-Сибирское море': (73.0, 160.0),
+    'Охотское море': (55.0, 148.0),
+}
+PLATFORMS = ['НИС Академик Мстислав Келдыш', 'НИС Профессор Штокман', 'НИС Эколог', 'НИС Картеш']
+
+# Правдоподобные диапазоны полей измерений; остальные - в пределах знаков поля
+RANGES = {
+    't_air_c': (-20, 25),
+    'humidity_percent': (40, 100),
+    'wind_speed_m_s': (0, 25),
+    'wind_direction': (0, 359),
+    'pressure_hpa': (970, 1045),
+    'ph_value': (7.4, 8.4),
+    'temp_c': (-1.8, 15),
+    'salinity_psu': (5, 35),
+    'do_sat_percent': (60, 120),
+    'do_sat_percent_oxy': (60, 120),
+}
+
+
+def random_value(field, rng):
+    """Случайное значение из RANGES или в пределах знаков поля"""
+    low, high = RANGES.get(field.name, (0, None))
+    if isinstance(field, (models.DecimalField, ScaledIntegerField)):
+        if high is None:
+            high = 10 ** (field.max_digits - field.decimal_places - 1)
+        return Decimal(f'{rng.uniform(low, high):.{field.decimal_places}f}')
+    if isinstance(field, models.IntegerField):
+        return rng.randint(low, 359 if high is None else high)
+    if isinstance(field, models.CharField):
+        return f'SYN-{rng.randrange(100)}'[:field.max_length]
+    return None
+
+
+def value_fields(model):
+    """Поля измерений, заполняемые генератором"""
+    return [
+        field for field in model._meta.concrete_fields
+        if not (field.primary_key or field.is_relation or not field.editable or isinstance(field, models.DateTimeField))
+    ]
+
+
+def expedition_count(scale):
+    return max(1, round(EXPEDITIONS_PER_SCALE * scale))
+
+
+def generate(scale=1.0, seed=0, scans=DEFAULT_SCANS, profile_every=DEFAULT_PROFILE_EVERY,
+             batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """
+    Создает синтетические экспедиции; номера продолжают уже созданные,
+    так что повторный запуск с большим scale только дополняет данные.
+    Возвращает число строк по моделям.
+    """
+    counts = Counter()
+    probe, _ = Probe.objects.get_or_create(probe_name=PROBE_NAME, defaults={'description': 'Синтетические данные'})
+    existing = Expedition.objects.filter(platform__startswith=PREFIX).count()
+    measurement_models = [(model, value_fields(model)) for model in SampleMeasurement.measurement_models()]
+    for index in range(existing, expedition_count(scale)):
+        rng = random.Random(f'{seed}:{index}')
+        with transaction.atomic():
+            expedition_counts = _generate_expedition(
+                index, rng, probe, measurement_models, scans, profile_every, batch_size,
+            )
+        counts.update(expedition_counts)
+        if progress:
+            progress(index, expedition_counts)
+    return counts
+
+
+def _generate_expedition(index, rng, probe, measurement_models, scans, profile_every, batch_size):
+    counts = Counter()
+    area, (center_lat, center_lon) = list(AREAS.items())[index % len(AREAS)]
+    start = EPOCH + datetime.timedelta(days=index * 30)
+    expedition = Expedition.objects.create(
+        platform=f'{PREFIX}{index:05d} {PLATFORMS[index % len(PLATFORMS)]}', area=area,
+        start_date=start.date(), end_date=(start + datetime.timedelta(days=20)).date(),
+    )
+    counts['Expedition'] += 1
+
+    # Станции - галс вокруг центра района, раз в 5 часов
+    lat = center_lat + rng.uniform(-1, 1)
+    lon = center_lon + rng.uniform(-2, 2)
+    stations = []
+    for number in range(STATIONS_PER_EXPEDITION):
+        lat = min(max(lat + rng.uniform(-0.05, 0.05), -89), 89)
+        lon = min(max(lon + rng.uniform(-0.1, 0.1), -179), 179)
+        stations.append(Station(
+            expedition=expedition, station_name=f'{index}-{number + 1}',
+            datetime=start + datetime.timedelta(hours=5 * number),
+            latitude=Decimal(f'{lat:.6f}'), longitude=Decimal(f'{lon:.6f}'),
+            bottom_depth=Decimal(f'{rng.uniform(20, 300):.2f}'), secchi_depth=Decimal(f'{rng.uniform(1, 15):.2f}'),
+        ))
+    Station.objects.bulk_create(stations, batch_size=batch_size)
+    counts['Station'] += len(stations)
+
+    samples = [
+        Sample(station=station, datetime=station.datetime + datetime.timedelta(minutes=offset), sampling_depth=depth)
+        for station in stations
+        for offset, depth in ((0, SURFACE), (20, BOTTOM))
+    ]
+    Sample.objects.bulk_create(samples, batch_size=batch_size)
+    counts['Sample'] += len(samples)
+
+    for model, fields in measurement_models:
+        extra = {'probe': probe} if any(f.name == 'probe' for f in model._meta.fields) else {}
+        rows = [
+            model(
+                sample=sample, sample_datetime=sample.datetime, expedition=expedition, **extra,
+                **{field.name: random_value(field, rng) for field in fields},
+            )
+            for sample in samples
+        ]
+        model.objects.bulk_create(rows, batch_size=batch_size)
+        counts[model.__name__] += len(rows)
+
+    for station in stations[::profile_every]:
+        counts.update(_generate_profile(station, probe, rng, scans, batch_size))
+    return counts
+
+
+def _generate_profile(station, probe, rng, scans, batch_size):
+    """Профиль с гладким ходом температуры и солености по глубине"""
+    max_depth = float(station.bottom_depth) * 0.95
+    profile = CTDProfile.objects.create(
+        station=station, probe=probe, start_datetime=station.datetime,
+        end_datetime=station.datetime + datetime.timedelta(seconds=scans // 4),
+        max_depth=Decimal(f'{max_depth:.2f}'), comment='Синтетический профиль',
+    )
+    surface_temp = rng.uniform(-1.5, 12)
+    surface_salinity = rng.uniform(20, 34)
+    thermocline = rng.uniform(10, 40)
+    rows = []
+    for scan in range(scans):
+        depth = max_depth * scan / max(scans - 1, 1)
+        # Резкий перепад в термоклине, ниже - почти однородная вода
+        mix = 1 / (1 + math.exp(min((depth - thermocline) / 3, 50)))
+        temp = -1.0 + (surface_temp + 1.0) * mix + rng.gauss(0, 0.02)
+        salinity = 34.5 - (34.5 - surface_salinity) * mix + rng.gauss(0, 0.005)
+        rows.append((
+            station.datetime + datetime.timedelta(milliseconds=250 * scan), depth, depth * 1.008, temp,
+            25 + temp * 0.9 + (salinity - 30) * 0.8, salinity, 7 - depth / max_depth * 2,
+            salinity * 0.78 - temp * 0.05,
+        ))
+    _insert_scans(profile, rows, batch_size)
+    return Counter({'CTDProfile': 1, 'CTDMeasurement': len(rows)})
+
+
+SCAN_FIELDS = ['datetime', 'depth_m', 'pressure_dbar', 'temp_c', 'cond_ms_cm', 'salinity_psu', 'do_ml_l', 'sigma_kg_m3']
+
+
+def _insert_scans(profile, rows, batch_size):
+    """
+    Сканы - INSERT пачками через курсор: на 10k+ сканов профиля ORM
+    (объект модели и Decimal на каждое значение) в разы медленнее.
+    Значения масштабируются так же, как ScaledIntegerField.encode.
+    """
+    # Синтетические экспедиции не секционированы - основная таблица
+    alias = router.db_for_write(CTDMeasurement, main_table=True)
+    connection = connections[alias]
+    fields = [CTDMeasurement._meta.get_field(name) for name in SCAN_FIELDS]
+    scales = [field.scale for field in fields[1:]]
+    adapt = connection.ops.adapt_datetimefield_value
+    table = connection.ops.quote_name(CTDMeasurement._meta.db_table)
+    columns = ', '.join(connection.ops.quote_name(f.column) for f in [CTDMeasurement._meta.get_field('profile'), *fields])
+    sql = f'INSERT INTO {table} ({columns}) VALUES ({", ".join(["%s"] * (len(fields) + 1))})'
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            cursor.executemany(sql, [
+                (profile.pk, adapt(moment), *(round(value * scale) for value, scale in zip(values, scales)))
+                for moment, *values in rows[start:start + batch_size]
+            ])
+
+
+def generated_expeditions():
+    return Expedition.objects.filter(platform__startswith=PREFIX).order_by('pk')
+
+
+def delete_generated(progress=None):
+    """Удаляет все синтетические экспедиции; возвращает их число"""
+    deleted = 0
+    for expedition in generated_expeditions():
+        purge(expedition)
+        deleted += 1
+        if progress:
+            progress(expedition)
+    Probe.objects.filter(probe_name=PROBE_NAME, ctd_profiles__isnull=True, ctd_measurements__isnull=True).delete()
+    return deleted
@@ -1,3 +1,1839 @@
-from django.test import TestCase
+import contextlib
+import gzip
+import io
+import json
+import logging
+import math
+import os
+import pstats
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+from types import SimpleNamespace
 
-# Create your tests here.
+import openpyxl
+from django.contrib import admin
+from django.contrib.auth.models import Permission, User
+from django.core.management import call_command
+from django.db import connection, connections, models
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import (
+    CTDMeasurement, CTDPartition, CTDProfile, Expedition, ExpeditionArchive, LogEvent, MeteoData, NutrientsData,
+    Probe, RequestProfile, Sample, SampleMeasurement, SlowQuery, Station,
+)
+from .backups import (
+    BackupError, create_snapshot, file_sha256, gunzip_file, list_snapshots, object_path, read_manifest, restore_snapshot,
+    verify_snapshot,
+)
+from .cold_storage import archive_expedition, rehydrate_expedition
+from .db import sqlite_pragmas
+from .events import EVENTS_ALIAS, EventStoreHandler, archive_events, event_page
+from .log_reader import entry_offset, read_log, reverse_entries, rotated_files, search_logs
+from .log_queue import (
+    ActionMessage, BatchFileHandler, DroppingQueueHandler, JsonMessage, LogListener, RotatingBatchFileHandler,
+)
+from .fields import ScaledIntegerField, column_arrays
+from .memory import memory_budget, memory_logger, track_memory
+from . import benchmarks, metrics, synthetic, urls
+from .metrics import Histogram, MetricsRegistry, RequestTimer, view_rows
+from .paginators import EstimatedCountPaginator
+from .profiling import profile_request
+from .partitions import (
+    PartitionUnavailable, UnroutedMeasurementQuery, archive_partition, create_partition, invalidate_registry,
+    partition_alias, registry_version_path, restore_partition, unregister_alias,
+)
+from .purge import purge, purge_plan
+from .rows import project_rows
+from .spatial import EARTH_RADIUS_KM, bounding_box
+from .slow_queries import QueryCollector, SlowQueryReport, SlowQueryStoreHandler, normalize_sql, query_groups
+from .routers import PIN_COOKIE, REPLICA_ALIAS, expected_migrations, replica_schema_current, use_replica
+from .write_queue import WriteQueue, WriteQueueFull
+
+
+def setUpModule():
+    # Тесты не пишут в журналы действий пользователей (logs/user_actions.log, logs/user_activity.log)
+    for name in ('user_actions', 'user_activity'):
+        logging.getLogger(name).disabled = True
+
+
+def tearDownModule():
+    for name in ('user_actions', 'user_activity'):
+        logging.getLogger(name).disabled = False
+
+
+def required_values(model):
+    """Значения для обязательных полей измерений, не заданных явно"""
+    values = {}
+    for field in model._meta.concrete_fields:
+        if field.null or field.primary_key or field.is_relation or not field.editable:
+            continue
+        if isinstance(field, (models.DecimalField, ScaledIntegerField)):
+            values[field.name] = Decimal('1')
+        elif isinstance(field, models.CharField):
+            values[field.name] = 'test'
+        elif isinstance(field, models.DateTimeField):
+            values[field.name] = timezone.now()
+    return values
+
+
+class OceanographyDataMixin:
+    """Наполнение тестовой базы станциями, пробами и всеми видами измерений"""
+
+    @classmethod
+    def create_stations(cls, expedition, probe, count, measurements_per_profile=2):
+        start = timezone.now() - timedelta(days=365)
+        offset = Station.objects.count()
+        for i in range(offset, offset + count):
+            station_time = start + timedelta(hours=i)
+            station = Station.objects.create(
+                expedition=expedition, station_name=f'St-{i}', datetime=station_time,
+                latitude=Decimal('60') + Decimal(i) / 100, longitude=Decimal('30'),
+            )
+            sample = Sample.objects.create(station=station, datetime=station_time, sampling_depth='0')
+            for model in SampleMeasurement.measurement_models():
+                extra = {'probe': probe} if any(f.name == 'probe' for f in model._meta.fields) else {}
+                model.objects.create(sample=sample, **extra, **required_values(model))
+
+            profile = CTDProfile.objects.create(
+                station=station, probe=probe, start_datetime=station_time,
+                end_datetime=station_time + timedelta(minutes=30), max_depth=Decimal('10'),
+            )
+            CTDMeasurement.objects.bulk_create([
+                CTDMeasurement(profile=profile, **{**required_values(CTDMeasurement), 'depth_m': Decimal(depth)})
+                for depth in range(measurements_per_profile)
+            ])
+
+
+class SpatialQueryTests(TestCase):
+    """Поиск станций по прямоугольнику, радиусу и ближайших: высокие широты, полюс, антимеридиан"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.expedition = Expedition.objects.create(
+            platform='НИС Тест', area='Карское море', start_date=date(2024, 7, 1), end_date=date(2024, 7, 20),
+        )
+        cls.points = {
+            'kara': (75, 60),
+            # 497.6 км от (75, 60), восточнее края прямоугольника r/(R cos lat)
+            'kara_edge': (Decimal('75.675'), Decimal('77.544')),
+            'kara_outside': (75, 80),
+            'east': (Decimal('65.5'), Decimal('179.9')),
+            'west': (Decimal('65.5'), Decimal('-179.9')),
+            'pole_near': (Decimal('89.9'), 0),
+            'pole_far': (Decimal('89.9'), 180),
+            'white_sea': (Decimal('65.5'), Decimal('36.5')),
+        }
+        for name, (lat, lon) in cls.points.items():
+            Station.objects.create(
+                expedition=cls.expedition, station_name=name, datetime=timezone.now(), latitude=lat, longitude=lon,
+            )
+
+    def names(self, queryset):
+        return {station.station_name for station in queryset}
+
+    def test_bounding_box_contains_circle(self):
+        min_lat, min_lon, max_lat, max_lon = bounding_box(75, 60, 500)
+        half_width = math.asin(math.sin(500 / EARTH_RADIUS_KM) / math.cos(math.radians(75)))
+        self.assertAlmostEqual(max_lon - 60, math.degrees(half_width))
+        self.assertGreater(max_lon, 77.544)
+        # Через антимеридиан - min_lon > max_lon
+        min_lat, min_lon, max_lat, max_lon = bounding_box(65.5, 179.9, 50)
+        self.assertGreater(min_lon, max_lon)
+
+    def test_in_bbox(self):
+        self.assertEqual(self.names(Station.objects.in_bbox(65, 36, 66, 37)), {'white_sea'})
+        self.assertEqual(self.names(Station.objects.in_bbox(65, 179, 66, -179)), {'east', 'west'})
+
+    def test_within_radius(self):
+        self.assertEqual(self.names(Station.objects.within_radius(75, 60, 500)), {'kara', 'kara_edge'})
+        self.assertEqual(self.names(Station.objects.within_radius(Decimal('65.5'), 180, 10)), {'east', 'west'})
+        # У полюса долгота не ограничивает: станции по разные стороны полюса в 22 км друг от друга
+        self.assertEqual(self.names(Station.objects.within_radius(Decimal('89.9'), 0, 30)), {'pole_near', 'pole_far'})
+        for station in Station.objects.within_radius(75, 60, 500):
+            self.assertLessEqual(station.distance_km, 500)
+
+    def test_nearest(self):
+        nearest = list(Station.objects.nearest(Decimal('65.5'), Decimal('179.95'), k=2))
+        self.assertEqual([station.station_name for station in nearest], ['east', 'west'])
+        self.assertEqual([s.station_name for s in Station.objects.nearest(75, 60, k=2)], ['kara', 'kara_edge'])
+        self.assertEqual(
+            [s.station_name for s in Station.objects.nearest(Decimal('89.95'), 0, k=2)], ['pole_near', 'pole_far'],
+        )
+        self.assertEqual(len(Station.objects.nearest(0, 0, k=50)), len(self.points))
+
+
+class ExpeditionMapTests(TestCase):
+    """GeoJSON станций для карты и его ETag"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.expedition = Expedition.objects.create(
+            platform='НИС Тест', area='Белое море', start_date=date(2024, 7, 1), end_date=date(2024, 7, 20),
+        )
+        cls.station = Station.objects.create(
+            expedition=cls.expedition, station_name='St-1', datetime=timezone.now(),
+            latitude=Decimal('65.5'), longitude=Decimal('36.5'), bottom_depth=Decimal('50'),
+        )
+
+    def get(self, **headers):
+        return self.client.get(
+            reverse('oceanography:expedition_stations_geojson', args=[self.expedition.pk]), {'zoom': 14}, **headers,
+        )
+
+    def test_etag_follows_popup_fields(self):
+        etag = self.get()['ETag']
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        for field, value in [('station_name', 'St-1a'), ('bottom_depth', Decimal('51')),
+                             ('secchi_depth', Decimal('4')), ('datetime', timezone.now() - timedelta(days=1))]:
+            setattr(self.station, field, value)
+            self.station.save()
+            response = self.get(HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200, field)
+            etag = response['ETag']
+        self.assertEqual(response.json()['features'][0]['properties']['name'], 'St-1a')
+
+    def test_etag_follows_samples_and_ctd(self):
+        etag = self.get()['ETag']
+        other = Station.objects.create(
+            expedition=self.expedition, station_name='St-2', datetime=timezone.now() - timedelta(hours=1),
+            latitude=Decimal('65.6'), longitude=Decimal('36.6'),
+        )
+        sample = Sample.objects.create(station=self.station, datetime=self.station.datetime, sampling_depth='0')
+        changes = [
+            lambda: other,
+            lambda: Sample.objects.create(station=self.station, datetime=self.station.datetime, sampling_depth='5'),
+            # Проба перенесена на другую станцию - число проб обеих станций изменилось
+            lambda: setattr(sample, 'station', other) or sample.save(),
+            lambda: CTDProfile.objects.create(
+                station=self.station, probe=Probe.objects.create(probe_name='SBE'), start_datetime=timezone.now(),
+                end_datetime=timezone.now(), max_depth=Decimal('10'),
+            ),
+        ]
+        for i, change in enumerate(changes):
+            change()
+            response = self.get(HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200, i)
+            etag = response['ETag']
+        features = {f['properties']['name']: f['properties'] for f in response.json()['features']}
+        self.assertEqual((features['St-1']['samples_count'], features['St-1']['has_ctd']), (1, True))
+        self.assertEqual(features['St-2']['samples_count'], 1)
+
+    def test_revalidation_is_one_aggregate_query(self):
+        etag = self.get()['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(queries), 1)
+        self.assertIn('MAX', queries[0]['sql'])
+
+        # ETag считается по станциям видимой области
+        outside = {'bbox': '10,10,11,11', 'zoom': 14}
+        url = reverse('oceanography:expedition_stations_geojson', args=[self.expedition.pk])
+        etag = self.client.get(url, outside)['ETag']
+        self.station.station_name = 'St-1b'
+        self.station.save()
+        self.assertEqual(self.client.get(url, outside, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get(url, {'bbox': 'x'}).status_code, 400)
+
+
+class SampleMeasurementSyncTests(OceanographyDataMixin, TestCase):
+    """Дата пробы и экспедиция в таблицах измерений следуют за пробой и станцией"""
+
+    @classmethod
+    def setUpTestData(cls):
+        probe = Probe.objects.create(probe_name='SBE 19plus')
+        cls.expedition, cls.other = [
+            Expedition.objects.create(
+                platform=f'НИС Тест {i}', area='Белое море',
+                start_date=date(2024, 7, 1), end_date=date(2024, 7, 20),
+            )
+            for i in range(2)
+        ]
+        cls.create_stations(cls.expedition, probe, 1)
+        cls.create_stations(cls.other, probe, 1)
+
+    def synced(self, sample):
+        """{модель: [(sample_datetime, expedition_id)]} измерений пробы"""
+        return {
+            model: list(model.objects.filter(sample=sample).values_list('sample_datetime', 'expedition_id'))
+            for model in SampleMeasurement.measurement_models()
+        }
+
+    def expected(self, sample, expedition):
+        return {model: [(sample.datetime, expedition.pk)] for model in SampleMeasurement.measurement_models()}
+
+    def test_filled_on_create(self):
+        sample = Sample.objects.get(station__expedition=self.expedition)
+        self.assertEqual(self.synced(sample), self.expected(sample, self.expedition))
+
+    def test_sample_datetime_edit_propagates(self):
+        sample = Sample.objects.get(station__expedition=self.expedition)
+        sample.datetime -= timedelta(days=3)
+        sample.save()
+        self.assertEqual(self.synced(sample), self.expected(sample, self.expedition))
+
+    def test_sample_moved_to_station_of_other_expedition(self):
+        sample = Sample.objects.get(station__expedition=self.expedition)
+        sample.station = Station.objects.get(expedition=self.other)
+        sample.save()
+        self.assertEqual(self.synced(sample), self.expected(sample, self.other))
+
+    def test_station_move_propagates_expedition(self):
+        station = Station.objects.get(expedition=self.expedition)
+        station.expedition = self.other
+        station.save()
+        sample = Sample.objects.get(station=station)
+        self.assertEqual(self.synced(sample), self.expected(sample, self.other))
+        # Пробы другой станции не затронуты
+        untouched = Sample.objects.exclude(station=station).get()
+        self.assertEqual(self.synced(untouched), self.expected(untouched, self.other))
+        self.assertEqual(MeteoData.objects.filter(expedition=self.expedition).count(), 0)
+
+
+class ExpeditionStationsTableTests(TestCase):
+    """Таблица станций экспедиции: страницы и сортировка JSON"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.expedition, other = [
+            Expedition.objects.create(
+                platform=f'НИС Тест {i}', area='Белое море',
+                start_date=date(2024, 7, 1), end_date=date(2024, 7, 20),
+            )
+            for i in range(2)
+        ]
+        start = timezone.now() - timedelta(days=10)
+        stations = Station.objects.bulk_create([
+            Station(
+                expedition=cls.expedition, station_name=f'St-{i:02}', datetime=start + timedelta(hours=i),
+                latitude=Decimal('65.5'), longitude=Decimal('36.5'), bottom_depth=Decimal(100 - i),
+            )
+            for i in range(51)
+        ])
+        for i in range(3):
+            for _ in range(i):
+                Sample.objects.create(station=stations[i], datetime=stations[i].datetime, sampling_depth='0')
+        Station.objects.create(
+            expedition=other, station_name='Other', datetime=start,
+            latitude=Decimal('60'), longitude=Decimal('30'),
+        )
+        cls.url = reverse('oceanography:expedition_stations_table', args=[cls.expedition.pk])
+
+    def names(self, **params):
+        return [row['name'] for row in self.client.get(self.url, params).json()['results']]
+
+    def test_pages_and_sorting(self):
+        first = self.client.get(self.url).json()
+        self.assertEqual((first['total'], first['num_pages'], first['page_size']), (51, 2, 50))
+        self.assertEqual(len(first['results']), 50)
+        self.assertEqual(first['results'][1]['samples_count'], 1)
+        self.assertEqual(first['results'][0]['bottom_depth'], 100.0)
+        self.assertIsNone(first['results'][0]['secchi_depth'])
+        self.assertEqual(self.names(page=2), ['St-50'])
+
+        self.assertEqual(self.names(sort='-samples_count')[:3], ['St-02', 'St-01', 'St-00'])
+        self.assertEqual(self.names(sort='bottom_depth')[:2], ['St-50', 'St-49'])
+        self.assertEqual(self.names(sort='-datetime')[0], 'St-50')
+
+    def test_bad_parameters(self):
+        self.assertEqual(self.client.get(self.url, {'sort': 'comment'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'page': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'page': 5}).status_code, 404)
+
+        empty = Expedition.objects.create(
+            platform='НИС Пусто', area='Белое море', start_date=date(2024, 7, 1), end_date=date(2024, 7, 20),
+        )
+        response = self.client.get(reverse('oceanography:expedition_stations_table', args=[empty.pk])).json()
+        self.assertEqual((response['total'], response['num_pages'], response['results']), (0, 1, []))
+
+
+class ProjectedRowsTests(TestCase):
+    """Табличные страницы на строках project_rows вместо экземпляров моделей"""
+
+    @classmethod
+    def setUpTestData(cls):
+        expedition = Expedition.objects.create(
+            platform='НИС Тест', area='Белое море', start_date=date(2024, 7, 1), end_date=date(2024, 7, 20),
+        )
+        cls.station = Station.objects.create(
+            expedition=expedition, station_name='St-1', datetime=timezone.now(),
+            latitude=Decimal('65.123456'), longitude=Decimal('36.5'), bottom_depth=Decimal('50.25'),
+        )
+        cls.with_meteo, cls.empty = [
+            Sample.objects.create(station=cls.station, datetime=cls.station.datetime, sampling_depth=depth)
+            for depth in ('поверхность', 'дно')
+        ]
+        MeteoData.objects.create(sample=cls.with_meteo, t_air_c=Decimal('-1.5'))
+
+    def setUp(self):
+        # Страницы data_* читают с реплики - в тестах читаем из основной базы
+        self.client.cookies[PIN_COOKIE] = str(time.time() + 60)
+
+    def test_rows_select_listed_columns(self):
+        rows = project_rows(
+            Station.objects.annotate(samples_count=models.Count('samples')).order_by('pk'),
+            [('name', 'station_name'), ('latitude', 'latitude'), ('bottom_depth', 'bottom_depth'),
+             ('platform', 'expedition__platform'), ('samples_count', 'samples_count')],
+        )
+        with CaptureQueriesContext(connection) as queries:
+            row = rows[0]
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('"comment"', queries[0]['sql'])
+        self.assertFalse(hasattr(row, '__dict__'))
+        self.assertEqual((row.name, row.platform, row.samples_count), ('St-1', 'НИС Тест', 2))
+        self.assertIsInstance(row.latitude, float)
+        self.assertEqual(row.decimal('latitude'), Decimal('65.123456'))
+        self.assertEqual(row.decimal('bottom_depth'), Decimal('50.25'))
+        self.assertEqual(row.decimal('name'), 'St-1')
+        self.assertEqual(rows.count(), 1)
+
+    def test_sample_page_badges(self):
+        response = self.client.get(reverse('oceanography:data_samples'))
+        badges = {row.sample_id: (row.has_meteo, row.has_ctd) for row in response.context['samples']}
+        self.assertEqual(badges, {self.with_meteo.pk: (True, False), self.empty.pk: (False, False)})
+        self.assertContains(response, '<span class="badge bg-info">Метео</span>', count=1, html=True)
+        self.assertContains(response, 'Всего: 2')
+
+    def test_measurement_page_rows(self):
+        response = self.client.get(reverse('oceanography:data_meteo'))
+        (row,) = response.context['object_list']
+        self.assertEqual(row.t_air_c, -1.5)
+        self.assertContains(response, 'St-1')
+
+
+class AdminChangelistQueriesTests(OceanographyDataMixin, TestCase):
+    """Число запросов на странице списка в админке не зависит от числа строк"""
+    MAX_QUERIES = 10
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.probe = Probe.objects.create(probe_name='SBE 19plus')
+        cls.expedition = Expedition.objects.create(
+            platform='НИС Тест', area='Белое море',
+            start_date=date(2024, 7, 1), end_date=date(2024, 7, 20),
+        )
+        cls.create_stations(cls.expedition, cls.probe, 2)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def changelist_queries(self, model):
+        url = reverse(f'admin:{model._meta.app_label}_{model._meta.model_name}_changelist')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelist_query_ceiling(self):
+        models_ = [model for model in admin.site._registry if model._meta.app_label == 'oceanography']
+        small = {model: self.changelist_queries(model) for model in models_}
+
+        self.create_stations(self.expedition, self.probe, 10)
+        for model in models_:
+            with self.subTest(model=model.__name__):
+                queries = self.changelist_queries(model)
+                self.assertLessEqual(queries, self.MAX_QUERIES)
+                self.assertEqual(queries, small[model])
+
+    def test_changelist_counts_annotated(self):
+        response = self.client.get(reverse('admin:oceanography_expedition_changelist'))
+        self.assertContains(response, '<td class="field-stations_count">2</td>', html=True)
+        response = self.client.get(reverse('admin:oceanography_station_changelist') + '?o=6')
+        self.assertContains(response, '<td class="field-samples_count">1</td>', count=2, html=True)
+
+
+class ViewQueryBudgetTests(OceanographyDataMixin, TestCase):
+    """
+    Каждая страница из urls.py: число запросов не больше бюджета и не растет
+    с объемом данных (сравнение на двух объемах). При ошибке выводятся запросы.
+    """
+    databases = {'default', EVENTS_ALIAS}
+    # Имя URL -> наибольшее число запросов (все базы, вместе с сессией и пользователем)
+    BUDGETS = {
+        'home': 16,
+        'coming_soon': 2,
+        'expedition_list': 4,
+        'expedition_detail': 4,
+        'expedition_stations_table': 3,
+        'expedition_stations_geojson': 4,
+        'add_station_single': 3,
+        'add_stations_excel': 3,
+        'expedition_create': 2,
+        'station_search': 3,
+        'data_overview': 18,
+        'data_expeditions': 4,
+        'data_stations': 4,
+        'data_samples': 4,
+        'data_meteo': 4,
+        'data_carbon': 4,
+        'data_ionic': 4,
+        'data_pigments': 4,
+        'data_oxymetr': 4,
+        'data_nutrients': 4,
+        'data_ph': 4,
+        'data_probes': 5,
+        'data_ctd': 4,
+        'ctd_profile_list': 5,
+        'ctd_profile_create': 4,
+        'ctd_profile_detail': 5,
+        'add_ctd_profile': 7,
+        'add_meteo_excel': 5,
+        'log_viewer': 5,
+        'request_metrics': 2,
+        'slow_queries': 3,
+        'prometheus_metrics': 2,
+    }
+    # Параметры запроса для страниц, которые без них отдают пустой ответ
+    QUERY = {
+        'station_search': {'lat': 60, 'lon': 30, 'radius_km': 500},
+        'expedition_stations_geojson': {'zoom': 14},
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.probe = Probe.objects.create(probe_name='SBE 19plus')
+        cls.expedition = Expedition.objects.create(
+            platform='НИС Тест', area='Белое море', start_date=date(2024, 7, 1), end_date=date(2024, 7, 20),
+        )
+        cls.create_stations(cls.expedition, cls.probe, 2)
+        cls.station = Station.objects.first()
+        cls.profile = CTDProfile.objects.first()
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        # Страницы data_* читают с реплики - в тестах читаем из основной базы
+        self.client.cookies[PIN_COOKIE] = str(time.time() + 60)
+
+    def url_kwargs(self, pattern):
+        values = {'pk': self.expedition.pk, 'expedition_id': self.expedition.pk, 'station_id': self.station.pk}
+        if pattern.name == 'ctd_profile_detail':
+            values['pk'] = self.profile.pk
+        return {name: values[name] for name in pattern.pattern.converters}
+
+    def page_queries(self, pattern):
+        url = reverse(f'oceanography:{pattern.name}', kwargs=self.url_kwargs(pattern))
+        with contextlib.ExitStack() as stack:
+            captured = [stack.enter_context(CaptureQueriesContext(connections[alias])) for alias in sorted(self.databases)]
+            response = self.client.get(url, self.QUERY.get(pattern.name, {}))
+            if hasattr(response, 'streaming_content'):
+                b''.join(response.streaming_content)
+        self.assertLess(response.status_code, 400, url)
+        return [query['sql'] for queries in captured for query in queries.captured_queries]
+
+    def format_queries(self, queries):
+        return '\n'.join(f'{i:>4}. {sql}' for i, sql in enumerate(queries, 1))
+
+    def test_every_url_within_budget(self):
+        patterns = [pattern for pattern in urls.urlpatterns if pattern.name]
+        self.assertEqual({pattern.name for pattern in patterns}, set(self.BUDGETS), 'Бюджет нужен каждой странице')
+        # Первый проход прогревает кэши (права, ContentType, проверка базы events)
+        for pattern in patterns:
+            self.page_queries(pattern)
+        small = {pattern.name: self.page_queries(pattern) for pattern in patterns}
+
+        self.create_stations(self.expedition, self.probe, 10)
+        for pattern in patterns:
+            with self.subTest(url=pattern.name):
+                queries = self.page_queries(pattern)
+                self.assertLessEqual(
+                    len(queries), self.BUDGETS[pattern.name],
+                    f'{pattern.name}: {len(queries)} запросов при бюджете {self.BUDGETS[pattern.name]}\n'
+                    + self.format_queries(queries),
+                )
+                self.assertEqual(
+                    len(queries), len(small[pattern.name]),
+                    f'{pattern.name}: число запросов растет с данными ({len(small[pattern.name])} -> {len(queries)})\n'
+                    + self.format_queries(queries),
+                )
+
+
+class EstimatedCountPaginatorTests(OceanographyDataMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        probe = Probe.objects.create(probe_name='SBE 19plus')
+        expedition = Expedition.objects.create(
+            platform='НИС Тест', area='Белое море',
+            start_date=date(2024, 7, 1), end_date=date(2024, 7, 20),
+        )
+        cls.create_stations(expedition, probe, 3, measurements_per_profile=5)
+
+    def test_unfiltered_uses_estimate(self):
+        CTDMeasurement.objects.filter(depth_m=0).delete()
+        paginator = EstimatedCountPaginator(CTDMeasurement.objects.all(), 10)
+        paginator.exact_count_limit = 0
+        with CaptureQueriesContext(connection) as queries:
+            count = paginator.count
+        self.assertNotIn('COUNT', queries[0]['sql'])
+        # Оценка по rowid - верхняя граница, удаленные строки не вычитаются
+        self.assertGreaterEqual(count, CTDMeasurement.objects.count())
+
+    def test_small_or_filtered_table_counts_exactly(self):
+        queryset = CTDMeasurement.objects.all()
+        self.assertEqual(EstimatedCountPaginator(queryset, 10).count, 15)
+
+        paginator = EstimatedCountPaginator(queryset.filter(depth_m__gte=3), 10)
+        paginator.exact_count_limit = 0
+        self.assertEqual(paginator.count, 6)
+
+
+class CTDProfileAdminTests(OceanographyDataMixin, TestCase):
+    """Страница профиля в админке не зависит от числа измерений в профиле"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        probe = Probe.objects.create(probe_name='SBE 19plus')
+        expedition = Expedition.objects.create(
+            platform='НИС Тест', area='Белое море',
+            start_date=date(2024, 7, 1), end_date=date(2024, 7, 20),
+        )
+        cls.create_stations(expedition, probe, 1, measurements_per_profile=5)
+        cls.create_stations(expedition, probe, 1, measurements_per_profile=250)
+        cls.short_profile, cls.long_profile = CTDProfile.objects.order_by('profile_id')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def change_page(self, profile, page=1):
+        url = reverse('admin:oceanography_ctdprofile_change', args=[profile.pk])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'m_page': page})
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_change_page_queries_do_not_depend_on_profile_length(self):
+        self.change_page(self.short_profile)  # прогрев кеша ContentType
+        response, short_queries = self.change_page(self.short_profile)
+        self.assertEqual(len(response.context['measurements']), 5)
+        self.assertFalse(response.context['measurements_has_next'])
+
+        response, long_queries = self.change_page(self.long_profile)
+        self.assertEqual(len(response.context['measurements']), 100)
+        self.assertTrue(response.context['measurements_has_next'])
+        self.assertEqual(short_queries, long_queries)
+
+    def test_last_page_and_bulk_edit_link(self):
+        response, _ = self.change_page(self.long_profile, page=3)
+        self.assertEqual(len(response.context['measurements']), 50)
+        self.assertFalse(response.context['measurements_has_next'])
+
+        response = self.client.get(response.context['measurements_changelist_url'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cl'].result_count, 250)
+
+
+class ScaledIntegerFieldTests(OceanographyDataMixin, TestCase):
+    """CTD измерения хранятся масштабированными целыми, в Python - Decimal"""
+
+    @classmethod
+    def setUpTestData(cls):
+        probe = Probe.objects.create(probe_name='SBE 19plus')
+        expedition = Expedition.objects.create(
+            platform='НИС Тест', area='Белое море',
+            start_date=date(2024, 7, 1), end_date=date(2024, 7, 20),
+        )
+        cls.create_stations(expedition, probe, 1, measurements_per_profile=0)
+        cls.profile = CTDProfile.objects.get()
+        for depth, temp in [('0.50', '-1.25'), ('10.25', '4.07')]:
+            cls.profile.measurements.create(**{
+                **required_values(CTDMeasurement), 'depth_m': Decimal(depth), 'temp_c': Decimal(temp),
+                'salinity_psu': 27.456, 'do_mg_l': None,
+            })
+
+    def test_stored_as_integers_and_read_as_decimal(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT depth_m, temp_c, salinity_psu FROM ctd_measurements ORDER BY depth_m")
+            self.assertEqual(cursor.fetchall(), [(50, -125, 27456), (1025, 407, 27456)])
+
+        measurement = CTDMeasurement.objects.order_by('depth_m').first()
+        self.assertEqual(measurement.temp_c, Decimal('-1.25'))
+        self.assertEqual(str(measurement.salinity_psu), '27.456')
+        self.assertIsNone(measurement.do_mg_l)
+
+    def test_lookups_scale_values(self):
+        measurements = CTDMeasurement.objects.all()
+        self.assertEqual(measurements.filter(depth_m__gte=10.2).count(), 1)
+        self.assertEqual(measurements.filter(depth_m__lt=Decimal('10.25')).count(), 1)
+        self.assertEqual(measurements.filter(temp_c=Decimal('4.07')).count(), 1)
+
+    def test_column_arrays_and_rows(self):
+        columns = column_arrays(
+            CTDMeasurement.objects.for_profile(self.profile).order_by('depth_m'),
+            ['measurement_id', 'depth_m', 'temp_c', 'do_mg_l'],
+        )
+        self.assertEqual(list(columns['depth_m']), [0.5, 10.25])
+        self.assertEqual(list(columns['temp_c']), [-1.25, 4.07])
+        self.assertTrue(all(value != value for value in columns['do_mg_l']))  # NaN
+        self.assertEqual(len(columns['measurement_id']), 2)
+
+        row = project_rows(CTDMeasurement.objects.order_by('depth_m'), [('temp_c', 'temp_c')]).first()
+        self.assertEqual(row.temp_c, -1.25)
+        self.assertEqual(row.decimal('temp_c'), Decimal('-1.25'))
+
+
+class PurgeTests(OceanographyDataMixin, TestCase):
+    """Удаление экспедиций и профилей пакетными DELETE снизу вверх"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.probe = Probe.objects.create(probe_name='SBE 19plus')
+        cls.expedition, cls.other = [
+            Expedition.objects.create(
+                platform=f'НИС Тест {i}', area='Белое море',
+                start_date=date(2024, 7, 1), end_date=date(2024, 7, 20),
+            )
+            for i in range(2)
+        ]
+        cls.create_stations(cls.expedition, cls.probe, 3, measurements_per_profile=5)
+        cls.create_stations(cls.other, cls.probe, 1)
+
+    def test_plan_covers_all_cascading_relations(self):
+        # Новая таблица, ссылающаяся на экспедицию, не должна остаться с висячими строками
+        cascading, pending = set(), [Expedition]
+        while pending:
+            model = pending.pop()
+            for relation in model._meta.related_objects:
+                if relation.on_delete is models.CASCADE and relation.related_model not in cascading:
+                    cascading.add(relation.related_model)
+                    pending.append(relation.related_model)
+        self.assertLessEqual(cascading, {model for model, _ in purge_plan(self.expedition)})
+
+    def test_purge_expedition_bottom_up_in_batches(self):
+        batches = []
+        deleted = purge(self.expedition, batch_size=2, progress=lambda model, count: batches.append(model))
+
+        self.assertEqual(deleted[CTDMeasurement], 15)
+        self.assertEqual(deleted[Station], 3)
+        self.assertEqual(batches.count(CTDMeasurement), 8)
+        self.assertFalse(Expedition.objects.filter(pk=self.expedition.pk).exists())
+        for model in [Station, Sample, CTDProfile, *SampleMeasurement.measurement_models()]:
+            self.assertEqual(model.objects.count(), 1, model.__name__)
+        self.assertEqual(CTDMeasurement.objects.count(), 2)
+
+    @override_settings(PURGE_BACKGROUND_ROWS=10, WRITE_QUEUE={'EAGER': True})
+    def test_admin_uses_purge_for_large_objects(self):
+        self.client.force_login(self.user)
+        url = reverse('admin:oceanography_expedition_delete', args=[self.expedition.pk])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        # Подтверждение - счетчики по таблицам, а не выборка всех строк каскада
+        self.assertContains(response, 'CTD измерения: 15')
+        self.assertFalse(any('FROM "ctd_measurements"' in q['sql'] and 'COUNT' not in q['sql'] for q in queries))
+
+        response = self.client.post(url, {'post': 'yes'})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Expedition.objects.filter(pk=self.expedition.pk).exists())
+        self.assertEqual(Station.objects.count(), 1)
+
+
+class ColdStorageTests(OceanographyDataMixin, TestCase):
+    """Экспедиция в холодном архиве: заглушка со счетчиками и восстановление"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.probe = Probe.objects.create(probe_name='SBE 19plus')
+        cls.expedition, cls.other = [
+            Expedition.objects.create(
+                platform=f'НИС Тест {i}', area='Белое море',
+                start_date=date(2024, 7, i + 1), end_date=date(2024, 7, 20),
+            )
+            for i in range(2)
+        ]
+        cls.create_stations(cls.expedition, cls.probe, 3, measurements_per_profile=4)
+        cls.create_stations(cls.other, cls.probe, 1)
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        settings_override = override_settings(EXPEDITION_ARCHIVE_DIR=directory)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def snapshot(self):
+        models_ = [Station, Sample, CTDProfile, CTDMeasurement, *SampleMeasurement.measurement_models()]
+        return {model: list(model.objects.order_by('pk').values_list()) for model in models_}
+
+    def test_archive_and_rehydrate_round_trip(self):
+        before = self.snapshot()
+        bundle = archive_expedition(self.expedition)
+
+        self.assertTrue(bundle.exists())
+        self.assertEqual(Station.objects.count(), 1)
+        self.assertEqual(CTDMeasurement.objects.count(), 2)
+        stub = ExpeditionArchive.objects.get(expedition=self.expedition)
+        self.assertEqual((stub.stations_count, stub.samples_count), (3, 3))
+        self.assertEqual(stub.counts['oceanography.CTDMeasurement'], 12)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            rehydrate_expedition(self.expedition)
+        self.assertEqual(self.snapshot(), before)
+        self.assertFalse(ExpeditionArchive.objects.exists())
+        self.assertFalse(bundle.exists())
+
+    @override_settings(WRITE_QUEUE={'EAGER': True})
+    def test_listing_uses_stub_and_staff_rehydrates(self):
+        archive_expedition(self.expedition)
+        response = self.client.get(reverse('oceanography:expedition_list'))
+        counts = {e.pk: e.stations_count for e in response.context['expeditions']}
+        self.assertEqual(counts, {self.expedition.pk: 3, self.other.pk: 1})
+
+        # Просмотр, даже staff, показывает заглушку и ничего не восстанавливает
+        url = reverse('oceanography:expedition_detail', args=[self.expedition.pk])
+        response = self.client.get(url)
+        self.assertEqual(response.context['stations_count'], 3)
+        self.assertNotContains(response, 'Восстановить из архива')
+        self.assertEqual(self.client.post(url).status_code, 403)
+        self.client.force_login(User.objects.create_user('staff', password='pw', is_staff=True))
+        self.assertContains(self.client.get(url), 'Восстановить из архива')
+        self.assertTrue(ExpeditionArchive.objects.exists())
+
+        self.assertRedirects(self.client.post(url), url)
+        self.assertEqual(Station.objects.filter(expedition=self.expedition).count(), 3)
+        self.assertFalse(ExpeditionArchive.objects.exists())
+
+
+class LogQueueTests(TestCase):
+    """Журнал через очередь и фоновый поток записи"""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.path = Path(directory) / 'test.log'
+        self.file_handler = BatchFileHandler(self.path, encoding='utf-8', delay=True)
+        self.file_handler.setFormatter(logging.Formatter('%(levelname)s %(message)s'))
+        self.addCleanup(self.file_handler.close)
+        self.logger = logging.getLogger('oceanography.tests.log_queue')
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self.addCleanup(setattr, self.logger, 'handlers', [])
+
+    def test_records_written_in_batches_and_flushed_on_stop(self):
+        listener = LogListener(maxsize=1000, batch_size=50, batch_wait=0.05)
+        listener.add_handler(self.logger.name, self.file_handler)
+        self.logger.addHandler(DroppingQueueHandler(listener))
+        for i in range(120):
+            self.logger.info(JsonMessage({'n': i}))
+        listener.stop()
+        lines = self.path.read_text(encoding='utf-8').splitlines()
+        self.assertEqual(lines, [f'INFO {{"n": {i}}}' for i in range(120)])
+
+    def test_full_queue_samples_and_drops_instead_of_blocking(self):
+        entered, release = threading.Event(), threading.Event()
+
+        class BlockingHandler(logging.Handler):
+            def emit(self, record):
+                entered.set()
+                release.wait(5)
+
+        listener = LogListener(maxsize=10, batch_size=1, batch_wait=0)
+        listener.add_handler(self.logger.name, BlockingHandler())
+        listener.add_handler(self.logger.name, self.file_handler)
+        self.logger.addHandler(DroppingQueueHandler(listener, sample_at=0.5, sample_rate=5))
+        self.addCleanup(listener.stop)
+        self.addCleanup(release.set)
+        self.logger.info('first')
+        self.assertTrue(entered.wait(5))
+
+        # 5 записей до порога, из остальных 45 - каждая 5-я (9): 5 помещаются, 4 отброшены;
+        # WARNING не прореживается, но в полную очередь тоже не попадает
+        for i in range(50):
+            self.logger.info('info %s', i)
+        self.logger.warning('warning')
+        self.assertEqual(listener.sampled, 36)
+        self.assertEqual(listener.dropped, 5)
+
+        with self.assertLogs('oceanography.log_queue', 'WARNING') as logs:
+            release.set()
+            listener.stop()
+        self.assertIn('dropped 5, sampled out 36', logs.output[0])
+        self.assertEqual(len(self.path.read_text(encoding='utf-8').splitlines()), 11)
+
+
+class LogReaderTests(TestCase):
+    """Хвост журнала и двоичный поиск периода без чтения файлов целиком"""
+
+    def setUp(self):
+        directory = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.path = directory / 'user_actions.log'
+        start = datetime(2025, 3, 1, 12, 0)
+        self.entries = []
+        for i in range(800):
+            entry = f'{start + timedelta(minutes=i):%Y-%m-%d %H:%M:%S} - INFO - USER: u{i} | ACTION: VIEW Ж{i}'
+            if i % 97 == 0:
+                entry += '\nTraceback (most recent call last):\n  File "views.py"'
+            self.entries.append(entry)
+        # 300 старых записей - в повернутой копии .1
+        Path(f'{self.path}.1').write_text(''.join(e + '\n' for e in self.entries[:300]), encoding='utf-8')
+        self.path.write_text(''.join(e + '\n' for e in self.entries[300:]), encoding='utf-8')
+
+    def test_reverse_entries_across_small_blocks(self):
+        self.assertEqual(list(reverse_entries(self.path, block_size=37)), self.entries[300:][::-1])
+
+    def test_entry_offset_finds_period_start(self):
+        content = self.path.read_bytes()
+        target = self.entries[450][:19]
+        self.assertEqual(entry_offset(self.path, target), content.index(target.encode()))
+        self.assertEqual(entry_offset(self.path, '2000-01-01 00:00:00'), 0)
+        self.assertEqual(entry_offset(self.path, '2100-01-01 00:00:00'), len(content))
+
+    def test_read_log_spans_rotated_files(self):
+        self.assertEqual(read_log(self.path, 5)['entries'], self.entries[-5:][::-1])
+        everything = read_log(self.path, 1000)
+        self.assertEqual(everything['entries'], self.entries[::-1])
+        self.assertTrue(everything['estimated'])
+
+        recent = read_log(self.path, 10, since=self.entries[700][:19])
+        self.assertEqual(recent['entries'], self.entries[-10:][::-1])
+        self.assertEqual(recent['filtered_count'], 100 + 2 * 1)  # строки трассировки записи 776
+        older = read_log(self.path, 1000, since=self.entries[200][:19])
+        self.assertEqual(older['entries'], self.entries[200:][::-1])
+
+
+class LogRotationTests(TestCase):
+    """Поворот журнала в сжатые копии и поиск по ним"""
+
+    def setUp(self):
+        directory = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.path = directory / 'user_actions.log'
+        self.handler = RotatingBatchFileHandler(str(self.path), max_bytes=2000, backup_count=3, encoding='utf-8')
+        self.handler.setFormatter(logging.Formatter('%(message)s'))
+        self.addCleanup(self.handler.close)
+        start = datetime(2025, 3, 1, 12, 0)
+        self.entries = [
+            f'{start + timedelta(minutes=i):%Y-%m-%d %H:%M:%S} - INFO - USER: u{i} | ACTION: VIEW Станция {i}'
+            for i in range(200)
+        ]
+        for i in range(0, len(self.entries), 10):
+            self.handler.emit_batch([
+                logging.LogRecord('user_actions', logging.INFO, __file__, 0, entry, None, None)
+                for entry in self.entries[i:i + 10]
+            ])
+
+    def test_rotated_files_compressed_with_retention(self):
+        files = rotated_files(self.path)
+        self.assertEqual([f.name for f in files], [
+            'user_actions.log', 'user_actions.log.1.gz', 'user_actions.log.2.gz', 'user_actions.log.3.gz',
+        ])
+        self.assertLessEqual(self.path.stat().st_size, 2000)
+        kept = read_log(self.path, 1000)['entries']
+        # Старые копии сверх BACKUP_COUNT удалены, остальное читается подряд
+        self.assertEqual(kept, self.entries[-len(kept):][::-1])
+        self.assertLess(len(kept), len(self.entries))
+
+        self.handler.rotate_now()
+        self.assertFalse(self.path.exists())
+        self.assertEqual(read_log(self.path, 5)['entries'], self.entries[-5:][::-1])
+
+    def test_period_skips_archives_compressed_before_it(self):
+        _, newest, older, _ = rotated_files(self.path)
+        with gzip.open(newest, 'rt', encoding='utf-8') as f:
+            since = f.readline()[:19]
+        # Копия, сжатая раньше начала периода, не читается (даже испорченная)
+        older.write_bytes(b'not gzip')
+        os.utime(older, (0, 0))
+        recent = read_log(self.path, 1000, since=since)
+        first = [entry[:19] for entry in self.entries].index(since)
+        self.assertEqual(recent['entries'], self.entries[first:][::-1])
+        self.assertEqual(recent['filtered_count'], len(self.entries) - first)
+        self.assertEqual(search_logs(self.path, 'станция', 1000, since=since)['filtered_count'], len(self.entries) - first)
+
+    def test_search_scans_archives_and_file_chunks(self):
+        kept = read_log(self.path, 1000)['entries'][::-1]
+        expected = [entry for entry in kept if 'станция 1' in entry.lower()]
+        result = search_logs(self.path, 'СТАНЦИЯ 1', limit=1000, chunk_size=300)
+        self.assertEqual(result['entries'], expected[::-1])
+        self.assertEqual(result['filtered_count'], len(expected))
+        limited = search_logs(self.path, 'станция 1', limit=3, workers=1)
+        self.assertEqual(limited['entries'], expected[::-1][:3])
+        self.assertEqual(limited['filtered_count'], len(expected))
+        self.assertEqual(search_logs(self.path, 'нет такого', limit=10)['entries'], [])
+
+
+class EventStoreTests(TestCase):
+    """События журналов в отдельной базе и страница просмотра"""
+    databases = {'default', EVENTS_ALIAS}
+
+    def record(self, name, message, level=logging.INFO):
+        return logging.LogRecord(name, level, __file__, 0, message, None, None)
+
+    def test_records_stored_as_structured_events(self):
+        EventStoreHandler().emit_batch([
+            self.record('user_actions', ActionMessage(
+                'ivanov', 5, 'VIEW Expedition', 'Path: /expeditions/3/', None, 'success',
+                '10.0.0.1', 'Firefox', '/expeditions/3/',
+            )),
+            self.record('user_activity', JsonMessage({
+                'user': 'anonymous', 'method': 'GET', 'path': '/data/?page=2', 'status': 404,
+                'ip': '10.0.0.2', 'user_agent': 'curl', 'query': {'page': '2'},
+            }), level=logging.WARNING),
+        ])
+        action, activity = LogEvent.objects.order_by('id')
+        self.assertEqual(
+            (action.source, action.user, action.action, action.path, action.status, action.ip),
+            (LogEvent.ACTION, 'ivanov', 'VIEW Expedition', '/expeditions/3/', 'success', '10.0.0.1'),
+        )
+        self.assertEqual(
+            (activity.source, activity.user, activity.action, activity.path, activity.status, activity.level),
+            (LogEvent.ACTIVITY, 'anonymous', 'GET', '/data/', '404', logging.WARNING),
+        )
+        self.assertEqual(activity.extra, {'user_agent': 'curl', 'query': {'page': '2'}})
+
+    def test_pages_follow_cursor_and_filters(self):
+        now = timezone.now()
+        LogEvent.objects.bulk_create([
+            LogEvent(
+                time=now - timedelta(hours=29 - i), source=LogEvent.ACTION,
+                user='ivanov' if i % 2 else 'petrov', action='VIEW Station', path=f'/stations/{i}/',
+            )
+            for i in range(30)
+        ])
+        first = event_page({'user': 'ivanov'}, page_size=10)
+        self.assertEqual([e.path for e in first['events']], [f'/stations/{i}/' for i in range(29, 9, -2)])
+        self.assertEqual(first['filtered_count'], 15)
+        second = event_page({'user': 'ivanov'}, before=first['next_before'], page_size=10)
+        self.assertEqual([e.path for e in second['events']], [f'/stations/{i}/' for i in range(9, 0, -2)])
+        self.assertIsNone(second['next_before'])
+
+        self.assertEqual(event_page({'time_filter': '1h'})['filtered_count'], 1)
+        self.assertEqual(event_page({'path': '/stations/4/'})['events'][0].user, 'petrov')
+
+        staff = User.objects.create_user('staff', password='pw', is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.get(reverse('oceanography:log_viewer'), {'user': 'petrov', 'time_filter': '24h'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['from_store'])
+        self.assertEqual(len(response.context['logs']), 12)
+
+    def test_clear_archives_events(self):
+        directory = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.assertEqual(archive_events(directory), (None, 0))
+
+        now = timezone.now()
+        LogEvent.objects.bulk_create([
+            LogEvent(time=now, source=LogEvent.ACTION, user='ivanov', path=f'/stations/{i}/', extra={'n': i})
+            for i in range(7)
+        ])
+        path, count = archive_events(directory, keep=1, batch_size=3)
+        self.assertEqual(count, 7)
+        self.assertFalse(LogEvent.objects.exists())
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            rows = [json.loads(line) for line in f]
+        self.assertEqual([row['path'] for row in rows], [f'/stations/{i}/' for i in range(7)])
+        self.assertEqual(rows[3]['extra'], {'n': 3})
+
+        LogEvent.objects.create(time=now, source=LogEvent.ACTION, user='petrov')
+        second, count = archive_events(directory, keep=1)
+        self.assertEqual(count, 1)
+        self.assertEqual(list(directory.iterdir()), [second])
+
+
+class RequestMetricsTests(TestCase):
+    """Метрики запросов: гистограммы по имени URL, страница и формат Prometheus"""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        override = self.settings(METRICS={'DIR': directory, 'FLUSH_INTERVAL': 3600, 'TOKEN': 'secret'})
+        override.enable()
+        self.addCleanup(override.disable)
+        self.directory = Path(directory)
+        metrics._registry = None
+        self.addCleanup(setattr, metrics, '_registry', None)
+        self.staff = User.objects.create_user('staff', password='pw', is_staff=True)
+
+    def test_histogram_quantiles(self):
+        histogram = Histogram((10, 20, 30))
+        for value in [5] * 50 + [15] * 45 + [25] * 4 + [100]:
+            histogram.observe(value)
+        self.assertAlmostEqual(histogram.quantile(0.5), 10)
+        self.assertAlmostEqual(histogram.quantile(0.95), 20)
+        self.assertAlmostEqual(histogram.quantile(0.99), 30)
+        self.assertEqual(histogram.cumulative()[-1], ('+Inf', 100))
+
+    def test_requests_recorded_by_url_name_with_queries(self):
+        self.client.force_login(self.staff)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('oceanography:expedition_list'))
+        # Следующий запрос очищает журнал запросов соединения
+        executed = len(queries)
+        self.client.get('/no-such-page/')
+        views = metrics.get_metrics_registry().collect()
+        listing = views['oceanography:expedition_list']
+        self.assertEqual(listing.statuses['2xx'], 1)
+        self.assertEqual(listing.histograms['queries'].sum, executed)
+        self.assertGreater(executed, 0)
+        self.assertEqual(listing.histograms['duration'].count, 1)
+        self.assertGreater(listing.histograms['size'].sum, 0)
+        self.assertEqual(views[metrics.UNRESOLVED].statuses['4xx'], 1)
+
+    def test_collect_merges_process_files(self):
+        other = MetricsRegistry(self.directory)
+        other.record('oceanography:home', 200, 0.02, 3, 0.001, 1000)
+        other.flush()
+        other.path.rename(self.directory / 'metrics_1.json')
+        registry = metrics.get_metrics_registry()
+        registry.record('oceanography:home', 500, 0.2, 5, 0.01, 2000)
+        home = registry.collect()['oceanography:home']
+        self.assertEqual((home.statuses['2xx'], home.statuses['5xx']), (1, 1))
+        self.assertEqual(home.histograms['queries'].sum, 8)
+        row, = view_rows({'oceanography:home': home})
+        self.assertEqual((row['requests'], row['errors']), (2, 1))
+
+    def test_prometheus_endpoint_requires_staff_or_token(self):
+        metrics.get_metrics_registry().record('oceanography:home', 200, 0.02, 3, 0.001, 1000)
+        url = reverse('oceanography:prometheus_metrics')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        response = self.client.get(url, HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        text = response.content.decode()
+        self.assertIn('oceanography_request_duration_seconds_bucket{view="oceanography:home",le="0.025"} 1', text)
+        self.assertIn('oceanography_requests_total{view="oceanography:home",status="2xx"} 1', text)
+
+        self.client.force_login(self.staff)
+        page = self.client.get(reverse('oceanography:request_metrics'))
+        self.assertContains(page, 'oceanography:home')
+
+
+class SlowQueryLogTests(OceanographyDataMixin, TestCase):
+    """Журнал медленных запросов: повторы N+1, стек вызова и группировка по SQL"""
+    databases = {'default', EVENTS_ALIAS}
+
+    @classmethod
+    def setUpTestData(cls):
+        expedition = Expedition.objects.create(
+            platform='НИС Тест', area='Белое море', start_date=date(2024, 7, 1), end_date=date(2024, 7, 20),
+        )
+        cls.create_stations(expedition, Probe.objects.create(probe_name='SBE 19plus'), 6)
+
+    def collector(self, **overrides):
+        config = {'THRESHOLD_MS': 10000, 'REPEAT_THRESHOLD': 5, 'STACK_DEPTH': 4, **overrides}
+        return QueryCollector(config, sampled=False)
+
+    def run_request(self, collector, work):
+        timer = RequestTimer(collector, record=False)
+        try:
+            work()
+        finally:
+            timer.cancel()
+        return collector.records()
+
+    def test_normalize_sql(self):
+        self.assertEqual(
+            normalize_sql('SELECT * FROM "t"  WHERE "a" IN (%s, %s, %s) AND "b" = \'x\' LIMIT 21'),
+            'SELECT * FROM "t" WHERE "a" IN (...) AND "b" = ? LIMIT ?',
+        )
+        self.assertEqual(normalize_sql('SELECT "col1" FROM "t2" WHERE id = 7'), 'SELECT "col1" FROM "t2" WHERE id = ?')
+
+    def test_repeated_query_recorded_once_with_stack(self):
+        def per_row_lookups():
+            for pk in Sample.objects.values_list('pk', flat=True):
+                Sample.objects.get(pk=pk)
+
+        records = self.run_request(self.collector(), per_row_lookups)
+        self.assertEqual(len(records), 1)
+        kind, sql, params, alias, elapsed, count, stack = records[0]
+        self.assertEqual((kind, count, alias), (SlowQuery.REPEATED, 6, 'default'))
+        self.assertIn('"samples"', sql)
+        self.assertTrue(stack[0].startswith('oceanography/tests.py:'))
+        self.assertTrue(stack[0].endswith('in per_row_lookups'))
+
+        slow = self.run_request(self.collector(THRESHOLD_MS=0), lambda: list(Station.objects.all()))
+        self.assertEqual([record[0] for record in slow], [SlowQuery.SLOW])
+
+    def test_store_groups_by_normalized_sql(self):
+        records = [
+            (SlowQuery.REPEATED, 'SELECT * FROM "samples" WHERE "id" = %s LIMIT 21', (1,), 'default', 0.03, 40, ['views.py:1 in f']),
+            (SlowQuery.SLOW, 'SELECT * FROM "stations" WHERE "id" IN (%s, %s)', (1, 2), 'default', 0.2, 1, []),
+            (SlowQuery.SLOW, 'SELECT * FROM "stations" WHERE "id" IN (%s, %s, %s)', (1, 2, 3), 'default', 0.3, 1, []),
+        ]
+        record = logging.LogRecord(
+            'slow_queries', logging.WARNING, __file__, 0,
+            SlowQueryReport('oceanography:add_meteo_excel', '/expeditions/1/add-meteo/excel/', records), None, None,
+        )
+        SlowQueryStoreHandler().emit_batch([record])
+        self.assertIn('SLOW 300.0 ms x1', str(record.msg))
+
+        stations, samples = query_groups()
+        self.assertEqual((stations['records'], stations['calls']), (2, 2))
+        self.assertAlmostEqual(stations['total_ms'], 500)
+        self.assertFalse(stations['is_repeated'])
+        self.assertTrue(samples['is_repeated'])
+        self.assertEqual(samples['example'].stack, 'views.py:1 in f')
+
+        staff = User.objects.create_user('staff', password='pw', is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.get(reverse('oceanography:slow_queries'))
+        self.assertContains(response, 'N+1 ×40')
+        self.assertContains(response, 'oceanography:add_meteo_excel')
+
+
+class RequestProfilingTests(OceanographyDataMixin, TestCase):
+    """Профиль запроса по заголовку или параметру - только staff с правом"""
+
+    @classmethod
+    def setUpTestData(cls):
+        expedition = Expedition.objects.create(
+            platform='НИС Тест', area='Белое море', start_date=date(2024, 7, 1), end_date=date(2024, 7, 20),
+        )
+        cls.create_stations(expedition, Probe.objects.create(probe_name='SBE 19plus'), 2)
+        cls.staff = User.objects.create_user('staff', password='pw', is_staff=True)
+        cls.profiler = User.objects.create_user('profiler', password='pw', is_staff=True)
+        cls.profiler.user_permissions.add(
+            Permission.objects.get(codename='add_requestprofile'),
+            Permission.objects.get(codename='view_requestprofile'),
+        )
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.directory = Path(directory)
+        override = self.settings(PROFILING={'DIR': directory, 'KEEP': 2})
+        override.enable()
+        self.addCleanup(override.disable)
+        self.url = reverse('oceanography:ctd_profile_detail', args=[CTDProfile.objects.first().pk])
+
+    def test_flag_ignored_without_permission(self):
+        self.assertNotIn('X-Profile-Id', self.client.get(self.url, {'_profile': 1}))
+        self.client.force_login(self.staff)
+        self.assertNotIn('X-Profile-Id', self.client.get(self.url, HTTP_X_PROFILE='1'))
+        self.assertFalse(RequestProfile.objects.exists())
+
+    def test_profile_stored_and_downloadable(self):
+        self.client.force_login(self.profiler)
+        response = self.client.get(self.url, HTTP_X_PROFILE='1')
+        self.assertEqual(response.status_code, 200)
+        profile = RequestProfile.objects.get(pk=response['X-Profile-Id'])
+        self.assertEqual((profile.view, profile.status, profile.user), ('oceanography:ctd_profile_detail', 200, 'profiler'))
+        self.assertGreater(profile.queries, 0)
+        self.assertIn('function calls', profile.summary)
+        self.assertTrue((self.directory / profile.file_name).exists())
+
+        download = self.client.get(reverse('admin:oceanography_requestprofile_download', args=[profile.pk]))
+        self.assertEqual(download.status_code, 200)
+        self.assertEqual(b''.join(download.streaming_content), (self.directory / profile.file_name).read_bytes())
+        self.assertEqual(self.client.get(response['X-Profile-Url']).status_code, 200)
+
+        # Без флага - обычный запрос
+        self.assertNotIn('X-Profile-Id', self.client.get(self.url))
+
+    def test_writer_thread_jobs_merged_into_profile(self):
+        def write_job():
+            return sum(range(1000))
+
+        writes = WriteQueue(eager=False, batch_wait=0)
+
+        def handler():
+            writes.submit(write_job).result(timeout=5)
+            return HttpResponse()
+
+        request = RequestFactory().get(self.url)
+        request.user = self.profiler
+        profile_request(request, handler)
+        profile = RequestProfile.objects.get()
+        self.assertIn('Поток записи: 1 заданий', profile.summary)
+        stats = pstats.Stats(str(self.directory / profile.file_name))
+        self.assertIn('write_job', {name for _, _, name in stats.stats})
+
+    def test_old_profiles_pruned_with_files(self):
+        self.client.force_login(self.profiler)
+        for _ in range(3):
+            self.client.get(self.url, {'_profile': 1})
+        self.assertEqual(RequestProfile.objects.count(), 2)
+        self.assertEqual(
+            sorted(p.name for p in self.directory.iterdir()),
+            sorted(RequestProfile.objects.values_list('file_name', flat=True)),
+        )
+
+
+class MemoryTrackingTests(TestCase):
+    """Учет памяти tracemalloc по заголовку запроса или ключу команды"""
+    SAMPLES = 300
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.expedition = Expedition.objects.create(
+            platform='НИС Тест', area='Белое море', start_date=date(2024, 7, 1), end_date=date(2024, 7, 20),
+        )
+        start = timezone.now() - timedelta(days=30)
+        for i in range(cls.SAMPLES):
+            station = Station.objects.create(
+                expedition=cls.expedition, station_name=f'St-{i}', datetime=start + timedelta(hours=i),
+                latitude=Decimal('60'), longitude=Decimal('30'),
+            )
+            Sample.objects.create(station=station, datetime=station.datetime, sampling_depth='поверхность')
+        cls.staff = User.objects.create_user('staff', password='pw', is_staff=True)
+        cls.tracer = User.objects.create_user('tracer', password='pw', is_staff=True)
+        cls.tracer.user_permissions.add(Permission.objects.get(codename='add_requestprofile'))
+
+    def setUp(self):
+        self.url = reverse('oceanography:add_meteo_excel', args=[self.expedition.pk])
+        # Выгрузка читает с реплики - закрепляем клиента за основной базой
+        self.client.cookies[PIN_COOKIE] = str(time.time() + 60)
+
+    def download_template(self, **headers):
+        with self.assertLogs('memory_usage', level='INFO') as logs:
+            response = self.client.post(self.url, {'action': 'download_template'}, **headers)
+            # Без заголовка и параметра запись не делается - assertLogs требует хотя бы одну
+            memory_logger().info('end')
+        return response, [record.msg.payload for record in logs.records if isinstance(record.msg, JsonMessage)]
+
+    def test_flag_ignored_without_permission(self):
+        self.client.force_login(self.staff)
+        response, records = self.download_template(HTTP_X_MEMORY_PROFILE='1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(records, [])
+
+    def test_template_export_within_budget(self):
+        self.client.force_login(self.tracer)
+        response, records = self.download_template(HTTP_X_MEMORY_PROFILE='1')
+        self.assertEqual(response.status_code, 200)
+        [payload] = records
+        self.assertEqual((payload['label'], payload['user']), ('meteo.download_template', 'tracer'))
+        self.assertGreater(payload['peak_kb'], 0)
+        # Порог регрессии - тот же предел, что в MEMORY_PROFILING['BUDGETS']
+        self.assertIsNotNone(payload['budget_kb'])
+        self.assertLess(payload['peak_kb'], memory_budget('meteo.download_template'))
+        self.assertFalse(payload['over_budget'])
+        self.assertTrue(payload['top'])
+        self.assertTrue(all(':' in site['site'] for site in payload['top']))
+
+    def test_block_report_and_budget(self):
+        with self.settings(MEMORY_PROFILING={'BUDGETS': {'test.block': 100}}):
+            with self.assertLogs('memory_usage', level='WARNING') as logs:
+                with track_memory('test.block') as report:
+                    data = [SimpleNamespace(payload=bytearray(1024)) for _ in range(500)]
+        self.assertTrue(report.traced)
+        self.assertGreater(report.peak_kb, 500)
+        self.assertTrue(report.over_budget)
+        self.assertIn({'type': 'SimpleNamespace', 'delta': 500}, report.objects)
+        self.assertEqual(logs.records[0].msg.payload['label'], 'test.block')
+        del data
+
+    def test_nested_block_not_traced(self):
+        with track_memory('outer', log=False), self.assertLogs('oceanography.memory', level='WARNING'):
+            with track_memory('inner', log=False) as inner:
+                pass
+        self.assertFalse(inner.traced)
+
+    def test_command_switch(self):
+        stderr = io.StringIO()
+        with self.assertLogs('memory_usage', level='INFO') as logs:
+            call_command('ctd_partitions', 'list', trace_memory=True, stdout=io.StringIO(), stderr=stderr)
+        self.assertEqual(logs.records[0].msg.payload['label'], 'command.ctd_partitions')
+        self.assertIn('command.ctd_partitions: пик', stderr.getvalue())
+
+
+class MeteoUploadTests(TestCase):
+    """Загрузка метеоданных из Excel"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.expedition = Expedition.objects.create(
+            platform='НИС Тест', area='Белое море', start_date=date(2024, 7, 1), end_date=date(2024, 7, 20),
+        )
+        station = Station.objects.create(
+            expedition=cls.expedition, station_name='St-1', datetime=timezone.now(),
+            latitude=Decimal('65.5'), longitude=Decimal('36.5'),
+        )
+        cls.samples = [
+            Sample.objects.create(station=station, datetime=station.datetime, sampling_depth=depth)
+            for depth in ('поверхность', 'дно')
+        ]
+
+    @override_settings(WRITE_QUEUE={'EAGER': True})
+    def test_upload_bad_cell_reported_per_row(self):
+        samples = self.samples
+        wb = openpyxl.Workbook()
+        ws = wb.active
+        ws.append(['sample_id'])
+        ws.append(['ID пробы'])
+        # Дата в ячейке температуры - TypeError в float()
+        ws.append([samples[0].pk, None, None, None, datetime(2024, 7, 1), 80, 5, 180, 1013])
+        ws.append([samples[1].pk, None, None, None, 5.5, 80, 5, 180, 1013])
+        self.client.force_login(User.objects.create_user('staff', password='pw', is_staff=True))
+        response = self.client.post(
+            reverse('oceanography:add_meteo_excel', args=[self.expedition.pk]),
+            {'action': 'upload_data', 'excel_file': benchmarks.workbook_file(wb, 'meteo.xlsx')}, follow=True,
+        )
+        errors = [str(m) for m in response.context['messages'] if m.level_tag == 'error']
+        self.assertEqual(len(errors), 1)
+        self.assertIn('Строка 3', errors[0])
+        self.assertTrue(MeteoData.objects.filter(sample=samples[1]).exists())
+        self.assertFalse(MeteoData.objects.filter(sample=samples[0]).exists())
+
+
+class StationUploadTests(TestCase):
+    """Загрузка станций и проб из Excel"""
+
+    @override_settings(WRITE_QUEUE={'EAGER': True})
+    def test_upload_without_comment_column(self):
+        expedition = Expedition.objects.create(
+            platform='НИС Тест', area='Белое море', start_date=date(2024, 7, 1), end_date=date(2024, 7, 20),
+        )
+        wb = openpyxl.Workbook()
+        ws = wb.active
+        ws.append(['station_name'])
+        ws.append(['Название станции*'])
+        # Колонка комментария пустая во всем файле - в сохраненной книге ее нет
+        ws.append(['St-1', '2024-07-02 10:00:00', 60.5, 30.5, 50, 5, '2024-07-02 10:00:00', 'поверхность', None])
+        ws.append(['St-2', '2024-07-02 12:00:00', 60.6, 30.5, 40, None])
+        self.client.force_login(User.objects.create_user('staff', password='pw', is_staff=True))
+        response = self.client.post(
+            reverse('oceanography:add_stations_excel', args=[expedition.pk]),
+            {'action': 'upload_data', 'excel_file': benchmarks.workbook_file(wb, 'stations.xlsx')}, follow=True,
+        )
+        self.assertEqual([str(m) for m in response.context['messages'] if m.level_tag == 'error'], [])
+        self.assertEqual(sorted(Station.objects.values_list('station_name', flat=True)), ['St-1', 'St-2'])
+        self.assertEqual(list(Sample.objects.values_list('sampling_depth', 'comment')), [('поверхность', 'Проба 1')])
+
+
+class SyntheticDataTests(TestCase):
+    """Генератор синтетических данных и замеры страниц по ним"""
+
+    def generate(self):
+        counts = synthetic.generate(scale=0.1, seed=7, scans=50, profile_every=50, batch_size=30)
+        station = Station.objects.filter(expedition__platform__startswith=synthetic.PREFIX).order_by('pk').last()
+        profile = CTDProfile.objects.filter(station__expedition__platform__startswith=synthetic.PREFIX).last()
+        snapshot = {
+            'station': Station.objects.filter(pk=station.pk).values(
+                'station_name', 'datetime', 'latitude', 'longitude', 'bottom_depth').get(),
+            'nutrients': list(NutrientsData.objects.filter(sample__station=station).values('no3_mg_n_l', 'sample_datetime')),
+            'scans': list(CTDMeasurement.objects.for_profile(profile).values_list('depth_m', 'temp_c', 'salinity_psu')),
+        }
+        return counts, snapshot
+
+    def test_generation_is_deterministic(self):
+        counts, first = self.generate()
+        stations = synthetic.STATIONS_PER_EXPEDITION
+        self.assertEqual(counts['Expedition'], 1)
+        self.assertEqual((counts['Station'], counts['Sample'], counts['MeteoData']), (stations, 2 * stations, 2 * stations))
+        self.assertEqual((counts['CTDProfile'], counts['CTDMeasurement']), (2, 100))
+        self.assertEqual(len(first['scans']), 50)
+        # Повторный запуск с тем же объемом ничего не добавляет
+        self.assertFalse(synthetic.generate(scale=0.1, seed=7))
+
+        self.assertEqual(synthetic.delete_generated(), 1)
+        self.assertFalse(Station.objects.exists())
+        self.assertEqual(self.generate()[1], first)
+
+    def test_benchmarks_written_and_compared(self):
+        synthetic.generate(scale=0.1, scans=20, profile_every=50)
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        baseline, output = Path(directory) / 'baseline.json', Path(directory) / 'run.json'
+        options = {
+            'only': ['home', 'ctd_profile_detail', 'stations_template'], 'repeat': 1, 'warmup': 0,
+            'upload_rows': 0, 'baseline': str(baseline), 'stdout': io.StringIO(),
+        }
+        call_command('run_benchmarks', save_baseline=True, output=str(output), **options)
+        results = benchmarks.load_results(baseline)
+        self.assertEqual(set(results['cases']), {'home', 'ctd_profile_detail', 'stations_template'})
+        self.assertGreater(results['cases']['ctd_profile_detail']['queries'], 0)
+        self.assertEqual(results['dataset']['ctd_measurements'], 40)
+
+        stdout = io.StringIO()
+        call_command('run_benchmarks', check=True, tolerance=100, **{**options, 'stdout': stdout})
+        self.assertIn('ctd_profile_detail', stdout.getvalue())
+
+        slower = {'cases': {name: {**case, 'median_ms': case['median_ms'] * 3 + 10}
+                            for name, case in results['cases'].items()}}
+        slower['cases']['home']['queries'] += 1
+        statuses = {row[0]: row[-1] for row in benchmarks.compare(slower, results)}
+        self.assertEqual(statuses, {
+            'home': benchmarks.MORE_QUERIES, 'ctd_profile_detail': benchmarks.SLOWER,
+            'stations_template': benchmarks.SLOWER,
+        })
+
+
+class SQLitePragmasTests(TestCase):
+
+    def test_pragmas_applied_to_new_connections(self):
+        pragmas = sqlite_pragmas()
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA busy_timeout")
+            self.assertEqual(cursor.fetchone()[0], pragmas['busy_timeout'])
+            cursor.execute("PRAGMA cache_size")
+            self.assertEqual(cursor.fetchone()[0], pragmas['cache_size'])
+            cursor.execute("PRAGMA temp_store")
+            self.assertEqual(cursor.fetchone()[0], 2)  # MEMORY
+
+
+class WriteQueueTests(TransactionTestCase):
+    """Очередь записи с настоящим потоком-писателем"""
+
+    def create_probe(self, name):
+        return Probe.objects.create(probe_name=name).pk
+
+    def test_batched_jobs_commit_and_failed_job_is_isolated(self):
+        write_queue = WriteQueue(batch_wait=0.2, eager=False)
+        good = [write_queue.submit(self.create_probe, f'probe-{i}') for i in range(5)]
+        bad = write_queue.submit(Probe.objects.create, probe_name=None)
+
+        self.assertEqual(len({future.result(timeout=10) for future in good}), 5)
+        with self.assertRaises(Exception):
+            bad.result(timeout=10)
+        self.assertEqual(Probe.objects.count(), 5)
+
+    def test_backpressure_and_coalescing(self):
+        release = threading.Event()
+        write_queue = WriteQueue(maxsize=1, batch_size=1, submit_timeout=0, eager=False)
+        blocking = write_queue.submit(release.wait, 10)
+        # Писатель занят первым заданием - второе занимает единственное место
+        while not blocking.running():
+            time.sleep(0.01)
+        queued = write_queue.submit(self.create_probe, 'queued', key='probe')
+        self.assertIs(write_queue.submit(self.create_probe, 'queued', key='probe'), queued)
+        with self.assertRaises(WriteQueueFull):
+            write_queue.submit(self.create_probe, 'overflow')
+
+        release.set()
+        self.assertTrue(blocking.result(timeout=10))
+        queued.result(timeout=10)
+        self.assertEqual(list(Probe.objects.values_list('probe_name', flat=True)), ['queued'])
+
+
+class ReplicaRouterTests(TransactionTestCase):
+    # В TestCase реплика-зеркало - отдельное соединение с той же базой в памяти,
+    # которое не видит незафиксированные данные теста и упирается в их блокировки
+    databases = {'default', REPLICA_ALIAS}
+
+    def test_reads_go_to_replica_only_inside_use_replica(self):
+        self.assertEqual(Probe.objects.all().db, 'default')
+        with use_replica() as alias:
+            self.assertEqual(alias, REPLICA_ALIAS)
+            self.assertEqual(Probe.objects.all().db, REPLICA_ALIAS)
+            self.assertEqual(Probe.objects.create(probe_name='SBE')._state.db, 'default')
+        self.assertEqual(Probe.objects.all().db, 'default')
+
+    def test_write_pins_client_to_primary(self):
+        response = self.client.post(
+            reverse('oceanography:expedition_create'),
+            {'platform': 'НИС Тест', 'area': 'Белое море', 'start_date': '2024-07-01', 'end_date': '2024-07-20'},
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+        request = self.client.get(reverse('oceanography:data_stations')).wsgi_request
+        with use_replica(request) as alias:
+            self.assertEqual(alias, 'default')
+
+    @override_settings(WRITE_QUEUE={'EAGER': False})
+    def test_queued_upload_pins_client_to_primary(self):
+        expedition = Expedition.objects.create(
+            platform='НИС Тест', area='Белое море', start_date=date(2024, 7, 1), end_date=date(2024, 7, 20),
+        )
+        wb = openpyxl.Workbook()
+        ws = wb.active
+        ws.append(['station_name'])
+        ws.append(['Название станции*'])
+        ws.append(['St-1', '2024-07-02 10:00:00', 60.5, 30.5, 50, 5, '2024-07-02 10:00:00', 'поверхность', 'Проба'])
+        response = self.client.post(
+            reverse('oceanography:add_stations_excel', args=[expedition.pk]),
+            {'action': 'upload_data', 'excel_file': benchmarks.workbook_file(wb, 'stations.xlsx')},
+        )
+        self.assertEqual(response.status_code, 302)
+        # Станцию записал поток очереди, а закрепление - в ответе запроса
+        self.assertEqual(Station.objects.filter(expedition=expedition).count(), 1)
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+    def test_replica_behind_migrations_not_used(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        path = os.path.join(directory, 'replica.sqlite3')
+        applied = sorted(expected_migrations())
+        with contextlib.closing(sqlite3.connect(path)) as db, db:
+            db.execute('CREATE TABLE django_migrations (app TEXT, name TEXT)')
+            db.executemany('INSERT INTO django_migrations VALUES (?, ?)', applied[:-1])
+        self.assertFalse(replica_schema_current(path))
+        with contextlib.closing(sqlite3.connect(path)) as db, db:
+            db.execute('INSERT INTO django_migrations VALUES (?, ?)', applied[-1])
+        self.assertTrue(replica_schema_current(path))
+
+    def test_data_views_render_from_replica(self):
+        with CaptureQueriesContext(connections[REPLICA_ALIAS]) as queries:
+            response = self.client.get(reverse('oceanography:data_stations'))
+        self.assertEqual(response.status_code, 200)
+        # Запросы страницы, включая отрисовку шаблона, ушли на реплику
+        self.assertTrue(any('"stations"' in query['sql'] for query in queries))
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+    def use_file_replica(self):
+        """Реплика - отдельный файл, как в работе, а не зеркало тестовой базы"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        replica = connections[REPLICA_ALIAS]
+        mirror = replica.settings_dict
+        replica.close()
+        replica.settings_dict = {**mirror, 'NAME': os.path.join(directory, 'replica.sqlite3')}
+        self.addCleanup(setattr, replica, 'settings_dict', mirror)
+        self.addCleanup(replica.close)
+
+    def test_login_survives_stale_replica(self):
+        self.use_file_replica()
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        call_command('refresh_replica', stdout=io.StringIO())
+        # Вход пишет только сессию - клиент не закреплен за основной базой
+        self.assertTrue(self.client.login(username='admin', password='password'))
+        self.assertEqual(self.client.get(reverse('admin:index')).status_code, 200)
+
+        with CaptureQueriesContext(connections[REPLICA_ALIAS]) as queries:
+            response = self.client.get(reverse('oceanography:data_stations'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(any('"stations"' in query['sql'] for query in queries))
+        self.assertFalse(any('django_session' in query['sql'] for query in queries))
+        self.assertNotIn('sessionid', response.cookies)
+        self.assertEqual(self.client.get(reverse('admin:index')).status_code, 200)
+
+
+class CTDPartitionTests(OceanographyDataMixin, TransactionTestCase):
+    """Измерения экспедиции в отдельном файле SQLite"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        settings_override = override_settings(CTD_PARTITIONS_DIR=self.directory)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        invalidate_registry()
+        self.addCleanup(invalidate_registry)
+
+        self.probe = Probe.objects.create(probe_name='SBE 19plus')
+        self.expeditions = [
+            Expedition.objects.create(
+                platform=f'НИС Тест {i}', area='Белое море',
+                start_date=date(2024, 7, 1), end_date=date(2024, 7, 20),
+            )
+            for i in range(2)
+        ]
+        for expedition in self.expeditions:
+            self.create_stations(expedition, self.probe, 2, measurements_per_profile=3)
+        self.partitioned, self.other = self.expeditions
+        self.addCleanup(unregister_alias, self.partitioned.pk)
+        self.assertEqual(create_partition(self.partitioned, batch_size=4), 6)
+        self.alias = partition_alias(self.partitioned.pk)
+
+    def test_measurements_moved_and_routed_by_profile(self):
+        self.assertEqual(CTDMeasurement.objects.main_table().count(), 6)
+        # Без профиля, секции или main_table() запрос не уходит молча в основную таблицу
+        with self.assertRaises(UnroutedMeasurementQuery):
+            CTDMeasurement.objects.count()
+        with self.assertRaises(UnroutedMeasurementQuery):
+            CTDMeasurement.objects.filter(depth_m=0).delete()
+        self.assertEqual(CTDMeasurement.objects.for_expedition(self.partitioned.pk).count(), 6)
+
+        profile = CTDProfile.objects.filter(station__expedition=self.partitioned).first()
+        self.assertEqual(CTDMeasurement.objects.for_profile(profile).db, self.alias)
+        measurement = profile.measurements.first()
+        self.assertEqual(measurement._state.db, self.alias)
+        self.assertEqual(measurement.profile, profile)
+
+        # Новые измерения профиля пишутся в его секцию
+        profile.measurements.create(**required_values(CTDMeasurement))
+        CTDMeasurement(profile=profile, **required_values(CTDMeasurement)).save()
+        self.assertEqual(profile.measurements.count(), 5)
+
+        other = CTDProfile.objects.filter(station__expedition=self.other).first()
+        self.assertEqual(CTDMeasurement.objects.for_profile(other).db, 'default')
+        self.assertEqual(other.measurements.count(), 3)
+
+    def test_partition_ids_shared_with_main_table(self):
+        profile = CTDProfile.objects.filter(station__expedition=self.partitioned).first()
+        other = CTDProfile.objects.filter(station__expedition=self.other).first()
+        created = [
+            profile.measurements.create(**required_values(CTDMeasurement)),
+            other.measurements.create(**required_values(CTDMeasurement)),
+            *CTDMeasurement.objects.using(self.alias).bulk_create([
+                CTDMeasurement(profile=profile, **required_values(CTDMeasurement)) for _ in range(2)
+            ]),
+            other.measurements.create(**required_values(CTDMeasurement)),
+        ]
+        ids = [measurement.pk for measurement in created]
+        self.assertEqual(ids, sorted(ids))
+        existing = list(CTDMeasurement.objects.main_table().values_list('pk', flat=True)) + list(
+            CTDMeasurement.objects.using(self.alias).values_list('pk', flat=True)
+        )
+        self.assertEqual(len(existing), len(set(existing)))
+
+    def test_admin_change_and_delete_find_partition_rows(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        profile = CTDProfile.objects.filter(station__expedition=self.partitioned).first()
+        measurement = profile.measurements.create(**{**required_values(CTDMeasurement), 'depth_m': Decimal('42.5')})
+        main = CTDProfile.objects.filter(station__expedition=self.other).first().measurements.first()
+
+        change_url = reverse('admin:oceanography_ctdmeasurement_change', args=[measurement.pk])
+        response = self.client.get(change_url, {'_changelist_filters': f'profile__profile_id__exact={profile.pk}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['original'].depth_m, Decimal('42.5'))
+        self.assertEqual(response.context['original']._state.db, self.alias)
+        data = {
+            name: value for name, value in response.context['adminform'].form.initial.items() if value is not None
+        }
+        self.client.post(change_url, {**data, 'datetime_0': '2024-07-02', 'datetime_1': '10:00:00', 'temp_c': '3.25'})
+        self.assertEqual(CTDMeasurement.objects.using(self.alias).get(pk=measurement.pk).temp_c, Decimal('3.25'))
+        response = self.client.get(reverse('admin:oceanography_ctdmeasurement_change', args=[main.pk]))
+        self.assertEqual(response.context['original']._state.db, 'default')
+
+        response = self.client.post(
+            reverse('admin:oceanography_ctdmeasurement_delete', args=[measurement.pk]), {'post': 'yes'},
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(CTDMeasurement.objects.using(self.alias).filter(pk=measurement.pk).exists())
+        self.assertTrue(CTDMeasurement.objects.main_table().filter(pk=main.pk).exists())
+
+    def test_registry_version_shared_between_processes(self):
+        profile = CTDProfile.objects.filter(station__expedition=self.partitioned).first()
+        self.assertEqual(CTDMeasurement.objects.for_profile(profile).db, self.alias)
+        # Другой процесс отправил секцию в архив: строка реестра и новая версия
+        CTDPartition.objects.filter(expedition=self.partitioned).update(state=CTDPartition.ARCHIVED)
+        registry_version_path().write_text('other-process')
+        with self.assertRaises(PartitionUnavailable):
+            CTDMeasurement.objects.for_profile(profile)
+
+    def test_station_move_carries_measurements(self):
+        station = Station.objects.filter(expedition=self.other).first()
+        profile = station.ctd_profiles.get()
+        ids = set(profile.measurements.values_list('pk', flat=True))
+        self.assertEqual(CTDMeasurement.objects.for_profile(profile).db, 'default')
+
+        station.expedition = self.partitioned
+        station.save()
+        self.assertEqual(CTDMeasurement.objects.for_profile(profile).db, self.alias)
+        self.assertEqual(set(profile.measurements.values_list('pk', flat=True)), ids)
+        self.assertFalse(CTDMeasurement.objects.main_table().filter(profile_id=profile.pk).exists())
+
+        # Профиль переходит на станцию несекционированной экспедиции - обратно в основную таблицу
+        profile.station = Station.objects.filter(expedition=self.other).first()
+        profile.save()
+        self.assertEqual(set(CTDMeasurement.objects.main_table().filter(profile_id=profile.pk).values_list(
+            'pk', flat=True)), ids)
+        self.assertEqual(CTDMeasurement.objects.for_expedition(self.partitioned.pk).count(), 6)
+
+    def test_profile_delete_cleans_partition(self):
+        profile = CTDProfile.objects.filter(station__expedition=self.partitioned).first()
+        profile.delete()
+        self.assertEqual(CTDMeasurement.objects.for_expedition(self.partitioned.pk).count(), 3)
+
+    def test_archive_and_restore(self):
+        profile = CTDProfile.objects.filter(station__expedition=self.partitioned).first()
+        archive_partition(self.partitioned.pk)
+        with self.assertRaises(PartitionUnavailable):
+            CTDMeasurement.objects.for_profile(profile)
+        response = self.client.get(reverse('oceanography:ctd_profile_detail', args=[profile.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['measurements_count'], 0)
+
+        restore_partition(self.partitioned.pk)
+        self.assertEqual(CTDMeasurement.objects.for_profile(profile).count(), 3)
+
+
+class BackupTests(OceanographyDataMixin, TransactionTestCase):
+    """Снимки базы, секций и файлов и восстановление из них"""
+
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        settings_override = override_settings(
+            BACKUP_DIR=self.directory / 'backups', MEDIA_ROOT=self.directory / 'media',
+            CTD_PARTITIONS_DIR=self.directory / 'partitions', EXPEDITION_ARCHIVE_DIR=self.directory / 'archive',
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        invalidate_registry()
+        self.addCleanup(invalidate_registry)
+
+        probe = Probe.objects.create(probe_name='SBE 19plus')
+        self.expeditions = [
+            Expedition.objects.create(
+                platform=f'НИС Тест {i}', area='Белое море',
+                start_date=date(2024, 7, 1), end_date=date(2024, 7, 20),
+            )
+            for i in range(2)
+        ]
+        for expedition in self.expeditions:
+            self.create_stations(expedition, probe, 2, measurements_per_profile=3)
+        (self.directory / 'partitions').mkdir()
+        self.addCleanup(unregister_alias, self.expeditions[0].pk)
+        create_partition(self.expeditions[0])
+        self.cast = self.directory / 'media' / 'ctd_profiles' / 'cast.cnv'
+        self.cast.parent.mkdir(parents=True)
+        self.cast.write_text('# cast\n1 2 3\n')
+
+    def test_snapshot_and_restore(self):
+        first = create_snapshot(pages=2, keep=5)
+        manifest = read_manifest(first)
+        self.assertEqual(len(manifest['partitions']), 1)
+        self.assertEqual(manifest['files']['ctd_profiles'], {'cast.cnv': file_sha256(self.cast)})
+        self.assertGreater(manifest['metrics']['database']['steps'], 1)
+
+        # Неизменные файлы второй снимок не копирует, старый удаляется по keep
+        second = create_snapshot(keep=1)
+        self.assertEqual(read_manifest(second)['metrics']['files_copied'], 0)
+        self.assertEqual(list_snapshots(), [second])
+        self.assertTrue(object_path(file_sha256(self.cast)).exists())
+
+        Station.objects.filter(expedition=self.expeditions[1]).delete()
+        for profile in CTDProfile.objects.filter(station__expedition=self.expeditions[0]):
+            profile.measurements.all().delete()
+        self.cast.unlink()
+
+        restore_snapshot(second.name)
+        self.assertEqual(Station.objects.count(), 4)
+        self.assertEqual(CTDMeasurement.objects.for_expedition(self.expeditions[0].pk).count(), 6)
+        self.assertEqual(CTDMeasurement.objects.for_expedition(self.expeditions[1].pk).count(), 6)
+        self.assertEqual(self.cast.read_text(), '# cast\n1 2 3\n')
+
+    def test_database_and_partitions_copied_at_one_moment(self):
+        partition = CTDPartition.objects.get()
+        path = self.directory / 'partitions' / partition.file_name
+        table = CTDMeasurement._meta.db_table
+        written = []
+
+        def write_during_copy(name, done, total):
+            # Запись в секцию, пока копируется основная база
+            if name == 'db' and not written:
+                writer = sqlite3.connect(path, timeout=1)
+                with writer:
+                    writer.execute(f'DELETE FROM {table}')
+                writer.close()
+                written.append(name)
+
+        snapshot = create_snapshot(pages=1, sleep=0, progress=write_during_copy)
+        manifest = read_manifest(snapshot)
+        self.assertEqual(written, ['db'])
+        self.assertTrue(manifest['consistency']['point_in_time'])
+        self.assertEqual(manifest['consistency']['journal_modes'][partition.file_name], 'wal')
+
+        copy = self.directory / 'copy.sqlite3'
+        gunzip_file(snapshot / 'partitions' / f'{partition.file_name}.gz', copy)
+        connection = sqlite3.connect(copy)
+        self.addCleanup(connection.close)
+        self.assertEqual(connection.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0], 6)
+
+    def test_verify_detects_damage(self):
+        path = create_snapshot()
+        verify_snapshot(path)
+        with gzip.open(object_path(file_sha256(self.cast)), 'wb') as f:
+            f.write(b'damaged')
+        with self.assertRaises(BackupError):
+            verify_snapshot(path)
+        with self.assertRaises(BackupError):
+            restore_snapshot(path.name)
@@ -9,9 +9,12 @@ urlpatterns = [
     path('coming-soon/', ComingSoonView.as_view(), name='coming_soon'),
     path('expeditions/', ExpeditionListView.as_view(), name='expedition_list'),
     path('expeditions/<int:pk>/', ExpeditionDetailView.as_view(), name='expedition_detail'),
+    path('expeditions/<int:pk>/stations.json', ExpeditionStationsTableView.as_view(), name='expedition_stations_table'),
+    path('expeditions/<int:pk>/stations.geojson', ExpeditionStationsGeoJSONView.as_view(), name='expedition_stations_geojson'),
     path('expeditions/<int:expedition_id>/add-station/single/', StationSingleCreateView.as_view(), name='add_station_single'),
     path('expeditions/<int:expedition_id>/add-stations/excel/', StationExcelUploadView.as_view(), name='add_stations_excel'),
     path('expeditions/create/', ExpeditionCreateView.as_view(), name='expedition_create'),
+    path('stations/search/', StationSearchView.as_view(), name='station_search'),
     
     # Просмотр всех данных
     path('data/', DataOverviewView.as_view(), name='data_overview'),
@@ -35,4 +38,7 @@ urlpatterns = [
     path('stations/<int:station_id>/add-ctd-profile/', CTDProfileCreateView.as_view(), name='add_ctd_profile'),
     path('expeditions/<int:expedition_id>/add-meteo/excel/', MeteoExcelUploadView.as_view(), name='add_meteo_excel'),
     path('logs/', LogViewerView.as_view(), name='log_viewer'),
+    path('metrics/', RequestMetricsView.as_view(), name='request_metrics'),
+    path('metrics/slow-queries/', SlowQueryListView.as_view(), name='slow_queries'),
+    path('metrics/prometheus', PrometheusMetricsView.as_view(), name='prometheus_metrics'),
 ]
\ No newline at end of file
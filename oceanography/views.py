@@ -1,26 +1,47 @@
+import hashlib
+import hmac
 import logging
 from .logger import user_action_logger
-from .mixins import LoggingMixin, ViewAccessLoggingMixin
+from .mixins import LoggingMixin, ProfilingMixin, ReplicaReadMixin, ViewAccessLoggingMixin
 import openpyxl
 from io import BytesIO
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse
 from django.views.generic import TemplateView, ListView, DetailView, FormView, CreateView, View
 from django.urls import reverse, reverse_lazy
 from django.contrib import messages
 from django.shortcuts import render, redirect, get_object_or_404
-from django.db.models import Count, Min, Max
+from django.db import transaction
+from django.db.models import Avg, Count, Exists, FloatField, Max, Min, OuterRef, Value, Window
+from django.db.models.functions import Cast, Floor
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+from django.utils.decorators import method_decorator
+from .cold_storage import apply_stub_counts, rehydrate_in_background
+from .events import TIME_FILTERS, archive_events, event_filters, event_page, events_available
+from .log_queue import log_dir, log_rotation_settings, parse_action_line, rotate_log
+from .log_reader import read_log, search_logs
+from .memory import track_request_memory
+from .metrics import get_metrics_registry, metrics_settings, prometheus_text, view_rows
+from .slow_queries import query_groups, slow_queries_settings
 from .forms import ExpeditionForm, StationForm, CTDProfileForm
+from .routers import use_replica
+from .rows import project_rows
+from .write_queue import WriteQueueFull, get_write_queue, write_queue_settings
 from .models import (
     Expedition, Station, Sample, MeteoData, CarbonData, 
     IonicCompositionData, PigmentsData, OxymetrData, 
-    NutrientsData, PHMeasurement, Probe, CTDData, CTDProfile
+    NutrientsData, PHMeasurement, Probe, CTDData, CTDProfile, CTDMeasurement, LogEvent, SlowQuery
 )
+from .partitions import PartitionUnavailable, measurement_counts
 
 import os
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.core.exceptions import PermissionDenied
 from django.utils import timezone
 from datetime import timedelta
+from urllib.parse import urlencode
 
 # Стандартный Django логгер для отладки
 logger = logging.getLogger(__name__)
@@ -40,11 +61,15 @@ class HomeView(ViewAccessLoggingMixin, TemplateView):
         context['samples_count'] = Sample.objects.count()
         context['ctd_data_count'] = CTDData.objects.count()
         
-        # Последние экспедиции
-        context['recent_expeditions'] = Expedition.objects.select_related().order_by('-start_date')[:5]
+        # Последние экспедиции; счетчики - в том же запросе, а не .count на строку
+        context['recent_expeditions'] = apply_stub_counts(Expedition.objects.select_related('cold_archive').annotate(
+            stations_count=Count('stations')
+        ).order_by('-start_date')[:5])
         
         # Последние станции с данными об экспедициях
-        context['recent_stations'] = Station.objects.select_related('expedition').order_by('-datetime')[:5]
+        context['recent_stations'] = Station.objects.select_related('expedition').annotate(
+            samples_count=Count('samples')
+        ).order_by('-datetime')[:5]
         
         # Последние пробы
         context['recent_samples'] = Sample.objects.select_related(
@@ -62,7 +87,7 @@ class HomeView(ViewAccessLoggingMixin, TemplateView):
         }
         
         # Последняя активность
-        latest_station = Station.objects.order_by('-datetime').first()
+        latest_station = Station.objects.select_related('expedition').order_by('-datetime').first()
         if latest_station:
             context['latest_activity'] = {
                 'type': 'станция',
@@ -88,10 +113,14 @@ class ExpeditionListView(ViewAccessLoggingMixin, ListView):
     paginate_by = 20
     
     def get_queryset(self):
-        return Expedition.objects.all().prefetch_related('stations')
+        # Meta.ordering не применяется к запросам с GROUP BY - порядок задан явно
+        return Expedition.objects.select_related('cold_archive').annotate(
+            stations_count=Count('stations')
+        ).order_by('-start_date')
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        apply_stub_counts(context['expeditions'])
         context['breadcrumbs'] = [
             {'url': reverse('oceanography:home'), 'name': 'Главная'},
             {'url': '', 'name': 'Экспедиции'}
@@ -132,14 +161,52 @@ class ExpeditionDetailView(ViewAccessLoggingMixin, DetailView):
     model = Expedition
     template_name = 'oceanography/expedition_detail.html'
     context_object_name = 'expedition'
-    
+    queryset = Expedition.objects.select_related('cold_archive')
+    archive = None
+
+    def get_object(self, queryset=None):
+        expedition = super().get_object(queryset)
+        # Экспедиция в холодном архиве - показывается заглушка; восстановление
+        # запускает только staff кнопкой (POST), а не любой просмотр страницы
+        self.archive = getattr(expedition, 'cold_archive', None)
+        return expedition
+
+    def post(self, request, *args, **kwargs):
+        if not request.user.is_staff:
+            raise PermissionDenied
+        expedition = get_object_or_404(self.get_queryset(), pk=kwargs['pk'])
+        if getattr(expedition, 'cold_archive', None) is not None:
+            future = rehydrate_in_background(expedition)
+            try:
+                future.result(timeout=settings.EXPEDITION_REHYDRATE_WAIT)
+            except FutureTimeoutError:
+                messages.info(request, 'Данные экспедиции восстанавливаются из архива, обновите страницу позже')
+            except Exception:
+                logger.exception('Rehydrate of expedition %s failed', expedition.pk)
+                messages.error(request, 'Не удалось восстановить данные экспедиции из архива')
+        return redirect('oceanography:expedition_detail', pk=expedition.pk)
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        expedition = self.get_object()
-        
-        # Оптимизируем запросы к базе данных
-        context['stations'] = expedition.stations.all().prefetch_related('samples')
-        context['samples_count'] = Sample.objects.filter(station__expedition=expedition).count()
+        expedition = self.object
+        
+        # Сводка по экспедиции одним агрегирующим запросом; таблица станций
+        # загружается постранично (ExpeditionStationsTableView), карта - через GeoJSON
+        summary = expedition.stations.order_by().aggregate(
+            stations_count=Count('station_id', distinct=True),
+            samples_count=Count('samples'),
+            min_lat=Min('latitude'), max_lat=Max('latitude'),
+            min_lon=Min('longitude'), max_lon=Max('longitude'),
+        )
+        context['stations_count'] = summary['stations_count']
+        context['samples_count'] = summary['samples_count']
+        context['archive'] = self.archive
+        if self.archive is not None:
+            context['stations_count'] = self.archive.stations_count
+            context['samples_count'] = self.archive.samples_count
+        context['map_bounds'] = {
+            key: summary[key] for key in ('min_lat', 'max_lat', 'min_lon', 'max_lon')
+        }
         
         # Расчет длительности в днях
         if expedition.start_date and expedition.end_date:
@@ -155,6 +222,190 @@ class ExpeditionDetailView(ViewAccessLoggingMixin, DetailView):
         ]
         return context
 
+class ExpeditionStationsTableView(View):
+    """
+    Таблица станций экспедиции (JSON) - постранично и с сортировкой.
+
+    Параметры: page - номер страницы, sort - поле сортировки
+    (с префиксом "-" для убывания). Строки страницы, число проб
+    и общее количество станций получаются одним запросом.
+    """
+    page_size = 50
+    sort_fields = {
+        'station_name', 'datetime', 'latitude', 'longitude',
+        'bottom_depth', 'secchi_depth', 'samples_count',
+    }
+    default_sort = 'datetime'
+
+    def get(self, request, pk):
+        sort = request.GET.get('sort', self.default_sort)
+        if sort.lstrip('-') not in self.sort_fields:
+            return JsonResponse({'error': f'Недопустимое поле сортировки: {sort}'}, status=400)
+        try:
+            page = max(int(request.GET.get('page', 1)), 1)
+        except ValueError:
+            return JsonResponse({'error': 'Некорректный номер страницы'}, status=400)
+
+        offset = (page - 1) * self.page_size
+        rows = list(
+            Station.objects.filter(expedition_id=pk).annotate(
+                samples_count=Count('samples'),
+                total_count=Window(Count('*')),
+            ).order_by(sort, 'station_id').values(
+                'station_id', 'station_name', 'datetime', 'latitude', 'longitude',
+                'bottom_depth', 'secchi_depth', 'samples_count', 'total_count',
+            )[offset:offset + self.page_size]
+        )
+        if not rows and page > 1:
+            return JsonResponse({'error': 'Страница не найдена'}, status=404)
+
+        total = rows[0]['total_count'] if rows else 0
+        results = [
+            {
+                'id': row['station_id'],
+                'name': row['station_name'],
+                'datetime': timezone.localtime(row['datetime']).strftime('%d.%m.%Y %H:%M'),
+                'lat': float(row['latitude']),
+                'lon': float(row['longitude']),
+                'bottom_depth': float(row['bottom_depth']) if row['bottom_depth'] is not None else None,
+                'secchi_depth': float(row['secchi_depth']) if row['secchi_depth'] is not None else None,
+                'samples_count': row['samples_count'],
+            }
+            for row in rows
+        ]
+        return JsonResponse({
+            'page': page,
+            'page_size': self.page_size,
+            'num_pages': max((total + self.page_size - 1) // self.page_size, 1),
+            'total': total,
+            'sort': sort,
+            'results': results,
+        })
+
+
+# Поля станции, которые видны на карте (точка и всплывающее окно)
+MAP_STATION_FIELDS = (
+    'station_id', 'station_name', 'datetime', 'latitude', 'longitude',
+    'bottom_depth', 'secchi_depth', 'samples_count', 'has_ctd',
+)
+
+
+def map_station_rows(stations):
+    """Строки станций для карты: поля окна станции, число проб и наличие CTD"""
+    return stations.annotate(
+        samples_count=Count('samples'),
+        has_ctd=Exists(CTDProfile.objects.filter(station_id=OuterRef('pk'))),
+    ).values_list(*MAP_STATION_FIELDS).order_by('station_id')
+
+
+def map_stations(request, pk):
+    """Станции экспедиции в видимой области карты (bbox из GET); ValueError - неверный bbox"""
+    stations = Station.objects.filter(expedition_id=pk).order_by()
+    if request.GET.get('bbox'):
+        min_lon, min_lat, max_lon, max_lat = (float(v) for v in request.GET['bbox'].split(','))
+        stations = stations.in_bbox(min_lat, min_lon, max_lat, max_lon)
+    return stations
+
+
+def _expedition_map_etag(request, pk):
+    """
+    ETag карты - одна агрегирующая выборка по станциям видимой области:
+    число и последний ключ станций, последняя правка станции (updated_at),
+    число и последние ключи проб и CTD профилей.
+    """
+    try:
+        stations = map_stations(request, pk)
+    except ValueError:
+        return None
+    summary = stations.aggregate(
+        stations_count=Count('station_id', distinct=True),
+        last_station=Max('station_id'),
+        updated=Max('updated_at'),
+        samples_count=Count('samples', distinct=True),
+        last_sample=Max('samples__sample_id'),
+        profiles_count=Count('ctd_profiles', distinct=True),
+        last_profile=Max('ctd_profiles__profile_id'),
+    )
+    key = '|'.join(str(summary[name]) for name in sorted(summary))
+    key += f"|{request.GET.get('bbox', '')}|{request.GET.get('zoom', '')}"
+    return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+
+@method_decorator(condition(etag_func=_expedition_map_etag), name='get')
+class ExpeditionStationsGeoJSONView(ViewAccessLoggingMixin, View):
+    """
+    Станции экспедиции в формате GeoJSON для карты.
+
+    Параметры: bbox=min_lon,min_lat,max_lon,max_lat - видимая область карты,
+    zoom - масштаб карты. До масштаба cluster_max_zoom станции группируются
+    в кластеры по сетке на стороне БД, дальше отдаются отдельными точками.
+    """
+    cluster_max_zoom = 12
+    # Размер ячейки кластера в пикселях при тайле 256 px
+    cluster_cell_px = 64
+    cache_max_age = 300
+
+    def get(self, request, pk):
+        try:
+            zoom = int(request.GET.get('zoom', self.cluster_max_zoom + 1))
+            stations = map_stations(request, pk)
+        except ValueError as e:
+            return JsonResponse({'error': f'Некорректные параметры: {e}'}, status=400)
+
+        if zoom <= self.cluster_max_zoom:
+            features = self._cluster_features(stations, zoom)
+        else:
+            features = self._station_features(stations)
+
+        response = JsonResponse({'type': 'FeatureCollection', 'features': features})
+        response['Content-Type'] = 'application/geo+json'
+        patch_cache_control(response, public=True, max_age=self.cache_max_age)
+        return response
+
+    def _cluster_features(self, stations, zoom):
+        cell = 360 / (2 ** max(zoom, 0)) * self.cluster_cell_px / 256
+        clusters = stations.annotate(
+            cell_x=Floor(Cast('longitude', FloatField()) / Value(cell)),
+            cell_y=Floor(Cast('latitude', FloatField()) / Value(cell)),
+        ).values('cell_x', 'cell_y').annotate(
+            count=Count('station_id'),
+            lat=Avg(Cast('latitude', FloatField())),
+            lon=Avg(Cast('longitude', FloatField())),
+            station_id=Min('station_id'),
+            station_name=Min('station_name'),
+        )
+        features = []
+        for cluster in clusters:
+            properties = {'cluster': True, 'count': cluster['count']}
+            if cluster['count'] == 1:
+                properties.update(id=cluster['station_id'], name=cluster['station_name'])
+            features.append(self._feature(cluster['lon'], cluster['lat'], properties))
+        return features
+
+    def _station_features(self, stations):
+        features = []
+        for values in map_station_rows(stations):
+            row = dict(zip(MAP_STATION_FIELDS, values))
+            features.append(self._feature(row['longitude'], row['latitude'], {
+                'cluster': False,
+                'id': row['station_id'],
+                'name': row['station_name'],
+                'datetime': timezone.localtime(row['datetime']).strftime('%d.%m.%Y %H:%M'),
+                'bottom_depth': float(row['bottom_depth']) if row['bottom_depth'] is not None else None,
+                'secchi_depth': float(row['secchi_depth']) if row['secchi_depth'] is not None else None,
+                'samples_count': row['samples_count'],
+                'has_ctd': row['has_ctd'],
+            }))
+        return features
+
+    def _feature(self, lon, lat, properties):
+        return {
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': [float(lon), float(lat)]},
+            'properties': properties,
+        }
+
+
 class StationSingleCreateView(ViewAccessLoggingMixin, LoggingMixin, CreateView):
     """Форма для добавления одной станции с автоматическим созданием двух проб"""
     model = Station
@@ -237,11 +488,60 @@ class StationSingleCreateView(ViewAccessLoggingMixin, LoggingMixin, CreateView):
 
 
 
+class StationSearchView(ViewAccessLoggingMixin, View):
+    """
+    Пространственный поиск станций (JSON).
+
+    Параметры: lat, lon и radius_km - поиск в радиусе; lat, lon и k - ближайшие
+    станции; bbox=min_lon,min_lat,max_lon,max_lat - поиск в прямоугольнике.
+    Дополнительно: expedition - ограничить поиск экспедицией.
+    """
+    max_results = 500
+
+    def get(self, request, *args, **kwargs):
+        try:
+            stations = self._search(request.GET)
+        except (KeyError, TypeError, ValueError) as e:
+            return JsonResponse({'error': f'Некорректные параметры поиска: {e}'}, status=400)
+
+        results = []
+        for station in stations:
+            item = {
+                'id': station.station_id,
+                'name': station.station_name,
+                'expedition_id': station.expedition_id,
+                'datetime': station.datetime.isoformat(),
+                'lat': float(station.latitude),
+                'lon': float(station.longitude),
+            }
+            if hasattr(station, 'distance_km'):
+                item['distance_km'] = round(station.distance_km, 3)
+            results.append(item)
+        return JsonResponse({'count': len(results), 'results': results})
+
+    def _search(self, params):
+        stations = Station.objects.order_by()
+        if params.get('expedition'):
+            stations = stations.filter(expedition_id=int(params['expedition']))
+
+        if params.get('bbox'):
+            min_lon, min_lat, max_lon, max_lat = (float(v) for v in params['bbox'].split(','))
+            return stations.in_bbox(min_lat, min_lon, max_lat, max_lon)[:self.max_results]
+
+        lat, lon = float(params['lat']), float(params['lon'])
+        if params.get('radius_km'):
+            return stations.within_radius(
+                lat, lon, float(params['radius_km'])
+            ).order_by('distance_km')[:self.max_results]
+        k = min(int(params.get('k', 10)), self.max_results)
+        return stations.nearest(lat, lon, k=k)
+
+
 # ============================================================================
 # ПРЕДСТАВЛЕНИЯ ДЛЯ ПРОСМОТРА ВСЕХ ДАННЫХ
 # ============================================================================
 
-class DataOverviewView(ViewAccessLoggingMixin, TemplateView):
+class DataOverviewView(ProfilingMixin, ReplicaReadMixin, ViewAccessLoggingMixin, TemplateView):
     """Обзор всех данных в системе"""
     template_name = 'oceanography/data_overview.html'
     
@@ -249,14 +549,15 @@ class DataOverviewView(ViewAccessLoggingMixin, TemplateView):
         context = super().get_context_data(**kwargs)
         
         # Статистика по всем основным таблицам
+        stations_count = Station.objects.count()
         context['stats'] = {
             'expeditions': {
                 'count': Expedition.objects.count(),
                 'recent': Expedition.objects.order_by('-start_date')[:5],
-                'total_stations': Station.objects.count(),
+                'total_stations': stations_count,
             },
             'stations': {
-                'count': Station.objects.count(),
+                'count': stations_count,
                 'with_samples': Station.objects.filter(samples__isnull=False).distinct().count(),
                 'recent': Station.objects.select_related('expedition').order_by('-datetime')[:10],
             },
@@ -310,7 +611,7 @@ class DataOverviewView(ViewAccessLoggingMixin, TemplateView):
         
         return context
 
-class ExpeditionDataView(ViewAccessLoggingMixin, ListView):
+class ExpeditionDataView(ProfilingMixin, ReplicaReadMixin, ViewAccessLoggingMixin, ListView):
     """Детальный просмотр всех экспедиций"""
     model = Expedition
     template_name = 'oceanography/data_expeditions.html'
@@ -318,13 +619,14 @@ class ExpeditionDataView(ViewAccessLoggingMixin, ListView):
     paginate_by = 20
     
     def get_queryset(self):
-        return Expedition.objects.annotate(
+        return Expedition.objects.select_related('cold_archive').annotate(
             stations_count=Count('stations'),
             samples_count=Count('stations__samples')
         ).order_by('-start_date')
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        apply_stub_counts(context['expeditions'])
         context['breadcrumbs'] = [
             {'url': reverse('oceanography:home'), 'name': 'Главная'},
             {'url': reverse('oceanography:data_overview'), 'name': 'Обзор данных'},
@@ -332,17 +634,30 @@ class ExpeditionDataView(ViewAccessLoggingMixin, ListView):
         ]
         return context
 
-class StationDataView(ViewAccessLoggingMixin, ListView):
+class StationDataView(ProfilingMixin, ReplicaReadMixin, ViewAccessLoggingMixin, ListView):
     """Детальный просмотр всех станций"""
     model = Station
     template_name = 'oceanography/data_stations.html'
     context_object_name = 'stations'
     paginate_by = 50
+    row_fields = [
+        ('station_name', 'station_name'),
+        ('expedition_id', 'expedition_id'),
+        ('platform', 'expedition__platform'),
+        ('expedition_start_date', 'expedition__start_date'),
+        ('datetime', 'datetime'),
+        ('latitude', 'latitude'),
+        ('longitude', 'longitude'),
+        ('bottom_depth', 'bottom_depth'),
+        ('secchi_depth', 'secchi_depth'),
+        ('samples_count', 'samples_count'),
+    ]
     
     def get_queryset(self):
-        return Station.objects.select_related('expedition').annotate(
-            samples_count=Count('samples')
-        ).order_by('-datetime')
+        return project_rows(
+            Station.objects.annotate(samples_count=Count('samples')).order_by('-datetime'),
+            self.row_fields
+        )
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -353,20 +668,41 @@ class StationDataView(ViewAccessLoggingMixin, ListView):
         ]
         return context
 
-class SampleDataView(ViewAccessLoggingMixin, ListView):
+class SampleDataView(ProfilingMixin, ReplicaReadMixin, ViewAccessLoggingMixin, ListView):
     """Детальный просмотр всех проб"""
     model = Sample
     template_name = 'oceanography/data_samples.html'
     context_object_name = 'samples'
     paginate_by = 50
+    row_fields = [
+        ('sample_id', 'sample_id'),
+        ('station_name', 'station__station_name'),
+        ('platform', 'station__expedition__platform'),
+        ('datetime', 'datetime'),
+        ('sampling_depth', 'sampling_depth'),
+        ('has_meteo', 'has_meteo'),
+        ('has_carbon', 'has_carbon'),
+        ('has_ionic', 'has_ionic'),
+        ('has_pigments', 'has_pigments'),
+        ('has_nutrients', 'has_nutrients'),
+        ('has_ph', 'has_ph'),
+        ('has_ctd', 'has_ctd'),
+        ('has_oxymetr', 'has_oxymetr'),
+    ]
     
     def get_queryset(self):
-        return Sample.objects.select_related(
-            'station', 'station__expedition'
-        ).prefetch_related(
-            'meteo_data', 'carbon_data', 'ionic_data', 
-            'pigments_data', 'nutrients_data', 'ph_measurements'
-        ).order_by('-datetime')
+        # Наличие данных каждого типа - подзапросы EXISTS вместо загрузки связанных строк
+        data_models = {
+            'has_meteo': MeteoData, 'has_carbon': CarbonData,
+            'has_ionic': IonicCompositionData, 'has_pigments': PigmentsData,
+            'has_nutrients': NutrientsData, 'has_ph': PHMeasurement,
+            'has_ctd': CTDData, 'has_oxymetr': OxymetrData,
+        }
+        samples = Sample.objects.annotate(**{
+            name: Exists(model.objects.filter(sample_id=OuterRef('pk')))
+            for name, model in data_models.items()
+        }).order_by('-datetime')
+        return project_rows(samples, self.row_fields)
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -377,17 +713,27 @@ class SampleDataView(ViewAccessLoggingMixin, ListView):
         ]
         return context
 
-class MeteoDataView(ViewAccessLoggingMixin, ListView):
+class MeteoDataView(ProfilingMixin, ReplicaReadMixin, ViewAccessLoggingMixin, ListView):
     """Детальный просмотр всех метеоданных"""
     model = MeteoData
     template_name = 'oceanography/data_meteo.html'
     context_object_name = 'meteo_data'
     paginate_by = 50
+    row_fields = [
+        ('sample_id', 'sample_id'),
+        ('station_name', 'sample__station__station_name'),
+        ('platform', 'sample__station__expedition__platform'),
+        ('t_air_c', 't_air_c'),
+        ('humidity_percent', 'humidity_percent'),
+        ('wind_speed_m_s', 'wind_speed_m_s'),
+        ('wind_direction', 'wind_direction'),
+        ('pressure_hpa', 'pressure_hpa'),
+    ]
     
     def get_queryset(self):
-        return MeteoData.objects.select_related(
-            'sample', 'sample__station', 'sample__station__expedition'
-        ).order_by('-sample__datetime')
+        return project_rows(
+            MeteoData.objects.order_by('-sample_datetime'), self.row_fields
+        )
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -398,17 +744,27 @@ class MeteoDataView(ViewAccessLoggingMixin, ListView):
         ]
         return context
 
-class CarbonDataView(ViewAccessLoggingMixin, ListView):
+class CarbonDataView(ProfilingMixin, ReplicaReadMixin, ViewAccessLoggingMixin, ListView):
     """Детальный просмотр всех данных по углероду"""
     model = CarbonData
     template_name = 'oceanography/data_carbon.html'
     context_object_name = 'carbon_data'
     paginate_by = 50
+    row_fields = [
+        ('sample_id', 'sample_id'),
+        ('station_name', 'sample__station__station_name'),
+        ('platform', 'sample__station__expedition__platform'),
+        ('dtc_mg_c_l', 'dtc_mg_c_l'),
+        ('dic_mg_c_l', 'dic_mg_c_l'),
+        ('doc_mg_c_l', 'doc_mg_c_l'),
+        ('tss_mg_l', 'tss_mg_l'),
+        ('poc_mg_c_m3', 'poc_mg_c_m3'),
+    ]
     
     def get_queryset(self):
-        return CarbonData.objects.select_related(
-            'sample', 'sample__station', 'sample__station__expedition'
-        ).order_by('-sample__datetime')
+        return project_rows(
+            CarbonData.objects.order_by('-sample_datetime'), self.row_fields
+        )
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -419,17 +775,28 @@ class CarbonDataView(ViewAccessLoggingMixin, ListView):
         ]
         return context
 
-class IonicDataView(ViewAccessLoggingMixin, ListView):
+class IonicDataView(ProfilingMixin, ReplicaReadMixin, ViewAccessLoggingMixin, ListView):
     """Детальный просмотр всех данных по ионному составу"""
     model = IonicCompositionData
     template_name = 'oceanography/data_ionic.html'
     context_object_name = 'ionic_data'
     paginate_by = 50
+    row_fields = [
+        ('sample_id', 'sample_id'),
+        ('station_name', 'sample__station__station_name'),
+        ('platform', 'sample__station__expedition__platform'),
+        ('cl_mg_l', 'cl_mg_l'),
+        ('hco3_mg_l', 'hco3_mg_l'),
+        ('so4_mg_l', 'so4_mg_l'),
+        ('ca_mg_l', 'ca_mg_l'),
+        ('mg_mg_l', 'mg_mg_l'),
+        ('mineralization_mg_l', 'mineralization_mg_l'),
+    ]
     
     def get_queryset(self):
-        return IonicCompositionData.objects.select_related(
-            'sample', 'sample__station', 'sample__station__expedition'
-        ).order_by('-sample__datetime')
+        return project_rows(
+            IonicCompositionData.objects.order_by('-sample_datetime'), self.row_fields
+        )
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -440,17 +807,26 @@ class IonicDataView(ViewAccessLoggingMixin, ListView):
         ]
         return context
 
-class PigmentsDataView(ViewAccessLoggingMixin, ListView):
+class PigmentsDataView(ProfilingMixin, ReplicaReadMixin, ViewAccessLoggingMixin, ListView):
     """Детальный просмотр всех данных по пигментам"""
     model = PigmentsData
     template_name = 'oceanography/data_pigments.html'
     context_object_name = 'pigments_data'
     paginate_by = 50
+    row_fields = [
+        ('sample_id', 'sample_id'),
+        ('station_name', 'sample__station__station_name'),
+        ('platform', 'sample__station__expedition__platform'),
+        ('chl_a_mg_m3', 'chl_a_mg_m3'),
+        ('chl_a_pheo_mg_m3', 'chl_a_pheo_mg_m3'),
+        ('chl_a_tri_mg_m3', 'chl_a_tri_mg_m3'),
+        ('total_chl_mg_m3', 'total_chl_mg_m3'),
+    ]
     
     def get_queryset(self):
-        return PigmentsData.objects.select_related(
-            'sample', 'sample__station', 'sample__station__expedition'
-        ).order_by('-sample__datetime')
+        return project_rows(
+            PigmentsData.objects.order_by('-sample_datetime'), self.row_fields
+        )
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -461,17 +837,25 @@ class PigmentsDataView(ViewAccessLoggingMixin, ListView):
         ]
         return context
 
-class OxymetrDataView(ViewAccessLoggingMixin, ListView):
+class OxymetrDataView(ProfilingMixin, ReplicaReadMixin, ViewAccessLoggingMixin, ListView):
     """Детальный просмотр всех данных оксиметра"""
     model = OxymetrData
     template_name = 'oceanography/data_oxymetr.html'
     context_object_name = 'oxymetr_data'
     paginate_by = 50
+    row_fields = [
+        ('sample_id', 'sample_id'),
+        ('station_name', 'sample__station__station_name'),
+        ('platform', 'sample__station__expedition__platform'),
+        ('do_mg_l_oxy', 'do_mg_l_oxy'),
+        ('do_sat_percent_oxy', 'do_sat_percent_oxy'),
+        ('turbidity_ntu_oxy', 'turbidity_ntu_oxy'),
+    ]
     
     def get_queryset(self):
-        return OxymetrData.objects.select_related(
-            'sample', 'sample__station', 'sample__station__expedition'
-        ).order_by('-sample__datetime')
+        return project_rows(
+            OxymetrData.objects.order_by('-sample_datetime'), self.row_fields
+        )
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -482,17 +866,27 @@ class OxymetrDataView(ViewAccessLoggingMixin, ListView):
         ]
         return context
 
-class NutrientsDataView(ViewAccessLoggingMixin, ListView):
+class NutrientsDataView(ProfilingMixin, ReplicaReadMixin, ViewAccessLoggingMixin, ListView):
     """Детальный просмотр всех данных по биогенным элементам"""
     model = NutrientsData
     template_name = 'oceanography/data_nutrients.html'
     context_object_name = 'nutrients_data'
     paginate_by = 50
+    row_fields = [
+        ('sample_id', 'sample_id'),
+        ('station_name', 'sample__station__station_name'),
+        ('platform', 'sample__station__expedition__platform'),
+        ('no2_mg_n_l', 'no2_mg_n_l'),
+        ('no3_mg_n_l', 'no3_mg_n_l'),
+        ('nh4_mg_n_l', 'nh4_mg_n_l'),
+        ('po4_mg_p_l', 'po4_mg_p_l'),
+        ('si_mg_si_l', 'si_mg_si_l'),
+    ]
     
     def get_queryset(self):
-        return NutrientsData.objects.select_related(
-            'sample', 'sample__station', 'sample__station__expedition'
-        ).order_by('-sample__datetime')
+        return project_rows(
+            NutrientsData.objects.order_by('-sample_datetime'), self.row_fields
+        )
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -503,17 +897,25 @@ class NutrientsDataView(ViewAccessLoggingMixin, ListView):
         ]
         return context
 
-class PHDataView(ViewAccessLoggingMixin, ListView):
+class PHDataView(ProfilingMixin, ReplicaReadMixin, ViewAccessLoggingMixin, ListView):
     """Детальный просмотр всех измерений pH"""
     model = PHMeasurement
     template_name = 'oceanography/data_ph.html'
     context_object_name = 'ph_measurements'
     paginate_by = 50
+    row_fields = [
+        ('sample_id', 'sample_id'),
+        ('station_name', 'sample__station__station_name'),
+        ('platform', 'sample__station__expedition__platform'),
+        ('sample_datetime', 'sample_datetime'),
+        ('ph_meter', 'ph_meter'),
+        ('ph_value', 'ph_value'),
+    ]
     
     def get_queryset(self):
-        return PHMeasurement.objects.select_related(
-            'sample', 'sample__station', 'sample__station__expedition'
-        ).order_by('-sample__datetime')
+        return project_rows(
+            PHMeasurement.objects.order_by('-sample_datetime'), self.row_fields
+        )
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -524,7 +926,7 @@ class PHDataView(ViewAccessLoggingMixin, ListView):
         ]
         return context
 
-class ProbeDataView(ViewAccessLoggingMixin, ListView):
+class ProbeDataView(ProfilingMixin, ReplicaReadMixin, ViewAccessLoggingMixin, ListView):
     """Детальный просмотр всех зондов"""
     model = Probe
     template_name = 'oceanography/data_probes.html'
@@ -545,17 +947,27 @@ class ProbeDataView(ViewAccessLoggingMixin, ListView):
         ]
         return context
 
-class CTDDataView(ViewAccessLoggingMixin, ListView):
+class CTDDataView(ProfilingMixin, ReplicaReadMixin, ViewAccessLoggingMixin, ListView):
     """Детальный просмотр всех CTD данных"""
     model = CTDData
     template_name = 'oceanography/data_ctd.html'
     context_object_name = 'ctd_data'
     paginate_by = 50
+    row_fields = [
+        ('sample_id', 'sample_id'),
+        ('station_name', 'sample__station__station_name'),
+        ('platform', 'sample__station__expedition__platform'),
+        ('probe_name', 'probe__probe_name'),
+        ('temp_c', 'temp_c'),
+        ('salinity_psu', 'salinity_psu'),
+        ('do_mg_l', 'do_mg_l'),
+        ('measured_depth_m', 'measured_depth_m'),
+    ]
     
     def get_queryset(self):
-        return CTDData.objects.select_related(
-            'sample', 'sample__station', 'sample__station__expedition', 'probe'
-        ).order_by('-sample__datetime')
+        return project_rows(
+            CTDData.objects.order_by('-sample_datetime'), self.row_fields
+        )
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -578,44 +990,52 @@ class CTDProfileListView(ViewAccessLoggingMixin, ListView):
     def get_queryset(self):
         return CTDProfile.objects.select_related(
             'station', 'station__expedition', 'probe'
-        ).prefetch_related('measurements').order_by('-start_datetime')
+        ).order_by('-start_datetime')
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        # Число измерений страницы - агрегатом по секциям вместо загрузки всех измерений
+        counts = measurement_counts(context['profiles'])
+        for profile in context['profiles']:
+            profile.measurements_count = counts.get(profile.pk, 0)
         context['breadcrumbs'] = [
             {'url': reverse('oceanography:home'), 'name': 'Главная'},
             {'url': '', 'name': 'CTD профили'}
         ]
         return context
 
-class CTDProfileDetailView(ViewAccessLoggingMixin, DetailView):
+class CTDProfileDetailView(ProfilingMixin, ViewAccessLoggingMixin, DetailView):
     """Детальный просмотр CTD профиля"""
     model = CTDProfile
     template_name = 'oceanography/ctd_profile_detail.html'
     context_object_name = 'profile'
     
+    def get_queryset(self):
+        return CTDProfile.objects.select_related('station__expedition', 'probe')
+    
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        profile = self.get_object()
-        
-        # Получаем измерения профиля
-        context['measurements'] = profile.measurements.all().order_by('depth_m')
-        context['measurements_count'] = context['measurements'].count()
+        profile = self.object
         
-        # Статистика по измерениям
-        if context['measurements']:
-            context['depth_range'] = {
-                'min': context['measurements'].aggregate(Min('depth_m'))['depth_m__min'],
-                'max': context['measurements'].aggregate(Max('depth_m'))['depth_m__max']
-            }
-            context['temp_range'] = {
-                'min': context['measurements'].aggregate(Min('temp_c'))['temp_c__min'],
-                'max': context['measurements'].aggregate(Max('temp_c'))['temp_c__max']
-            }
-            context['salinity_range'] = {
-                'min': context['measurements'].aggregate(Min('salinity_psu'))['salinity_psu__min'],
-                'max': context['measurements'].aggregate(Max('salinity_psu'))['salinity_psu__max']
-            }
+        # Получаем измерения профиля (из секции экспедиции, если она выделена)
+        try:
+            context['measurements'] = CTDMeasurement.objects.for_profile(profile).order_by('depth_m')
+        except PartitionUnavailable as e:
+            messages.warning(self.request, str(e))
+            context['measurements'] = CTDMeasurement.objects.main_table().none()
+        
+        # Число измерений и диапазоны - одним запросом
+        stats = context['measurements'].aggregate(
+            count=Count('pk'),
+            depth_min=Min('depth_m'), depth_max=Max('depth_m'),
+            temp_min=Min('temp_c'), temp_max=Max('temp_c'),
+            salinity_min=Min('salinity_psu'), salinity_max=Max('salinity_psu'),
+        )
+        context['measurements_count'] = stats['count']
+        if stats['count']:
+            context['depth_range'] = {'min': stats['depth_min'], 'max': stats['depth_max']}
+            context['temp_range'] = {'min': stats['temp_min'], 'max': stats['temp_max']}
+            context['salinity_range'] = {'min': stats['salinity_min'], 'max': stats['salinity_max']}
         
         context['breadcrumbs'] = [
             {'url': reverse('oceanography:home'), 'name': 'Главная'},
@@ -644,7 +1064,8 @@ class CTDProfileCreateView(ViewAccessLoggingMixin, CreateView):
             form.add_error('end_datetime', 'Время окончания должно быть позже времени начала')
             return self.form_invalid(form)
         
-        response = super().form_valid(form)
+        with track_request_memory(self.request, 'ctd.create'):
+            response = super().form_valid(form)
         messages.success(self.request, f'CTD профиль успешно создан! Файл данных можно будет обработать позже.')
         return response
     
@@ -674,7 +1095,49 @@ class CTDProfileCreateView(ViewAccessLoggingMixin, CreateView):
         
         return context
 
-class MeteoExcelUploadView(ViewAccessLoggingMixin, LoggingMixin, View):
+def save_meteo_rows(parsed_rows, samples):
+    """
+    Задание очереди записи: создание/обновление метеоданных из разобранного файла.
+
+    parsed_rows - (номер строки, ID пробы, значения полей), samples - {ID: проба}.
+    Возвращает (создано, обновлено, ошибки).
+    """
+    created_count = 0
+    updated_count = 0
+    errors = []
+    existing = {
+        meteo.sample_id: meteo for meteo in MeteoData.objects.filter(
+            sample_id__in=[sample_id for _, sample_id, _ in parsed_rows]
+        )
+    }
+
+    for row_num, sample_id, values in parsed_rows:
+        sample = samples.get(sample_id)
+        if sample is None:
+            errors.append(f"Строка {row_num}: Проба с ID {sample_id} не найдена в экспедиции")
+            continue
+        try:
+            with transaction.atomic():
+                meteo_data = existing.get(sample_id)
+                created = meteo_data is None
+                if created:
+                    meteo_data = existing[sample_id] = MeteoData()
+                meteo_data.sample = sample
+                for field, value in values.items():
+                    setattr(meteo_data, field, value)
+                meteo_data.save()
+        except Exception as e:
+            errors.append(f"Строка {row_num}: Неизвестная ошибка - {str(e)}")
+            continue
+
+        if created:
+            created_count += 1
+        else:
+            updated_count += 1
+    return created_count, updated_count, errors
+
+
+class MeteoExcelUploadView(ProfilingMixin, ViewAccessLoggingMixin, LoggingMixin, View):
     """Массовое добавление метеоданных через Excel"""
     template_name = 'oceanography/meteo_excel_upload.html'
     
@@ -711,9 +1174,12 @@ class MeteoExcelUploadView(ViewAccessLoggingMixin, LoggingMixin, View):
         action = request.POST.get('action')
         
         if action == 'download_template':
-            return self.download_template(expedition)
+            # Выгрузка только читает данные - с реплики
+            with use_replica(request), track_request_memory(request, 'meteo.download_template'):
+                return self.download_template(expedition)
         elif action == 'upload_data':
-            return self.upload_data(request, expedition)
+            with track_request_memory(request, 'meteo.upload_data'):
+                return self.upload_data(request, expedition)
         
         return redirect('oceanography:add_meteo_excel', expedition_id=self.kwargs.get('expedition_id'))
     
@@ -855,8 +1321,7 @@ class MeteoExcelUploadView(ViewAccessLoggingMixin, LoggingMixin, View):
             wb = openpyxl.load_workbook(excel_file)
             ws = wb.active
             
-            created_count = 0
-            updated_count = 0
+            parsed_rows = []
             errors = []
             
             # Обрабатываем каждую строку, начиная с третьей
@@ -865,43 +1330,38 @@ class MeteoExcelUploadView(ViewAccessLoggingMixin, LoggingMixin, View):
                     continue
                 
                 try:
-                    sample_id = int(row[0])
-                    
-                    # Находим пробу
-                    sample = Sample.objects.get(
-                        sample_id=sample_id,
-                        station__expedition=expedition
-                    )
-                    
-                    # Создаем или обновляем метеоданные
-                    meteo_data, created = MeteoData.objects.get_or_create(sample=sample)
-                    
-                    # Заполняем поля (колонки 5-9)
+                    # Заполняем поля (колонки 5-9); пустые ячейки не меняют значения
+                    values = {}
                     if row[4] is not None:  # Температура воздуха
-                        meteo_data.t_air_c = float(row[4])
+                        values['t_air_c'] = float(row[4])
                     if row[5] is not None:  # Влажность
-                        meteo_data.humidity_percent = float(row[5])
+                        values['humidity_percent'] = float(row[5])
                     if row[6] is not None:  # Скорость ветра
-                        meteo_data.wind_speed_m_s = float(row[6])
+                        values['wind_speed_m_s'] = float(row[6])
                     if row[7] is not None:  # Направление ветра
-                        meteo_data.wind_direction = int(row[7])
+                        values['wind_direction'] = int(row[7])
                     if row[8] is not None:  # Давление
-                        meteo_data.pressure_hpa = float(row[8])
-                    
-                    meteo_data.save()
-                    
-                    if created:
-                        created_count += 1
-                    else:
-                        updated_count += 1
-                        
-                except Sample.DoesNotExist:
-                    errors.append(f"Строка {row_num}: Проба с ID {row[0]} не найдена в экспедиции")
+                        values['pressure_hpa'] = float(row[8])
+                    parsed_rows.append((row_num, int(row[0]), values))
                 except ValueError as e:
                     errors.append(f"Строка {row_num}: Ошибка преобразования данных - {str(e)}")
                 except Exception as e:
+                    # Например, дата в числовой ячейке (TypeError) - ошибка строки, а не всего файла
                     errors.append(f"Строка {row_num}: Неизвестная ошибка - {str(e)}")
             
+            # Все пробы файла одним запросом
+            samples = Sample.objects.select_related('station').filter(
+                sample_id__in=[sample_id for _, sample_id, _ in parsed_rows],
+                station__expedition=expedition
+            ).in_bulk()
+            
+            # Запись - через общую очередь, разбор файла выше идет вне транзакции
+            job = get_write_queue().submit(save_meteo_rows, parsed_rows, samples)
+            created_count, updated_count, write_errors = job.result(
+                timeout=write_queue_settings()['RESULT_TIMEOUT']
+            )
+            errors.extend(write_errors)
+            
             # Формируем сообщения о результате
             if created_count > 0 or updated_count > 0:
                 success_msg = f"Успешно обработано: {created_count} новых записей, {updated_count} обновлений"
@@ -923,13 +1383,57 @@ class MeteoExcelUploadView(ViewAccessLoggingMixin, LoggingMixin, View):
             elif created_count == 0 and updated_count == 0:
                 messages.warning(request, "Не было обработано ни одной записи. Проверьте формат файла.")
                 
+        except WriteQueueFull:
+            messages.error(request, "Сервер занят другими загрузками, повторите попытку через минуту")
+        except FutureTimeoutError:
+            messages.info(request, "Файл принят и записывается в фоне, обновите страницу позже")
         except Exception as e:
             messages.error(request, f"Ошибка при обработке файла: {str(e)}")
         
         return redirect('oceanography:add_meteo_excel', expedition_id=expedition.pk)
 
         
-class StationExcelUploadView(ViewAccessLoggingMixin, View):
+def save_station_rows(expedition, parsed_rows):
+    """
+    Задание очереди записи: станции и пробы из разобранного файла.
+
+    parsed_rows - (номер строки, данные станции, список данных проб).
+    Возвращает (создано станций, создано проб, ошибки).
+    """
+    created_stations = 0
+    created_samples = 0
+    errors = []
+
+    for row_num, station_data, samples_data in parsed_rows:
+        # Проверяем уникальность станции
+        if Station.objects.filter(
+            expedition=expedition,
+            station_name=station_data['station_name'],
+            datetime=station_data['datetime']
+        ).exists():
+            errors.append(f"Строка {row_num}: Станция с таким названием и датой уже существует")
+            continue
+
+        try:
+            with transaction.atomic():
+                station = Station.objects.create(
+                    expedition=expedition,
+                    **{k: v for k, v in station_data.items() if v is not None}
+                )
+                Sample.objects.bulk_create([
+                    Sample(station=station, **{k: v for k, v in sample_data.items() if v is not None})
+                    for sample_data in samples_data
+                ])
+        except Exception as e:
+            errors.append(f"Строка {row_num}: Ошибка обработки - {str(e)}")
+            continue
+
+        created_stations += 1
+        created_samples += len(samples_data)
+    return created_stations, created_samples, errors
+
+
+class StationExcelUploadView(ProfilingMixin, ViewAccessLoggingMixin, View):
     """Массовое добавление станций и проб через Excel"""
     template_name = 'oceanography/station_excel_upload.html'
     
@@ -956,9 +1460,12 @@ class StationExcelUploadView(ViewAccessLoggingMixin, View):
         action = request.POST.get('action')
         
         if action == 'download_template':
-            return self.download_template(expedition)
+            # Выгрузка только читает данные - с реплики
+            with use_replica(request), track_request_memory(request, 'stations.download_template'):
+                return self.download_template(expedition)
         elif action == 'upload_data':
-            return self.upload_data(request, expedition)
+            with track_request_memory(request, 'stations.upload_data'):
+                return self.upload_data(request, expedition)
         
         # Используем expedition_id из kwargs, а не неопределенную переменную
         return redirect('oceanography:add_stations_excel', expedition_id=self.kwargs.get('expedition_id'))
@@ -1151,14 +1658,15 @@ class StationExcelUploadView(ViewAccessLoggingMixin, View):
             wb = openpyxl.load_workbook(excel_file)
             ws = wb.active
             
-            created_stations = 0
-            created_samples = 0
+            parsed_rows = []
             errors = []
             
             # Обрабатываем каждую строку, начиная с ТРЕТЬЕЙ (первые две - заголовки)
             for row_num, row in enumerate(ws.iter_rows(min_row=3, values_only=True), 3):
                 if not row or row[0] is None:  # Пропускаем пустые строки
                     continue
+                # Пустые последние колонки (комментарий пробы) openpyxl не сохраняет
+                row = (*row, *[None] * (12 - len(row)))
                 
                 try:
                     # Читаем данные станции
@@ -1177,23 +1685,8 @@ class StationExcelUploadView(ViewAccessLoggingMixin, View):
                         errors.append(f"Строка {row_num}: Отсутствуют обязательные данные станции")
                         continue
                     
-                    # Проверяем уникальность станции
-                    if Station.objects.filter(
-                        expedition=expedition,
-                        station_name=station_data['station_name'],
-                        datetime=station_data['datetime']
-                    ).exists():
-                        errors.append(f"Строка {row_num}: Станция с таким названием и датой уже существует")
-                        continue
-                    
-                    # Создаем станцию
-                    station = Station.objects.create(
-                        expedition=expedition,
-                        **{k: v for k, v in station_data.items() if v is not None}
-                    )
-                    created_stations += 1
-                    
                     # Читаем данные проб (колонки 6+)
+                    samples_data = []
                     sample_col = 6
                     sample_num = 1
                     
@@ -1208,22 +1701,26 @@ class StationExcelUploadView(ViewAccessLoggingMixin, View):
                         # Если горизонт отбора указан, создаем пробу
                         if sample_data['sampling_depth']:
                             if not sample_data['datetime']:
-                                sample_data['datetime'] = station.datetime
+                                sample_data['datetime'] = station_data['datetime']
                             if not sample_data['comment']:
                                 sample_data['comment'] = f'Проба {sample_num}'
-                            
-                            Sample.objects.create(
-                                station=station,
-                                **{k: v for k, v in sample_data.items() if v is not None}
-                            )
-                            created_samples += 1
+                            samples_data.append(sample_data)
                         
                         sample_col += 3
                         sample_num += 1
+                    
+                    parsed_rows.append((row_num, station_data, samples_data))
                         
                 except Exception as e:
                     errors.append(f"Строка {row_num}: Ошибка обработки - {str(e)}")
             
+            # Запись - через общую очередь, разбор файла выше идет вне транзакции
+            job = get_write_queue().submit(save_station_rows, expedition, parsed_rows)
+            created_stations, created_samples, write_errors = job.result(
+                timeout=write_queue_settings()['RESULT_TIMEOUT']
+            )
+            errors.extend(write_errors)
+            
             # Формируем сообщения о результате
             if created_stations > 0:
                 success_msg = f"Успешно создано: {created_stations} станций, {created_samples} проб"
@@ -1237,12 +1734,20 @@ class StationExcelUploadView(ViewAccessLoggingMixin, View):
             elif created_stations == 0:
                 messages.warning(request, "Не было создано ни одной станции. Проверьте формат файла.")
                 
+        except WriteQueueFull:
+            messages.error(request, "Сервер занят другими загрузками, повторите попытку через минуту")
+        except FutureTimeoutError:
+            messages.info(request, "Файл принят и записывается в фоне, обновите страницу позже")
         except Exception as e:
             messages.error(request, f"Ошибка при обработке файла: {str(e)}")
         
         return redirect('oceanography:add_stations_excel', expedition_id=expedition.pk)
 
 
+# Сколько последних записей журнала показывать без базы событий
+LOG_TAIL_ENTRIES = 1000
+
+
 class LogViewerView(ViewAccessLoggingMixin, LoginRequiredMixin, UserPassesTestMixin, TemplateView):
     """Просмотр логов (только для администраторов)"""
     template_name = 'oceanography/logs_viewer.html'
@@ -1254,43 +1759,27 @@ class LogViewerView(ViewAccessLoggingMixin, LoginRequiredMixin, UserPassesTestMi
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
-        log_file = os.path.join(settings.BASE_DIR, 'logs', 'user_actions.log')
-        logs = []
-
-        try:
-            if os.path.exists(log_file):
-                with open(log_file, 'r', encoding='utf-8') as f:
-                    # Читаем последние 1000 строк
-                    lines = f.readlines()[-1000:]
-                    logs = [line.strip() for line in lines if line.strip()]
-                logs.reverse()  # Новые логи вверху
-        except Exception as e:
-            logger.error(f"Error reading log file: {e}")
-
-        # Фильтрация по времени
-        time_filter = self.request.GET.get('time_filter', 'all')
-        filtered_logs = []
-
-        if time_filter != 'all':
+        filters = event_filters(self.request.GET)
+        if filters['q']:
+            # Поиск текста - по файлу журнала и его сжатым копиям
+            context.update(self._file_entries(filters['time_filter'], query=filters['q']))
+        elif events_available():
+            # Структурированные события: страница по ключу, фильтры по индексам
             try:
-                if time_filter == '1h':
-                    cutoff_time = timezone.now() - timedelta(hours=1)
-                elif time_filter == '24h':
-                    cutoff_time = timezone.now() - timedelta(hours=24)
-                elif time_filter == '7d':
-                    cutoff_time = timezone.now() - timedelta(days=7)
-
-                cutoff_str = cutoff_time.strftime('%Y-%m-%d %H:%M:%S')
-                filtered_logs = [log for log in logs if log[:19] >= cutoff_str]
-            except:
-                filtered_logs = logs
+                before = int(self.request.GET.get('before', ''))
+            except ValueError:
+                before = None
+            page = event_page(filters, before=before)
+            context.update(page)
+            context['logs'] = page['events']
+            context['from_store'] = True
         else:
-            filtered_logs = logs
+            context.update(self._file_entries(filters['time_filter']))
 
-        context['logs'] = filtered_logs
-        context['total_count'] = len(logs)
-        context['filtered_count'] = len(filtered_logs)
-        context['time_filter'] = time_filter
+        context['filters'] = filters
+        context['time_filter'] = filters['time_filter']
+        context['filter_query'] = urlencode({name: value for name, value in filters.items() if value})
+        context['source_choices'] = LogEvent.SOURCE_CHOICES
         context['breadcrumbs'] = [
             {'url': reverse('oceanography:home'), 'name': 'Главная'},
             {'url': '', 'name': 'Просмотр логов'}
@@ -1298,16 +1787,49 @@ class LogViewerView(ViewAccessLoggingMixin, LoginRequiredMixin, UserPassesTestMi
 
         return context
 
+    def _file_entries(self, time_filter, query=''):
+        """
+        Последние LOG_TAIL_ENTRIES записей user_actions.log (база событий не
+        настроена): файл читается с конца, период - двоичным поиском.
+        С query - строки с этим текстом из файла и всех его копий.
+        """
+        log_file = os.path.join(settings.BASE_DIR, 'logs', 'user_actions.log')
+        period = TIME_FILTERS.get(time_filter)
+        since = None
+        if period is not None:
+            since = timezone.localtime(timezone.now() - period).strftime('%Y-%m-%d %H:%M:%S')
+
+        try:
+            if query:
+                result = search_logs(log_file, query, LOG_TAIL_ENTRIES, since=since)
+            else:
+                result = read_log(log_file, LOG_TAIL_ENTRIES, since=since)
+        except OSError as e:
+            logger.error(f"Error reading log file: {e}")
+            result = {'entries': [], 'filtered_count': 0, 'estimated': False}
+
+        return {
+            'logs': [parse_action_line(entry) for entry in result['entries']],
+            # Без периода общее число записей оценивается, с периодом - не считается
+            'total_count': result['filtered_count'] if since is None and not query else None,
+            'filtered_count': result['filtered_count'],
+            'count_estimated': result['estimated'],
+        }
+
     def post(self, request, *args, **kwargs):
         """Очистка логов"""
         if request.user.is_superuser and 'clear_logs' in request.POST:
             log_file = os.path.join(settings.BASE_DIR, 'logs', 'user_actions.log')
             try:
-                if os.path.exists(log_file):
-                    # Вместо полного удаления, создаем backup и очищаем
+                # Текущий файл уходит в сжатую копию (хранится LOG_ROTATION['BACKUP_COUNT'] копий)
+                if not rotate_log(user_action_logger.logger.name) and os.path.exists(log_file):
                     backup_file = f"{log_file}.backup.{timezone.now().strftime('%Y%m%d_%H%M%S')}"
                     os.rename(log_file, backup_file)
-                messages.success(request, 'Логи успешно очищены и сохранены в backup')
+                # Страница читает события из базы - они тоже уходят в сжатый архив
+                archived = 0
+                if events_available():
+                    _, archived = archive_events(log_dir(), keep=log_rotation_settings()['BACKUP_COUNT'])
+                messages.success(request, f'Логи очищены и сохранены в архив (событий: {archived})')
             except Exception as e:
                 messages.error(request, f'Ошибка при очистке логов: {str(e)}')
 
@@ -1318,4 +1840,77 @@ class LogViewerView(ViewAccessLoggingMixin, LoginRequiredMixin, UserPassesTestMi
                 details="User cleared application logs"
             )
 
-        return self.get(request, *args, **kwargs)
\ No newline at end of file
+        return self.get(request, *args, **kwargs)
+
+class RequestMetricsView(LoginRequiredMixin, UserPassesTestMixin, TemplateView):
+    """Метрики запросов по имени URL: p50/p95/p99 времени, SQL и размера ответа (только staff)"""
+    template_name = 'oceanography/request_metrics.html'
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        rows = view_rows(get_metrics_registry().collect())
+        context['rows'] = rows
+        context['total_requests'] = sum(row['requests'] for row in rows)
+        context['metrics_enabled'] = metrics_settings()['ENABLED']
+        context['breadcrumbs'] = [
+            {'url': reverse('oceanography:home'), 'name': 'Главная'},
+            {'url': reverse('oceanography:log_viewer'), 'name': 'Просмотр логов'},
+            {'url': '', 'name': 'Метрики запросов'},
+        ]
+        return context
+
+    def post(self, request, *args, **kwargs):
+        """Сброс накопленных метрик"""
+        if request.user.is_superuser and 'reset_metrics' in request.POST:
+            get_metrics_registry().reset()
+            messages.success(request, 'Метрики сброшены')
+        return redirect('oceanography:request_metrics')
+
+
+class SlowQueryListView(LoginRequiredMixin, UserPassesTestMixin, TemplateView):
+    """Журнал медленных SQL запросов, сгруппированный по нормализованному SQL (только staff)"""
+    template_name = 'oceanography/slow_queries.html'
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        time_filter = self.request.GET.get('time_filter', '24h')
+        view = self.request.GET.get('view', '').strip()
+        kind = self.request.GET.get('kind', '')
+        available = events_available(model=SlowQuery)
+        context.update({
+            'groups': query_groups(TIME_FILTERS.get(time_filter), view=view, kind=kind) if available else [],
+            'store_available': available,
+            'config': slow_queries_settings(),
+            'time_filter': time_filter,
+            'view_filter': view,
+            'kind': kind,
+            'kind_choices': SlowQuery.KIND_CHOICES,
+            'breadcrumbs': [
+                {'url': reverse('oceanography:home'), 'name': 'Главная'},
+                {'url': reverse('oceanography:request_metrics'), 'name': 'Метрики запросов'},
+                {'url': '', 'name': 'Медленные запросы'},
+            ],
+        })
+        return context
+
+
+class PrometheusMetricsView(View):
+    """Метрики в формате Prometheus: staff или Authorization: Bearer METRICS['TOKEN']"""
+
+    def get(self, request):
+        token = metrics_settings().get('TOKEN')
+        authorized = request.user.is_authenticated and request.user.is_staff
+        if not authorized and token:
+            authorized = hmac.compare_digest(request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {token}')
+        if not authorized:
+            return HttpResponse('Forbidden', status=403, content_type='text/plain')
+        return HttpResponse(
+            prometheus_text(get_metrics_registry().collect()),
+            content_type='text/plain; version=0.0.4; charset=utf-8',
+        )
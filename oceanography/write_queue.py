@@ -0,0 +1,198 @@
+"""
+Очередь записи для SQLite.
+
+SQLite допускает одного писателя: параллельные загрузки Excel конкурируют
+за блокировку записи, ждут друг друга и падают с "database is locked".
+Вместо этого массовые записи передаются в очередь, которую разбирает
+единственный поток-писатель. Задания, накопившиеся за короткое время,
+выполняются в одной транзакции (каждое - в своей точке сохранения), так что
+ошибка одного задания не откатывает остальные. Вызывающий получает
+Future и может дождаться результата или вернуть ответ сразу.
+
+Разбор файлов и чтение выполняются до постановки в очередь, в потоке
+запроса: транзакция писателя содержит только запись. SQL задания
+засчитывается HTTP запросу, который его поставил (метрики и журнал
+медленных запросов, metrics.py), и закрепляет его клиента за основной
+базой (routers.py) уже при постановке - до того, как задание выполнено.
+Задание профилируемого запроса выполняется под своим cProfile, и его
+статистика попадает в профиль запроса (profiling.py).
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from .metrics import attributed_to, current_stats
+from .profiling import current_writer_profiles, profiled_job
+from .routers import note_write
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WRITE_QUEUE = {
+    'MAXSIZE': 64,          # заданий в очереди, дальше - WriteQueueFull
+    'BATCH_SIZE': 16,       # заданий в одной транзакции
+    'BATCH_WAIT': 0.05,     # сколько ждать следующие задания для пакета, с
+    'SUBMIT_TIMEOUT': 2,    # ожидание места в очереди, с
+    'RESULT_TIMEOUT': 60,   # ожидание результата во view, с
+    'EAGER': False,         # выполнять сразу в вызывающем потоке (тесты)
+}
+
+
+def write_queue_settings():
+    return {**DEFAULT_WRITE_QUEUE, **getattr(settings, 'WRITE_QUEUE', {})}
+
+
+class WriteQueueFull(Exception):
+    """Очередь записи переполнена - клиенту следует повторить позже"""
+
+
+class WriteJob:
+    """Задание очереди: функция записи и Future для результата"""
+    __slots__ = ('func', 'args', 'kwargs', 'key', 'future', 'submitted_at', 'stats', 'profiles')
+
+    def __init__(self, func, args, kwargs, key=None):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.key = key
+        self.future = Future()
+        self.submitted_at = time.monotonic()
+        self.stats = current_stats()
+        self.profiles = current_writer_profiles()
+
+    def __call__(self):
+        with attributed_to(self.stats), profiled_job(self.profiles):
+            return self.func(*self.args, **self.kwargs)
+
+
+class WriteQueue:
+    """Очередь с одним потоком-писателем для базы `using`"""
+
+    def __init__(self, using='default', maxsize=None, batch_size=None, batch_wait=None,
+                 submit_timeout=None, eager=None):
+        config = write_queue_settings()
+        self.using = using
+        self.batch_size = batch_size or config['BATCH_SIZE']
+        self.batch_wait = config['BATCH_WAIT'] if batch_wait is None else batch_wait
+        self.submit_timeout = config['SUBMIT_TIMEOUT'] if submit_timeout is None else submit_timeout
+        self._eager = eager
+        self._queue = queue.Queue(maxsize=maxsize or config['MAXSIZE'])
+        # Ключ -> ожидающее задание, для слияния одинаковых заданий
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def eager(self):
+        # Без явного значения читается из настроек при каждом вызове (override_settings в тестах)
+        return write_queue_settings()['EAGER'] if self._eager is None else self._eager
+
+    def submit(self, func, *args, key=None, **kwargs):
+        """
+        Ставит запись в очередь и возвращает Future с результатом func.
+
+        Если задание с тем же key еще ждет выполнения, возвращается его Future.
+        При переполненной очереди (дольше submit_timeout) - WriteQueueFull.
+        """
+        job = WriteJob(func, args, kwargs, key)
+        # Поток-писатель не видит ContextVar запроса - запись отмечается здесь
+        note_write(f'write_queue.{getattr(func, "__name__", "job")}')
+        if self.eager:
+            self._run_batch([job])
+            return job.future
+
+        with self._lock:
+            if key is not None and key in self._pending:
+                return self._pending[key].future
+            if key is not None:
+                self._pending[key] = job
+        try:
+            self._queue.put(job, timeout=self.submit_timeout)
+        except queue.Full:
+            with self._lock:
+                self._pending.pop(key, None)
+            raise WriteQueueFull(f'Очередь записи заполнена ({self._queue.maxsize} заданий)')
+        self._ensure_writer()
+        return job.future
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def _ensure_writer(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._writer_loop, name=f'write-queue-{self.using}', daemon=True
+                )
+                self._thread.start()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        with self._lock:
+            for job in batch:
+                if job.key is not None:
+                    self._pending.pop(job.key, None)
+        return batch
+
+    def _writer_loop(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                self._run_batch(batch)
+            except Exception:
+                logger.exception('Write queue batch failed')
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+                connections[self.using].close_if_unusable_or_obsolete()
+
+    def _run_batch(self, batch):
+        """Пакет заданий в одной транзакции, каждое - в своей точке сохранения"""
+        results = []
+        try:
+            with transaction.atomic(using=self.using):
+                for job in batch:
+                    if not job.future.set_running_or_notify_cancel():
+                        continue
+                    try:
+                        with transaction.atomic(using=self.using):
+                            results.append((job, job(), None))
+                    except Exception as exc:
+                        results.append((job, None, exc))
+        except Exception as exc:
+            # Не удалось зафиксировать транзакцию - ни одно задание не записано
+            for job, _, _ in results:
+                job.future.set_exception(exc)
+            raise
+        # Результаты отдаются только после фиксации транзакции
+        for job, result, exc in results:
+            if exc is not None:
+                job.future.set_exception(exc)
+            else:
+                job.future.set_result(result)
+
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+
+def get_write_queue(using='default'):
+    """Общая очередь записи процесса для базы using"""
+    with _queues_lock:
+        if using not in _queues:
+            _queues[using] = WriteQueue(using)
+        return _queues[using]
@@ -42,6 +42,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Первым: журнал активности и метрики запросов (время - с учетом всех middleware ниже)
+    'oceanography.middleware.UserActivityLoggingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -49,6 +51,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'oceanography.middleware.ReadAfterWriteMiddleware',
 ]
 
 ROOT_URLCONF = 'oceanography_project.urls'
@@ -68,21 +71,6 @@ TEMPLATES = [
         },
     },
 ]
-# LOGGING = {
-#     'version': 1,
-#     'disable_existing_loggers': False,
-#     'handlers': {
-#         'file': {
-#             'level': 'INFO',
-#             'class': 'logging.handlers.RotatingFileHandler',
-#             'filename': os.path.join(BASE_DIR, 'logs', 'user_actions.log'),
-#             'maxBytes': 1024*1024*5,  # 5 MB
-#             'backupCount': 5,
-#             'formatter': 'verbose',
-#         },
-#     },
-#     # ... остальная конфигураця ...
-# }
 WSGI_APPLICATION = 'oceanography_project.wsgi.application'
 
 
@@ -92,10 +80,124 @@ WSGI_APPLICATION = 'oceanography_project.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+        # Постоянные соединения (секунды, 0 - новое соединение на каждый запрос)
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
+    },
+    # Реплика только для чтения (страницы data_* и выгрузки), обновляется
+    # командой refresh_replica. Пока файла нет, чтение идет из основной базы.
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('DB_REPLICA_NAME', BASE_DIR / 'db_replica.sqlite3'),
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
+        'TEST': {'MIRROR': 'default'},
+    },
+    # События журналов пользователей (oceanography/events.py) - отдельный файл,
+    # схема: python manage.py migrate --database events
+    'events': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('EVENTS_DB_NAME', BASE_DIR / 'logs' / 'events.sqlite3'),
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
+    },
+}
+
+DATABASE_ROUTERS = [
+    'oceanography.events.EventsRouter',
+    'oceanography.partitions.CTDPartitionRouter',
+    'oceanography.routers.ReplicaRouter',
+]
+
+# Файлы секций CTD измерений по экспедициям (см. oceanography/partitions.py)
+CTD_PARTITIONS_DIR = Path(os.environ.get('CTD_PARTITIONS_DIR', BASE_DIR / 'partitions'))
+
+# Холодный архив экспедиций (см. oceanography/cold_storage.py)
+EXPEDITION_ARCHIVE_DIR = Path(os.environ.get('EXPEDITION_ARCHIVE_DIR', BASE_DIR / 'archive'))
+# Сколько секунд страница архивной экспедиции ждет ее восстановления
+EXPEDITION_REHYDRATE_WAIT = float(os.environ.get('EXPEDITION_REHYDRATE_WAIT', 5))
+
+# Снимки команды backup (см. oceanography/backups.py) и сколько последних хранить
+BACKUP_DIR = Path(os.environ.get('BACKUP_DIR', BASE_DIR / 'backups'))
+BACKUP_KEEP = int(os.environ.get('BACKUP_KEEP', 7))
+
+# Сколько секунд после записи клиент читает из основной базы
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', 60))
+
+# PRAGMA для каждого нового соединения SQLite (см. oceanography/db.py).
+# None отключает PRAGMA.
+SQLITE_PRAGMAS = {
+    'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', -64000)),
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+    'temp_store': os.environ.get('SQLITE_TEMP_STORE', 'MEMORY'),
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 20000)),
+}
+
+# Очередь записи для массовых загрузок (см. oceanography/write_queue.py)
+WRITE_QUEUE = {
+    'MAXSIZE': int(os.environ.get('WRITE_QUEUE_MAXSIZE', 64)),
+    'BATCH_SIZE': int(os.environ.get('WRITE_QUEUE_BATCH_SIZE', 16)),
+    'RESULT_TIMEOUT': int(os.environ.get('WRITE_QUEUE_RESULT_TIMEOUT', 60)),
+    'EAGER': os.environ.get('WRITE_QUEUE_EAGER') == '1',
+}
+
+# Журналы действий пользователей пишет фоновый поток (см. oceanography/log_queue.py)
+LOG_QUEUE = {
+    'ENABLED': os.environ.get('LOG_QUEUE_ENABLED', '1') == '1',
+    'MAXSIZE': int(os.environ.get('LOG_QUEUE_MAXSIZE', 10000)),
+    'BATCH_SIZE': int(os.environ.get('LOG_QUEUE_BATCH_SIZE', 500)),
+    'SAMPLE_AT': float(os.environ.get('LOG_QUEUE_SAMPLE_AT', 0.8)),
+    'SAMPLE_RATE': int(os.environ.get('LOG_QUEUE_SAMPLE_RATE', 10)),
 }
 
+# Метрики запросов по имени URL (oceanography/metrics.py): страница /metrics/ и /metrics/prometheus
+METRICS = {
+    'ENABLED': os.environ.get('METRICS_ENABLED', '1') == '1',
+    'DIR': os.environ.get('METRICS_DIR', BASE_DIR / 'logs' / 'metrics'),
+    'FLUSH_INTERVAL': int(os.environ.get('METRICS_FLUSH_INTERVAL', 10)),
+    # Bearer-токен для сборщика Prometheus (без него - только staff)
+    'TOKEN': os.environ.get('METRICS_TOKEN', ''),
+}
+
+# Журнал медленных SQL запросов (oceanography/slow_queries.py), страница /metrics/slow-queries/
+SLOW_QUERIES = {
+    'ENABLED': os.environ.get('SLOW_QUERIES_ENABLED', '0') == '1',
+    'THRESHOLD_MS': float(os.environ.get('SLOW_QUERIES_THRESHOLD_MS', 100)),
+    'SAMPLE_RATE': float(os.environ.get('SLOW_QUERIES_SAMPLE_RATE', 0)),
+    'REPEAT_THRESHOLD': int(os.environ.get('SLOW_QUERIES_REPEAT_THRESHOLD', 20)),
+}
+
+# Профилирование запросов по требованию (oceanography/profiling.py): X-Profile: 1 или ?_profile=1
+PROFILING = {
+    'ENABLED': os.environ.get('PROFILING_ENABLED', '1') == '1',
+    'DIR': os.environ.get('PROFILING_DIR', BASE_DIR / 'profiles'),
+    'KEEP': int(os.environ.get('PROFILING_KEEP', 50)),
+}
+
+# Учет памяти tracemalloc по требованию (oceanography/memory.py): X-Memory-Profile: 1, ?_memory=1
+# или --trace-memory у команд; BUDGETS - предел пика операции в КБ
+MEMORY_PROFILING = {
+    'ENABLED': os.environ.get('MEMORY_PROFILING_ENABLED', '1') == '1',
+    'TOP': int(os.environ.get('MEMORY_PROFILING_TOP', 10)),
+    'BUDGETS': {
+        'meteo.download_template': int(os.environ.get('MEMORY_BUDGET_METEO_TEMPLATE_KB', 16 * 1024)),
+        'stations.download_template': int(os.environ.get('MEMORY_BUDGET_STATIONS_TEMPLATE_KB', 16 * 1024)),
+    },
+}
+
+# Поворот файлов журналов: по размеру или возрасту, копии сжимаются в .N.gz (oceanography/log_queue.py)
+LOG_ROTATION = {
+    'MAX_BYTES': int(os.environ.get('LOG_ROTATION_MAX_BYTES', 10 * 1024 * 1024)),
+    'MAX_AGE_HOURS': float(os.environ.get('LOG_ROTATION_MAX_AGE_HOURS', 0)),
+    'BACKUP_COUNT': int(os.environ.get('LOG_ROTATION_BACKUP_COUNT', 20)),
+}
+
+# Объекты от этого числа строк (со всеми данными) админка удаляет в фоне (oceanography/purge.py)
+PURGE_BACKGROUND_ROWS = int(os.environ.get('PURGE_BACKGROUND_ROWS', 10000))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators